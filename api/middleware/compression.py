@@ -0,0 +1,217 @@
+# api/middleware/compression.py - ถอดการบีบอัดข้อมูลที่อุปกรณ์ส่งมา (Content-Encoding)
+import io
+import re
+import json
+import zlib
+import logging
+from werkzeug.exceptions import HTTPException, BadRequest, RequestEntityTooLarge
+from werkzeug.wsgi import LimitedStream, get_content_length
+
+# zstd ใช้ได้เฉพาะเมื่อติดตั้งแพ็คเกจ zstandard
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# endpoint ของอุปกรณ์ที่รับข้อมูลแบบบีบอัดได้
+COMPRESSED_PATHS = (
+    re.compile(r'^/api/v1/traffic/(realtime|batch)$'),
+    re.compile(r'^/api/v1/devices/heartbeat$'),
+    re.compile(r'^/api/v1/snapshots/cameras/[^/]+/snapshot$'),
+)
+
+# endpoint ที่อ่านข้อมูลแบบ stream จึงคลายการบีบอัดทีละส่วนระหว่างอ่าน
+STREAMING_PATHS = (
+    re.compile(r'^/api/v1/traffic/stream$'),
+)
+
+# ขนาดข้อมูลที่อ่านจากอุปกรณ์ต่อครั้ง
+READ_CHUNK_SIZE = 16384
+
+def supported_encodings():
+    """รายการ Content-Encoding ที่รองรับในเครื่องนี้"""
+    encodings = ['gzip', 'deflate']
+    if zstandard is not None:
+        encodings.append('zstd')
+    return encodings
+
+class _ZlibReader(io.RawIOBase):
+    """อ่านข้อมูล gzip/deflate ทีละส่วน โดยไม่คลายข้อมูลเกินขนาด buffer ที่ขอในแต่ละครั้ง"""
+    
+    def __init__(self, source, encoding):
+        self._source = source
+        self._encoding = encoding
+        self._tail = b''
+        self._started = False
+        self._decompressor = self._new_decompressor()
+    
+    def _new_decompressor(self, wbits=None):
+        if wbits is None:
+            wbits = zlib.MAX_WBITS | 16 if self._encoding == 'gzip' else zlib.MAX_WBITS
+        return zlib.decompressobj(wbits)
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        size = len(buffer)
+        while True:
+            if not self._tail:
+                if self._decompressor.eof:
+                    # gzip อาจมีหลาย member ต่อกัน
+                    self._tail = self._decompressor.unused_data
+                    if not self._tail:
+                        self._tail = self._source.read(READ_CHUNK_SIZE)
+                    if not self._tail:
+                        return 0
+                    self._decompressor = self._new_decompressor()
+                else:
+                    self._tail = self._source.read(READ_CHUNK_SIZE)
+                    if not self._tail:
+                        raise BadRequest('ข้อมูลที่บีบอัดไม่สมบูรณ์')
+            
+            try:
+                output = self._decompressor.decompress(self._tail, size)
+            except zlib.error:
+                if self._encoding != 'deflate' or self._started:
+                    raise BadRequest('ข้อมูลที่บีบอัดไม่ถูกต้อง')
+                # อุปกรณ์บางรุ่นส่ง deflate แบบไม่มี zlib header
+                self._started = True
+                self._decompressor = self._new_decompressor(-zlib.MAX_WBITS)
+                continue
+            
+            self._started = True
+            self._tail = self._decompressor.unconsumed_tail
+            if output:
+                buffer[:len(output)] = output
+                return len(output)
+
+class _ZstdReader(io.RawIOBase):
+    """อ่านข้อมูล zstd ทีละส่วนผ่าน stream_reader ของ zstandard"""
+    
+    def __init__(self, source):
+        self._reader = zstandard.ZstdDecompressor().stream_reader(
+            source, read_size=READ_CHUNK_SIZE, read_across_frames=True
+        )
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        try:
+            return self._reader.readinto(buffer)
+        except zstandard.ZstdError:
+            raise BadRequest('ข้อมูลที่บีบอัดไม่ถูกต้อง')
+
+class _SizeLimitedReader(io.RawIOBase):
+    """จำกัดขนาดของข้อมูลหลังคลายการบีบอัด เพื่อป้องกัน decompression bomb"""
+    
+    def __init__(self, reader, max_size):
+        self._reader = reader
+        self._max_size = max_size
+        self._size = 0
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        count = self._reader.readinto(buffer)
+        self._size += count
+        if self._max_size is not None and self._size > self._max_size:
+            raise RequestEntityTooLarge('ข้อมูลหลังคลายการบีบอัดมีขนาดเกินกำหนด')
+        return count
+
+class DecompressionMiddleware:
+    """
+    WSGI middleware ที่คลายการบีบอัดข้อมูลจากอุปกรณ์ตาม header Content-Encoding
+    
+    endpoint ทั่วไปจะถูกคลายข้อมูลทั้งหมดก่อนส่งต่อ และจำกัดขนาดหลังคลายด้วย max_body_size
+    ส่วน endpoint แบบ stream จะคลายทีละส่วนระหว่างที่อ่าน และจำกัดด้วย max_stream_size
+    """
+    
+    def __init__(self, app, max_body_size, max_stream_size=None):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.max_stream_size = max_stream_size
+    
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return self.app(environ, start_response)
+        
+        path = environ.get('PATH_INFO', '')
+        streaming = any(pattern.match(path) for pattern in STREAMING_PATHS)
+        if not streaming and not any(pattern.match(path) for pattern in COMPRESSED_PATHS):
+            return self.app(environ, start_response)
+        
+        if encoding == 'x-gzip':
+            encoding = 'gzip'
+        
+        if encoding not in supported_encodings():
+            logger.warning(f"ไม่รองรับ Content-Encoding: {encoding} ({path})")
+            return self._error(
+                start_response, '415 Unsupported Media Type',
+                f"ไม่รองรับ Content-Encoding นี้ (รองรับ: {', '.join(supported_encodings())})"
+            )
+        
+        # อ่านข้อมูลดิบไม่เกิน Content-Length เดิม เว้นแต่เซิร์ฟเวอร์จัดการจุดสิ้นสุดของ stream เอง
+        source = environ['wsgi.input']
+        if 'wsgi.input_terminated' not in environ:
+            source = LimitedStream(source, get_content_length(environ) or 0)
+        
+        if encoding == 'zstd':
+            reader = _ZstdReader(source)
+        else:
+            reader = _ZlibReader(source, encoding)
+        
+        max_size = self.max_stream_size if streaming else self.max_body_size
+        decoded = io.BufferedReader(_SizeLimitedReader(reader, max_size), READ_CHUNK_SIZE)
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        
+        if streaming:
+            environ['wsgi.input'] = decoded
+            environ['wsgi.input_terminated'] = True
+            environ.pop('CONTENT_LENGTH', None)
+            return self.app(environ, start_response)
+        
+        try:
+            body = decoded.read()
+        except HTTPException as e:
+            logger.warning(f"คลายการบีบอัดข้อมูลไม่สำเร็จ ({path}): {e.description}")
+            return self._error(start_response, f'{e.code} {e.name}', e.description)
+        
+        environ['wsgi.input'] = io.BytesIO(body)
+        environ['CONTENT_LENGTH'] = str(len(body))
+        
+        return self.app(environ, start_response)
+    
+    def _error(self, start_response, status, message):
+        body = json.dumps({'success': False, 'message': message}, ensure_ascii=False).encode('utf-8')
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Accept-Encoding', ', '.join(supported_encodings()))
+        ])
+        return [body]
+
+def init_decompression(app, config):
+    """
+    ครอบแอปพลิเคชันด้วย DecompressionMiddleware ตามการตั้งค่าในส่วน [compression]
+    
+    Args:
+        app: แอปพลิเคชัน Flask
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    """
+    if not config.getboolean('compression', 'enabled', fallback=True):
+        return
+    
+    max_stream_mb = config.getint('compression', 'max_stream_decoded_mb', fallback=256)
+    app.wsgi_app = DecompressionMiddleware(
+        app.wsgi_app,
+        max_body_size=app.config["MAX_CONTENT_LENGTH"],
+        max_stream_size=max_stream_mb * 1024 * 1024
+    )
+    
+    logger.info(f"รองรับข้อมูลแบบบีบอัด: {', '.join(supported_encodings())}")
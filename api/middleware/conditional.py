@@ -0,0 +1,90 @@
+# api/middleware/conditional.py - ตอบ 304 Not Modified เมื่อข้อมูลของสาขาไม่เปลี่ยน (ETag / Last-Modified)
+import hashlib
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, make_response
+from server.watermarks import get_data_watermarks
+from server.timezones import get_timezones
+
+def _validators(branch_id):
+    """
+    สร้าง ETag และเวลา Last-Modified ของคำขอปัจจุบัน
+    
+    validator เปลี่ยนเมื่อข้อมูลของสาขาเปลี่ยน และเมื่อขึ้นวันใหม่
+    (ช่วงเวลาเริ่มต้นของหลาย endpoint คำนวณจากวันที่ปัจจุบัน)
+    
+    Returns:
+        tuple: (etag, last_modified เป็น epoch วินาที)
+    """
+    watermarks = get_data_watermarks()
+    version, modified = watermarks.get(branch_id)
+    
+    # เที่ยงคืนของวันนี้ตามเวลาท้องถิ่นของสาขา (วันที่เดียวกับค่าเริ่มต้นของช่วงเวลาใน endpoint)
+    # คำขอที่ไม่ระบุสาขาใช้เขตเวลาเริ่มต้น
+    timezones = get_timezones()
+    today = timezones.today(branch_id)
+    midnight = timezones.zone(branch_id).localize(datetime.combine(today, datetime.min.time()))
+    last_modified = max(modified, midnight.timestamp())
+    
+    token = f"{watermarks.epoch}:{version}:{today}:{request.full_path}"
+    etag = hashlib.sha1(token.encode()).hexdigest()[:32]
+    
+    return etag, last_modified
+
+def _not_modified(etag, last_modified):
+    """ตรวจ If-None-Match (มีสิทธิ์ก่อน) หรือ If-Modified-Since ของคำขอ"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    
+    if request.if_modified_since is not None and last_modified is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    
+    return False
+
+def _set_validators(response, etag, last_modified):
+    """ใส่ ETag, Last-Modified และ Cache-Control ลงใน response"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc)
+    # ข้อมูลต้องยืนยันตัวตน จึงให้ browser เก็บได้แต่ต้องตรวจสอบกับเซิร์ฟเวอร์ทุกครั้ง
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def conditional_get(per_branch=True):
+    """
+    Decorator สำหรับ endpoint อ่านข้อมูล ให้ตอบ 304 โดยไม่เรียก view เมื่อ validator ของ client ยังตรงกัน
+    
+    Args:
+        per_branch: True = ใช้การเปลี่ยนแปลงของสาขาใน branch_id ของ URL,
+                    False = ใช้การเปลี่ยนแปลงล่าสุดของทุกสาขา
+    
+    Returns:
+        decorator: ฟังก์ชันที่ครอบ view
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if get_data_watermarks() is None:
+                return f(*args, **kwargs)
+            
+            # คำนวณ validator ก่อนเรียก view ถ้ามีข้อมูลใหม่ระหว่างนั้น คำขอถัดไปจะได้ข้อมูลใหม่
+            etag, last_modified = _validators(kwargs.get('branch_id') if per_branch else None)
+            
+            # Last-Modified มีความละเอียดระดับวินาที ถ้าข้อมูลเพิ่งเปลี่ยนในวินาทีนี้
+            # การเปลี่ยนแปลงถัดไปในวินาทีเดียวกันจะแยกไม่ออก จึงส่งเฉพาะ ETag
+            if int(last_modified) >= int(time.time()):
+                last_modified = None
+            
+            if _not_modified(etag, last_modified):
+                return _set_validators(make_response('', 304), etag, last_modified)
+            
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                _set_validators(response, etag, last_modified)
+            return response
+        
+        return decorated
+    
+    return decorator
@@ -8,6 +8,12 @@ from sqlalchemy.exc import SQLAlchemyError
 from server.db import get_session
 from models.branch import Branch
 from api.middleware.auth import token_required, admin_required
+from api.middleware.conditional import conditional_get
+from server.occupancy import get_occupancy_registry
+from server.anomalies import get_anomaly_detector
+from server.timezones import get_timezones, get_zone
+from server.report_cache import get_report_cache
+from server.watermarks import touch_branches
 
 # สร้าง Blueprint
 branches_bp = Blueprint('branches', __name__)
@@ -16,6 +22,7 @@ logger = logging.getLogger(__name__)
 
 @branches_bp.route('', methods=['GET'])
 @token_required
+@conditional_get(per_branch=False)
 def get_branches():
     """ดึงข้อมูลสาขาทั้งหมด"""
     try:
@@ -55,6 +62,7 @@ def get_branches():
 
 @branches_bp.route('/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
 def get_branch(branch_id):
     """ดึงข้อมูลสาขาตาม branch_id"""
     try:
@@ -111,6 +119,16 @@ def create_branch():
                 'message': 'ข้อมูลไม่ครบถ้วน กรุณาระบุ branch_id และ name'
             }), 400
         
+        # เขตเวลาของสาขา (ไม่ระบุ = [app] timezone)
+        if data.get('timezone'):
+            try:
+                get_zone(data['timezone'])
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'message': str(e)
+                }), 400
+        
         db = get_session()
         
         try:
@@ -138,6 +156,7 @@ def create_branch():
                 open_time=data.get('open_time', '09:00'),
                 close_time=data.get('close_time', '20:00'),
                 capacity=data.get('capacity', 100),
+                timezone=data.get('timezone') or None,
                 latitude=data.get('latitude'),
                 longitude=data.get('longitude')
             )
@@ -145,6 +164,18 @@ def create_branch():
             db.add(new_branch)
             db.commit()
             
+            registry = get_occupancy_registry()
+            if registry is not None:
+                registry.set_branch(data['branch_id'], data['name'], data.get('capacity', 100))
+            
+            detector = get_anomaly_detector()
+            if detector is not None:
+                detector.set_branch(data['branch_id'], data.get('open_time', '09:00'), data.get('close_time', '20:00'))
+            
+            get_timezones().set_branch(data['branch_id'], data.get('timezone'))
+            
+            touch_branches([data['branch_id']])
+            
             logger.info(f"สร้างสาขาใหม่ {data['branch_id']} สำเร็จ")
             
             return jsonify({
@@ -179,6 +210,15 @@ def update_branch(branch_id):
     try:
         data = request.json
         
+        if data.get('timezone'):
+            try:
+                get_zone(data['timezone'])
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'message': str(e)
+                }), 400
+        
         db = get_session()
         
         try:
@@ -216,15 +256,37 @@ def update_branch(branch_id):
                 branch.close_time = data['close_time']
             if 'capacity' in data:
                 branch.capacity = data['capacity']
+            if 'timezone' in data:
+                branch.timezone = data['timezone'] or None
             if 'latitude' in data:
                 branch.latitude = data['latitude']
             if 'longitude' in data:
                 branch.longitude = data['longitude']
             
             branch.updated_at = datetime.now()
+            branch_name, branch_capacity = branch.name, branch.capacity
+            branch_hours = (branch.open_time, branch.close_time)
+            branch_timezone = branch.timezone
             
             db.commit()
             
+            registry = get_occupancy_registry()
+            if registry is not None:
+                registry.set_branch(branch_id, branch_name, branch_capacity)
+            
+            detector = get_anomaly_detector()
+            if detector is not None:
+                detector.set_branch(branch_id, *branch_hours)
+            
+            get_timezones().set_branch(branch_id, branch_timezone)
+            
+            # รายงานที่แคชไว้มีชื่อสาขาอยู่ด้วย
+            report_cache = get_report_cache()
+            if report_cache is not None:
+                report_cache.purge(branch_id)
+            
+            touch_branches([branch_id])
+            
             logger.info(f"อัพเดตข้อมูลสาขา {branch_id} สำเร็จ")
             
             return jsonify({
@@ -272,6 +334,22 @@ def delete_branch(branch_id):
             db.delete(branch)
             db.commit()
             
+            registry = get_occupancy_registry()
+            if registry is not None:
+                registry.remove_branch(branch_id)
+            
+            detector = get_anomaly_detector()
+            if detector is not None:
+                detector.remove_branch(branch_id)
+            
+            get_timezones().remove_branch(branch_id)
+            
+            report_cache = get_report_cache()
+            if report_cache is not None:
+                report_cache.purge(branch_id)
+            
+            touch_branches([branch_id])
+            
             logger.info(f"ลบสาขา {branch_id} สำเร็จ")
             
             return jsonify({
@@ -298,8 +376,23 @@ def delete_branch(branch_id):
         }), 500
 
 @branches_bp.route('/<branch_id>/current-count', methods=['GET'])
+@conditional_get()
 def get_branch_current_count(branch_id):
     """ดึงข้อมูลจำนวนลูกค้าปัจจุบันของสาขา (ไม่ต้องล็อกอิน)"""
+    registry = get_occupancy_registry()
+    if registry is not None:
+        # อ่านจากทะเบียนในหน่วยความจำโดยไม่ต้อง query ฐานข้อมูล
+        state = registry.get_branch(branch_id)
+        if state is not None:
+            return jsonify({
+                'success': True,
+                'branch_id': state['branch_id'],
+                'name': state['name'],
+                'current_count': state['current_count'],
+                'capacity': state['capacity'] or 100,
+                'last_updated': state['last_updated'].isoformat() if state['last_updated'] else None
+            })
+    
     try:
         db = get_session()
         
@@ -313,6 +406,10 @@ def get_branch_current_count(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
+            # สาขาที่ถูกเพิ่มโดยไม่ผ่าน API จะถูกเพิ่มเข้าทะเบียนเมื่ออ่านครั้งแรก
+            if registry is not None:
+                registry.set_branch(branch.branch_id, branch.name, branch.capacity)
+            
             # ดึงข้อมูลจำนวนลูกค้าปัจจุบัน
             return jsonify({
                 'success': True,
@@ -341,8 +438,28 @@ def get_branch_current_count(branch_id):
         }), 500
 
 @branches_bp.route('/current-counts', methods=['GET'])
+@conditional_get(per_branch=False)
 def get_all_branches_current_count():
     """ดึงข้อมูลจำนวนลูกค้าปัจจุบันของทุกสาขา (ไม่ต้องล็อกอิน)"""
+    registry = get_occupancy_registry()
+    if registry is not None:
+        result = [
+            {
+                'branch_id': state['branch_id'],
+                'name': state['name'],
+                'current_count': state['current_count'],
+                'capacity': state['capacity'] or 100,
+                'last_updated': state['last_updated'].isoformat() if state['last_updated'] else None
+            }
+            for state in registry.get_branches()
+        ]
+        
+        return jsonify({
+            'success': True,
+            'branches': result,
+            'count': len(result)
+        })
+    
     try:
         db = get_session()
         
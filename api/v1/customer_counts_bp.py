@@ -1,70 +1,118 @@
 # api/v1/customer_counts_bp.py - API สำหรับจัดการข้อมูลการนับลูกค้า
 import logging
 import json
-from flask import Blueprint, request, jsonify, g
-from datetime import datetime, timedelta
-from sqlalchemy import func, and_, desc
+import queue
+from flask import Blueprint, request, jsonify, g, current_app, Response, stream_with_context
+from werkzeug.exceptions import HTTPException, ClientDisconnected
+from werkzeug.wsgi import get_input_stream
+from datetime import timedelta
 from sqlalchemy.exc import SQLAlchemyError
 from server.db import get_session
-from models.customer_count import CustomerCount
 from models.branch import Branch
+from models.camera_latest import CameraLatest
 from api.middleware.auth import token_required
+from api.middleware.conditional import conditional_get
+from server.ingest import parse_count, store_counts
+from server.ingest_queue import get_ingest_queue
+from server.occupancy import get_occupancy_registry
+from server.forecast import get_forecast_profiles, MAX_FORECAST_HOURS
+from server.sketches import get_sketch_store, DEFAULT_QUANTILES, SKETCH_METRICS
+from server.timezones import get_timezones
+from server.ingest_stream import ingest_ndjson, upload_progress
+from server.wire_format import FRAME_MIMETYPE, decode_frame, frame_records
+from server.rollups import iter_rollup_series
+from server.analytics import DOWNSAMPLE_METHODS, MIN_DOWNSAMPLE_POINTS, downsample_indices, series_from_rows, to_datetimes
+from server.aggregates import (
+    aggregate_periods, build_comparison, make_period, parse_periods, rank_branches, utilisation,
+    DEFAULT_METRICS, RANKING_METRICS, RANKING_GROUPS, UTILISATION_METRICS
+)
 
 # สร้าง Blueprint
 customer_counts_bp = Blueprint('customer_counts', __name__)
 
 logger = logging.getLogger(__name__)
 
+# ช่วงเวลาที่รองรับของประวัติการนับลูกค้า
+HISTORY_INTERVALS = ('hour', 'day', 'week', 'month')
+
+# ค่าที่ใช้เลือกจุดเมื่อลดจำนวนจุดของประวัติ (ชื่อใน response -> คอลัมน์ของ Series)
+DOWNSAMPLE_FIELDS = {'entry_count': 'entries', 'exit_count': 'exits', 'max_count': 'max_count'}
+
 @customer_counts_bp.route('/realtime', methods=['POST'])
 def record_realtime():
     """บันทึกข้อมูลการนับลูกค้าแบบเรียลไทม์"""
+    if request.mimetype == FRAME_MIMETYPE:
+        return record_frame(use_queue=True)
+    
     try:
         data = request.json
         
         # ตรวจสอบข้อมูลที่จำเป็น
-        required_fields = ['camera_id', 'branch_id', 'timestamp', 'entry_count', 'exit_count', 'current_count']
-        if not all(field in data for field in required_fields):
+        try:
+            record = parse_count(data)
+        except ValueError as e:
             return jsonify({
                 'success': False,
-                'message': 'ข้อมูลไม่ครบถ้วน'
+                'message': str(e)
             }), 400
         
-        db = get_session()
-        
-        try:
-            # แปลง timestamp เป็น datetime
-            if isinstance(data['timestamp'], str):
-                timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
-            else:
-                timestamp = datetime.now()
-            
-            # สร้างข้อมูลการนับลูกค้า
-            new_count = CustomerCount(
-                camera_id=data['camera_id'],
-                branch_id=data['branch_id'],
-                timestamp=timestamp,
-                entry_count=data['entry_count'],
-                exit_count=data['exit_count'],
-                current_count=data['current_count'],
-                meta_data=json.dumps(data.get('meta_data', {}))
-            )
+        # โหมด write-behind: เข้าคิวแล้วตอบกลับทันที
+        ingest_queue = get_ingest_queue()
+        if ingest_queue is not None:
+            try:
+                future = ingest_queue.put(record)
+            except queue.Full:
+                logger.warning(f"คิวบันทึกข้อมูลเต็ม ปฏิเสธข้อมูลจากกล้อง {record['camera_id']}")
+                return jsonify({
+                    'success': False,
+                    'message': 'คิวบันทึกข้อมูลเต็ม กรุณาส่งใหม่ภายหลัง'
+                }), 503
             
-            db.add(new_count)
+            if future is None:
+                return jsonify({
+                    'success': True,
+                    'message': 'รับข้อมูลเข้าคิวแล้ว',
+                    'queued': True
+                }), 202
             
-            # อัพเดตจำนวนลูกค้าปัจจุบันของสาขา
-            branch = db.query(Branch).filter_by(branch_id=data['branch_id']).first()
-            if branch:
-                branch.current_customer_count = data['current_count']
-                branch.last_updated = timestamp
+            # durability แบบ sync: รอจนกว่า group commit ที่มีข้อมูลนี้จะสำเร็จ
+            try:
+                future.result(timeout=ingest_queue.sync_timeout)
+            except Exception as e:
+                logger.error(f"เกิดข้อผิดพลาดในการบันทึกข้อมูลจากคิว: {str(e)}")
+                return jsonify({
+                    'success': False,
+                    'message': 'เกิดข้อผิดพลาดในการบันทึกข้อมูล'
+                }), 500
             
+            return jsonify({
+                'success': True,
+                'message': 'บันทึกข้อมูลสำเร็จ',
+                'queued': True
+            })
+        
+        db = get_session()
+        
+        try:
+            stored = store_counts(db, [record])
             db.commit()
             
-            logger.info(f"บันทึกข้อมูลการนับลูกค้าสำหรับกล้อง {data['camera_id']} สำเร็จ")
+            if stored['duplicates']:
+                logger.info(f"ข้ามข้อมูลซ้ำจากกล้อง {record['camera_id']} ({record['timestamp']})")
+                return jsonify({
+                    'success': True,
+                    'message': 'ข้อมูลนี้ถูกบันทึกไว้แล้ว',
+                    'id': None,
+                    'duplicate': True
+                })
+            
+            logger.info(f"บันทึกข้อมูลการนับลูกค้าสำหรับกล้อง {record['camera_id']} สำเร็จ")
             
             return jsonify({
                 'success': True,
                 'message': 'บันทึกข้อมูลสำเร็จ',
-                'id': new_count.id
+                'id': stored['id'],
+                'duplicate': False
             })
         
         except SQLAlchemyError as e:
@@ -85,14 +133,29 @@ def record_realtime():
             'message': 'เกิดข้อผิดพลาด: ' + str(e)
         }), 500
 
+@customer_counts_bp.route('/ingest/stats', methods=['GET'])
+@token_required
+def get_ingest_stats():
+    """ดึงสถิติของคิวบันทึกข้อมูล (ต้องมีการยืนยันตัวตน)"""
+    ingest_queue = get_ingest_queue()
+    
+    return jsonify({
+        'success': True,
+        'mode': 'queued' if ingest_queue is not None else 'direct',
+        'queue': ingest_queue.stats() if ingest_queue is not None else None
+    })
+
 @customer_counts_bp.route('/batch', methods=['POST'])
 def record_batch():
     """บันทึกข้อมูลการนับลูกค้าแบบกลุ่ม"""
+    if request.mimetype == FRAME_MIMETYPE:
+        return record_frame(use_queue=False)
+    
     try:
         data = request.json
         
         # ตรวจสอบข้อมูลที่จำเป็น
-        if 'data' not in data or not isinstance(data['data'], list):
+        if not isinstance(data, dict) or 'data' not in data or not isinstance(data['data'], list):
             return jsonify({
                 'success': False,
                 'message': 'ข้อมูลไม่ถูกต้อง กรุณาส่งข้อมูลในรูปแบบอาร์เรย์'
@@ -105,56 +168,44 @@ def record_batch():
                 'count': 0
             })
         
+        # ตรวจสอบข้อมูลทีละรายการ รายการที่ไม่ถูกต้องจะถูกรายงานกลับพร้อมลำดับ
+        records = []
+        rejected = []
+        for index, item in enumerate(data['data']):
+            try:
+                records.append(parse_count(item))
+            except ValueError as e:
+                rejected.append({'index': index, 'message': str(e)})
+        
+        if not records:
+            return jsonify({
+                'success': False,
+                'message': 'ไม่มีข้อมูลที่ถูกต้อง',
+                'count': 0,
+                'accepted': 0,
+                'rejected': rejected
+            }), 400
+        
         db = get_session()
         
         try:
-            # สร้างข้อมูลการนับลูกค้าทั้งหมด
-            count_records = []
-            for item in data['data']:
-                # ตรวจสอบข้อมูลที่จำเป็น
-                required_fields = ['camera_id', 'branch_id', 'timestamp', 'entry_count', 'exit_count', 'current_count']
-                if not all(field in item for field in required_fields):
-                    continue
-                
-                # แปลง timestamp เป็น datetime
-                if isinstance(item['timestamp'], str):
-                    timestamp = datetime.fromisoformat(item['timestamp'].replace('Z', '+00:00'))
-                else:
-                    timestamp = datetime.now()
-                
-                # สร้างข้อมูลการนับลูกค้า
-                count_record = CustomerCount(
-                    camera_id=item['camera_id'],
-                    branch_id=item['branch_id'],
-                    timestamp=timestamp,
-                    entry_count=item['entry_count'],
-                    exit_count=item['exit_count'],
-                    current_count=item['current_count'],
-                    meta_data=json.dumps(item.get('meta_data', {}))
-                )
-                
-                count_records.append(count_record)
-            
-            # บันทึกข้อมูลทั้งหมด
-            db.add_all(count_records)
-            
-            # อัพเดตจำนวนลูกค้าปัจจุบันของสาขา
-            if count_records:
-                # ใช้ข้อมูลล่าสุด
-                latest_record = max(count_records, key=lambda r: r.timestamp)
-                branch = db.query(Branch).filter_by(branch_id=latest_record.branch_id).first()
-                if branch:
-                    branch.current_customer_count = latest_record.current_count
-                    branch.last_updated = latest_record.timestamp
-            
+            # บันทึกข้อมูลทั้งหมดและอัพเดตทุกสาขาใน transaction เดียว
+            stored = store_counts(db, records)
             db.commit()
             
-            logger.info(f"บันทึกข้อมูลการนับลูกค้าแบบกลุ่มจำนวน {len(count_records)} รายการสำเร็จ")
+            logger.info(
+                f"บันทึกข้อมูลการนับลูกค้าแบบกลุ่มจำนวน {stored['inserted']} รายการสำเร็จ "
+                f"(ซ้ำ {stored['duplicates']} รายการ, ปฏิเสธ {len(rejected)} รายการ)"
+            )
             
             return jsonify({
                 'success': True,
                 'message': 'บันทึกข้อมูลสำเร็จ',
-                'count': len(count_records)
+                'count': stored['inserted'],
+                'accepted': len(records),
+                'inserted': stored['inserted'],
+                'duplicates': stored['duplicates'],
+                'rejected': rejected
             })
         
         except SQLAlchemyError as e:
@@ -175,45 +226,249 @@ def record_batch():
             'message': 'เกิดข้อผิดพลาด: ' + str(e)
         }), 500
 
+def record_frame(use_queue):
+    """
+    บันทึกข้อมูลการนับที่ส่งมาในรูปแบบเฟรมไบนารี (application/x-shopcounter-frame)
+    
+    Args:
+        use_queue: ใช้คิวบันทึกข้อมูลถ้าเปิดใช้งาน (เฉพาะ /realtime)
+    """
+    try:
+        rows = decode_frame(request.get_data())
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    if not rows:
+        return jsonify({
+            'success': True,
+            'message': 'ไม่มีข้อมูลที่ต้องบันทึก',
+            'count': 0
+        })
+    
+    records = frame_records(rows)
+    
+    ingest_queue = get_ingest_queue() if use_queue else None
+    if ingest_queue is not None:
+        futures = []
+        try:
+            for record in records:
+                futures.append(ingest_queue.put(record))
+        except queue.Full:
+            logger.warning(f"คิวบันทึกข้อมูลเต็ม รับข้อมูลจากเฟรมได้ {len(futures)} จาก {len(records)} รายการ")
+            return jsonify({
+                'success': False,
+                'message': 'คิวบันทึกข้อมูลเต็ม กรุณาส่งใหม่ภายหลัง',
+                'accepted': len(futures)
+            }), 503
+        
+        if ingest_queue.durability != 'sync':
+            return jsonify({
+                'success': True,
+                'message': 'รับข้อมูลเข้าคิวแล้ว',
+                'queued': True,
+                'accepted': len(records)
+            }), 202
+        
+        try:
+            for future in futures:
+                future.result(timeout=ingest_queue.sync_timeout)
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการบันทึกข้อมูลจากคิว: {str(e)}")
+            return jsonify({
+                'success': False,
+                'message': 'เกิดข้อผิดพลาดในการบันทึกข้อมูล'
+            }), 500
+        
+        return jsonify({
+            'success': True,
+            'message': 'บันทึกข้อมูลสำเร็จ',
+            'queued': True,
+            'accepted': len(records)
+        })
+    
+    db = get_session()
+    
+    try:
+        stored = store_counts(db, records)
+        db.commit()
+        
+        logger.info(
+            f"บันทึกข้อมูลการนับลูกค้าจากเฟรมไบนารี {stored['inserted']} รายการสำเร็จ "
+            f"(ซ้ำ {stored['duplicates']} รายการ)"
+        )
+        
+        return jsonify({
+            'success': True,
+            'message': 'บันทึกข้อมูลสำเร็จ',
+            'count': stored['inserted'],
+            'accepted': len(records),
+            'inserted': stored['inserted'],
+            'duplicates': stored['duplicates']
+        })
+    
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"เกิดข้อผิดพลาดในการบันทึกข้อมูล: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาดในการบันทึกข้อมูล'
+        }), 500
+    
+    finally:
+        db.close()
+
+@customer_counts_bp.route('/stream', methods=['POST'])
+def record_stream():
+    """
+    บันทึกข้อมูลการนับลูกค้าย้อนหลังแบบ NDJSON (หนึ่งรายการต่อบรรทัด)
+    
+    อ่านข้อมูลจาก request stream ทีละบรรทัดโดยไม่ต้องโหลดทั้งหมดเข้าหน่วยความจำ
+    จึงไม่ถูกจำกัดด้วย MAX_CONTENT_LENGTH ระบุ upload_id และ offset (ตำแหน่งไบต์ในไฟล์
+    ของอุปกรณ์ที่ข้อมูลชุดนี้เริ่มต้น) เพื่อส่งต่อจาก committed_offset เมื่อการเชื่อมต่อขาด
+    """
+    upload_id = request.args.get('upload_id') or request.headers.get('X-Upload-Id')
+    base_offset = request.args.get('offset', type=int)
+    if base_offset is None:
+        base_offset = request.headers.get('X-Resume-Offset', 0, type=int)
+    
+    if base_offset < 0:
+        return jsonify({
+            'success': False,
+            'message': 'offset ต้องไม่ติดลบ'
+        }), 400
+    
+    try:
+        stream = get_input_stream(request.environ, max_content_length=None)
+        summary = ingest_ndjson(
+            stream,
+            upload_id=upload_id,
+            base_offset=base_offset,
+            chunk_rows=current_app.config['STREAM_CHUNK_ROWS'],
+            max_line_bytes=current_app.config['STREAM_MAX_LINE_BYTES']
+        )
+        
+        return jsonify({
+            'success': True,
+            'message': 'บันทึกข้อมูลสำเร็จ',
+            **summary
+        })
+    
+    except ClientDisconnected:
+        progress = upload_progress.get(upload_id)
+        logger.warning(f"การเชื่อมต่อขาดระหว่างรับข้อมูลแบบ stream (upload_id: {upload_id})")
+        return jsonify({
+            'success': False,
+            'message': 'การเชื่อมต่อขาดระหว่างรับข้อมูล กรุณาส่งต่อจาก committed_offset',
+            'progress': progress
+        }), 400
+    
+    except HTTPException as e:
+        # ข้อมูลที่บีบอัดไม่ถูกต้อง หรือขนาดหลังคลายการบีบอัดเกินกำหนด
+        logger.warning(f"ไม่สามารถอ่านข้อมูลแบบ stream (upload_id: {upload_id}): {e.description}")
+        return jsonify({
+            'success': False,
+            'message': e.description,
+            'progress': upload_progress.get(upload_id)
+        }), e.code
+    
+    except SQLAlchemyError as e:
+        logger.error(f"เกิดข้อผิดพลาดในการบันทึกข้อมูลแบบ stream: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาดในการบันทึกข้อมูล กรุณาส่งต่อจาก committed_offset',
+            'progress': upload_progress.get(upload_id)
+        }), 500
+    
+    except Exception as e:
+        logger.error(f"เกิดข้อผิดพลาดในการบันทึกข้อมูลแบบ stream: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาด: ' + str(e)
+        }), 500
+
+@customer_counts_bp.route('/stream/<upload_id>', methods=['GET'])
+def get_stream_progress(upload_id):
+    """ดึงความคืบหน้าของการอัพโหลดแบบ stream เพื่อหาตำแหน่งที่ต้องส่งต่อ"""
+    progress = upload_progress.get(upload_id)
+    
+    if progress is None:
+        return jsonify({
+            'success': False,
+            'message': 'ไม่พบข้อมูลการอัพโหลด'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'progress': progress
+    })
+
 @customer_counts_bp.route('/current', methods=['GET'])
 @token_required
+@conditional_get(per_branch=False)
 def get_current_counts():
     """ดึงข้อมูลจำนวนลูกค้าปัจจุบันของทุกสาขา (ต้องมีการยืนยันตัวตน)"""
+    registry = get_occupancy_registry()
+    if registry is not None:
+        # อ่านจากทะเบียนในหน่วยความจำโดยไม่ต้อง query ฐานข้อมูล
+        results = []
+        for state in registry.get_branches():
+            results.append({
+                'branch_id': state['branch_id'],
+                'branch_name': state['name'],
+                'current_count': state['current_count'],
+                'cameras': [
+                    {
+                        'camera_id': camera['camera_id'],
+                        'current_count': camera['current_count'],
+                        'timestamp': camera['timestamp'].isoformat()
+                    }
+                    for camera in state['cameras']
+                ],
+                'last_updated': state['last_updated'].isoformat() if state['last_updated'] else None
+            })
+        
+        return jsonify({
+            'success': True,
+            'data': results
+        })
+    
     try:
         db = get_session()
         
         try:
-            # ดึงข้อมูลสาขาทั้งหมด
-            branches = db.query(Branch).all()
+            # ดึงทุกสาขาพร้อมข้อมูลล่าสุดของทุกกล้องด้วย query เดียว
+            rows = db.query(
+                    Branch.branch_id, Branch.name, Branch.last_updated,
+                    CameraLatest.camera_id, CameraLatest.current_count, CameraLatest.timestamp
+                ) \
+                .outerjoin(CameraLatest, CameraLatest.branch_id == Branch.branch_id) \
+                .order_by(Branch.id, CameraLatest.camera_id) \
+                .all()
             
             results = []
-            for branch in branches:
-                # ดึงข้อมูลการนับลูกค้าล่าสุดของแต่ละกล้องในสาขา
-                cameras = db.query(CustomerCount.camera_id, func.max(CustomerCount.id).label('latest_id')) \
-                    .filter_by(branch_id=branch.branch_id) \
-                    .group_by(CustomerCount.camera_id) \
-                    .all()
+            by_branch = {}
+            for branch_id, name, last_updated, camera_id, current_count, timestamp in rows:
+                branch_data = by_branch.get(branch_id)
+                if branch_data is None:
+                    branch_data = by_branch[branch_id] = {
+                        'branch_id': branch_id,
+                        'branch_name': name,
+                        'current_count': 0,
+                        'cameras': [],
+                        'last_updated': last_updated.isoformat() if last_updated else None
+                    }
+                    results.append(branch_data)
                 
-                camera_counts = []
-                total_current_count = 0
-                
-                for camera_id, latest_id in cameras:
-                    latest_count = db.query(CustomerCount).filter_by(id=latest_id).first()
-                    if latest_count:
-                        camera_counts.append({
-                            'camera_id': camera_id,
-                            'current_count': latest_count.current_count,
-                            'timestamp': latest_count.timestamp.isoformat()
-                        })
-                        total_current_count += latest_count.current_count
-                
-                results.append({
-                    'branch_id': branch.branch_id,
-                    'branch_name': branch.name,
-                    'current_count': total_current_count,
-                    'cameras': camera_counts,
-                    'last_updated': branch.last_updated.isoformat() if branch.last_updated else None
-                })
+                if camera_id is not None:
+                    branch_data['cameras'].append({
+                        'camera_id': camera_id,
+                        'current_count': current_count,
+                        'timestamp': timestamp.isoformat()
+                    })
+                    branch_data['current_count'] += current_count
             
             return jsonify({
                 'success': True,
@@ -239,19 +494,56 @@ def get_current_counts():
 
 @customer_counts_bp.route('/history/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
 def get_history(branch_id):
     """ดึงข้อมูลประวัติการนับลูกค้าของสาขา (ต้องมีการยืนยันตัวตน)"""
     try:
         # ดึงพารามิเตอร์
-        start_date = request.args.get('start_date', (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'))
-        end_date = request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+        timezones = get_timezones()
+        today = timezones.today(branch_id)
+        start_date = request.args.get('start_date', (today - timedelta(days=7)).strftime('%Y-%m-%d'))
+        end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
         interval = request.args.get('interval', 'hour')  # hour, day, week, month
+        max_points = request.args.get('max_points', type=int)  # จำนวนจุดสูงสุดของกราฟ (ไม่ระบุ = ทุกจุด)
+        method = request.args.get('downsample', 'lttb')  # lttb, minmax
+        downsample_by = request.args.get('downsample_by', 'entry_count')
+        
+        if interval not in HISTORY_INTERVALS:
+            return jsonify({
+                'success': False,
+                'message': f"interval ต้องเป็นหนึ่งใน {', '.join(HISTORY_INTERVALS)}"
+            }), 400
         
-        # แปลงวันที่
-        start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-        end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        if max_points is not None and max_points < MIN_DOWNSAMPLE_POINTS:
+            return jsonify({
+                'success': False,
+                'message': f'max_points ต้องไม่น้อยกว่า {MIN_DOWNSAMPLE_POINTS}'
+            }), 400
+        
+        if method not in DOWNSAMPLE_METHODS:
+            return jsonify({
+                'success': False,
+                'message': f"downsample ต้องเป็นหนึ่งใน {', '.join(DOWNSAMPLE_METHODS)}"
+            }), 400
+        
+        if downsample_by not in DOWNSAMPLE_FIELDS:
+            return jsonify({
+                'success': False,
+                'message': f"downsample_by ต้องเป็นหนึ่งใน {', '.join(DOWNSAMPLE_FIELDS)}"
+            }), 400
+        
+        # แปลงวันที่ตามเวลาท้องถิ่นของสาขาเป็นช่วงเวลาในเขตเวลาที่บันทึก
+        try:
+            period = make_period(start_date, end_date, branch_id)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        offset = timezones.offset(branch_id, period.start)
         
         db = get_session()
+        streaming = False
         
         try:
             # ตรวจสอบว่ามีสาขานี้อยู่หรือไม่
@@ -262,81 +554,65 @@ def get_history(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
-            # ดึงข้อมูลตามช่วงเวลา
-            # สร้าง SQL ที่เหมาะสมตาม interval ที่ต้องการ
-            if interval == 'hour':
-                # กรณีรายชั่วโมง
-                # ดึงข้อมูลทุกบันทึก แล้วจัดกลุ่มตามชั่วโมงในแอพลิเคชัน
-                counts = db.query(CustomerCount) \
-                    .filter(and_(
-                        CustomerCount.branch_id == branch_id,
-                        CustomerCount.timestamp >= start_datetime,
-                        CustomerCount.timestamp < end_datetime
-                    )) \
-                    .order_by(CustomerCount.timestamp) \
-                    .all()
-                
-                # จัดกลุ่มข้อมูลตามชั่วโมง
-                hourly_data = {}
-                for count in counts:
-                    hour_key = count.timestamp.strftime('%Y-%m-%d %H:00:00')
-                    if hour_key not in hourly_data:
-                        hourly_data[hour_key] = {
-                            'timestamp': hour_key,
-                            'entry_count': 0,
-                            'exit_count': 0,
-                            'max_count': 0
-                        }
-                    
-                    hourly_data[hour_key]['entry_count'] += count.entry_count
-                    hourly_data[hour_key]['exit_count'] += count.exit_count
-                    hourly_data[hour_key]['max_count'] = max(hourly_data[hour_key]['max_count'], count.current_count)
-                
-                result = list(hourly_data.values())
-            
-            elif interval == 'day':
-                # กรณีรายวัน
-                daily_data = {}
-                
-                counts = db.query(CustomerCount) \
-                    .filter(and_(
-                        CustomerCount.branch_id == branch_id,
-                        CustomerCount.timestamp >= start_datetime,
-                        CustomerCount.timestamp < end_datetime
-                    )) \
-                    .order_by(CustomerCount.timestamp) \
-                    .all()
-                
-                for count in counts:
-                    day_key = count.timestamp.strftime('%Y-%m-%d')
-                    if day_key not in daily_data:
-                        daily_data[day_key] = {
-                            'timestamp': day_key,
-                            'entry_count': 0,
-                            'exit_count': 0,
-                            'max_count': 0
-                        }
-                    
-                    daily_data[day_key]['entry_count'] += count.entry_count
-                    daily_data[day_key]['exit_count'] += count.exit_count
-                    daily_data[day_key]['max_count'] = max(daily_data[day_key]['max_count'], count.current_count)
-                
-                result = list(daily_data.values())
-                
-            else:
-                # กรณีรายสัปดาห์หรือรายเดือน (จัดการคล้ายกับรายวัน แต่แบ่งกลุ่มตาม week หรือ month)
-                # ในที่นี้ไม่ได้เขียนรายละเอียดทั้งหมด
-                result = []
+            # รวมข้อมูลตามช่วงเวลาในฐานข้อมูลจากตารางสรุป แล้วส่งผลลัพธ์ทีละแถว
+            # หน่วยความจำจึงขึ้นกับจำนวนแถวที่อ่านต่อครั้ง ไม่ใช่จำนวนข้อมูลการนับในช่วงเวลา
+            rows = iter_rollup_series(db, period.start, period.end, interval, branch_ids=[branch_id], offset=offset)
+            timestamp_format = '%Y-%m-%d %H:00:00' if interval == 'hour' else '%Y-%m-%d'
             
-            return jsonify({
+            header = {
                 'success': True,
                 'branch_id': branch_id,
                 'branch_name': branch.name,
                 'interval': interval,
                 'start_date': start_date,
-                'end_date': end_date,
-                'data': result
-            })
+                'end_date': end_date
+            }
+            
+            if max_points is not None:
+                # ลดจำนวนจุดต้องเห็นข้อมูลทั้งช่วง จึงโหลดเป็นอาร์เรย์ก่อน (ขนาดของ response ไม่เกิน max_points จุด)
+                series = series_from_rows(row[1:] for row in rows)
+                values = getattr(series, DOWNSAMPLE_FIELDS[downsample_by])
+                indices = downsample_indices(series.timestamps, values, max_points, method)
+                header['downsample'] = {
+                    'method': method,
+                    'by': downsample_by,
+                    'max_points': max_points,
+                    'total_points': len(series.timestamps),
+                    'points': len(indices)
+                }
+                rows = (
+                    (branch_id, bucket, entries, exits, max_count, None, None)
+                    for bucket, entries, exits, max_count in zip(
+                        to_datetimes(series.timestamps[indices]),
+                        series.entries[indices].tolist(),
+                        series.exits[indices].tolist(),
+                        series.max_count[indices].tolist()
+                    )
+                )
+            
+            header = json.dumps(header, ensure_ascii=False)
+            
+            def generate():
+                try:
+                    yield header[:-1] + ', "data": ['
+                    separator = ''
+                    for _, bucket, entries, exits, max_count, _, _ in rows:
+                        yield separator + json.dumps({
+                            'timestamp': bucket.strftime(timestamp_format),
+                            'entry_count': entries,
+                            'exit_count': exits,
+                            'max_count': max_count
+                        })
+                        separator = ', '
+                    yield ']}'
+                except SQLAlchemyError as e:
+                    logger.error(f"เกิดข้อผิดพลาดในการอ่านข้อมูลประวัติ: {str(e)}")
+                    raise
+                finally:
+                    db.close()
+            
+            streaming = True
+            return Response(stream_with_context(generate()), mimetype='application/json')
         
         except SQLAlchemyError as e:
             logger.error(f"เกิดข้อผิดพลาดในการดึงข้อมูล: {str(e)}")
@@ -346,7 +622,9 @@ def get_history(branch_id):
             }), 500
         
         finally:
-            db.close()
+            # session ที่ส่งข้อมูลแบบ stream จะถูกปิดเมื่อส่งข้อมูลครบ
+            if not streaming:
+                db.close()
     
     except Exception as e:
         logger.error(f"เกิดข้อผิดพลาดในการดึงข้อมูลประวัติการนับลูกค้า: {str(e)}")
@@ -357,16 +635,25 @@ def get_history(branch_id):
 
 @customer_counts_bp.route('/summary/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
 def get_summary(branch_id):
     """ดึงข้อมูลสรุปการนับลูกค้าของสาขา (ต้องมีการยืนยันตัวตน)"""
     try:
         # ดึงพารามิเตอร์
-        start_date = request.args.get('start_date', (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'))
-        end_date = request.args.get('end_date', datetime.now().strftime('%Y-%m-%d'))
+        timezones = get_timezones()
+        today = timezones.today(branch_id)
+        start_date = request.args.get('start_date', (today - timedelta(days=7)).strftime('%Y-%m-%d'))
+        end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
         
-        # แปลงวันที่
-        start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
-        end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        # แปลงวันที่ตามเวลาท้องถิ่นของสาขาเป็นช่วงเวลาในเขตเวลาที่บันทึก
+        try:
+            period = make_period(start_date, end_date, branch_id)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        start_datetime, end_datetime = period.start, period.end
         
         db = get_session()
         
@@ -379,56 +666,33 @@ def get_summary(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
-            # ดึงข้อมูลสรุป
-            # รวมจำนวนลูกค้าเข้า
-            total_entries = db.query(func.sum(CustomerCount.entry_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_datetime,
-                    CustomerCount.timestamp < end_datetime
-                )) \
-                .scalar() or 0
+            # ดึงข้อมูลสรุปรายชั่วโมงของวัน (ตามเวลาท้องถิ่นของสาขา) ด้วย query เดียว แล้วคำนวณยอดรวมจากผลลัพธ์
+            hourly = {
+                hour: values[0]
+                for hour, values in aggregate_periods(
+                    db, [period], DEFAULT_METRICS + UTILISATION_METRICS, branch_ids=[branch_id], group_by='hour',
+                    offset=timezones.offset(branch_id, start_datetime)
+                ).items()
+            }
             
-            # รวมจำนวนลูกค้าออก
-            total_exits = db.query(func.sum(CustomerCount.exit_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_datetime,
-                    CustomerCount.timestamp < end_datetime
-                )) \
-                .scalar() or 0
-            
-            # จำนวนลูกค้าสูงสุด
-            max_count = db.query(func.max(CustomerCount.current_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_datetime,
-                    CustomerCount.timestamp < end_datetime
-                )) \
-                .scalar() or 0
+            total_entries = sum(values['entries'] for values in hourly.values())
+            total_exits = sum(values['exits'] for values in hourly.values())
+            max_count = max((values['max_count'] for values in hourly.values()), default=0)
+            occupancy_seconds = sum(values['occupancy_seconds'] for values in hourly.values())
+            busy_seconds = sum(values['busy_seconds'] for values in hourly.values())
             
             # หาชั่วโมงที่มีลูกค้าเข้ามากที่สุด
-            # ในที่นี้ใช้การจัดกลุ่มตามชั่วโมงแบบง่ายๆ
-            busy_hours_data = db.query(
-                    func.date_format(CustomerCount.timestamp, '%H:00').label('hour'),
-                    func.sum(CustomerCount.entry_count).label('entries')
-                ) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_datetime,
-                    CustomerCount.timestamp < end_datetime
-                )) \
-                .group_by('hour') \
-                .order_by(desc('entries')) \
-                .limit(5) \
-                .all()
-            
-            busy_hours = [{'hour': hour, 'entries': entries} for hour, entries in busy_hours_data]
+            busy_hours_data = sorted(hourly.items(), key=lambda item: (-item[1]['entries'], item[0]))[:5]
+            busy_hours = [{'hour': f"{hour:02d}:00", 'entries': values['entries']} for hour, values in busy_hours_data]
             
             # จำนวนลูกค้าเฉลี่ยต่อวัน
-            days = (end_datetime - start_datetime).days
+            days = round((end_datetime - start_datetime).total_seconds() / 86400)
             avg_daily_entries = total_entries / max(1, days)
             
+            # visitor-minutes และเวลาที่ใกล้เต็มความจุ (ค่าตามเวลาจากตารางสรุป)
+            usage = utilisation(occupancy_seconds, busy_seconds, (end_datetime - start_datetime).total_seconds(), branch.capacity)
+            usage['avg_daily_visitor_minutes'] = round(usage['visitor_minutes'] / max(1, days), 2)
+            
             return jsonify({
                 'success': True,
                 'branch_id': branch_id,
@@ -443,7 +707,8 @@ def get_summary(branch_id):
                     'total_exits': total_exits,
                     'max_count': max_count,
                     'avg_daily_entries': round(avg_daily_entries, 2),
-                    'busy_hours': busy_hours
+                    'busy_hours': busy_hours,
+                    'utilisation': usage
                 }
             })
         
@@ -466,20 +731,37 @@ def get_summary(branch_id):
 
 @customer_counts_bp.route('/compare/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
 def compare_periods(branch_id):
-    """เปรียบเทียบข้อมูลการนับลูกค้าระหว่างสองช่วงเวลา (ต้องมีการยืนยันตัวตน)"""
+    """
+    เปรียบเทียบข้อมูลการนับลูกค้าระหว่างช่วงเวลา (ต้องมีการยืนยันตัวตน)
+    
+    ใช้ period1_* / period2_* สำหรับการเปรียบเทียบสองช่วง หรือ periods (และ previous)
+    สำหรับเปรียบเทียบช่วงแรกกับหลายช่วงพร้อมกัน
+    """
     try:
         # ดึงพารามิเตอร์
-        period1_start = request.args.get('period1_start', (datetime.now() - timedelta(days=14)).strftime('%Y-%m-%d'))
-        period1_end = request.args.get('period1_end', (datetime.now() - timedelta(days=8)).strftime('%Y-%m-%d'))
-        period2_start = request.args.get('period2_start', (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'))
-        period2_end = request.args.get('period2_end', datetime.now().strftime('%Y-%m-%d'))
+        periods_param = request.args.get('periods')
+        previous = request.args.get('previous', 0, type=int)
         
-        # แปลงวันที่
-        period1_start_dt = datetime.strptime(period1_start, '%Y-%m-%d')
-        period1_end_dt = datetime.strptime(period1_end, '%Y-%m-%d') + timedelta(days=1)
-        period2_start_dt = datetime.strptime(period2_start, '%Y-%m-%d')
-        period2_end_dt = datetime.strptime(period2_end, '%Y-%m-%d') + timedelta(days=1)
+        today = get_timezones().today(branch_id)
+        period1_start = request.args.get('period1_start', (today - timedelta(days=14)).strftime('%Y-%m-%d'))
+        period1_end = request.args.get('period1_end', (today - timedelta(days=8)).strftime('%Y-%m-%d'))
+        period2_start = request.args.get('period2_start', (today - timedelta(days=7)).strftime('%Y-%m-%d'))
+        period2_end = request.args.get('period2_end', today.strftime('%Y-%m-%d'))
+        
+        # แปลงช่วงเวลาตามเวลาท้องถิ่นของสาขา (ช่วงแรกของรายการคือช่วงที่นำไปเทียบกับช่วงอื่น)
+        try:
+            if periods_param:
+                periods = parse_periods(periods_param, max(0, previous), branch_id)
+            else:
+                periods = [make_period(period2_start, period2_end, branch_id),
+                           make_period(period1_start, period1_end, branch_id)]
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
         
         db = get_session()
         
@@ -492,84 +774,198 @@ def compare_periods(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
-            # ดึงข้อมูลช่วงที่ 1
-            period1_entries = db.query(func.sum(CustomerCount.entry_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period1_start_dt,
-                    CustomerCount.timestamp < period1_end_dt
-                )) \
-                .scalar() or 0
-            
-            period1_exits = db.query(func.sum(CustomerCount.exit_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period1_start_dt,
-                    CustomerCount.timestamp < period1_end_dt
-                )) \
-                .scalar() or 0
-            
-            period1_max = db.query(func.max(CustomerCount.current_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period1_start_dt,
-                    CustomerCount.timestamp < period1_end_dt
-                )) \
-                .scalar() or 0
-            
-            # ดึงข้อมูลช่วงที่ 2
-            period2_entries = db.query(func.sum(CustomerCount.entry_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period2_start_dt,
-                    CustomerCount.timestamp < period2_end_dt
-                )) \
-                .scalar() or 0
-            
-            period2_exits = db.query(func.sum(CustomerCount.exit_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period2_start_dt,
-                    CustomerCount.timestamp < period2_end_dt
-                )) \
-                .scalar() or 0
+            # คำนวณทุกช่วงเวลาด้วย query เดียว
+            comparison = build_comparison(db, branch_id, periods)
             
-            period2_max = db.query(func.max(CustomerCount.current_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period2_start_dt,
-                    CustomerCount.timestamp < period2_end_dt
-                )) \
-                .scalar() or 0
+            if periods_param:
+                return jsonify({
+                    'success': True,
+                    'branch_id': branch_id,
+                    'branch_name': branch.name,
+                    'periods': comparison
+                })
             
-            # คำนวณความเปลี่ยนแปลง
-            entries_change = ((period2_entries - period1_entries) / max(1, period1_entries)) * 100
-            exits_change = ((period2_exits - period1_exits) / max(1, period1_exits)) * 100
-            max_change = ((period2_max - period1_max) / max(1, period1_max)) * 100
+            period2, period1 = comparison
+            changes = period1.pop('changes')
             
             return jsonify({
                 'success': True,
                 'branch_id': branch_id,
                 'branch_name': branch.name,
-                'period1': {
-                    'start_date': period1_start,
-                    'end_date': period1_end,
-                    'entries': period1_entries,
-                    'exits': period1_exits,
-                    'max_count': period1_max
+                'period1': period1,
+                'period2': period2,
+                'changes': changes
+            })
+        
+        except SQLAlchemyError as e:
+            logger.error(f"เกิดข้อผิดพลาดในการดึงข้อมูล: {str(e)}")
+            return jsonify({
+                'success': False,
+                'message': 'เกิดข้อผิดพลาดในการดึงข้อมูล'
+            }), 500
+        
+        finally:
+            db.close()
+    
+    except Exception as e:
+        logger.error(f"เกิดข้อผิดพลาดในการเปรียบเทียบข้อมูลการนับลูกค้า: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาด: ' + str(e)
+        }), 500
+
+@customer_counts_bp.route('/rankings', methods=['GET'])
+@token_required
+@conditional_get(per_branch=False)
+def get_rankings():
+    """
+    จัดอันดับสาขาตามยอดคนเข้า/ออก จำนวนคนสูงสุด หรือ % ของความจุ (ต้องมีการยืนยันตัวตน)
+    
+    คำนวณทุกสาขาด้วย query เดียวจากตารางสรุป แทนการเรียก /summary ทีละสาขา
+    """
+    try:
+        # ดึงพารามิเตอร์
+        today = get_timezones().today()
+        start_date = request.args.get('start_date', (today - timedelta(days=7)).strftime('%Y-%m-%d'))
+        end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
+        sort_by = request.args.get('sort_by', 'entries')
+        order = request.args.get('order', 'desc')  # desc = อันดับสูงสุด, asc = อันดับต่ำสุด
+        limit = request.args.get('limit', type=int)
+        group_by = request.args.get('group_by') or None  # province, city
+        
+        if sort_by not in RANKING_METRICS:
+            return jsonify({
+                'success': False,
+                'message': f"sort_by ต้องเป็นหนึ่งใน {', '.join(RANKING_METRICS)}"
+            }), 400
+        
+        if order not in ('asc', 'desc'):
+            return jsonify({
+                'success': False,
+                'message': 'order ต้องเป็น asc หรือ desc'
+            }), 400
+        
+        if group_by is not None and group_by not in RANKING_GROUPS:
+            return jsonify({
+                'success': False,
+                'message': f"group_by ต้องเป็นหนึ่งใน {', '.join(RANKING_GROUPS)}"
+            }), 400
+        
+        if limit is not None and limit < 1:
+            return jsonify({
+                'success': False,
+                'message': 'limit ต้องมากกว่า 0'
+            }), 400
+        
+        try:
+            period = make_period(start_date, end_date)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        db = get_session()
+        
+        try:
+            rankings = rank_branches(db, period, sort_by, order == 'desc', limit, group_by)
+            
+            return jsonify({
+                'success': True,
+                'period': {
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'days': (period.end - period.start).days
                 },
-                'period2': {
-                    'start_date': period2_start,
-                    'end_date': period2_end,
-                    'entries': period2_entries,
-                    'exits': period2_exits,
-                    'max_count': period2_max
+                'sort_by': sort_by,
+                'order': order,
+                'group_by': group_by,
+                'data': rankings
+            })
+        
+        except SQLAlchemyError as e:
+            logger.error(f"เกิดข้อผิดพลาดในการดึงข้อมูล: {str(e)}")
+            return jsonify({
+                'success': False,
+                'message': 'เกิดข้อผิดพลาดในการดึงข้อมูล'
+            }), 500
+        
+        finally:
+            db.close()
+    
+    except Exception as e:
+        logger.error(f"เกิดข้อผิดพลาดในการจัดอันดับสาขา: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาด: ' + str(e)
+        }), 500
+
+@customer_counts_bp.route('/percentiles', methods=['GET'])
+@token_required
+@conditional_get(per_branch=False)
+def get_percentiles():
+    """
+    p50/p90/p99 ของจำนวนคนเข้าและจำนวนคนสูงสุดต่อชั่วโมงของหลายสาขาในช่วงวันที่ (ต้องมีการยืนยันตัวตน)
+    
+    รวม quantile sketch รายวันของแต่ละสาขา (server/sketches.py) แทนการอ่านค่ารายชั่วโมงทั้งหมด
+    sketch ของวันที่ปิดแล้วถูกสร้างจากตารางสรุปรายชั่วโมงเมื่อถูกขอครั้งแรก ไม่ได้ถูกอัพเดตระหว่างบันทึกข้อมูล
+    """
+    try:
+        # ดึงพารามิเตอร์
+        today = get_timezones().today()
+        start_date = request.args.get('start_date', (today - timedelta(days=30)).strftime('%Y-%m-%d'))
+        end_date = request.args.get('end_date', today.strftime('%Y-%m-%d'))
+        branch_ids = [item.strip() for item in request.args.get('branch_ids', '').split(',') if item.strip()] or None
+        metrics = [item.strip() for item in request.args.get('metrics', '').split(',') if item.strip()] or None
+        
+        try:
+            quantiles = [float(item) for item in request.args.get('quantiles', '').split(',') if item.strip()] \
+                or list(DEFAULT_QUANTILES)
+        except ValueError:
+            quantiles = None
+        
+        if quantiles is None or any(not 0 <= q <= 1 for q in quantiles):
+            return jsonify({
+                'success': False,
+                'message': 'quantiles ต้องเป็นตัวเลขระหว่าง 0 ถึง 1 คั่นด้วยจุลภาค'
+            }), 400
+        
+        if metrics is not None and any(metric not in SKETCH_METRICS for metric in metrics):
+            return jsonify({
+                'success': False,
+                'message': f"metrics ต้องเป็นหนึ่งใน {', '.join(SKETCH_METRICS)}"
+            }), 400
+        
+        store = get_sketch_store()
+        if store is None:
+            return jsonify({
+                'success': False,
+                'message': 'ไม่ได้เปิดใช้งาน quantile sketch (ส่วน [sketches])'
+            }), 503
+        
+        try:
+            period = make_period(start_date, end_date)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), 400
+        
+        db = get_session()
+        
+        try:
+            result = store.percentiles(db, period.start, period.end, quantiles, branch_ids, metrics)
+            
+            return jsonify({
+                'success': True,
+                'period': {
+                    'start_date': start_date,
+                    'end_date': end_date,
+                    'days': (period.end - period.start).days
                 },
-                'changes': {
-                    'entries': round(entries_change, 2),
-                    'exits': round(exits_change, 2),
-                    'max_count': round(max_change, 2)
-                }
+                'branch_ids': branch_ids,
+                'relative_accuracy': store.relative_accuracy,
+                'data': result
             })
         
         except SQLAlchemyError as e:
@@ -583,10 +979,71 @@ def compare_periods(branch_id):
             db.close()
     
     except Exception as e:
-        logger.error(f"เกิดข้อผิดพลาดในการเปรียบเทียบข้อมูลการนับลูกค้า: {str(e)}")
+        logger.error(f"เกิดข้อผิดพลาดในการคำนวณ percentile: {str(e)}")
         return jsonify({
             'success': False,
             'message': 'เกิดข้อผิดพลาด: ' + str(e)
         }), 500
+
+@customer_counts_bp.route('/forecast/<branch_id>', methods=['GET'])
+@token_required
+def get_forecast(branch_id):
+    """
+    พยากรณ์จำนวนคนเข้าและจำนวนคนในสาขาของชั่วโมงปัจจุบันและชั่วโมงถัดไป (ต้องมีการยืนยันตัวตน)
+    
+    อ่านจากโปรไฟล์รายชั่วโมงของสัปดาห์ในหน่วยความจำ (server/forecast.py) โดยไม่ query ข้อมูลการนับ
+    """
+    try:
+        hours = request.args.get('hours', 3, type=int)
+        
+        if hours < 1 or hours > MAX_FORECAST_HOURS:
+            return jsonify({
+                'success': False,
+                'message': f'hours ต้องอยู่ระหว่าง 1 ถึง {MAX_FORECAST_HOURS}'
+            }), 400
+        
+        profiles = get_forecast_profiles()
+        if profiles is None:
+            return jsonify({
+                'success': False,
+                'message': 'ไม่ได้เปิดใช้งานการพยากรณ์ (ส่วน [forecast])'
+            }), 503
+        
+        db = get_session()
+        
+        try:
+            # ตรวจสอบว่ามีสาขานี้อยู่หรือไม่
+            branch = db.query(Branch).filter_by(branch_id=branch_id).first()
+            if not branch:
+                return jsonify({
+                    'success': False,
+                    'message': 'ไม่พบสาขา'
+                }), 404
+            
+            return jsonify({
+                'success': True,
+                'branch_id': branch_id,
+                'branch_name': branch.name,
+                'capacity': branch.capacity,
+                'half_life_weeks': profiles.half_life_weeks,
+                'data': profiles.forecast(branch_id, get_timezones().storage_now(), hours)
+            })
+        
+        except SQLAlchemyError as e:
+            logger.error(f"เกิดข้อผิดพลาดในการดึงข้อมูล: {str(e)}")
+            return jsonify({
+                'success': False,
+                'message': 'เกิดข้อผิดพลาดในการดึงข้อมูล'
+            }), 500
+        
+        finally:
+            db.close()
     
+    except Exception as e:
+        logger.error(f"เกิดข้อผิดพลาดในการพยากรณ์จำนวนลูกค้า: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาด: ' + str(e)
+        }), 500
+
 # Removed duplicate definition of record_realtime
\ No newline at end of file
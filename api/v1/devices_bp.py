@@ -8,6 +8,7 @@ import uuid
 from sqlalchemy.exc import SQLAlchemyError
 from server.db import get_session
 from models.device import Device
+from server.anomalies import get_anomaly_detector, ALERT_TYPES
 from api.middleware.auth import token_required
 
 # สร้าง Blueprint
@@ -78,7 +79,7 @@ def register_device():
                     'message': 'ลงทะเบียนอุปกรณ์ใหม่สำเร็จ',
                     'device_id': new_device.device_id
                 })
-                
+            
             # Similar modifications needed for other functions in this file
             # that reference the metadata field
         
@@ -249,6 +250,13 @@ def get_devices():
             # ดึงข้อมูลอุปกรณ์ทั้งหมด
             devices = db.query(Device).all()
             
+            # การแจ้งเตือนของกล้องที่ยังไม่หาย
+            detector = get_anomaly_detector()
+            alerts_by_camera = {}
+            if detector is not None:
+                for alert in detector.alerts():
+                    alerts_by_camera.setdefault(alert['camera_id'], []).append(alert)
+            
             # แปลงข้อมูลเป็น JSON
             devices_data = []
             for device in devices:
@@ -262,8 +270,10 @@ def get_devices():
                     'last_seen': device.last_seen.isoformat(),
                     'status': device.status,
                     'version': device.version,
-                    'metadata': json.loads(device.metadata) if device.metadata else {}
+                    'metadata': json.loads(device.meta_data) if device.meta_data else {}
                 }
+                if detector is not None:
+                    device_data['alerts'] = alerts_by_camera.get(device.camera_id, [])
                 devices_data.append(device_data)
             
             return jsonify({
@@ -289,6 +299,44 @@ def get_devices():
             'message': 'เกิดข้อผิดพลาด: ' + str(e)
         }), 500
 
+@devices_bp.route('/alerts', methods=['GET'])
+@token_required
+def get_device_alerts():
+    """ดึงการแจ้งเตือนของกล้องที่ผิดปกติ (ต้องมีการยืนยันตัวตน)"""
+    try:
+        detector = get_anomaly_detector()
+        if detector is None:
+            return jsonify({
+                'success': False,
+                'message': 'ไม่ได้เปิดใช้งานการตรวจจับความผิดปกติ'
+            }), 503
+        
+        alert_type = request.args.get('type')
+        if alert_type is not None and alert_type not in ALERT_TYPES:
+            return jsonify({
+                'success': False,
+                'message': f"type ต้องเป็นหนึ่งใน {', '.join(ALERT_TYPES)}"
+            }), 400
+        
+        alerts = detector.alerts(
+            branch_id=request.args.get('branch_id'),
+            alert_type=alert_type,
+            camera_id=request.args.get('camera_id')
+        )
+        
+        return jsonify({
+            'success': True,
+            'alerts': alerts,
+            'count': len(alerts)
+        })
+    
+    except Exception as e:
+        logger.error(f"เกิดข้อผิดพลาดในการดึงการแจ้งเตือนของอุปกรณ์: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': 'เกิดข้อผิดพลาด: ' + str(e)
+        }), 500
+
 @devices_bp.route('/<device_id>', methods=['GET'])
 @token_required
 def get_device(device_id):
@@ -317,9 +365,13 @@ def get_device(device_id):
                 'last_seen': device.last_seen.isoformat(),
                 'status': device.status,
                 'version': device.version,
-                'metadata': json.loads(device.metadata) if device.metadata else {}
+                'metadata': json.loads(device.meta_data) if device.meta_data else {}
             }
             
+            detector = get_anomaly_detector()
+            if detector is not None:
+                device_data['alerts'] = detector.alerts(camera_id=device.camera_id)
+            
             return jsonify({
                 'success': True,
                 'device': device_data
@@ -7,32 +7,87 @@ import os
 from flask import Blueprint, request, jsonify, g, current_app, send_file
 from functools import wraps
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_, desc
 from sqlalchemy.exc import SQLAlchemyError
 from server.db import get_session
-from models.customer_count import CustomerCount
 from models.branch import Branch
-from api.middleware.auth import token_required
+from api.middleware.auth import token_required, admin_required
+from api.middleware.conditional import conditional_get
+from server.analytics import load_series, resample, group_spans, hour_of_day, busiest, to_datetimes
+from server.aggregates import aggregate_periods, build_comparison, make_period, parse_periods, utilisation, UTILISATION_METRICS
+from server.report_cache import cached_report, get_report_cache
+from server.watermarks import touch_branches
+from server.timezones import get_timezones
 
 # สร้าง Blueprint
 reports_bp = Blueprint('reports', __name__)
 
 logger = logging.getLogger(__name__)
 
+def _daily_data(series):
+    """แปลง Series รายวันเป็นรายการข้อมูลรายวันของรายงาน"""
+    return [
+        {
+            'date': date.strftime('%Y-%m-%d'),
+            'day': date.strftime('%A'),  # ชื่อวัน (อังกฤษ)
+            'entries': entries,
+            'exits': exits,
+            'max_count': max_count
+        }
+        for date, entries, exits, max_count in zip(
+            to_datetimes(series.timestamps), series.entries.tolist(), series.exits.tolist(), series.max_count.tolist()
+        )
+    ]
+
+def _period_utilisation(db, branch, start, end):
+    """visitor-minutes และเวลาที่ใกล้เต็มความจุของสาขาในช่วง [start, end) จากตารางสรุป"""
+    values = aggregate_periods(db, [(start, end)], UTILISATION_METRICS, branch_ids=[branch.branch_id])[0]
+    return utilisation(values['occupancy_seconds'], values['busy_seconds'], (end - start).total_seconds(), branch.capacity)
+
+def _write_utilisation_rows(csv_writer, usage):
+    """เขียนค่าการใช้พื้นที่ในส่วนสรุปของรายงาน CSV"""
+    csv_writer.writerow(['visitor-minutes ทั้งหมด', usage['visitor_minutes']])
+    csv_writer.writerow(['จำนวนลูกค้าเฉลี่ยตลอดช่วง', usage['avg_occupancy']])
+    csv_writer.writerow(['การใช้พื้นที่เฉลี่ย (%)', usage['avg_utilisation_pct']])
+    csv_writer.writerow(['เวลาที่ใกล้เต็มความจุ (นาที)', usage['busy_minutes']])
+
+def _report_date(date_str, branch_id):
+    """วันที่ของรายงาน (date_str = YYYY-MM-DD, None = วันนี้ตามเวลาท้องถิ่นของสาขา)"""
+    if date_str:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    return get_timezones().today(branch_id)
+
+def daily_period(date_str, branch_id=None):
+    """ช่วงเวลา [start, end) ในเขตเวลาที่บันทึกของรายงานประจำวัน (date_str = YYYY-MM-DD, None = วันนี้)"""
+    return get_timezones().day_range(_report_date(date_str, branch_id), branch_id=branch_id)
+
+def weekly_period(date_str, branch_id=None):
+    """ช่วงเวลา [start, end) ของรายงานประจำสัปดาห์ที่มีวันที่ date_str (เริ่มวันจันทร์)"""
+    return get_timezones().week_range(_report_date(date_str, branch_id), branch_id)
+
+def monthly_period(date_str, branch_id=None):
+    """ช่วงเวลา [start, end) ของรายงานประจำเดือน (date_str = YYYY-MM, None = เดือนนี้)"""
+    if date_str is None:
+        date_str = get_timezones().today(branch_id).strftime('%Y-%m')
+    if len(date_str) != 7:  # รูปแบบ YYYY-MM
+        raise ValueError('รูปแบบวันที่ไม่ถูกต้อง (ควรเป็น YYYY-MM)')
+    
+    month = datetime.strptime(date_str, '%Y-%m')
+    return get_timezones().month_range(month.year, month.month, branch_id)
+
 @reports_bp.route('/daily/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
+@cached_report('daily', daily_period)
 def daily_report(branch_id):
     """สร้างรายงานประจำวันของสาขา"""
     try:
         # ดึงพารามิเตอร์
-        date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+        date_str = request.args.get('date', get_timezones().today(branch_id).strftime('%Y-%m-%d'))
         output_format = request.args.get('format', 'json')  # json, csv
         
         # แปลงวันที่
         try:
-            report_date = datetime.strptime(date_str, '%Y-%m-%d')
-            start_date = report_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = start_date + timedelta(days=1)
+            start_date, end_date = daily_period(date_str, branch_id)
         except ValueError:
             return jsonify({
                 'success': False,
@@ -50,55 +105,38 @@ def daily_report(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
-            # ดึงข้อมูลการนับลูกค้าตามชั่วโมง
-            hourly_counts = db.query(
-                    func.hour(CustomerCount.timestamp).label('hour'),
-                    func.sum(CustomerCount.entry_count).label('entries'),
-                    func.sum(CustomerCount.exit_count).label('exits'),
-                    func.max(CustomerCount.current_count).label('max_count')
-                ) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_date,
-                    CustomerCount.timestamp < end_date
-                )) \
-                .group_by('hour') \
-                .order_by('hour') \
-                .all()
+            # ดึงข้อมูลการนับลูกค้าตามชั่วโมง (เวลาท้องถิ่นของสาขา) จากตารางสรุป
+            series = load_series(db, branch_id, start_date, end_date, 'hour',
+                                 get_timezones().offset(branch_id, start_date))
+            hours = hour_of_day(series.timestamps)
             
             # สร้างข้อมูลรายงาน
-            hourly_data = []
-            total_entries = 0
-            total_exits = 0
-            max_hour_count = 0
-            max_hour = None
-            
-            for hour, entries, exits, max_count in hourly_counts:
-                hourly_data.append({
+            hourly_data = [
+                {
                     'hour': hour,
                     'time': f"{hour:02d}:00",
                     'entries': entries,
                     'exits': exits,
                     'max_count': max_count
-                })
-                
-                total_entries += entries
-                total_exits += exits
-                
-                if entries > max_hour_count:
-                    max_hour_count = entries
-                    max_hour = hour
+                }
+                for hour, entries, exits, max_count in zip(
+                    hours.tolist(), series.entries.tolist(), series.exits.tolist(), series.max_count.tolist()
+                )
+            ]
+            
+            busiest_index = busiest(series.entries)
             
             # สร้างข้อมูลสรุป
             summary = {
                 'date': date_str,
                 'branch_id': branch_id,
                 'branch_name': branch.name,
-                'total_entries': total_entries,
-                'total_exits': total_exits,
-                'max_concurrent': max(c[3] for c in hourly_counts) if hourly_counts else 0,
-                'busiest_hour': f"{max_hour:02d}:00" if max_hour is not None else None,
-                'busiest_hour_count': max_hour_count
+                'total_entries': int(series.entries.sum()),
+                'total_exits': int(series.exits.sum()),
+                'max_concurrent': int(series.max_count.max()) if len(series.max_count) else 0,
+                'busiest_hour': f"{hours[busiest_index]:02d}:00" if busiest_index is not None else None,
+                'busiest_hour_count': int(series.entries[busiest_index]) if busiest_index is not None else 0,
+                'utilisation': _period_utilisation(db, branch, start_date, end_date)
             }
             
             # ส่งข้อมูลในรูปแบบที่ต้องการ
@@ -130,6 +168,7 @@ def daily_report(branch_id):
                 csv_writer.writerow(['จำนวนลูกค้าสูงสุด', summary['max_concurrent']])
                 csv_writer.writerow(['ช่วงเวลาที่มีลูกค้าเข้ามากที่สุด', summary['busiest_hour']])
                 csv_writer.writerow(['จำนวนลูกค้าในช่วงเวลาที่มากที่สุด', summary['busiest_hour_count']])
+                _write_utilisation_rows(csv_writer, summary['utilisation'])
                 
                 # สร้างไฟล์
                 csv_data.seek(0)
@@ -173,20 +212,19 @@ def daily_report(branch_id):
 
 @reports_bp.route('/weekly/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
+@cached_report('weekly', weekly_period)
 def weekly_report(branch_id):
     """สร้างรายงานประจำสัปดาห์ของสาขา"""
     try:
         # ดึงพารามิเตอร์
-        date_str = request.args.get('date', datetime.now().strftime('%Y-%m-%d'))
+        date_str = request.args.get('date', get_timezones().today(branch_id).strftime('%Y-%m-%d'))
         output_format = request.args.get('format', 'json')  # json, csv
         
         # แปลงวันที่
         try:
-            report_date = datetime.strptime(date_str, '%Y-%m-%d')
-            # หาวันแรกของสัปดาห์ (จันทร์)
-            start_date = report_date - timedelta(days=report_date.weekday())
-            start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_date = start_date + timedelta(days=7)
+            # เริ่มจากวันแรกของสัปดาห์ (จันทร์)
+            start_date, end_date = weekly_period(date_str, branch_id)
         except ValueError:
             return jsonify({
                 'success': False,
@@ -204,60 +242,28 @@ def weekly_report(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
-            # ดึงข้อมูลการนับลูกค้าตามวัน
-            daily_counts = db.query(
-                    func.date(CustomerCount.timestamp).label('date'),
-                    func.sum(CustomerCount.entry_count).label('entries'),
-                    func.sum(CustomerCount.exit_count).label('exits'),
-                    func.max(CustomerCount.current_count).label('max_count')
-                ) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_date,
-                    CustomerCount.timestamp < end_date
-                )) \
-                .group_by('date') \
-                .order_by('date') \
-                .all()
-            
-            # สร้างข้อมูลรายงาน
-            daily_data = []
-            total_entries = 0
-            total_exits = 0
-            max_day_count = 0
-            max_day = None
+            # ดึงข้อมูลการนับลูกค้าตามวัน (เวลาท้องถิ่นของสาขา) จากตารางสรุป
+            timezones = get_timezones()
+            series = load_series(db, branch_id, start_date, end_date, 'day', timezones.offset(branch_id, start_date))
+            daily_data = _daily_data(series)
             
-            for date, entries, exits, max_count in daily_counts:
-                date_str = date.strftime('%Y-%m-%d')
-                day_name = date.strftime('%A')  # ชื่อวัน (อังกฤษ)
-                
-                daily_data.append({
-                    'date': date_str,
-                    'day': day_name,
-                    'entries': entries,
-                    'exits': exits,
-                    'max_count': max_count
-                })
-                
-                total_entries += entries
-                total_exits += exits
-                
-                if entries > max_day_count:
-                    max_day_count = entries
-                    max_day = day_name
+            total_entries = int(series.entries.sum())
+            busiest_index = busiest(series.entries)
             
             # สร้างข้อมูลสรุป
+            local_start = timezones.to_local(start_date, branch_id)
             summary = {
-                'start_date': start_date.strftime('%Y-%m-%d'),
-                'end_date': (end_date - timedelta(days=1)).strftime('%Y-%m-%d'),
+                'start_date': local_start.strftime('%Y-%m-%d'),
+                'end_date': (local_start + timedelta(days=6)).strftime('%Y-%m-%d'),
                 'branch_id': branch_id,
                 'branch_name': branch.name,
                 'total_entries': total_entries,
-                'total_exits': total_exits,
-                'avg_daily_entries': round(total_entries / 7, 2) if daily_counts else 0,
-                'max_concurrent': max(c[3] for c in daily_counts) if daily_counts else 0,
-                'busiest_day': max_day,
-                'busiest_day_count': max_day_count
+                'total_exits': int(series.exits.sum()),
+                'avg_daily_entries': round(total_entries / 7, 2) if daily_data else 0,
+                'max_concurrent': int(series.max_count.max()) if daily_data else 0,
+                'busiest_day': daily_data[busiest_index]['day'] if busiest_index is not None else None,
+                'busiest_day_count': daily_data[busiest_index]['entries'] if busiest_index is not None else 0,
+                'utilisation': _period_utilisation(db, branch, start_date, end_date)
             }
             
             # ส่งข้อมูลในรูปแบบที่ต้องการ
@@ -291,6 +297,7 @@ def weekly_report(branch_id):
                 csv_writer.writerow(['จำนวนลูกค้าสูงสุด', summary['max_concurrent']])
                 csv_writer.writerow(['วันที่มีลูกค้าเข้ามากที่สุด', summary['busiest_day']])
                 csv_writer.writerow(['จำนวนลูกค้าในวันที่มากที่สุด', summary['busiest_day_count']])
+                _write_utilisation_rows(csv_writer, summary['utilisation'])
                 
                 # สร้างไฟล์
                 csv_data.seek(0)
@@ -334,31 +341,19 @@ def weekly_report(branch_id):
 
 @reports_bp.route('/monthly/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
+@cached_report('monthly', monthly_period)
 def monthly_report(branch_id):
     """สร้างรายงานประจำเดือนของสาขา"""
     try:
         # ดึงพารามิเตอร์
-        date_str = request.args.get('date', datetime.now().strftime('%Y-%m'))
+        date_str = request.args.get('date', get_timezones().today(branch_id).strftime('%Y-%m'))
         output_format = request.args.get('format', 'json')  # json, csv
         
         # แปลงวันที่
         try:
-            if len(date_str) == 7:  # รูปแบบ YYYY-MM
-                date_parts = date_str.split('-')
-                year = int(date_parts[0])
-                month = int(date_parts[1])
-                
-                # หาวันแรกและวันสุดท้ายของเดือน
-                start_date = datetime(year, month, 1)
-                if month == 12:
-                    end_date = datetime(year + 1, 1, 1)
-                else:
-                    end_date = datetime(year, month + 1, 1)
-            else:
-                return jsonify({
-                    'success': False,
-                    'message': 'รูปแบบวันที่ไม่ถูกต้อง (ควรเป็น YYYY-MM)'
-                }), 400
+            # หาวันแรกของเดือนและวันแรกของเดือนถัดไป
+            start_date, end_date = monthly_period(date_str, branch_id)
         except ValueError:
             return jsonify({
                 'success': False,
@@ -376,104 +371,56 @@ def monthly_report(branch_id):
                     'message': 'ไม่พบสาขา'
                 }), 404
             
-            # ดึงข้อมูลการนับลูกค้าตามวัน
-            daily_counts = db.query(
-                    func.date(CustomerCount.timestamp).label('date'),
-                    func.sum(CustomerCount.entry_count).label('entries'),
-                    func.sum(CustomerCount.exit_count).label('exits'),
-                    func.max(CustomerCount.current_count).label('max_count')
-                ) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= start_date,
-                    CustomerCount.timestamp < end_date
-                )) \
-                .group_by('date') \
-                .order_by('date') \
-                .all()
+            # ดึงข้อมูลการนับลูกค้าตามวัน (เวลาท้องถิ่นของสาขา) จากตารางสรุป
+            timezones = get_timezones()
+            series = load_series(db, branch_id, start_date, end_date, 'day', timezones.offset(branch_id, start_date))
+            daily_data = _daily_data(series)
             
-            # สร้างข้อมูลรายงาน
-            daily_data = []
-            total_entries = 0
-            total_exits = 0
-            max_day_count = 0
-            max_day = None
+            total_entries = int(series.entries.sum())
+            busiest_index = busiest(series.entries)
             
-            for date, entries, exits, max_count in daily_counts:
-                date_str = date.strftime('%Y-%m-%d')
-                day_name = date.strftime('%A')  # ชื่อวัน (อังกฤษ)
-                
-                daily_data.append({
-                    'date': date_str,
-                    'day': day_name,
+            # สร้างข้อมูลสรุปรายสัปดาห์ (สัปดาห์เริ่มวันจันทร์ วันที่เริ่ม/สิ้นสุดคือวันแรก/วันสุดท้ายที่มีข้อมูลในเดือนนี้)
+            weeks = resample(series, 'week')
+            first_days, last_days = group_spans(series, 'week')
+            weekly_data = [
+                {
+                    'week': monday.isocalendar()[1],  # เลขสัปดาห์
+                    'start_date': first_day.strftime('%Y-%m-%d'),
+                    'end_date': last_day.strftime('%Y-%m-%d'),
                     'entries': entries,
                     'exits': exits,
                     'max_count': max_count
-                })
-                
-                total_entries += entries
-                total_exits += exits
-                
-                if entries > max_day_count:
-                    max_day_count = entries
-                    max_day = date_str
-            
-            # สร้างข้อมูลสรุปรายสัปดาห์
-            weekly_data = []
-            
-            # จัดกลุ่มข้อมูลตามสัปดาห์
-            week_data = {}
-            for item in daily_data:
-                date_obj = datetime.strptime(item['date'], '%Y-%m-%d')
-                week_num = date_obj.isocalendar()[1]  # เลขสัปดาห์
-                
-                if week_num not in week_data:
-                    week_data[week_num] = {
-                        'week': week_num,
-                        'start_date': item['date'],
-                        'end_date': item['date'],
-                        'entries': 0,
-                        'exits': 0,
-                        'max_count': 0
-                    }
-                
-                # อัพเดตข้อมูลสัปดาห์
-                week_data[week_num]['entries'] += item['entries']
-                week_data[week_num]['exits'] += item['exits']
-                week_data[week_num]['max_count'] = max(week_data[week_num]['max_count'], item['max_count'])
-                week_data[week_num]['end_date'] = item['date']
-            
-            # แปลงข้อมูลสัปดาห์เป็นรายการ
-            for week_num in sorted(week_data.keys()):
-                weekly_data.append(week_data[week_num])
+                }
+                for monday, first_day, last_day, entries, exits, max_count in zip(
+                    to_datetimes(weeks.timestamps), to_datetimes(first_days), to_datetimes(last_days),
+                    weeks.entries.tolist(), weeks.exits.tolist(), weeks.max_count.tolist()
+                )
+            ]
             
             # หาสัปดาห์ที่มีลูกค้าเข้ามากที่สุด
-            max_week_entries = 0
-            max_week = None
+            busiest_week = busiest(weeks.entries)
             
-            for week in weekly_data:
-                if week['entries'] > max_week_entries:
-                    max_week_entries = week['entries']
-                    max_week = week['week']
-            
-            # สร้างข้อมูลสรุป
-            days_in_month = (end_date - start_date).days
+            # สร้างข้อมูลสรุป (วันที่ตามเวลาท้องถิ่นของสาขา)
+            month_start = datetime.strptime(date_str, '%Y-%m')
+            month_end = (month_start + timedelta(days=32)).replace(day=1)
+            days_in_month = (month_end - month_start).days
             summary = {
-                'year': start_date.year,
-                'month': start_date.month,
-                'month_name': start_date.strftime('%B'),  # ชื่อเดือน (อังกฤษ)
-                'start_date': start_date.strftime('%Y-%m-%d'),
-                'end_date': (end_date - timedelta(days=1)).strftime('%Y-%m-%d'),
+                'year': month_start.year,
+                'month': month_start.month,
+                'month_name': month_start.strftime('%B'),  # ชื่อเดือน (อังกฤษ)
+                'start_date': month_start.strftime('%Y-%m-%d'),
+                'end_date': (month_end - timedelta(days=1)).strftime('%Y-%m-%d'),
                 'branch_id': branch_id,
                 'branch_name': branch.name,
                 'total_entries': total_entries,
-                'total_exits': total_exits,
+                'total_exits': int(series.exits.sum()),
                 'avg_daily_entries': round(total_entries / days_in_month, 2) if days_in_month > 0 else 0,
-                'max_concurrent': max(c[3] for c in daily_counts) if daily_counts else 0,
-                'busiest_day': max_day,
-                'busiest_day_count': max_day_count,
-                'busiest_week': max_week,
-                'busiest_week_count': max_week_entries
+                'max_concurrent': int(series.max_count.max()) if daily_data else 0,
+                'busiest_day': daily_data[busiest_index]['date'] if busiest_index is not None else None,
+                'busiest_day_count': daily_data[busiest_index]['entries'] if busiest_index is not None else 0,
+                'busiest_week': weekly_data[busiest_week]['week'] if busiest_week is not None else None,
+                'busiest_week_count': weekly_data[busiest_week]['entries'] if busiest_week is not None else 0,
+                'utilisation': _period_utilisation(db, branch, start_date, end_date)
             }
             
             # ส่งข้อมูลในรูปแบบที่ต้องการ
@@ -526,12 +473,13 @@ def monthly_report(branch_id):
                 csv_writer.writerow(['จำนวนลูกค้าในวันที่มากที่สุด', summary['busiest_day_count']])
                 csv_writer.writerow(['สัปดาห์ที่มีลูกค้าเข้ามากที่สุด', summary['busiest_week']])
                 csv_writer.writerow(['จำนวนลูกค้าในสัปดาห์ที่มากที่สุด', summary['busiest_week_count']])
+                _write_utilisation_rows(csv_writer, summary['utilisation'])
                 
                 # สร้างไฟล์
                 csv_data.seek(0)
                 
                 # สร้างชื่อไฟล์
-                filename = f"monthly_report_{branch_id}_{start_date.strftime('%Y-%m')}.csv"
+                filename = f"monthly_report_{branch_id}_{month_start.strftime('%Y-%m')}.csv"
                 
                 # ส่งไฟล์
                 return send_file(
@@ -570,10 +518,18 @@ def monthly_report(branch_id):
 
 @reports_bp.route('/comparison/<branch_id>', methods=['GET'])
 @token_required
+@conditional_get()
 def comparison_report(branch_id):
-    """สร้างรายงานเปรียบเทียบระหว่างสองช่วงเวลา"""
+    """
+    สร้างรายงานเปรียบเทียบระหว่างช่วงเวลา
+    
+    ใช้ period1_* / period2_* สำหรับการเปรียบเทียบสองช่วง หรือ periods (และ previous)
+    สำหรับเปรียบเทียบช่วงแรกกับหลายช่วงพร้อมกัน
+    """
     try:
         # ดึงพารามิเตอร์
+        periods_param = request.args.get('periods')
+        previous = request.args.get('previous', 0, type=int)
         period1_start = request.args.get('period1_start')
         period1_end = request.args.get('period1_end')
         period2_start = request.args.get('period2_start')
@@ -581,22 +537,23 @@ def comparison_report(branch_id):
         output_format = request.args.get('format', 'json')  # json, csv
         
         # ตรวจสอบพารามิเตอร์
-        if not all([period1_start, period1_end, period2_start, period2_end]):
+        if not periods_param and not all([period1_start, period1_end, period2_start, period2_end]):
             return jsonify({
                 'success': False,
-                'message': 'กรุณาระบุช่วงเวลาทั้งสองช่วง (period1_start, period1_end, period2_start, period2_end)'
+                'message': 'กรุณาระบุช่วงเวลาทั้งสองช่วง (period1_start, period1_end, period2_start, period2_end) หรือ periods'
             }), 400
         
-        # แปลงวันที่
+        # แปลงช่วงเวลา (ช่วงแรกของรายการคือช่วงที่นำไปเทียบกับช่วงอื่น)
         try:
-            period1_start_dt = datetime.strptime(period1_start, '%Y-%m-%d')
-            period1_end_dt = datetime.strptime(period1_end, '%Y-%m-%d') + timedelta(days=1)
-            period2_start_dt = datetime.strptime(period2_start, '%Y-%m-%d')
-            period2_end_dt = datetime.strptime(period2_end, '%Y-%m-%d') + timedelta(days=1)
+            if periods_param:
+                periods = parse_periods(periods_param, max(0, previous), branch_id)
+            else:
+                periods = [make_period(period2_start, period2_end, branch_id),
+                           make_period(period1_start, period1_end, branch_id)]
         except ValueError:
             return jsonify({
                 'success': False,
-                'message': 'รูปแบบวันที่ไม่ถูกต้อง (ควรเป็น YYYY-MM-DD)'
+                'message': 'รูปแบบช่วงเวลาไม่ถูกต้อง (ควรเป็น YYYY-MM-DD และไม่เกิน 12 ช่วง)'
             }), 400
         
         db = get_session()
@@ -609,87 +566,21 @@ def comparison_report(branch_id):
                     'success': False,
                     'message': 'ไม่พบสาขา'
                 }), 404 
-                
-            # ดึงข้อมูลช่วงที่ 1
-            period1_entries = db.query(func.sum(CustomerCount.entry_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period1_start_dt,
-                    CustomerCount.timestamp < period1_end_dt
-                )) \
-                .scalar() or 0
-            
-            period1_exits = db.query(func.sum(CustomerCount.exit_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period1_start_dt,
-                    CustomerCount.timestamp < period1_end_dt
-                )) \
-                .scalar() or 0
-            
-            period1_max = db.query(func.max(CustomerCount.current_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period1_start_dt,
-                    CustomerCount.timestamp < period1_end_dt
-                )) \
-                .scalar() or 0
-            
-            # ดึงข้อมูลช่วงที่ 2
-            period2_entries = db.query(func.sum(CustomerCount.entry_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period2_start_dt,
-                    CustomerCount.timestamp < period2_end_dt
-                )) \
-                .scalar() or 0
             
-            period2_exits = db.query(func.sum(CustomerCount.exit_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period2_start_dt,
-                    CustomerCount.timestamp < period2_end_dt
-                )) \
-                .scalar() or 0
-            
-            period2_max = db.query(func.max(CustomerCount.current_count)) \
-                .filter(and_(
-                    CustomerCount.branch_id == branch_id,
-                    CustomerCount.timestamp >= period2_start_dt,
-                    CustomerCount.timestamp < period2_end_dt
-                )) \
-                .scalar() or 0
-            
-            # คำนวณความเปลี่ยนแปลง
-            entries_change = ((period2_entries - period1_entries) / max(1, period1_entries)) * 100
-            exits_change = ((period2_exits - period1_exits) / max(1, period1_exits)) * 100
-            max_change = ((period2_max - period1_max) / max(1, period1_max)) * 100
+            # คำนวณทุกช่วงเวลาด้วย query เดียว
+            comparison = build_comparison(db, branch_id, periods)
             
             # สร้างข้อมูลผลลัพธ์
             result = {
                 'success': True,
                 'branch_id': branch_id,
-                'branch_name': branch.name,
-                'period1': {
-                    'start_date': period1_start,
-                    'end_date': period1_end,
-                    'entries': period1_entries,
-                    'exits': period1_exits,
-                    'max_count': period1_max
-                },
-                'period2': {
-                    'start_date': period2_start,
-                    'end_date': period2_end,
-                    'entries': period2_entries,
-                    'exits': period2_exits,
-                    'max_count': period2_max
-                },
-                'changes': {
-                    'entries': round(entries_change, 2),
-                    'exits': round(exits_change, 2),
-                    'max_count': round(max_change, 2)
-                }
+                'branch_name': branch.name
             }
+            if periods_param:
+                result['periods'] = comparison
+            else:
+                result['period2'], result['period1'] = comparison
+                result['changes'] = result['period1'].pop('changes')
             
             # ส่งข้อมูลในรูปแบบที่ต้องการ
             if output_format == 'csv':
@@ -701,30 +592,46 @@ def comparison_report(branch_id):
                 csv_writer.writerow(['รายงานเปรียบเทียบ', f"{branch.name} ({branch_id})"])
                 csv_writer.writerow([])
                 
-                # เขียนข้อมูลทั้งสองช่วงเวลา
-                csv_writer.writerow(['ช่วงเวลาที่ 1', period1_start, 'ถึง', period1_end])
-                csv_writer.writerow(['จำนวนลูกค้าเข้า', period1_entries])
-                csv_writer.writerow(['จำนวนลูกค้าออก', period1_exits])
-                csv_writer.writerow(['จำนวนลูกค้าสูงสุด', period1_max])
-                csv_writer.writerow([])
-                
-                csv_writer.writerow(['ช่วงเวลาที่ 2', period2_start, 'ถึง', period2_end])
-                csv_writer.writerow(['จำนวนลูกค้าเข้า', period2_entries])
-                csv_writer.writerow(['จำนวนลูกค้าออก', period2_exits])
-                csv_writer.writerow(['จำนวนลูกค้าสูงสุด', period2_max])
-                csv_writer.writerow([])
-                
-                # เขียนข้อมูลการเปลี่ยนแปลง
-                csv_writer.writerow(['การเปลี่ยนแปลง (%)'])
-                csv_writer.writerow(['จำนวนลูกค้าเข้า', f"{round(entries_change, 2)}%"])
-                csv_writer.writerow(['จำนวนลูกค้าออก', f"{round(exits_change, 2)}%"])
-                csv_writer.writerow(['จำนวนลูกค้าสูงสุด', f"{round(max_change, 2)}%"])
+                if periods_param:
+                    # เขียนข้อมูลทุกช่วงเวลา โดยการเปลี่ยนแปลงคือช่วงแรกเทียบกับช่วงนั้น
+                    csv_writer.writerow(['ช่วงเวลา', 'ถึง', 'จำนวนลูกค้าเข้า', 'จำนวนลูกค้าออก', 'จำนวนลูกค้าสูงสุด',
+                                         'เปลี่ยนแปลงลูกค้าเข้า (%)', 'เปลี่ยนแปลงลูกค้าออก (%)', 'เปลี่ยนแปลงลูกค้าสูงสุด (%)'])
+                    for item in comparison:
+                        changes = item.get('changes', {})
+                        csv_writer.writerow([
+                            item['start_date'], item['end_date'],
+                            item['entries'], item['exits'], item['max_count'],
+                            changes.get('entries', ''), changes.get('exits', ''), changes.get('max_count', '')
+                        ])
+                else:
+                    period1 = result['period1']
+                    period2 = result['period2']
+                    changes = result['changes']
+                    
+                    # เขียนข้อมูลทั้งสองช่วงเวลา
+                    csv_writer.writerow(['ช่วงเวลาที่ 1', period1_start, 'ถึง', period1_end])
+                    csv_writer.writerow(['จำนวนลูกค้าเข้า', period1['entries']])
+                    csv_writer.writerow(['จำนวนลูกค้าออก', period1['exits']])
+                    csv_writer.writerow(['จำนวนลูกค้าสูงสุด', period1['max_count']])
+                    csv_writer.writerow([])
+                    
+                    csv_writer.writerow(['ช่วงเวลาที่ 2', period2_start, 'ถึง', period2_end])
+                    csv_writer.writerow(['จำนวนลูกค้าเข้า', period2['entries']])
+                    csv_writer.writerow(['จำนวนลูกค้าออก', period2['exits']])
+                    csv_writer.writerow(['จำนวนลูกค้าสูงสุด', period2['max_count']])
+                    csv_writer.writerow([])
+                    
+                    # เขียนข้อมูลการเปลี่ยนแปลง
+                    csv_writer.writerow(['การเปลี่ยนแปลง (%)'])
+                    csv_writer.writerow(['จำนวนลูกค้าเข้า', f"{changes['entries']}%"])
+                    csv_writer.writerow(['จำนวนลูกค้าออก', f"{changes['exits']}%"])
+                    csv_writer.writerow(['จำนวนลูกค้าสูงสุด', f"{changes['max_count']}%"])
                 
                 # สร้างไฟล์
                 csv_data.seek(0)
                 
                 # สร้างชื่อไฟล์
-                filename = f"comparison_report_{branch_id}_{period1_start}_vs_{period2_start}.csv"
+                filename = f"comparison_report_{branch_id}_{periods[0].start_date}_vs_{periods[1].start_date if len(periods) > 1 else periods[0].end_date}.csv"
                 
                 # ส่งไฟล์
                 return send_file(
@@ -753,4 +660,43 @@ def comparison_report(branch_id):
         return jsonify({
             'success': False,
             'message': 'เกิดข้อผิดพลาด: ' + str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+@reports_bp.route('/cache/stats', methods=['GET'])
+@token_required
+def get_cache_stats():
+    """ดึงสถิติของแคชรายงาน (hit/miss, จำนวนรายการ, ขนาด)"""
+    report_cache = get_report_cache()
+    
+    return jsonify({
+        'success': True,
+        'enabled': report_cache is not None,
+        'cache': report_cache.stats() if report_cache is not None else None
+    })
+
+@reports_bp.route('/cache/purge', methods=['POST'])
+@token_required
+@admin_required
+def purge_cache():
+    """ล้างแคชรายงานทั้งหมด หรือเฉพาะสาขาที่ระบุใน branch_id (เฉพาะ admin)"""
+    report_cache = get_report_cache()
+    if report_cache is None:
+        return jsonify({
+            'success': False,
+            'message': 'ไม่ได้เปิดใช้งานแคชรายงาน'
+        }), 404
+    
+    data = request.get_json(silent=True) or {}
+    branch_id = data.get('branch_id') or request.args.get('branch_id')
+    purged = report_cache.purge(branch_id)
+    
+    # validator ที่ client ถืออยู่ต้องไม่ตรงกันอีก (เช่นหลังคำนวณตารางสรุปใหม่)
+    touch_branches([branch_id] if branch_id else None)
+    
+    logger.info(f"ล้างแคชรายงาน {purged} รายการ" + (f" ของสาขา {branch_id}" if branch_id else ""))
+    
+    return jsonify({
+        'success': True,
+        'message': 'ล้างแคชรายงานสำเร็จ',
+        'purged': purged
+    })
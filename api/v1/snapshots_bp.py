@@ -10,6 +10,8 @@ from server.db import get_session
 from models.snapshot import Snapshot
 from models.branch import Branch
 from server.utils import save_base64_image, generate_filename
+from server.ingest import parse_timestamp
+from server.timezones import get_timezones
 from api.middleware.auth import token_required
 
 # สร้าง Blueprint
@@ -41,11 +43,8 @@ def upload_snapshot(camera_id):
         db = get_session()
         
         try:
-            # แปลง timestamp เป็น datetime
-            if isinstance(data['timestamp'], str):
-                timestamp = datetime.fromisoformat(data['timestamp'].replace('Z', '+00:00'))
-            else:
-                timestamp = datetime.now()
+            # แปลง timestamp เป็นเวลาในเขตเวลาที่บันทึก
+            timestamp = parse_timestamp(data['timestamp'], data['branch_id'])
             
             # สร้างชื่อไฟล์
             filename = generate_filename(f"snapshot_{camera_id}", "jpg")
@@ -108,13 +107,14 @@ def get_camera_snapshots(camera_id):
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        # แปลงวันที่
+        # แปลงวันที่ (ตามเขตเวลาเริ่มต้น) เป็นช่วงเวลาในเขตเวลาที่บันทึก
+        timezones = get_timezones()
         start_datetime = None
         end_datetime = None
         if start_date:
-            start_datetime = datetime.strptime(start_date, '%Y-%m-%d')
+            start_datetime, _ = timezones.day_range(datetime.strptime(start_date, '%Y-%m-%d'))
         if end_date:
-            end_datetime = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+            _, end_datetime = timezones.day_range(datetime.strptime(end_date, '%Y-%m-%d'))
         
         db = get_session()
         
@@ -306,7 +306,7 @@ def cleanup_snapshots():
             }), 400
         
         # คำนวณวันที่ตัด
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = get_timezones().storage_now() - timedelta(days=days)
         
         db = get_session()
         
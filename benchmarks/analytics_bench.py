@@ -0,0 +1,120 @@
+# benchmarks/analytics_bench.py - เปรียบเทียบการคำนวณรายงานด้วยลูป Python กับ NumPy (server/analytics.py)
+"""
+จำลองข้อมูลการนับของสาขาเดียว แล้ววัดเวลาของการคำนวณแบบเดิม (วนลูปทีละแถวด้วย dict)
+เทียบกับฟังก์ชันใน server/analytics.py: รวมรายวัน/รายสัปดาห์, หาช่วงที่มีคนมากที่สุด,
+เปอร์เซ็นไทล์ และค่าเฉลี่ยเคลื่อนที่
+
+วิธีใช้:
+    python benchmarks/analytics_bench.py [--rows 1000000] [--repeat 3]
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from server.analytics import series_from_rows, resample, busiest, percentiles, moving_average
+
+# ค่าเฉลี่ยเคลื่อนที่ของจำนวนคนเข้ารายนาที (60 นาที)
+WINDOW = 60
+
+def make_rows(count):
+    """สร้างข้อมูลตัวอย่าง: หนึ่งแถวต่อนาที (เวลา, entries, exits, max_count, min_count, samples)"""
+    base = datetime(2023, 1, 1)
+    rng = np.random.default_rng(42)
+    entries = rng.integers(0, 6, count).tolist()
+    exits = rng.integers(0, 6, count).tolist()
+    current = rng.integers(0, 80, count).tolist()
+    return [
+        (base + timedelta(minutes=i), entries[i], exits[i], current[i], current[i], 1)
+        for i in range(count)
+    ]
+
+def python_report(rows):
+    """การคำนวณแบบเดิม: วนลูปทีละแถวและจัดกลุ่มด้วย dict"""
+    days = {}
+    for timestamp, entries, exits, max_count, _, _ in rows:
+        key = timestamp.date()
+        day = days.get(key)
+        if day is None:
+            days[key] = [entries, exits, max_count]
+        else:
+            day[0] += entries
+            day[1] += exits
+            day[2] = max(day[2], max_count)
+
+    weeks = {}
+    for date, (entries, exits, max_count) in days.items():
+        key = date.isocalendar()[:2]
+        week = weeks.setdefault(key, [0, 0, 0])
+        week[0] += entries
+        week[1] += exits
+        week[2] = max(week[2], max_count)
+
+    busiest_day, busiest_count = None, 0
+    for date, (entries, _, _) in days.items():
+        if entries > busiest_count:
+            busiest_day, busiest_count = date, entries
+
+    values = sorted(row[3] for row in rows)
+    p95 = values[int(round(0.95 * (len(values) - 1)))]
+
+    averages = []
+    window_sum = 0
+    for index, row in enumerate(rows):
+        window_sum += row[1]
+        if index >= WINDOW:
+            window_sum -= rows[index - WINDOW][1]
+        averages.append(window_sum / WINDOW if index >= WINDOW - 1 else None)
+
+    return len(days), len(weeks), busiest_day, p95, averages[-1]
+
+def numpy_report(series):
+    """การคำนวณเดียวกันด้วย server/analytics.py"""
+    days = resample(series, 'day')
+    weeks = resample(days, 'week')
+    index = busiest(days.entries)
+    p95 = percentiles(series.max_count, (95,))[95]
+    averages = moving_average(series.entries, WINDOW)
+    return len(days.timestamps), len(weeks.timestamps), days.timestamps[index], p95, averages[-1]
+
+def best_time(func, repeat):
+    """เวลาที่ดีที่สุดจากการรันหลายรอบ (วินาที)"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark การคำนวณรายงานด้วยลูป Python และ NumPy')
+    parser.add_argument('--rows', type=int, default=1000000, help='จำนวนแถวของสาขา')
+    parser.add_argument('--repeat', type=int, default=3, help='จำนวนรอบที่วัด')
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    series = series_from_rows(rows)
+
+    python_result = python_report(rows)
+    numpy_result = numpy_report(series)
+    assert python_result[:2] == numpy_result[:2], (python_result, numpy_result)
+
+    results = [
+        ('python loops', best_time(lambda: python_report(rows), args.repeat)),
+        ('numpy (series_from_rows)', best_time(lambda: series_from_rows(rows), args.repeat)),
+        ('numpy (analytics)', best_time(lambda: numpy_report(series), args.repeat)),
+    ]
+
+    baseline = results[0][1]
+    print(f"{args.rows:,} แถว, {python_result[0]:,} วัน, {python_result[1]:,} สัปดาห์")
+    print(f"{'วิธี':<32}{'ms':>12}{'ns/แถว':>10}{'เร็วขึ้น':>10}")
+    for name, elapsed in results:
+        print(f"{name:<32}{elapsed * 1000:>12.1f}{elapsed / args.rows * 1e9:>10.1f}{baseline / elapsed:>9.1f}x")
+
+if __name__ == '__main__':
+    main()
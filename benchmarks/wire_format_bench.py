@@ -0,0 +1,87 @@
+# benchmarks/wire_format_bench.py - เปรียบเทียบการรับข้อมูลแบบ JSON กับเฟรมไบนารี
+"""
+วัดขนาดข้อมูลต่อรายการและเวลาในการแปลงข้อมูลต่อรายการของทั้งสองรูปแบบ
+
+วิธีใช้:
+    python benchmarks/wire_format_bench.py [--rows 10000] [--repeat 5] [--min-speedup 4]
+
+exit code 1 ถ้า decode_frame เร็วกว่า JSON น้อยกว่า --min-speedup เท่า (ใช้ตรวจใน CI)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server.ingest import parse_count
+from server.wire_format import encode_frame, decode_frame, frame_records
+
+def make_rows(count):
+    """สร้างข้อมูลตัวอย่าง: กล้อง 8 ตัวใน 3 สาขา ส่งข้อมูลทุก 5 วินาที"""
+    base = int(datetime(2025, 1, 1, 9, 0).timestamp())
+    return [
+        (f'camera-{i % 8:02d}', f'BR{i % 3:03d}', base + i * 5, i % 3, i % 2, i % 40)
+        for i in range(count)
+    ]
+
+def best_time(func, repeat):
+    """เวลาที่ดีที่สุดจากการรันหลายรอบ (วินาที)"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark รูปแบบข้อมูล JSON และเฟรมไบนารี')
+    parser.add_argument('--rows', type=int, default=10000, help='จำนวนรายการ')
+    parser.add_argument('--repeat', type=int, default=5, help='จำนวนรอบที่วัด')
+    parser.add_argument('--min-speedup', type=float, default=4.0,
+                        help='อัตราเร็วขั้นต่ำของ decode_frame เทียบกับ JSON (0 = ไม่ตรวจ)')
+    args = parser.parse_args()
+    
+    rows = make_rows(args.rows)
+    json_body = json.dumps({'data': [
+        {
+            'camera_id': camera_id,
+            'branch_id': branch_id,
+            'timestamp': datetime.fromtimestamp(timestamp).isoformat(),
+            'entry_count': entry_count,
+            'exit_count': exit_count,
+            'current_count': current_count
+        }
+        for camera_id, branch_id, timestamp, entry_count, exit_count, current_count in rows
+    ]}).encode('utf-8')
+    frame_body = encode_frame(rows)
+    
+    results = [
+        ('json (loads + parse_count)', len(json_body),
+         best_time(lambda: [parse_count(item) for item in json.loads(json_body)['data']], args.repeat)),
+        ('frame (decode_frame)', len(frame_body),
+         best_time(lambda: decode_frame(frame_body), args.repeat)),
+        ('frame (decode_frame + frame_records)', len(frame_body),
+         best_time(lambda: frame_records(decode_frame(frame_body)), args.repeat)),
+    ]
+    
+    baseline_bytes, baseline_time = results[0][1], results[0][2]
+    print(f"{'รูปแบบ':<40}{'ไบต์/รายการ':>14}{'µs/รายการ':>12}{'เร็วขึ้น':>10}")
+    for name, size, elapsed in results:
+        print(
+            f"{name:<40}{size / args.rows:>14.1f}{elapsed / args.rows * 1e6:>12.2f}"
+            f"{baseline_time / elapsed:>9.1f}x"
+        )
+    print(f"ขนาดข้อมูลลดลง {baseline_bytes / len(frame_body):.1f} เท่า")
+    
+    speedup = baseline_time / results[1][2]
+    if speedup < args.min_speedup:
+        print(f"decode_frame เร็วกว่า JSON {speedup:.1f} เท่า น้อยกว่าที่กำหนด ({args.min_speedup:.1f} เท่า)")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
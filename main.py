@@ -1,17 +1,27 @@
 # main.py - จุดเริ่มต้นเซิร์ฟเวอร์หลักสำหรับระบบนับจำนวนลูกค้า
 import os
 import sys
+import shutil
 import logging
 import argparse
+import tempfile
 from configparser import ConfigParser
 from pathlib import Path
+from datetime import datetime, timedelta
 
 # เพิ่ม path ปัจจุบันเข้าไปใน sys.path
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 from server.app import create_app
 from server.config_manager import load_config, initialize_config
-from server.db import init_db, create_tables
+from server.db import init_db, create_tables, get_session
+from server.migrations import run_migrations
+from server.partitions import init_partitions
+from server.rollups import backfill_rollups
+from server.utilisation import init_utilisation
+from server.archive import init_archive, archive_counts, archive_cutoff
+from server.query_plans import check_query_plans, seed_sample_data
+from server.forecast import rebuild_forecast
 from models import create_admin_if_not_exists
 
 # ตั้งค่าการบันทึก log
@@ -52,7 +62,7 @@ def ensure_directories():
     
     for dir_path in dirs:
         Path(dir_path).mkdir(parents=True, exist_ok=True)
-        
+    
     logging.info("สร้างโฟลเดอร์ที่จำเป็นเรียบร้อยแล้ว")
 
 def parse_arguments():
@@ -63,9 +73,109 @@ def parse_arguments():
     parser.add_argument('--port', type=int, help='Port ที่จะใช้เริ่มเซิร์ฟเวอร์')
     parser.add_argument('--debug', action='store_true', help='เริ่มในโหมด debug')
     parser.add_argument('--init-db', action='store_true', help='สร้างฐานข้อมูลใหม่')
+    parser.add_argument('--backfill-rollups', action='store_true',
+                        help='คำนวณตารางสรุปข้อมูลการนับใหม่จากข้อมูลเดิมแล้วออกจากโปรแกรม')
+    parser.add_argument('--backfill-from', type=str, help='วันแรกที่คำนวณตารางสรุปใหม่ (YYYY-MM-DD)')
+    parser.add_argument('--backfill-to', type=str, help='วันสุดท้ายที่คำนวณตารางสรุปใหม่ (YYYY-MM-DD)')
+    parser.add_argument('--archive-counts', action='store_true',
+                        help='ย้ายข้อมูลการนับที่เก่ากว่า retention_days ไปคลังข้อมูลแล้วออกจากโปรแกรม')
+    parser.add_argument('--rebuild-forecast', action='store_true',
+                        help='คำนวณโปรไฟล์การพยากรณ์ใหม่จากตารางสรุปรายชั่วโมงแล้วออกจากโปรแกรม')
+    parser.add_argument('--check-query-plans', action='store_true',
+                        help='ตรวจว่าคำสั่ง SELECT ของ endpoint ที่ใช้บ่อยใช้ index แล้วออกจากโปรแกรม')
+    parser.add_argument('--sample-data', action='store_true',
+                        help='ใช้กับ --check-query-plans: ตรวจกับฐานข้อมูล SQLite ชั่วคราวที่มีข้อมูลตัวอย่าง')
     
     return parser.parse_args()
 
+def run_backfill_rollups(args):
+    """คำนวณตารางสรุปข้อมูลการนับใหม่ตามช่วงวันที่ระบุใน command line"""
+    try:
+        start = datetime.strptime(args.backfill_from, '%Y-%m-%d') if args.backfill_from else None
+        end = datetime.strptime(args.backfill_to, '%Y-%m-%d') + timedelta(days=1) if args.backfill_to else None
+    except ValueError:
+        logging.error("รูปแบบวันที่ไม่ถูกต้อง (ควรเป็น YYYY-MM-DD)")
+        sys.exit(1)
+    
+    db = get_session()
+    try:
+        result = backfill_rollups(db, start, end)
+        logging.info(f"คำนวณตารางสรุปใหม่ {result['days']} วัน ({result['records']} รายการ) สำเร็จ")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"เกิดข้อผิดพลาดในการคำนวณตารางสรุป: {str(e)}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+def run_archive_counts(config):
+    """ย้ายข้อมูลการนับเก่าไปคลังข้อมูล แล้วคืนพื้นที่ไฟล์ฐานข้อมูล (SQLite)"""
+    archive = init_archive(config, start_job=False)
+    if archive is None:
+        logging.error("ไม่ได้เปิดใช้งานคลังข้อมูล (ส่วน [archive])")
+        sys.exit(1)
+    
+    db = get_session()
+    try:
+        result = archive_counts(db, archive, archive_cutoff(config))
+        logging.info(f"ย้ายข้อมูลการนับไปคลัง {result['months']} เดือน ({result['records']} รายการ) สำเร็จ")
+        
+        if result['records'] and db.get_bind().dialect.name == 'sqlite':
+            db.connection().exec_driver_sql('VACUUM')
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        logging.error(f"เกิดข้อผิดพลาดในการย้ายข้อมูลไปคลัง: {str(e)}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+def run_rebuild_forecast(config):
+    """คำนวณโปรไฟล์รายชั่วโมงของสัปดาห์ของทุกสาขาใหม่จากตารางสรุปรายชั่วโมง"""
+    try:
+        result = rebuild_forecast(config)
+        logging.info(f"คำนวณโปรไฟล์การพยากรณ์ใหม่ {result['branches']} สาขา ({result['hours']} ชั่วโมง) สำเร็จ")
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการคำนวณโปรไฟล์การพยากรณ์: {str(e)}")
+        sys.exit(1)
+
+def run_check_query_plans(config, sample_data=False):
+    """
+    ตรวจแผนการทำงานของคำสั่ง SELECT ที่ใช้บ่อย
+    (exit code 1 ถ้ามีคำสั่งที่อ่านทั้งตาราง หรือ endpoint ที่ไม่มีคำสั่งให้ตรวจ)
+    """
+    # ปิดแคชและงานเบื้องหลังเพื่อให้ทุกคำสั่งถูกส่งไปยังฐานข้อมูลโดยตรง
+    # (ข้อมูลตัวอย่างถูกบันทึกทันทีโดยไม่ผ่านคิว)
+    for section, option, value in (('report_cache', 'enabled', 'false'), ('http_cache', 'enabled', 'false'),
+                                   ('occupancy', 'enabled', 'false'), ('archive', 'interval_hours', '0'),
+                                   ('forecast', 'enabled', 'false'), ('ingest', 'mode', 'direct')):
+        if config.has_section(section):
+            config.set(section, option, value)
+    app = create_app(config)
+    
+    try:
+        if sample_data:
+            seed_sample_data(app)
+        results, unchecked = check_query_plans(app)
+    except Exception as e:
+        logging.error(f"เกิดข้อผิดพลาดในการตรวจแผนการทำงาน: {str(e)}")
+        sys.exit(1)
+    
+    regressions = [result for result in results if result['scans']]
+    for result in regressions:
+        print(f"[อ่านทั้งตาราง: {', '.join(result['scans'])}] {result['endpoint']}")
+        print(f"    {' '.join(result['statement'].split())}")
+        for line in result['plan']:
+            print(f"    | {line}")
+    
+    for endpoint, reason in unchecked:
+        print(f"[ตรวจไม่ครบ] {endpoint}: {reason}")
+    
+    print(f"ตรวจ {len(results)} คำสั่ง พบคำสั่งที่อ่านทั้งตาราง {len(regressions)} คำสั่ง "
+          f"endpoint ที่ตรวจไม่ครบ {len(unchecked)} รายการ")
+    if regressions or unchecked:
+        sys.exit(1)
+
 def main():
     """ฟังก์ชันหลักในการเริ่มต้นเซิร์ฟเวอร์"""
     # แยกวิเคราะห์อาร์กิวเมนต์
@@ -92,13 +202,56 @@ def main():
     if args.debug:
         config.set('server', 'debug', 'true')
     
+    # ตรวจแผนการทำงานกับฐานข้อมูลชั่วคราว (ไม่แตะฐานข้อมูลตามการตั้งค่า)
+    sample_dir = None
+    if args.check_query_plans and args.sample_data:
+        sample_dir = tempfile.mkdtemp(prefix='shop-counter-plans-')
+        config.set('database', 'type', 'sqlite')
+        config.set('database', 'path', sample_dir)
+        config.set('database', 'name', 'sample.db')
+        args.init_db = True
+    
+    # เชื่อมต่อฐานข้อมูล
+    init_db(config)
+    
     # สร้างฐานข้อมูล
     if args.init_db:
         logging.info("กำลังเริ่มต้นฐานข้อมูล...")
-        init_db(config)
         create_tables(config)
         create_admin_if_not_exists(config)
     
+    # ปรับโครงสร้างฐานข้อมูลเดิมให้เป็นปัจจุบัน
+    run_migrations(config)
+    
+    # แบ่งข้อมูลการนับเป็นพาร์ทิชันรายเดือน (ย้ายข้อมูลเดิมเข้าพาร์ทิชันถ้ายังไม่ได้ย้าย)
+    init_partitions(config)
+    
+    # ย้ายข้อมูลเก่าไปคลังข้อมูล
+    if args.archive_counts:
+        run_archive_counts(config)
+        return
+    
+    # คำนวณโปรไฟล์การพยากรณ์ใหม่
+    if args.rebuild_forecast:
+        run_rebuild_forecast(config)
+        return
+    
+    # ตรวจแผนการทำงานของคำสั่งที่ใช้บ่อย
+    if args.check_query_plans:
+        try:
+            run_check_query_plans(config, sample_data=args.sample_data)
+        finally:
+            if sample_dir is not None:
+                shutil.rmtree(sample_dir, ignore_errors=True)
+        return
+    
+    # คำนวณตารางสรุปจากข้อมูลเดิม (รวมข้อมูลในคลัง)
+    if args.backfill_rollups:
+        init_archive(config, start_job=False)
+        init_utilisation(config)
+        run_backfill_rollups(args)
+        return
+    
     # สร้างแอปพลิเคชัน
     app = create_app(config)
     
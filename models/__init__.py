@@ -12,8 +12,12 @@ from models.customer import Customer
 from models.employee import Employee
 from models.appointment import Appointment
 from models.customer_count import CustomerCount
+from models.camera_latest import CameraLatest
+from models.traffic_rollup import TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay
 from models.snapshot import Snapshot
 from models.device import Device
+from models.forecast_profile import ForecastProfile
+from models.traffic_sketch import TrafficSketchDay
 
 
 def create_admin_if_not_exists(config):
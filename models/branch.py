@@ -1,6 +1,7 @@
 # models/branch.py - โมเดลสาขา
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, Float
+from sqlalchemy.orm import relationship
 from server.db import Base
 
 class Branch(Base):
@@ -24,11 +25,15 @@ class Branch(Base):
     current_customer_count = Column(Integer, default=0)
     last_updated = Column(DateTime)
     capacity = Column(Integer, default=100)  # ความจุของสาขา
+    timezone = Column(String(50))  # เขตเวลาของสาขา เช่น Asia/Bangkok (ว่าง = [app] timezone)
     latitude = Column(Float)
     longitude = Column(Float)
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
     
+    employees = relationship("Employee", back_populates="branch")
+    appointments = relationship("Appointment", back_populates="branch")
+    
     def __repr__(self):
         return f"<Branch {self.branch_id} {self.name}>"
     
@@ -51,6 +56,7 @@ class Branch(Base):
             'current_customer_count': self.current_customer_count,
             'last_updated': self.last_updated.isoformat() if self.last_updated else None,
             'capacity': self.capacity,
+            'timezone': self.timezone,
             'latitude': self.latitude,
             'longitude': self.longitude,
             'created_at': self.created_at.isoformat(),
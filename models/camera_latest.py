@@ -0,0 +1,31 @@
+# models/camera_latest.py - โมเดลข้อมูลการนับล่าสุดของแต่ละกล้อง
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime
+from server.db import Base
+
+class CameraLatest(Base):
+    """ข้อมูลการนับล่าสุดของแต่ละกล้อง (อัพเดตทุกครั้งที่รับข้อมูลใหม่)"""
+    
+    __tablename__ = 'camera_latest'
+    
+    camera_id = Column(String(50), primary_key=True)
+    branch_id = Column(String(50), nullable=False, index=True)
+    timestamp = Column(DateTime, nullable=False)
+    entry_count = Column(Integer, default=0)
+    exit_count = Column(Integer, default=0)
+    current_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.now)
+    
+    def __repr__(self):
+        return f"<CameraLatest {self.camera_id} {self.timestamp}>"
+    
+    def to_dict(self):
+        """แปลงข้อมูลเป็น dictionary"""
+        return {
+            'camera_id': self.camera_id,
+            'branch_id': self.branch_id,
+            'timestamp': self.timestamp.isoformat(),
+            'entry_count': self.entry_count,
+            'exit_count': self.exit_count,
+            'current_count': self.current_count
+        }
@@ -1,13 +1,20 @@
 # models/customer_count.py - โมเดลข้อมูลการนับลูกค้า
 import json
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
 from server.db import Base
 
 class CustomerCount(Base):
     """โมเดลข้อมูลการนับลูกค้า"""
     
     __tablename__ = 'customer_counts'
+    __table_args__ = (
+        # natural key สำหรับกันข้อมูลซ้ำเมื่อกล้องส่งข้อมูลเดิมซ้ำ
+        Index('uq_customer_counts_camera_timestamp', 'camera_id', 'timestamp', unique=True),
+        Index('uq_customer_counts_camera_event', 'camera_id', 'event_id', unique=True),
+        # ช่วงเวลาของสาขา คอลัมน์ที่รวมในรายงานอยู่ท้าย index จึงอ่านจาก index อย่างเดียวได้ (covering index)
+        Index('ix_customer_counts_branch_timestamp', 'branch_id', 'timestamp', 'entry_count', 'exit_count', 'current_count'),
+    )
     
     id = Column(Integer, primary_key=True)
     camera_id = Column(String(50), nullable=False)
@@ -17,6 +24,7 @@ class CustomerCount(Base):
     exit_count = Column(Integer, default=0)   # จำนวนคนออกในช่วงเวลานี้
     current_count = Column(Integer, default=0)  # จำนวนคนปัจจุบันในเวลานั้น
     meta_data = Column(Text)  # เก็บข้อมูลเพิ่มเติมในรูปแบบ JSON
+    event_id = Column(String(64))  # รหัสเหตุการณ์จากอุปกรณ์ (ถ้ามี) ใช้กันข้อมูลซ้ำ
     
     def __repr__(self):
         return f"<CustomerCount {self.camera_id} {self.timestamp}>"
@@ -31,5 +39,6 @@ class CustomerCount(Base):
             'entry_count': self.entry_count,
             'exit_count': self.exit_count,
             'current_count': self.current_count,
-            'meta_data': json.loads(self.meta_data) if self.meta_data else {}
+            'meta_data': json.loads(self.meta_data) if self.meta_data else {},
+            'event_id': self.event_id
         }
\ No newline at end of file
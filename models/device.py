@@ -1,13 +1,18 @@
 # models/device.py - โมเดลอุปกรณ์
 import json
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
 from server.db import Base
 
 class Device(Base):
     """โมเดลอุปกรณ์"""
     
     __tablename__ = 'devices'
+    __table_args__ = (
+        # อุปกรณ์ของสาขา/กล้อง และอุปกรณ์ที่ไม่ได้ติดต่อมานาน
+        Index('ix_devices_branch_camera', 'branch_id', 'camera_id'),
+        Index('ix_devices_last_seen', 'last_seen'),
+    )
     
     id = Column(Integer, primary_key=True)
     device_id = Column(String(100), unique=True, nullable=False)  # เช่น UUID หรือรหัสเฉพาะ
@@ -0,0 +1,33 @@
+# models/forecast_profile.py - โมเดลโปรไฟล์รายชั่วโมงของสัปดาห์สำหรับพยากรณ์จำนวนลูกค้า
+from sqlalchemy import Column, Integer, String, DateTime, Float
+from server.db import Base
+
+class ForecastProfile(Base):
+    """ค่าเฉลี่ยและความแปรปรวน (แบบถ่วงน้ำหนักลดลงตามเวลา) ของชั่วโมงหนึ่งในสัปดาห์ของสาขา"""
+    
+    __tablename__ = 'forecast_profiles'
+    
+    branch_id = Column(String(50), primary_key=True)
+    slot = Column(Integer, primary_key=True)  # ชั่วโมงของสัปดาห์ 0-167 (0 = วันจันทร์ 00:00)
+    entries_mean = Column(Float, nullable=False, default=0)     # จำนวนคนเข้าต่อชั่วโมง
+    entries_var = Column(Float, nullable=False, default=0)
+    occupancy_mean = Column(Float, nullable=False, default=0)   # จำนวนคนสูงสุดในสาขาระหว่างชั่วโมง
+    occupancy_var = Column(Float, nullable=False, default=0)
+    samples = Column(Integer, nullable=False, default=0)  # จำนวนชั่วโมงที่รวมเข้าโปรไฟล์แล้ว
+    last_bucket = Column(DateTime)  # ชั่วโมงล่าสุดที่รวมเข้าโปรไฟล์
+    
+    def __repr__(self):
+        return f"<ForecastProfile {self.branch_id} {self.slot}>"
+    
+    def to_dict(self):
+        """แปลงข้อมูลเป็น dictionary"""
+        return {
+            'branch_id': self.branch_id,
+            'slot': self.slot,
+            'entries_mean': self.entries_mean,
+            'entries_var': self.entries_var,
+            'occupancy_mean': self.occupancy_mean,
+            'occupancy_var': self.occupancy_var,
+            'samples': self.samples,
+            'last_bucket': self.last_bucket.isoformat() if self.last_bucket else None
+        }
@@ -1,13 +1,18 @@
 # models/snapshot.py - โมเดลภาพสแนปช็อต
 import json
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index
 from server.db import Base
 
 class Snapshot(Base):
     """โมเดลภาพสแนปช็อต"""
     
     __tablename__ = 'snapshots'
+    __table_args__ = (
+        # ภาพล่าสุดของกล้องและของสาขา (กรองตามรหัสแล้วเรียงตามเวลา)
+        Index('ix_snapshots_camera_timestamp', 'camera_id', 'timestamp'),
+        Index('ix_snapshots_branch_timestamp', 'branch_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     camera_id = Column(String(50), nullable=False)
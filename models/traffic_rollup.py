@@ -0,0 +1,63 @@
+# models/traffic_rollup.py - โมเดลข้อมูลการนับที่สรุปแล้วรายนาที รายชั่วโมง และรายวัน
+from sqlalchemy import Column, Integer, String, DateTime, Float, Index
+from server.db import Base
+
+class _TrafficRollupColumns:
+    """
+    คอลัมน์ของตารางสรุปทุกระดับ: หนึ่งแถวต่อสาขา ช่วงเวลา และกล้อง
+    
+    primary key เริ่มด้วย (branch_id, bucket) จึงอ่านช่วงเวลาของสาขาได้จาก index เดียว
+    """
+    
+    branch_id = Column(String(50), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)  # เวลาเริ่มต้นของช่วง
+    camera_id = Column(String(50), primary_key=True)
+    entry_count = Column(Integer, nullable=False, default=0)  # ผลรวมจำนวนคนเข้า
+    exit_count = Column(Integer, nullable=False, default=0)   # ผลรวมจำนวนคนออก
+    max_count = Column(Integer, nullable=False, default=0)    # จำนวนคนสูงสุดในช่วง
+    min_count = Column(Integer, nullable=False, default=0)    # จำนวนคนต่ำสุดในช่วง
+    sample_count = Column(Integer, nullable=False, default=0)  # จำนวนข้อมูลการนับในช่วง
+    occupancy_seconds = Column(Float, nullable=False, default=0)  # ผลรวมจำนวนคน x วินาทีของสาขา (server/utilisation.py)
+    busy_seconds = Column(Float, nullable=False, default=0)  # วินาทีที่สาขามีคนเกิน busy_threshold_pct ของความจุ
+    
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.branch_id} {self.camera_id} {self.bucket}>"
+    
+    def to_dict(self):
+        """แปลงข้อมูลเป็น dictionary"""
+        return {
+            'branch_id': self.branch_id,
+            'camera_id': self.camera_id,
+            'bucket': self.bucket.isoformat(),
+            'entry_count': self.entry_count,
+            'exit_count': self.exit_count,
+            'max_count': self.max_count,
+            'min_count': self.min_count,
+            'sample_count': self.sample_count,
+            'occupancy_seconds': self.occupancy_seconds,
+            'busy_seconds': self.busy_seconds
+        }
+
+def _bucket_index(table_name):
+    """
+    covering index ที่เริ่มด้วย bucket สำหรับคำสั่งที่อ่านช่วงเวลาของทุกสาขา (เช่น การจัดอันดับสาขา)
+    ซึ่งใช้ primary key ไม่ได้เพราะไม่ได้ระบุ branch_id
+    """
+    return Index(f'ix_{table_name}_bucket', 'bucket', 'branch_id', 'entry_count', 'exit_count', 'max_count')
+
+class TrafficRollupMinute(_TrafficRollupColumns, Base):
+    """ข้อมูลสรุปรายนาที"""
+    
+    __tablename__ = 'traffic_rollup_minute'
+
+class TrafficRollupHour(_TrafficRollupColumns, Base):
+    """ข้อมูลสรุปรายชั่วโมง"""
+    
+    __tablename__ = 'traffic_rollup_hour'
+    __table_args__ = (_bucket_index('traffic_rollup_hour'),)
+
+class TrafficRollupDay(_TrafficRollupColumns, Base):
+    """ข้อมูลสรุปรายวัน"""
+    
+    __tablename__ = 'traffic_rollup_day'
+    __table_args__ = (_bucket_index('traffic_rollup_day'),)
@@ -0,0 +1,27 @@
+# models/traffic_sketch.py - โมเดล quantile sketch รายวันของค่ารายชั่วโมงของแต่ละสาขา
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, Index
+from server.db import Base
+
+class TrafficSketchDay(Base):
+    """
+    sketch ของจำนวนคนเข้าและจำนวนคนสูงสุดต่อชั่วโมงของสาขาในหนึ่งวัน (server/sketches.py)
+    
+    sample_count และ max_count_total เป็นผลรวมจากตารางสรุปรายวันตอนสร้าง sketch
+    ใช้ตรวจว่า sketch ยังตรงกับตารางสรุปปัจจุบัน
+    """
+    
+    __tablename__ = 'traffic_sketch_day'
+    
+    branch_id = Column(String(50), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)  # เวลาเริ่มต้นของวัน
+    sample_count = Column(Integer, nullable=False, default=0)
+    max_count_total = Column(Integer, nullable=False, default=0)
+    hours = Column(Integer, nullable=False, default=0)  # จำนวนชั่วโมงที่มีข้อมูลการนับ
+    entries_sketch = Column(LargeBinary, nullable=False)
+    peak_sketch = Column(LargeBinary, nullable=False)
+    
+    # สำหรับอ่าน sketch ของทุกสาขาในช่วงวันที่
+    __table_args__ = (Index('ix_traffic_sketch_day_bucket', 'bucket'),)
+    
+    def __repr__(self):
+        return f"<TrafficSketchDay {self.branch_id} {self.bucket}>"
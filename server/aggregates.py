@@ -0,0 +1,336 @@
+# server/aggregates.py - สรุปข้อมูลการนับหลายช่วงเวลาด้วย query เดียว (conditional aggregation)
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case, and_, or_
+from server.rollups import GRAINS, ROLLUP_MODELS, choose_grain
+from server.timebucket import time_part
+from server.timezones import get_timezones
+from models.branch import Branch
+
+# ช่วงเวลาหนึ่งช่วง: start_date/end_date เป็นข้อความ YYYY-MM-DD (รวมวันสุดท้าย)
+# ส่วน start/end เป็น datetime แบบ [start, end)
+Period = namedtuple('Period', ('start_date', 'end_date', 'start', 'end'))
+
+# ค่าที่คำนวณได้: ชื่อ -> (ฟังก์ชัน aggregate, คอลัมน์ในตารางสรุป)
+METRICS = {
+    'entries': (func.sum, 'entry_count'),
+    'exits': (func.sum, 'exit_count'),
+    'max_count': (func.max, 'max_count'),
+    'min_count': (func.min, 'min_count'),
+    'samples': (func.sum, 'sample_count'),
+    'occupancy_seconds': (func.sum, 'occupancy_seconds'),
+    'busy_seconds': (func.sum, 'busy_seconds')
+}
+
+DEFAULT_METRICS = ('entries', 'exits', 'max_count')
+
+# ค่าตามเวลาที่ใช้คำนวณ utilisation()
+UTILISATION_METRICS = ('occupancy_seconds', 'busy_seconds')
+
+# การจัดกลุ่มผลลัพธ์ที่รองรับ: ชื่อ -> ระดับของตารางสรุปที่หยาบที่สุดที่ใช้ได้
+GROUPINGS = {
+    None: 'day',
+    'branch': 'day',
+    'hour': 'hour',      # ชั่วโมงของวัน 0-23
+    'weekday': 'day'     # 0 = วันจันทร์
+}
+
+# จำนวนช่วงเวลาสูงสุดต่อคำขอ
+MAX_PERIODS = 12
+
+# ค่าที่ใช้จัดอันดับสาขา (capacity_pct = max_count เทียบกับความจุของสาขา %)
+RANKING_METRICS = ('entries', 'exits', 'max_count', 'capacity_pct')
+
+# คอลัมน์ของสาขาที่ใช้จัดกลุ่มอันดับได้
+RANKING_GROUPS = ('province', 'city')
+
+def make_period(start_date, end_date, branch_id=None):
+    """
+    สร้างช่วงเวลาจากวันที่เริ่มต้นและวันที่สิ้นสุด (รวมวันสุดท้าย) ตามเวลาท้องถิ่นของสาขา
+    
+    Args:
+        start_date, end_date: ข้อความ YYYY-MM-DD
+        branch_id: รหัสสาขา (None = เขตเวลาเริ่มต้น ใช้กับคำขอที่อ่านหลายสาขา)
+    
+    Raises:
+        ValueError: ถ้ารูปแบบวันที่ไม่ถูกต้อง หรือวันที่สิ้นสุดอยู่ก่อนวันที่เริ่มต้น
+    """
+    first_day = datetime.strptime(start_date, '%Y-%m-%d').date()
+    days = (datetime.strptime(end_date, '%Y-%m-%d').date() - first_day).days + 1
+    if days <= 0:
+        raise ValueError('วันที่สิ้นสุดต้องไม่อยู่ก่อนวันที่เริ่มต้น')
+    start, end = get_timezones().day_range(first_day, days, branch_id)
+    return Period(start_date, end_date, start, end)
+
+def parse_periods(value, previous=0, branch_id=None):
+    """
+    แปลงพารามิเตอร์ periods เป็นรายการช่วงเวลา
+    
+    Args:
+        value: ข้อความ 'YYYY-MM-DD:YYYY-MM-DD,YYYY-MM-DD:YYYY-MM-DD,...'
+        previous: จำนวนช่วงที่มีความยาวเท่ากัน ซึ่งอยู่ก่อนหน้าช่วงแรก ที่ต้องการเพิ่มต่อท้าย
+        branch_id: รหัสสาขาที่ใช้เขตเวลา (None = เขตเวลาเริ่มต้น)
+    
+    Returns:
+        list: รายการ Period
+    
+    Raises:
+        ValueError: ถ้ารูปแบบไม่ถูกต้องหรือมีช่วงเวลามากเกินไป
+    """
+    periods = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        start_date, separator, end_date = item.partition(':')
+        if not separator:
+            raise ValueError('รูปแบบช่วงเวลาไม่ถูกต้อง (ควรเป็น YYYY-MM-DD:YYYY-MM-DD)')
+        periods.append(make_period(start_date, end_date, branch_id))
+    
+    if not periods:
+        raise ValueError('กรุณาระบุช่วงเวลาอย่างน้อยหนึ่งช่วง')
+    
+    if previous:
+        first = periods[0]
+        first_day = datetime.strptime(first.start_date, '%Y-%m-%d').date()
+        days = (datetime.strptime(first.end_date, '%Y-%m-%d').date() - first_day).days + 1
+        for index in range(1, previous + 1):
+            start_day = first_day - timedelta(days=days * index)
+            start, end = get_timezones().day_range(start_day, days, branch_id)
+            periods.append(Period(
+                start_day.strftime('%Y-%m-%d'), (start_day + timedelta(days=days - 1)).strftime('%Y-%m-%d'), start, end
+            ))
+    
+    if len(periods) > MAX_PERIODS:
+        raise ValueError(f'เปรียบเทียบได้ไม่เกิน {MAX_PERIODS} ช่วงเวลา')
+    
+    return periods
+
+def _common_grain(periods, coarsest):
+    """ระดับตารางสรุปที่หยาบที่สุดที่ขอบเขตของทุกช่วงตรงกัน และไม่หยาบกว่า coarsest"""
+    finest = GRAINS.index(coarsest)
+    for period in periods:
+        finest = min(finest, GRAINS.index(choose_grain(period.start, period.end, coarsest)))
+    return GRAINS[finest]
+
+def aggregate_periods(db, periods, metrics=DEFAULT_METRICS, branch_ids=None, group_by=None, offset=None):
+    """
+    คำนวณค่าสรุปของหลายช่วงเวลาพร้อมกันในการอ่านตารางสรุปครั้งเดียว
+    
+    แต่ละค่าของแต่ละช่วงเป็นคอลัมน์ในรูป SUM(CASE WHEN bucket อยู่ในช่วง THEN ... END)
+    จำนวน query จึงไม่เพิ่มตามจำนวนช่วงเวลาหรือจำนวนค่าที่ต้องการ
+    
+    Args:
+        db: database session
+        periods: รายการ Period หรือ tuple (start, end)
+        metrics: ชื่อค่าที่ต้องการจาก METRICS
+        branch_ids: รายการรหัสสาขา (None = ทุกสาขา)
+        group_by: None, 'branch', 'hour' (ชั่วโมงของวัน) หรือ 'weekday'
+        offset: ผลต่างของเวลาท้องถิ่นกับเขตเวลาที่บันทึก สำหรับ group_by 'hour'/'weekday' (TimezoneService.offset)
+    
+    Returns:
+        ถ้า group_by เป็น None: list ของ dict ค่าสรุป (หนึ่งรายการต่อช่วงเวลา)
+        ถ้าไม่ใช่: dict ของ key กลุ่ม -> list ของ dict ค่าสรุป (เฉพาะกลุ่มที่มีข้อมูล)
+    """
+    if group_by not in GROUPINGS:
+        raise ValueError(f"group_by ไม่รองรับ: {group_by}")
+    unknown = [metric for metric in metrics if metric not in METRICS]
+    if unknown:
+        raise ValueError(f"ไม่รองรับค่า: {', '.join(unknown)}")
+    
+    periods = [period if isinstance(period, Period) else Period(None, None, *period) for period in periods]
+    grain = _common_grain(periods, GROUPINGS[group_by])
+    table = ROLLUP_MODELS[grain].__table__
+    
+    conditions = [and_(table.c.bucket >= period.start, table.c.bucket < period.end) for period in periods]
+    columns = [
+        METRICS[metric][0](case((condition, table.c[METRICS[metric][1]])))
+        for condition in conditions
+        for metric in metrics
+    ]
+    
+    if group_by == 'branch':
+        key = table.c.branch_id
+    elif group_by is not None:
+        key = time_part(group_by, table.c.bucket, offset=offset)
+    else:
+        key = None
+    
+    statement = select(*([key] if key is not None else []), *columns).where(or_(*conditions))
+    if branch_ids is not None:
+        statement = statement.where(table.c.branch_id.in_(branch_ids))
+    if key is not None:
+        statement = statement.group_by(key)
+    
+    def split(values):
+        values = [int(value or 0) for value in values]
+        return [
+            dict(zip(metrics, values[index * len(metrics):(index + 1) * len(metrics)]))
+            for index in range(len(periods))
+        ]
+    
+    if key is None:
+        return split(db.execute(statement).one())
+    
+    return {row[0]: split(row[1:]) for row in db.execute(statement)}
+
+def percent_change(current, reference):
+    """เปอร์เซ็นต์การเปลี่ยนแปลงจาก reference เป็น current (ทศนิยม 2 ตำแหน่ง)"""
+    return round(((current - reference) / max(1, reference)) * 100, 2)
+
+def compare_values(current, reference):
+    """เปอร์เซ็นต์การเปลี่ยนแปลงของทุกค่าใน dict"""
+    return {metric: percent_change(current[metric], reference[metric]) for metric in current}
+
+def build_comparison(db, branch_id, periods, metrics=DEFAULT_METRICS):
+    """
+    เปรียบเทียบช่วงแรกกับช่วงอื่นทั้งหมดด้วย query เดียว
+    
+    Args:
+        db: database session
+        branch_id: รหัสสาขา
+        periods: รายการ Period (ช่วงแรกคือช่วงที่ต้องการประเมิน)
+        metrics: ชื่อค่าที่ต้องการจาก METRICS
+    
+    Returns:
+        list: dict ของแต่ละช่วง (start_date, end_date และค่าสรุป) ช่วงที่สองเป็นต้นไปมี changes
+              คือการเปลี่ยนแปลงของช่วงแรกเทียบกับช่วงนั้น (%)
+    """
+    results = aggregate_periods(db, periods, metrics, branch_ids=[branch_id])
+    current = results[0]
+    
+    comparison = []
+    for index, (period, values) in enumerate(zip(periods, results)):
+        item = {'start_date': period.start_date, 'end_date': period.end_date}
+        item.update(values)
+        if index > 0:
+            item['changes'] = compare_values(current, values)
+        comparison.append(item)
+    
+    return comparison
+
+def utilisation(occupancy_seconds, busy_seconds, seconds, capacity):
+    """
+    ค่าการใช้พื้นที่ของสาขาจากผลรวมตามเวลาในตารางสรุป
+    
+    Args:
+        occupancy_seconds: ผลรวมจำนวนคน x วินาที
+        busy_seconds: วินาทีที่จำนวนคนเกินเกณฑ์ของความจุ
+        seconds: ความยาวของช่วงเวลา (วินาที)
+        capacity: ความจุของสาขา (None หรือ 0 = ไม่คำนวณ avg_utilisation_pct)
+    
+    Returns:
+        dict: visitor_minutes, avg_occupancy (จำนวนคนเฉลี่ยตลอดช่วง), avg_utilisation_pct,
+              busy_minutes และ busy_pct (% ของช่วงเวลา)
+    """
+    avg_occupancy = occupancy_seconds / seconds if seconds else 0
+    return {
+        'visitor_minutes': round(occupancy_seconds / 60, 2),
+        'avg_occupancy': round(avg_occupancy, 2),
+        'avg_utilisation_pct': _capacity_pct(avg_occupancy, capacity),
+        'busy_minutes': round(busy_seconds / 60, 2),
+        'busy_pct': round(busy_seconds * 100 / seconds, 2) if seconds else 0
+    }
+
+def _capacity_pct(max_count, capacity):
+    return round(max_count * 100 / capacity, 2) if capacity else None
+
+def branch_totals(db, period):
+    """
+    ค่าสรุปของทุกสาขาในช่วงเวลาด้วย query เดียว (สาขาที่ไม่มีข้อมูลมีค่าเป็น 0)
+    
+    Args:
+        db: database session
+        period: Period หรือ tuple (start, end)
+    
+    Returns:
+        list: dict ของแต่ละสาขา (branch_id, branch_name, province, city, capacity, entries, exits,
+              max_count, capacity_pct) เรียงตามลำดับของสาขา
+    """
+    period = period if isinstance(period, Period) else Period(None, None, *period)
+    table = ROLLUP_MODELS[_common_grain([period], 'day')].__table__
+    
+    totals = select(
+        table.c.branch_id,
+        func.sum(table.c.entry_count).label('entries'),
+        func.sum(table.c.exit_count).label('exits'),
+        func.max(table.c.max_count).label('max_count')
+    ) \
+        .where(table.c.bucket >= period.start, table.c.bucket < period.end) \
+        .group_by(table.c.branch_id) \
+        .subquery()
+    
+    statement = select(
+        Branch.branch_id, Branch.name, Branch.province, Branch.city, Branch.capacity,
+        totals.c.entries, totals.c.exits, totals.c.max_count
+    ) \
+        .outerjoin(totals, totals.c.branch_id == Branch.branch_id) \
+        .order_by(Branch.id)
+    
+    results = []
+    for branch_id, name, province, city, capacity, entries, exits, max_count in db.execute(statement):
+        max_count = int(max_count or 0)
+        results.append({
+            'branch_id': branch_id,
+            'branch_name': name,
+            'province': province,
+            'city': city,
+            'capacity': capacity,
+            'entries': int(entries or 0),
+            'exits': int(exits or 0),
+            'max_count': max_count,
+            'capacity_pct': _capacity_pct(max_count, capacity)
+        })
+    return results
+
+def _group_totals(branches, group_by):
+    """รวมค่าสรุปของสาขาตามคอลัมน์ group_by (capacity_pct ของกลุ่มคือค่าสูงสุดของสาขาในกลุ่ม)"""
+    groups = {}
+    for branch in branches:
+        group = groups.get(branch[group_by])
+        if group is None:
+            group = groups[branch[group_by]] = {
+                group_by: branch[group_by],
+                'branches': 0,
+                'capacity': 0,
+                'entries': 0,
+                'exits': 0,
+                'max_count': 0,
+                'capacity_pct': None
+            }
+        group['branches'] += 1
+        group['capacity'] += branch['capacity'] or 0
+        group['entries'] += branch['entries']
+        group['exits'] += branch['exits']
+        group['max_count'] = max(group['max_count'], branch['max_count'])
+        if branch['capacity_pct'] is not None:
+            group['capacity_pct'] = max(group['capacity_pct'] or 0, branch['capacity_pct'])
+    return list(groups.values())
+
+def rank_branches(db, period, sort_by='entries', descending=True, limit=None, group_by=None):
+    """
+    จัดอันดับสาขา (หรือกลุ่มสาขาตามจังหวัด/เมือง) ตามค่าสรุปในช่วงเวลา
+    
+    Args:
+        db: database session
+        period: Period หรือ tuple (start, end)
+        sort_by: หนึ่งใน RANKING_METRICS
+        descending: True = มากไปน้อย (อันดับสูงสุด), False = น้อยไปมาก (อันดับต่ำสุด)
+        limit: จำนวนอันดับที่ต้องการ (None = ทั้งหมด)
+        group_by: None หรือหนึ่งใน RANKING_GROUPS
+    
+    Returns:
+        list: dict ของแต่ละอันดับ (rank และค่าจาก branch_totals) รายการที่ไม่มีค่า sort_by อยู่ท้ายเสมอ
+    """
+    if sort_by not in RANKING_METRICS:
+        raise ValueError(f"sort_by ต้องเป็นหนึ่งใน {', '.join(RANKING_METRICS)}")
+    if group_by is not None and group_by not in RANKING_GROUPS:
+        raise ValueError(f"group_by ต้องเป็นหนึ่งใน {', '.join(RANKING_GROUPS)}")
+    
+    items = branch_totals(db, period)
+    if group_by is not None:
+        items = _group_totals(items, group_by)
+    
+    sign = -1 if descending else 1
+    items.sort(key=lambda item: (item[sort_by] is None, sign * (item[sort_by] or 0)))
+    if limit is not None:
+        items = items[:limit]
+    
+    return [dict(item, rank=rank) for rank, item in enumerate(items, 1)]
@@ -0,0 +1,347 @@
+# server/analytics.py - คำนวณสถิติของข้อมูลการนับด้วย NumPy (ทำงานกับทั้งอาร์เรย์ แทนการวนลูปทีละแถว)
+"""
+ข้อมูลของสาขาถูกโหลดเป็น Series ซึ่งเก็บแต่ละคอลัมน์เป็นอาร์เรย์ต่อเนื่องกันในหน่วยความจำ
+    
+    timestamps  int64 จำนวนวินาทีนับจาก 1970-01-01 ของเวลาที่บันทึก (ไม่มี timezone แบบเดียวกับฐานข้อมูล)
+    entries, exits, max_count, min_count, samples  int32
+
+series = load_series(db, 'BR001', start, end, 'day')
+weekly = resample(series, 'week')                 # รวมเป็นรายสัปดาห์ (เริ่มวันจันทร์)
+index = busiest(weekly.entries)                   # ตำแหน่งของสัปดาห์ที่มีคนเข้ามากที่สุด
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+import numpy as np
+from sqlalchemy import select
+from server.rollups import GRAINS, iter_rollup_series
+from server.archive import get_archive
+from server.partitions import counts_table
+
+# คอลัมน์ของ Series (ลำดับเดียวกับผลลัพธ์ของ iter_rollup_series หลัง branch_id)
+SERIES_FIELDS = ('timestamps', 'entries', 'exits', 'max_count', 'min_count', 'samples')
+
+Series = namedtuple('Series', SERIES_FIELDS)
+
+# ระดับที่ resample รองรับ
+RESAMPLE_GRAINS = ('minute', 'hour', 'day', 'week', 'month')
+
+# จำนวนแถวที่แปลงเป็นอาร์เรย์ต่อครั้งระหว่างโหลดข้อมูล
+LOAD_CHUNK_SIZE = 10000
+
+# วิธีลดจำนวนจุดของกราฟที่รองรับ และจำนวนจุดขั้นต่ำ (จุดแรก จุดสุดท้าย และอย่างน้อยหนึ่งช่วงตรงกลาง)
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+MIN_DOWNSAMPLE_POINTS = 4
+
+_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_SECOND = timedelta(seconds=1)
+
+def empty_series():
+    """Series ที่ไม่มีข้อมูล"""
+    return Series(np.empty(0, dtype=np.int64), *(np.empty(0, dtype=np.int32) for _ in SERIES_FIELDS[1:]))
+
+def series_from_rows(rows):
+    """
+    แปลงแถว (เวลา, entries, exits, max_count, min_count, samples) เป็น Series
+    
+    Args:
+        rows: iterable ของ tuple ที่เวลาเป็น datetime (อ่านทีละ LOAD_CHUNK_SIZE แถว)
+    
+    Returns:
+        Series: เรียงตามลำดับของแถวที่รับมา
+    """
+    rows = iter(rows)
+    chunks = [[] for _ in SERIES_FIELDS]
+    
+    while True:
+        chunk = list(islice(rows, LOAD_CHUNK_SIZE))
+        if not chunk:
+            break
+        columns = list(zip(*chunk))
+        # ลบ epoch ทีละค่าเร็วกว่าให้ NumPy แปลง datetime เป็น datetime64 หลายเท่า
+        chunks[0].append(np.fromiter(
+            ((timestamp - _EPOCH) // _ONE_SECOND for timestamp in columns[0]), dtype=np.int64, count=len(chunk)
+        ))
+        for target, column in zip(chunks[1:], columns[1:]):
+            target.append(np.array(column, dtype=np.int32))
+    
+    if not chunks[0]:
+        return empty_series()
+    
+    return Series(*(np.concatenate(parts) for parts in chunks))
+
+def load_series(db, branch_id, start, end, grain='hour', offset=None):
+    """
+    โหลดข้อมูลการนับของสาขา (รวมทุกกล้อง) เป็น Series
+    
+    Args:
+        db: database session
+        branch_id: รหัสสาขา
+        start: เวลาเริ่มต้น
+        end: เวลาสิ้นสุด (ไม่รวม)
+        grain: 'minute', 'hour', 'day' (อ่านจากตารางสรุป) หรือ 'raw' (ข้อมูลการนับทุกรายการ
+               รวมข้อมูลที่ถูกย้ายไปคลังแล้ว)
+        offset: ผลต่างของเวลาท้องถิ่นของสาขากับเขตเวลาที่บันทึก (เฉพาะตารางสรุป)
+    
+    Returns:
+        Series: เรียงตามเวลา
+    """
+    if grain == 'raw':
+        counts = counts_table(start, end)
+        result = db.execute(
+            select(
+                counts.c.timestamp,
+                counts.c.entry_count,
+                counts.c.exit_count,
+                counts.c.current_count,
+                counts.c.current_count
+            )
+            .where(
+                counts.c.branch_id == branch_id,
+                counts.c.timestamp >= start,
+                counts.c.timestamp < end
+            )
+            .order_by(counts.c.timestamp)
+            .execution_options(yield_per=LOAD_CHUNK_SIZE)
+        )
+        series = series_from_rows(
+            (timestamp, entries or 0, exits or 0, current or 0, current or 0, 1)
+            for timestamp, entries, exits, current, _ in result
+        )
+        
+        archive = get_archive()
+        if archive is None:
+            return series
+        
+        archived = archive.read(branch_id, start, end)
+        if len(archived.timestamps) == 0:
+            return series
+        
+        archived = Series(
+            archived.timestamps // 1000000,
+            archived.entry_count,
+            archived.exit_count,
+            archived.current_count,
+            archived.current_count,
+            np.ones(len(archived.timestamps), dtype=np.int32)
+        )
+        return _sorted(Series(*(np.concatenate(pair) for pair in zip(archived, series))))
+    
+    if grain not in GRAINS:
+        raise ValueError(f"grain ต้องเป็น raw หรือหนึ่งใน {', '.join(GRAINS)}")
+    
+    return series_from_rows(
+        row[1:] for row in iter_rollup_series(db, start, end, grain, branch_ids=[branch_id], offset=offset)
+    )
+
+def bucket_keys(timestamps, grain):
+    """
+    เวลาเริ่มต้นของช่วงที่แต่ละเวลาอยู่ (วินาทีนับจาก 1970-01-01)
+    
+    Args:
+        timestamps: อาร์เรย์ int64 ของเวลา
+        grain: หนึ่งใน RESAMPLE_GRAINS (week เริ่มวันจันทร์)
+    """
+    if grain in _SECONDS:
+        return timestamps - timestamps % _SECONDS[grain]
+    
+    if grain == 'week':
+        days = timestamps // 86400
+        # 1970-01-01 เป็นวันพฤหัสบดี จึงเลื่อน 3 วันเพื่อให้สัปดาห์เริ่มวันจันทร์
+        return (days - (days + 3) % 7) * 86400
+    
+    if grain == 'month':
+        return timestamps.astype('datetime64[s]').astype('datetime64[M]').astype('datetime64[s]').astype(np.int64)
+    
+    raise ValueError(f"grain ต้องเป็นหนึ่งใน {', '.join(RESAMPLE_GRAINS)}")
+
+def _group_starts(keys):
+    """ตำแหน่งเริ่มต้นของแต่ละกลุ่มใน keys ที่เรียงแล้ว"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+
+def _sorted(series):
+    """คืน series ที่เรียงตามเวลา (คืนตัวเดิมถ้าเรียงอยู่แล้ว)"""
+    if len(series.timestamps) < 2 or np.all(series.timestamps[1:] >= series.timestamps[:-1]):
+        return series
+    order = np.argsort(series.timestamps, kind='stable')
+    return Series(*(column[order] for column in series))
+
+def resample(series, grain):
+    """
+    รวมข้อมูลเป็นช่วงที่หยาบขึ้น (ผลรวมของ entries/exits/samples, ค่าสูงสุด/ต่ำสุดของ max_count/min_count)
+    
+    Args:
+        series: Series
+        grain: หนึ่งใน RESAMPLE_GRAINS
+    
+    Returns:
+        Series: หนึ่งแถวต่อช่วงที่มีข้อมูล timestamps เป็นเวลาเริ่มต้นของช่วง
+    """
+    series = _sorted(series)
+    keys = bucket_keys(series.timestamps, grain)
+    starts = _group_starts(keys)
+    if len(starts) == 0:
+        return empty_series()
+    
+    def total(column):
+        return np.add.reduceat(column, starts, dtype=np.int64).astype(np.int32)
+    
+    return Series(
+        keys[starts],
+        total(series.entries),
+        total(series.exits),
+        np.maximum.reduceat(series.max_count, starts),
+        np.minimum.reduceat(series.min_count, starts),
+        total(series.samples)
+    )
+
+def group_spans(series, grain):
+    """
+    เวลาแรกและเวลาสุดท้ายที่มีข้อมูลในแต่ละช่วงของ resample(series, grain)
+    
+    Returns:
+        tuple: (อาร์เรย์เวลาแรก, อาร์เรย์เวลาสุดท้าย)
+    """
+    series = _sorted(series)
+    starts = _group_starts(bucket_keys(series.timestamps, grain))
+    if len(starts) == 0:
+        return series.timestamps, series.timestamps
+    
+    ends = np.append(starts[1:], len(series.timestamps)) - 1
+    return series.timestamps[starts], series.timestamps[ends]
+
+def hour_of_day(timestamps):
+    """ชั่วโมงของวัน 0-23"""
+    return (timestamps // 3600) % 24
+
+def day_of_week(timestamps):
+    """วันในสัปดาห์ (0 = วันจันทร์)"""
+    return (timestamps // 86400 + 3) % 7
+
+def busiest(values):
+    """
+    ตำแหน่งของค่าที่มากที่สุด (ตำแหน่งแรกถ้ามีหลายตำแหน่ง)
+    
+    Returns:
+        int หรือ None ถ้าไม่มีข้อมูลหรือทุกค่าเป็น 0
+    """
+    if len(values) == 0:
+        return None
+    index = int(np.argmax(values))
+    return index if values[index] > 0 else None
+
+def percentiles(values, q=(50, 90, 95, 99)):
+    """
+    เปอร์เซ็นไทล์ของค่า (interpolation แบบ linear)
+    
+    Returns:
+        dict: {q: ค่า} หรือ dict ว่างถ้าไม่มีข้อมูล
+    """
+    if len(values) == 0:
+        return {}
+    return dict(zip(q, np.percentile(values, q).tolist()))
+
+def moving_average(values, window):
+    """
+    ค่าเฉลี่ยเคลื่อนที่ย้อนหลัง window ตำแหน่ง
+    
+    Returns:
+        อาร์เรย์ float64 ความยาวเท่ากับ values (ตำแหน่งที่ข้อมูลยังไม่ครบ window เป็น NaN)
+    """
+    if window < 1:
+        raise ValueError('window ต้องมากกว่า 0')
+    
+    result = np.full(len(values), np.nan)
+    if len(values) >= window:
+        cumulative = np.cumsum(np.asarray(values, dtype=np.float64))
+        cumulative[window:] = cumulative[window:] - cumulative[:-window]
+        result[window - 1:] = cumulative[window - 1:] / window
+    return result
+
+def lttb_indices(x, y, max_points):
+    """
+    เลือกจุดด้วย Largest-Triangle-Three-Buckets: แบ่งจุดตรงกลางเป็น max_points - 2 ช่วง
+    แล้วเลือกจุดในแต่ละช่วงที่สร้างสามเหลี่ยมใหญ่ที่สุดกับจุดที่เลือกก่อนหน้าและค่าเฉลี่ยของช่วงถัดไป
+    รูปร่างของกราฟจึงใกล้เคียงเดิมแม้จำนวนจุดลดลงมาก
+    
+    Args:
+        x: อาร์เรย์เวลา (เรียงแล้ว)
+        y: อาร์เรย์ค่า ความยาวเท่ากับ x
+        max_points: จำนวนจุดสูงสุด (ไม่น้อยกว่า MIN_DOWNSAMPLE_POINTS)
+    
+    Returns:
+        อาร์เรย์ตำแหน่งของจุดที่เลือก เรียงจากน้อยไปมาก (รวมจุดแรกและจุดสุดท้ายเสมอ)
+    """
+    count = len(y)
+    if count <= max_points:
+        return np.arange(count)
+    if max_points < MIN_DOWNSAMPLE_POINTS:
+        raise ValueError(f'max_points ต้องไม่น้อยกว่า {MIN_DOWNSAMPLE_POINTS}')
+    
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # ขอบเขตของแต่ละช่วงระหว่างจุดแรกและจุดสุดท้าย (ช่วงสุดท้ายของค่าเฉลี่ยคือจุดสุดท้าย)
+    edges = (np.arange(max_points - 1) * (count - 2) / (max_points - 2)).astype(np.intp) + 1
+    edges[-1] = count - 1
+    
+    selected = np.empty(max_points, dtype=np.intp)
+    selected[0], selected[-1] = 0, count - 1
+    previous = 0
+    for index in range(max_points - 2):
+        start, end = edges[index], edges[index + 1]
+        next_end = edges[index + 2] if index + 2 < len(edges) else count
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+        # สองเท่าของพื้นที่สามเหลี่ยม (ไม่ต้องหารสองเพราะใช้เปรียบเทียบเท่านั้น)
+        areas = np.abs(
+            (x[previous] - average_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[index + 1] = previous
+    return selected
+
+def minmax_indices(y, max_points):
+    """
+    เลือกจุดที่มีค่าต่ำสุดและสูงสุดของแต่ละช่วง (ยอดและจุดต่ำสุดของกราฟจึงไม่หายไป)
+    
+    Args:
+        y: อาร์เรย์ค่า
+        max_points: จำนวนจุดสูงสุด (ไม่น้อยกว่า MIN_DOWNSAMPLE_POINTS)
+    
+    Returns:
+        อาร์เรย์ตำแหน่งของจุดที่เลือก เรียงจากน้อยไปมาก (รวมจุดแรกและจุดสุดท้ายเสมอ)
+    """
+    count = len(y)
+    if count <= max_points:
+        return np.arange(count)
+    if max_points < MIN_DOWNSAMPLE_POINTS:
+        raise ValueError(f'max_points ต้องไม่น้อยกว่า {MIN_DOWNSAMPLE_POINTS}')
+    
+    y = np.asarray(y)
+    selected = [np.array([0, count - 1])]
+    for chunk in np.array_split(np.arange(1, count - 1), (max_points - 2) // 2):
+        values = y[chunk]
+        selected.append(chunk[[np.argmin(values), np.argmax(values)]])
+    return np.unique(np.concatenate(selected))
+
+def downsample_indices(x, y, max_points, method='lttb'):
+    """
+    ตำแหน่งของจุดที่เหลือหลังลดจำนวนจุดด้วย method (หนึ่งใน DOWNSAMPLE_METHODS)
+    
+    Raises:
+        ValueError: ถ้า method ไม่รองรับหรือ max_points น้อยเกินไป
+    """
+    if method == 'lttb':
+        return lttb_indices(x, y, max_points)
+    if method == 'minmax':
+        return minmax_indices(y, max_points)
+    raise ValueError(f"method ต้องเป็นหนึ่งใน {', '.join(DOWNSAMPLE_METHODS)}")
+
+def to_datetimes(timestamps):
+    """แปลงอาร์เรย์เวลาเป็นรายการ datetime"""
+    return timestamps.astype('datetime64[s]').astype(object).tolist()
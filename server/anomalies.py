@@ -0,0 +1,340 @@
+# server/anomalies.py - ตรวจจับกล้องที่ผิดปกติจากข้อมูลการนับที่ ingest บันทึกแล้ว
+"""
+แต่ละกล้องมีสถานะในหน่วยความจำขนาดคงที่ ข้อมูลการนับแต่ละรายการจึงใช้เวลา O(1) และไม่ต้อง query ฐานข้อมูล
+    
+    silent    ไม่มีข้อมูลเกิน silent_minutes นาทีระหว่างเวลาเปิดของสาขา (ตรวจตอนอ่านการแจ้งเตือน)
+    flatline  จำนวนคนไม่เปลี่ยนและไม่มีคนเข้า/ออกเลยนาน flatline_minutes นาทีระหว่างเวลาเปิด
+    jump      จำนวนคนเปลี่ยน หรือจำนวนคนเข้า/ออกในข้อมูลเดียว มากกว่า max_jump คน
+    drift     current_count ต่างจากค่าที่คำนวณจากคนเข้าลบคนออกสะสมของวันเกิน drift_threshold คน
+
+การแจ้งเตือน jump คงอยู่ alert_hold_minutes นาทีหลังเกิดครั้งล่าสุด ส่วนแบบอื่นหายไปเมื่อกล้องกลับมาปกติ
+สถานะไม่ถูกบันทึกลงฐานข้อมูล หลังเริ่มเซิร์ฟเวอร์ใหม่จะเริ่มจากค่าล่าสุดในตาราง camera_latest
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from server.db import get_session
+from models.branch import Branch
+from models.camera_latest import CameraLatest
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# ตัวตรวจจับที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+anomaly_detector = None
+
+# ประเภทการแจ้งเตือน
+ALERT_TYPES = ('silent', 'flatline', 'jump', 'drift')
+
+# เวลาเปิด/ปิดเมื่อสาขาไม่ได้กำหนดไว้ (ค่าเริ่มต้นเดียวกับโมเดล Branch)
+DEFAULT_HOURS = ('09:00', '20:00')
+
+def _parse_hours(open_time, close_time):
+    """แปลงเวลาเปิด/ปิด HH:MM เป็นนาทีนับจากเที่ยงคืน (None ถ้ารูปแบบไม่ถูกต้อง)"""
+    minutes = []
+    for value, default in zip((open_time, close_time), DEFAULT_HOURS):
+        try:
+            hour, minute = (value or default).split(':')[:2]
+            minutes.append(int(hour) * 60 + int(minute))
+        except (AttributeError, ValueError):
+            return None
+    return tuple(minutes)
+
+def _open_since(hours, timestamp):
+    """
+    เวลาที่สาขาเปิดในรอบปัจจุบัน
+    
+    Args:
+        hours: (นาทีที่เปิด, นาทีที่ปิด) ถ้าปิดก่อนเปิดถือว่าเปิดข้ามเที่ยงคืน และถ้าเท่ากันถือว่าเปิดตลอด
+        timestamp: เวลาที่ตรวจสอบ
+    
+    Returns:
+        datetime หรือ None ถ้าสาขาปิดอยู่ (datetime.min ถ้าเปิดตลอด)
+    """
+    if hours is None:
+        return None
+    
+    open_minute, close_minute = hours
+    if open_minute == close_minute:
+        return datetime.min
+    
+    midnight = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    minute = timestamp.hour * 60 + timestamp.minute
+    
+    if open_minute < close_minute:
+        if open_minute <= minute < close_minute:
+            return midnight + timedelta(minutes=open_minute)
+        return None
+    
+    if minute >= open_minute:
+        return midnight + timedelta(minutes=open_minute)
+    if minute < close_minute:
+        return midnight - timedelta(days=1) + timedelta(minutes=open_minute)
+    return None
+
+class _CameraState:
+    """สถานะของกล้องหนึ่งตัว"""
+    
+    __slots__ = ('branch_id', 'timestamp', 'count', 'flat_since', 'expected', 'expected_day', 'alerts')
+    
+    def __init__(self, branch_id):
+        self.branch_id = branch_id
+        self.timestamp = None     # เวลาของข้อมูลล่าสุด
+        self.count = None         # current_count ล่าสุด
+        self.flat_since = None    # เวลาที่จำนวนเริ่มไม่เปลี่ยน (นับเฉพาะเวลาเปิด)
+        self.expected = None      # current_count ที่คาดไว้จากคนเข้าลบคนออกสะสมของวัน
+        self.expected_day = None
+        self.alerts = {}          # ประเภท -> การแจ้งเตือนที่ยังไม่หาย
+
+class AnomalyDetector:
+    """
+    ตรวจจับกล้องที่หยุดส่งข้อมูล ค่าค้าง ค่ากระโดด หรือจำนวนคนไม่สอดคล้องกับคนเข้า/ออก
+    แบบ incremental จากข้อมูลที่ ingest บันทึกแล้ว
+    """
+    
+    def __init__(self, silent_minutes=15, flatline_minutes=120, max_jump=30,
+                 drift_threshold=10, alert_hold_minutes=60):
+        self.silent = timedelta(minutes=silent_minutes)
+        self.flatline = timedelta(minutes=flatline_minutes)
+        self.max_jump = max_jump
+        self.drift_threshold = drift_threshold
+        self.alert_hold = timedelta(minutes=alert_hold_minutes)
+        
+        self._cameras = {}
+        self._hours = {}  # branch_id -> (นาทีที่เปิด, นาทีที่ปิด)
+        self._lock = threading.Lock()
+    
+    def load(self, db):
+        """
+        โหลดเวลาเปิด/ปิดของสาขาและค่าล่าสุดของแต่ละกล้องจากฐานข้อมูล
+        
+        Args:
+            db: database session
+        """
+        branches = db.execute(select(Branch.branch_id, Branch.open_time, Branch.close_time)).all()
+        cameras = db.execute(
+            select(CameraLatest.camera_id, CameraLatest.branch_id,
+                   CameraLatest.current_count, CameraLatest.timestamp)
+        ).all()
+        
+        with self._lock:
+            self._hours = {
+                branch_id: _parse_hours(open_time, close_time)
+                for branch_id, open_time, close_time in branches
+            }
+            self._cameras = {}
+            for camera_id, branch_id, current_count, timestamp in cameras:
+                state = self._cameras[camera_id] = _CameraState(branch_id)
+                state.timestamp = state.flat_since = timestamp
+                state.count = state.expected = current_count
+                state.expected_day = timestamp.date()
+        
+        logger.info(f"โหลดสถานะการตรวจจับความผิดปกติของ {len(cameras)} กล้อง")
+    
+    def observe(self, records):
+        """
+        รับข้อมูลการนับที่บันทึกแล้ว และอัพเดตการแจ้งเตือนของกล้องที่เกี่ยวข้อง
+        
+        Args:
+            records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+        """
+        with self._lock:
+            for record in sorted(records, key=lambda record: record['timestamp'].replace(tzinfo=None)):
+                self._observe_locked(record)
+    
+    def _observe_locked(self, record):
+        """ตรวจข้อมูลการนับหนึ่งรายการ (ต้องถือ lock อยู่)"""
+        camera_id = record['camera_id']
+        timestamp = record['timestamp'].replace(tzinfo=None)
+        state = self._cameras.get(camera_id)
+        if state is None:
+            state = self._cameras[camera_id] = _CameraState(record['branch_id'])
+        elif state.timestamp is not None and timestamp < state.timestamp:
+            # ข้อมูลย้อนหลังไม่เปลี่ยนสถานะปัจจุบันของกล้อง
+            return
+        
+        state.branch_id = record['branch_id']
+        entries, exits, count = record['entry_count'], record['exit_count'], record['current_count']
+        
+        # ค่ากระโดด
+        change = abs(count - state.count) if state.count is not None else 0
+        if max(change, entries, exits) > self.max_jump:
+            self._raise(state, camera_id, 'jump', timestamp, {
+                'previous_count': state.count, 'current_count': count,
+                'entry_count': entries, 'exit_count': exits
+            })
+        elif 'jump' in state.alerts and timestamp - state.alerts['jump']['last_seen'] > self.alert_hold:
+            self._clear(state, camera_id, 'jump')
+        
+        # ค่าค้าง นับเฉพาะช่วงเวลาที่สาขาเปิด
+        opened = self._open_since(state.branch_id, timestamp)
+        if opened is None or entries or exits or count != state.count or state.flat_since is None:
+            state.flat_since = timestamp
+        elif state.flat_since < opened:
+            state.flat_since = opened
+        
+        if opened is not None and timestamp - state.flat_since >= self.flatline:
+            self._raise(state, camera_id, 'flatline', timestamp, {'current_count': count}, since=state.flat_since)
+        else:
+            self._clear(state, camera_id, 'flatline')
+        
+        # จำนวนคนเทียบกับคนเข้าลบคนออกสะสม (เริ่มนับใหม่ทุกวัน)
+        if state.expected is None or state.expected_day != timestamp.date():
+            state.expected = count
+            state.expected_day = timestamp.date()
+        else:
+            state.expected += entries - exits
+        
+        drift = count - state.expected
+        if abs(drift) > self.drift_threshold:
+            self._raise(state, camera_id, 'drift', timestamp, {
+                'current_count': count, 'expected_count': state.expected, 'drift': drift
+            })
+        else:
+            self._clear(state, camera_id, 'drift')
+        
+        state.timestamp = timestamp
+        state.count = count
+    
+    def _branch_hours(self, branch_id):
+        """เวลาเปิด/ปิดของสาขา (ค่าเริ่มต้นถ้ายังไม่รู้จักสาขา)"""
+        if branch_id in self._hours:
+            return self._hours[branch_id]
+        return _parse_hours(*DEFAULT_HOURS)
+    
+    def _open_since(self, branch_id, timestamp):
+        """เวลาที่สาขาเปิดในรอบปัจจุบัน (เวลาเปิด/ปิดเป็นเวลาท้องถิ่นของสาขา ส่วน timestamp และผลลัพธ์เป็นเวลาที่บันทึก)"""
+        local = get_timezones().to_local(timestamp, branch_id)
+        opened = _open_since(self._branch_hours(branch_id), local)
+        if opened is None or opened == datetime.min or local == timestamp:
+            return opened
+        return opened - (local - timestamp)
+    
+    def _raise(self, state, camera_id, alert_type, timestamp, detail, since=None):
+        """เพิ่มหรือต่ออายุการแจ้งเตือน (ต้องถือ lock อยู่)"""
+        alert = state.alerts.get(alert_type)
+        if alert is None:
+            alert = state.alerts[alert_type] = {'since': since or timestamp}
+            logger.warning(f"กล้อง {camera_id} ของสาขา {state.branch_id} ผิดปกติ ({alert_type}): {detail}")
+        alert['last_seen'] = timestamp
+        alert['detail'] = detail
+    
+    def _clear(self, state, camera_id, alert_type):
+        """ลบการแจ้งเตือนเมื่อกล้องกลับมาปกติ (ต้องถือ lock อยู่)"""
+        if state.alerts.pop(alert_type, None) is not None:
+            logger.info(f"กล้อง {camera_id} ของสาขา {state.branch_id} กลับมาปกติ ({alert_type})")
+    
+    def alerts(self, branch_id=None, alert_type=None, camera_id=None, now=None):
+        """
+        การแจ้งเตือนที่ยังไม่หาย
+        
+        Args:
+            branch_id: กรองตามสาขา (None = ทุกสาขา)
+            alert_type: กรองตามประเภท (None = ทุกประเภท)
+            camera_id: กรองตามกล้อง (None = ทุกกล้อง)
+            now: เวลาปัจจุบันในเขตเวลาที่บันทึก (None = เวลาปัจจุบัน)
+        
+        Returns:
+            list: dict ของการแจ้งเตือน เรียงตามเวลาที่เริ่มผิดปกติ
+        """
+        now = now or get_timezones().storage_now()
+        results = []
+        
+        with self._lock:
+            if camera_id is not None:
+                cameras = [(camera_id, self._cameras[camera_id])] if camera_id in self._cameras else []
+            else:
+                cameras = self._cameras.items()
+            
+            for current_camera, state in cameras:
+                if branch_id is not None and state.branch_id != branch_id:
+                    continue
+                
+                alerts = dict(state.alerts)
+                if 'jump' in alerts and now - alerts['jump']['last_seen'] > self.alert_hold:
+                    del alerts['jump']
+                
+                # กล้องที่เงียบตรวจจากเวลาของข้อมูลล่าสุด จึงไม่ต้องมีเธรดหรือ query เป็นระยะ
+                opened = self._open_since(state.branch_id, now)
+                if opened is not None and state.timestamp is not None:
+                    since = max(state.timestamp, opened)
+                    if now - since >= self.silent:
+                        alerts['silent'] = {
+                            'since': since, 'last_seen': now,
+                            'detail': {'last_data': state.timestamp.isoformat()}
+                        }
+                
+                for current_type, alert in alerts.items():
+                    if alert_type is not None and current_type != alert_type:
+                        continue
+                    results.append({
+                        'camera_id': current_camera,
+                        'branch_id': state.branch_id,
+                        'type': current_type,
+                        'since': alert['since'].isoformat(),
+                        'last_seen': alert['last_seen'].isoformat(),
+                        'detail': alert['detail']
+                    })
+        
+        results.sort(key=lambda alert: alert['since'])
+        return results
+    
+    def set_branch(self, branch_id, open_time, close_time):
+        """อัพเดตเวลาเปิด/ปิดหลังสร้างหรือแก้ไขสาขา"""
+        with self._lock:
+            self._hours[branch_id] = _parse_hours(open_time, close_time)
+    
+    def remove_branch(self, branch_id):
+        """ลบสาขาและกล้องของสาขาออกหลังลบสาขา"""
+        with self._lock:
+            self._hours.pop(branch_id, None)
+            self._cameras = {
+                camera_id: state for camera_id, state in self._cameras.items()
+                if state.branch_id != branch_id
+            }
+
+def init_anomalies(config):
+    """
+    เริ่มต้นตัวตรวจจับความผิดปกติของกล้องตามการตั้งค่าในส่วน [anomalies]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        AnomalyDetector หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global anomaly_detector
+    
+    if not config.getboolean('anomalies', 'enabled', fallback=True):
+        return None
+    
+    if anomaly_detector is not None:
+        return anomaly_detector
+    
+    detector = AnomalyDetector(
+        silent_minutes=config.getfloat('anomalies', 'silent_minutes', fallback=15),
+        flatline_minutes=config.getfloat('anomalies', 'flatline_minutes', fallback=120),
+        max_jump=config.getint('anomalies', 'max_jump', fallback=30),
+        drift_threshold=config.getint('anomalies', 'drift_threshold', fallback=10),
+        alert_hold_minutes=config.getfloat('anomalies', 'alert_hold_minutes', fallback=60)
+    )
+    
+    db = get_session()
+    try:
+        detector.load(db)
+    finally:
+        db.close()
+    
+    # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+    from server.ingest import add_commit_listener
+    add_commit_listener(detector.observe)
+    
+    anomaly_detector = detector
+    logger.info("เริ่มการตรวจจับความผิดปกติของกล้อง")
+    
+    return detector
+
+def get_anomaly_detector():
+    """คืนค่าตัวตรวจจับที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return anomaly_detector
@@ -13,7 +13,7 @@ def create_app(config):
     
     Args:
         config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
-        
+    
     Returns:
         แอปพลิเคชัน Flask ที่ตั้งค่าแล้ว
     """
@@ -27,6 +27,8 @@ def create_app(config):
     app.config["UPLOAD_FOLDER"] = config.get("app", "upload_folder")
     app.config["SNAPSHOT_FOLDER"] = config.get("app", "snapshot_folder")
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16 MB max upload
+    app.config["STREAM_CHUNK_ROWS"] = config.getint("ingest", "stream_chunk_rows", fallback=1000)
+    app.config["STREAM_MAX_LINE_BYTES"] = config.getint("ingest", "stream_max_line_bytes", fallback=65536)
     
     # ตั้งค่า CORS
     allowed_origins = config.get("server", "allowed_origins")
@@ -35,6 +37,10 @@ def create_app(config):
     # ตั้งค่า ProxyFix สำหรับการทำงานหลัง reverse proxy
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
     
+    # คลายการบีบอัดข้อมูลที่อุปกรณ์ส่งมา (gzip/deflate/zstd)
+    from api.middleware.compression import init_decompression
+    init_decompression(app, config)
+    
     # ลงทะเบียน blueprints
     register_blueprints(app)
     
@@ -44,6 +50,46 @@ def create_app(config):
     # ลงทะเบียน hooks
     register_hooks(app)
     
+    # เริ่มต้นเขตเวลาของระบบและของสาขา (ใช้แปลงเวลาที่รับเข้าและขอบเขตของวัน)
+    from server.timezones import init_timezones
+    init_timezones(config)
+    
+    # เริ่มต้นการคำนวณ visitor-minutes ในตารางสรุประหว่างรับข้อมูล (ถ้าเปิดใช้งาน)
+    from server.utilisation import init_utilisation
+    init_utilisation(config)
+    
+    # เริ่มต้นทะเบียนจำนวนลูกค้าปัจจุบันในหน่วยความจำ (ถ้าเปิดใช้งาน)
+    from server.occupancy import init_occupancy
+    init_occupancy(config)
+    
+    # เริ่มต้นโปรไฟล์รายชั่วโมงของสัปดาห์สำหรับการพยากรณ์ (ถ้าเปิดใช้งาน)
+    from server.forecast import init_forecast
+    init_forecast(config)
+    
+    # เริ่มต้นการตรวจจับกล้องที่ผิดปกติ (ถ้าเปิดใช้งาน)
+    from server.anomalies import init_anomalies
+    init_anomalies(config)
+    
+    # เริ่มต้นที่เก็บ quantile sketch สำหรับ /traffic/percentiles (ถ้าเปิดใช้งาน)
+    from server.sketches import init_sketches
+    init_sketches(config)
+    
+    # เริ่มต้นการติดตามการเปลี่ยนแปลงข้อมูลสำหรับ ETag/Last-Modified (ถ้าเปิดใช้งาน)
+    from server.watermarks import init_watermarks
+    init_watermarks(config)
+    
+    # เริ่มต้นคลังข้อมูลการนับเก่าและการย้ายข้อมูลเป็นระยะ (ถ้าเปิดใช้งาน)
+    from server.archive import init_archive
+    init_archive(config)
+    
+    # เริ่มต้นแคชผลลัพธ์รายงาน (ถ้าเปิดใช้งาน)
+    from server.report_cache import init_report_cache
+    init_report_cache(config)
+    
+    # เริ่มต้นคิวบันทึกข้อมูลการนับลูกค้า (ถ้าเปิดใช้งาน)
+    from server.ingest_queue import init_ingest_queue
+    init_ingest_queue(config)
+    
     logger.info("สร้างแอปพลิเคชัน Flask เสร็จสมบูรณ์")
     
     return app
@@ -98,6 +144,10 @@ def register_error_handlers(app):
     def method_not_allowed(error):
         return jsonify({"error": "Method Not Allowed", "message": "The method is not allowed for the requested URL"}), 405
     
+    @app.errorhandler(413)
+    def request_entity_too_large(error):
+        return jsonify({"error": "Request Entity Too Large", "message": str(error)}), 413
+    
     @app.errorhandler(500)
     def internal_server_error(error):
         logger.error(f"Internal Server Error: {error}")
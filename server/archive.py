@@ -0,0 +1,449 @@
+# server/archive.py - ย้ายข้อมูลการนับเก่าออกจากฐานข้อมูลไปเก็บเป็นไฟล์ columnar (.npy) และอ่านด้วย memory map
+"""
+ข้อมูลการนับที่เก่ากว่า [analytics] retention_days ถูกย้ายออกจากตาราง customer_counts
+ไปเก็บทีละสาขาทีละเดือนที่ <path>/<branch_id>/<YYYY-MM>/<segment>/
+    
+    timestamp.npy      int64 จำนวนไมโครวินาทีนับจาก 1970-01-01 (เรียงจากน้อยไปมาก)
+    camera.npy         int16 ตำแหน่งของกล้องใน meta.json
+    entry_count.npy    int32
+    exit_count.npy     int32
+    current_count.npy  int32
+    meta.json          branch_id, เดือน, จำนวนแถว, รายชื่อกล้อง
+
+ไฟล์ .npy ไม่บีบอัดเพื่อให้เปิดด้วย np.load(mmap_mode='r') ได้ การอ่านช่วงเวลาจึงใช้ searchsorted
+บนไฟล์ timestamp แล้วคัดลอกเฉพาะแถวที่ต้องการ โดยไม่ต้องโหลดทั้งไฟล์เข้าหน่วยความจำ
+
+ตารางสรุป (rollups) ไม่ถูกย้าย รายงานและ /traffic/history จึงอ่านข้อมูลเก่าได้ตามปกติ
+ส่วนการอ่านข้อมูลการนับทุกรายการ (load_series แบบ raw และ --backfill-rollups) จะรวมข้อมูลจากไฟล์ให้อัตโนมัติ
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+import numpy as np
+from sqlalchemy import select, delete, func
+from models.customer_count import CustomerCount
+from server.db import get_session
+from server.timebucket import time_bucket
+from server.partitions import get_partitions, month_start, next_month
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# คลังข้อมูลที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+cold_archive = None
+
+# คอลัมน์ที่เก็บในแต่ละ segment และชนิดข้อมูล
+ARCHIVE_COLUMNS = {
+    'timestamp': np.int64,
+    'camera': np.int16,
+    'entry_count': np.int32,
+    'exit_count': np.int32,
+    'current_count': np.int32
+}
+
+# จำนวนแถวที่อ่านจากฐานข้อมูลต่อครั้งระหว่างย้ายข้อมูล
+ARCHIVE_FETCH_SIZE = 10000
+
+# ข้อมูลที่อ่านจากคลัง: camera เป็นตำแหน่งใน camera_ids
+ArchivedCounts = namedtuple(
+    'ArchivedCounts', ('timestamps', 'camera_ids', 'cameras', 'entry_count', 'exit_count', 'current_count')
+)
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+def to_microseconds(timestamp):
+    """แปลง datetime (ไม่มี timezone) เป็นจำนวนไมโครวินาทีนับจาก 1970-01-01"""
+    return (timestamp.replace(tzinfo=None) - _EPOCH) // _ONE_MICROSECOND
+
+def from_microseconds(value):
+    """แปลงจำนวนไมโครวินาทีนับจาก 1970-01-01 เป็น datetime"""
+    return _EPOCH + timedelta(microseconds=int(value))
+
+def _empty_counts():
+    return ArchivedCounts(np.empty(0, dtype=np.int64), [], *(
+        np.empty(0, dtype=ARCHIVE_COLUMNS[name]) for name in ('camera', 'entry_count', 'exit_count', 'current_count')
+    ))
+
+class ColdArchive:
+    """คลังข้อมูลการนับเก่าบนดิสก์ (หนึ่งไดเรกทอรีต่อสาขา หนึ่งไดเรกทอรีย่อยต่อเดือน)"""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def _branch_path(self, branch_id):
+        # เข้ารหัสรหัสสาขาให้ใช้เป็นชื่อไดเรกทอรีได้อย่างปลอดภัย (รวมถึง '.' และ '/')
+        return os.path.join(self.path, quote(branch_id, safe='').replace('.', '%2E'))
+    
+    def _month_path(self, branch_id, month):
+        return os.path.join(self._branch_path(branch_id), month.strftime('%Y-%m'))
+    
+    def branches(self):
+        """รหัสสาขาที่มีข้อมูลในคลัง"""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(unquote(name) for name in os.listdir(self.path) if not name.startswith('.'))
+    
+    def months(self, branch_id):
+        """เดือนที่มีข้อมูลของสาขาในคลัง (datetime ของวันแรกของเดือน เรียงจากเก่าไปใหม่)"""
+        path = self._branch_path(branch_id)
+        if not os.path.isdir(path):
+            return []
+        return sorted(
+            datetime.strptime(name, '%Y-%m') for name in os.listdir(path)
+            if len(name) == 7 and not name.startswith('.')
+        )
+    
+    def first_month(self):
+        """เดือนแรกที่มีข้อมูลในคลัง (None ถ้าคลังว่าง)"""
+        firsts = [months[0] for months in map(self.months, self.branches()) if months]
+        return min(firsts) if firsts else None
+    
+    def _segments(self, branch_id, month):
+        path = self._month_path(branch_id, month)
+        if not os.path.isdir(path):
+            return []
+        return [
+            os.path.join(path, name) for name in sorted(os.listdir(path))
+            if not name.startswith('.')
+        ]
+    
+    def read(self, branch_id, start, end):
+        """
+        อ่านข้อมูลการนับของสาขาในช่วง [start, end) จากคลัง
+        
+        Returns:
+            ArchivedCounts: เรียงตามเวลา
+        """
+        start_us, end_us = to_microseconds(start), to_microseconds(end)
+        camera_index = {}
+        parts = []
+        
+        month = month_start(start)
+        while month < end:
+            for segment in self._segments(branch_id, month):
+                with open(os.path.join(segment, 'meta.json'), encoding='utf-8') as f:
+                    meta = json.load(f)
+                
+                timestamps = np.load(os.path.join(segment, 'timestamp.npy'), mmap_mode='r')
+                low, high = np.searchsorted(timestamps, [start_us, end_us])
+                if low == high:
+                    continue
+                
+                columns = {
+                    name: np.array(np.load(os.path.join(segment, f'{name}.npy'), mmap_mode='r')[low:high])
+                    for name in ARCHIVE_COLUMNS
+                }
+                
+                # แปลงตำแหน่งกล้องของ segment เป็นตำแหน่งในผลลัพธ์รวม
+                mapping = np.array([
+                    camera_index.setdefault(camera_id, len(camera_index)) for camera_id in meta['cameras']
+                ], dtype=np.int16)
+                columns['camera'] = mapping[columns['camera']]
+                parts.append(columns)
+            month = next_month(month)
+        
+        camera_ids = sorted(camera_index, key=camera_index.get)
+        if not parts:
+            return _empty_counts()
+        
+        merged = {name: np.concatenate([part[name] for part in parts]) for name in ARCHIVE_COLUMNS}
+        if len(parts) > 1:
+            order = np.argsort(merged['timestamp'], kind='stable')
+            merged = {name: column[order] for name, column in merged.items()}
+        
+        return ArchivedCounts(
+            merged['timestamp'], camera_ids, merged['camera'],
+            merged['entry_count'], merged['exit_count'], merged['current_count']
+        )
+    
+    def iter_records(self, start, end):
+        """
+        ข้อมูลการนับของทุกสาขาในช่วง [start, end) ในรูปแบบเดียวกับ parse_count
+        
+        Returns:
+            iterator: dict ของแต่ละรายการ
+        """
+        for branch_id in self.branches():
+            counts = self.read(branch_id, start, end)
+            for timestamp, camera, entry_count, exit_count, current_count in zip(
+                counts.timestamps.tolist(), counts.cameras.tolist(), counts.entry_count.tolist(),
+                counts.exit_count.tolist(), counts.current_count.tolist()
+            ):
+                yield {
+                    'branch_id': branch_id,
+                    'camera_id': counts.camera_ids[camera],
+                    'timestamp': from_microseconds(timestamp),
+                    'entry_count': entry_count,
+                    'exit_count': exit_count,
+                    'current_count': current_count
+                }
+    
+    def write_segment(self, branch_id, month, name, columns, camera_ids):
+        """
+        เขียน segment ใหม่ลงในไดเรกทอรีชั่วคราว
+        
+        Returns:
+            tuple: (ไดเรกทอรีชั่วคราว, ไดเรกทอรีปลายทาง) ให้ผู้เรียก rename เมื่อพร้อม
+        """
+        month_path = self._month_path(branch_id, month)
+        os.makedirs(month_path, exist_ok=True)
+        
+        final_path = os.path.join(month_path, name)
+        temp_path = os.path.join(month_path, f'.{name}.tmp')
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        
+        for column, dtype in ARCHIVE_COLUMNS.items():
+            np.save(os.path.join(temp_path, f'{column}.npy'), np.ascontiguousarray(columns[column], dtype=dtype))
+        
+        with open(os.path.join(temp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'branch_id': branch_id,
+                'month': month.strftime('%Y-%m'),
+                'rows': int(len(columns['timestamp'])),
+                'cameras': camera_ids
+            }, f, ensure_ascii=False)
+        
+        return temp_path, final_path
+
+def _load_month(db, counts, branch_id, start, end, max_id=None):
+    """อ่านข้อมูลการนับของสาขาในช่วงเวลาจากตาราง counts เป็นอาร์เรย์ (เรียงตามเวลา)"""
+    statement = select(
+        counts.c.id, counts.c.camera_id, counts.c.timestamp,
+        counts.c.entry_count, counts.c.exit_count, counts.c.current_count
+    ).where(
+        counts.c.branch_id == branch_id,
+        counts.c.timestamp >= start,
+        counts.c.timestamp < end
+    )
+    if max_id is not None:
+        statement = statement.where(counts.c.id <= max_id)
+    
+    result = db.execute(
+        statement
+        .order_by(counts.c.timestamp, counts.c.id)
+        .execution_options(yield_per=ARCHIVE_FETCH_SIZE)
+    )
+    
+    camera_index = {}
+    chunks = {name: [] for name in ARCHIVE_COLUMNS}
+    ids = []
+    
+    for partition in result.partitions():
+        columns = list(zip(*partition))
+        ids.append(np.array(columns[0], dtype=np.int64))
+        chunks['camera'].append(np.array(
+            [camera_index.setdefault(camera_id, len(camera_index)) for camera_id in columns[1]], dtype=np.int16
+        ))
+        chunks['timestamp'].append(np.fromiter(map(to_microseconds, columns[2]), dtype=np.int64, count=len(partition)))
+        for name, values in zip(('entry_count', 'exit_count', 'current_count'), columns[3:]):
+            chunks[name].append(np.array([value or 0 for value in values], dtype=np.int32))
+    
+    if not ids:
+        return None, None, None
+    
+    ids = np.concatenate(ids)
+    columns = {name: np.concatenate(parts) for name, parts in chunks.items()}
+    return ids, columns, sorted(camera_index, key=camera_index.get)
+
+def archive_counts(db, archive, before):
+    """
+    ย้ายข้อมูลการนับที่เก่ากว่า before ไปเก็บในคลัง ทีละสาขาทีละเดือน
+    
+    แต่ละเดือนถูกเขียนเป็น segment ใหม่ แล้วลบออกจากฐานข้อมูลใน transaction ของเดือนนั้น
+    ข้อมูลที่เข้ามาระหว่างทำงานจะไม่ถูกย้าย (จำกัดด้วย id สูงสุดตอนเริ่ม)
+    
+    Args:
+        db: database session
+        archive: ColdArchive
+        before: ย้ายเฉพาะเดือนที่สิ้นสุดก่อนหรือเท่ากับเวลานี้ (ปัดลงเป็นวันแรกของเดือน)
+    
+    Returns:
+        dict: months (จำนวนเดือนที่ย้าย) และ records (จำนวนข้อมูลการนับที่ย้าย)
+    """
+    before = month_start(before)
+    partitions = get_partitions()
+    if partitions is not None:
+        return _archive_partitions(db, archive, partitions, before)
+    
+    counts = CustomerCount.__table__
+    result = {'months': 0, 'records': 0}
+    
+    max_id = db.execute(select(func.max(counts.c.id))).scalar()
+    if max_id is None:
+        return result
+    
+    month = time_bucket('month', counts.c.timestamp)
+    groups = db.execute(
+        select(counts.c.branch_id, month)
+        .where(counts.c.timestamp < before, counts.c.id <= max_id)
+        .group_by(counts.c.branch_id, month)
+        .order_by(counts.c.branch_id, month)
+    ).all()
+    
+    for branch_id, start in groups:
+        end = next_month(start)
+        ids, columns, camera_ids = _load_month(db, counts, branch_id, start, end, max_id)
+        if ids is None:
+            continue
+        
+        # ชื่อ segment มาจากช่วง id จึงไม่ซ้ำกับ segment ของการย้ายครั้งก่อน
+        name = f'{int(ids.min()):012d}-{int(ids.max()):012d}'
+        temp_path, final_path = archive.write_segment(branch_id, start, name, columns, camera_ids)
+        
+        try:
+            db.execute(delete(counts).where(
+                counts.c.branch_id == branch_id,
+                counts.c.timestamp >= start,
+                counts.c.timestamp < end,
+                counts.c.id <= max_id
+            ))
+            if os.path.exists(final_path):
+                # segment เดียวกันถูกเขียนไว้แล้วจากการทำงานครั้งก่อนที่ลบข้อมูลไม่สำเร็จ
+                shutil.rmtree(temp_path)
+            else:
+                os.rename(temp_path, final_path)
+            db.commit()
+        except Exception:
+            db.rollback()
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        
+        result['months'] += 1
+        result['records'] += len(ids)
+        logger.info(f"ย้ายข้อมูลการนับของสาขา {branch_id} เดือน {start:%Y-%m} ไปยังคลัง {len(ids)} รายการ")
+    
+    return result
+
+def _archive_partitions(db, archive, partitions, before):
+    """
+    ย้ายพาร์ทิชันของเดือนที่เก่ากว่า before ไปเก็บในคลัง แล้วลบทั้งตาราง
+    
+    พาร์ทิชันถูกแยกออก (เปลี่ยนชื่อ) ก่อน ข้อมูลของเดือนนั้นที่เข้ามาระหว่างทำงานจึงไปอยู่ในพาร์ทิชันใหม่
+    ตารางที่ถูกแยกไว้แล้วจากการทำงานครั้งก่อนที่ไม่สำเร็จจะถูกย้ายต่อด้วยชื่อ segment เดิม
+    """
+    result = {'months': 0, 'records': 0}
+    
+    for month in partitions.months(refresh=True):
+        if month < before:
+            partitions.detach(db, month)
+    
+    for month, table, name in partitions.detached():
+        branch_ids = db.execute(select(table.c.branch_id).distinct().order_by(table.c.branch_id)).scalars().all()
+        # ชื่อ segment ขึ้นต้นด้วยเวลาที่แยกพาร์ทิชัน เพราะ id ของแต่ละพาร์ทิชันเริ่มนับใหม่
+        prefix = name.rsplit('_a', 1)[1]
+        
+        segments = []
+        try:
+            for branch_id in branch_ids:
+                ids, columns, camera_ids = _load_month(db, table, branch_id, month, next_month(month))
+                if ids is None:
+                    continue
+                segment = f'{prefix}-{int(ids.min()):012d}-{int(ids.max()):012d}'
+                segments.append((branch_id, len(ids)) + archive.write_segment(branch_id, month, segment, columns, camera_ids))
+            
+            for _, _, temp_path, final_path in segments:
+                if os.path.exists(final_path):
+                    shutil.rmtree(temp_path)
+                else:
+                    os.rename(temp_path, final_path)
+        except Exception:
+            db.rollback()
+            for _, _, temp_path, _ in segments:
+                shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        
+        # ข้อมูลทั้งเดือนอยู่ในคลังแล้ว ลบทั้งตารางแทนการ DELETE ทีละแถว
+        partitions.drop(db, name)
+        
+        for branch_id, records, _, _ in segments:
+            result['months'] += 1
+            result['records'] += records
+            logger.info(f"ย้ายข้อมูลการนับของสาขา {branch_id} เดือน {month:%Y-%m} ไปยังคลัง {records} รายการ")
+    
+    return result
+
+def archive_cutoff(config, now=None):
+    """เวลาที่ข้อมูลก่อนหน้านั้นถูกย้ายไปคลัง ตาม [analytics] retention_days (ปัดลงเป็นวันแรกของเดือน)"""
+    retention_days = config.getint('analytics', 'retention_days', fallback=90)
+    return month_start((now or get_timezones().storage_now()) - timedelta(days=retention_days))
+
+class ArchiveJob:
+    """เธรดที่ย้ายข้อมูลเก่าไปคลังเป็นระยะ"""
+    
+    def __init__(self, archive, config, interval):
+        self.archive = archive
+        self.config = config
+        self.interval = interval
+        
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def run_once(self):
+        """ย้ายข้อมูลหนึ่งรอบ"""
+        db = get_session()
+        try:
+            return archive_counts(db, self.archive, archive_cutoff(self.config))
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการย้ายข้อมูลไปคลัง: {str(e)}")
+            return None
+        finally:
+            db.close()
+    
+    def start(self):
+        """เริ่มเธรด"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='count-archiver', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """หยุดเธรด"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_once()
+
+def init_archive(config, start_job=True):
+    """
+    เริ่มต้นคลังข้อมูลการนับเก่าตามการตั้งค่าในส่วน [archive]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+        start_job: เริ่มเธรดย้ายข้อมูลเป็นระยะ (ถ้า interval_hours มากกว่า 0)
+    
+    Returns:
+        ColdArchive หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global cold_archive
+    
+    if not config.getboolean('archive', 'enabled', fallback=True):
+        return None
+    
+    if cold_archive is not None:
+        return cold_archive
+    
+    path = config.get('archive', 'path', fallback='') or os.path.join(config.get('database', 'path'), 'archive')
+    cold_archive = ColdArchive(path)
+    
+    interval_hours = config.getfloat('archive', 'interval_hours', fallback=24)
+    if start_job and interval_hours > 0:
+        ArchiveJob(cold_archive, config, interval_hours * 3600).start()
+    
+    logger.info(f"เริ่มคลังข้อมูลการนับเก่าที่ {path}")
+    
+    return cold_archive
+
+def get_archive():
+    """คืนค่าคลังข้อมูลที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return cold_archive
@@ -12,7 +12,7 @@ def load_config(config_path):
     
     Args:
         config_path: พาธไปยังไฟล์การตั้งค่า
-        
+    
     Returns:
         อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
     """
@@ -70,6 +70,7 @@ def initialize_config(config_path):
         'company': 'Your Company',
         'logo_path': 'web/static/images/logo.png',
         'timezone': 'Asia/Bangkok',
+        'storage_timezone': '',  # เขตเวลาของเวลาที่บันทึกในฐานข้อมูล (ว่าง = timezone) ห้ามเปลี่ยนหลังมีข้อมูลแล้ว
         'language': 'th',
         'upload_folder': 'uploads',
         'snapshot_folder': 'snapshots',
@@ -108,6 +109,90 @@ def initialize_config(config_path):
         'retention_days': '90'
     }
     
+    # ส่วนของการรับข้อมูลจากกล้อง
+    config['ingest'] = {
+        'mode': 'direct',  # direct = บันทึกทันที, queued = เข้าคิวแล้วบันทึกเป็นกลุ่ม
+        'queue_size': '10000',
+        'flush_interval_ms': '500',
+        'flush_max_rows': '500',
+        'durability': 'async',  # async = ตอบ 202 ทันที, sync = รอจน commit
+        'sync_timeout': '10',
+        'stream_chunk_rows': '1000',  # จำนวนรายการต่อการ commit ของ /traffic/stream
+        'stream_max_line_bytes': '65536'
+    }
+    
+    # ส่วนของจำนวนลูกค้าปัจจุบันในหน่วยความจำ
+    config['occupancy'] = {
+        'enabled': 'true',
+        'fusion': 'sum',  # sum = รวมทุกกล้อง, max = ใช้ค่าสูงสุด (กล้องมองพื้นที่เดียวกัน)
+        'persist_interval': '5',  # บันทึกลงตาราง branches ทุกกี่วินาที
+        'persist_min_change': '5',  # บันทึกทันทีเมื่อจำนวนเปลี่ยนไปอย่างน้อยกี่คน
+        'branch_refresh_interval': '30'  # อ่านรายการสาขาจากตาราง branches ทุกกี่วินาที (0 = ไม่อ่าน)
+    }
+    
+    # ส่วนของแคชผลลัพธ์รายงาน
+    config['report_cache'] = {
+        'enabled': 'true',
+        'max_entries': '512',
+        'max_size_mb': '64',  # ขนาดรวมสูงสุดของรายงานในแคช
+        'open_ttl': '60'  # อายุสูงสุด (วินาที) ของรายงานที่ช่วงเวลายังไม่ปิด
+    }
+    
+    # ส่วนของ conditional GET (ETag / Last-Modified / 304)
+    config['http_cache'] = {
+        'enabled': 'true'
+    }
+    
+    # ส่วนของคลังข้อมูลการนับเก่า (ย้ายข้อมูลที่เก่ากว่า analytics.retention_days)
+    config['archive'] = {
+        'enabled': 'true',
+        'path': '',  # ว่าง = <database.path>/archive
+        'interval_hours': '24'  # ย้ายข้อมูลทุกกี่ชั่วโมง (0 = เฉพาะ python main.py --archive-counts)
+    }
+    
+    # ส่วนของการแบ่งตาราง customer_counts เป็นพาร์ทิชันรายเดือน
+    # เปิดเฉพาะการติดตั้งใหม่ที่สร้างไฟล์การตั้งค่านี้ (ยังไม่มีข้อมูลการนับที่ต้องย้าย)
+    config['partitions'] = {
+        'enabled': 'true'
+    }
+    
+    # ส่วนของโปรไฟล์รายชั่วโมงของสัปดาห์สำหรับ /traffic/forecast
+    config['forecast'] = {
+        'enabled': 'true',
+        'half_life_weeks': '4',  # น้ำหนักของข้อมูลเก่าลดลงครึ่งหนึ่งทุกกี่สัปดาห์
+        'late_minutes': '15',  # รอข้อมูลที่มาช้าของกล้องอื่นกี่นาทีหลังจบชั่วโมง ก่อนรวมชั่วโมงนั้นเข้าโปรไฟล์
+        'persist_interval': '60'  # บันทึกโปรไฟล์ที่เปลี่ยนลงฐานข้อมูลทุกกี่วินาที
+    }
+    
+    # ส่วนของผลรวมจำนวนคนตามเวลา (visitor-minutes) และเวลาที่ใกล้เต็มความจุในตารางสรุป
+    config['utilisation'] = {
+        'enabled': 'true',
+        'busy_threshold_pct': '80',  # นับเวลาที่จำนวนคนไม่น้อยกว่ากี่ % ของความจุสาขา
+        'max_gap_minutes': '15'  # ช่วงระหว่างข้อมูลที่ยาวกว่านี้นับเฉพาะกี่นาทีสุดท้าย
+    }
+    
+    # ส่วนของการตรวจจับกล้องที่ผิดปกติสำหรับ /devices/alerts
+    config['anomalies'] = {
+        'enabled': 'true',
+        'silent_minutes': '15',  # แจ้งเตือนเมื่อกล้องไม่ส่งข้อมูลนานกี่นาทีระหว่างเวลาเปิด
+        'flatline_minutes': '120',  # แจ้งเตือนเมื่อจำนวนไม่เปลี่ยนเลยนานกี่นาทีระหว่างเวลาเปิด
+        'max_jump': '30',  # จำนวนคนที่เปลี่ยนได้มากที่สุดในข้อมูลเดียว
+        'drift_threshold': '10',  # ผลต่างสูงสุดระหว่าง current_count กับคนเข้าลบคนออกสะสมของวัน
+        'alert_hold_minutes': '60'  # การแจ้งเตือนค่ากระโดดคงอยู่กี่นาที
+    }
+    
+    # ส่วนของ quantile sketch รายวันสำหรับ /traffic/percentiles
+    config['sketches'] = {
+        'enabled': 'true',
+        'relative_accuracy': '0.01'  # ความคลาดเคลื่อนสัมพัทธ์สูงสุดของค่าที่ประมาณได้
+    }
+    
+    # ส่วนของการรับข้อมูลแบบบีบอัด (Content-Encoding: gzip/deflate/zstd)
+    config['compression'] = {
+        'enabled': 'true',
+        'max_stream_decoded_mb': '256'  # ขนาดสูงสุดหลังคลายการบีบอัดของ /traffic/stream
+    }
+    
     # บันทึกการตั้งค่า
     try:
         with open(config_path, 'w', encoding='utf-8') as f:
@@ -142,7 +227,7 @@ def get_database_uri(config):
     
     Args:
         config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่าฐานข้อมูล
-        
+    
     Returns:
         URI สำหรับเชื่อมต่อฐานข้อมูล
     """
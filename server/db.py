@@ -64,6 +64,8 @@ def create_tables(config):
     from models.employee import Employee
     from models.appointment import Appointment
     from models.customer_count import CustomerCount
+    from models.camera_latest import CameraLatest
+    from models.traffic_rollup import TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay
     
     # สร้างตารางทั้งหมด
     Base.metadata.create_all(bind=engine)
@@ -0,0 +1,393 @@
+# server/forecast.py - โปรไฟล์รายชั่วโมงของสัปดาห์ของแต่ละสาขา สำหรับพยากรณ์จำนวนลูกค้าในชั่วโมงถัดไป
+"""
+แต่ละสาขามี 168 ช่อง (ชั่วโมงของสัปดาห์ 0 = วันจันทร์ 00:00) เก็บค่าเฉลี่ยและความแปรปรวนของ
+    
+    entries    จำนวนคนเข้าทั้งชั่วโมง (รวมทุกกล้อง)
+    occupancy  จำนวนคนสูงสุดระหว่างชั่วโมง (max_count ของกล้องที่สูงที่สุด แบบเดียวกับ peak ของ /traffic/history)
+
+ข้อมูลการนับใหม่จาก ingest ถูกสะสมในชั่วโมงที่ยังไม่ปิดของสาขา เมื่อได้รับข้อมูลที่เลยท้ายชั่วโมงไปแล้ว
+มากกว่า lateness (รอข้อมูลที่มาช้าของกล้องอื่นในสาขา) ชั่วโมงนั้นจะถูกรวมเข้าช่องของมันแบบ exponential decay
+(น้ำหนักของข้อมูลลดลงครึ่งหนึ่งทุก half_life_weeks สัปดาห์)
+การพยากรณ์จึงอ่านค่าจากหน่วยความจำโดยไม่ query ข้อมูลการนับ และช่องที่เปลี่ยนถูกบันทึกลงตาราง
+forecast_profiles เป็นระยะ เริ่มเซิร์ฟเวอร์ใหม่จึงไม่ต้องคำนวณใหม่ทั้งหมด
+
+ชั่วโมงที่ไม่มีข้อมูลเลย (เช่นสาขาปิดหรืออุปกรณ์ออฟไลน์) จะไม่ถูกรวม และข้อมูลของชั่วโมงที่รวมไปแล้วจะถูกข้าม
+"""
+import atexit
+import logging
+import threading
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.exc import SQLAlchemyError
+from server.db import get_session
+from models.forecast_profile import ForecastProfile
+from models.traffic_rollup import TrafficRollupHour
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# ทะเบียนโปรไฟล์ที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+forecast_profiles = None
+
+# จำนวนช่องต่อสาขา (ชั่วโมงของสัปดาห์)
+SLOTS = 7 * 24
+
+# ค่าที่เก็บในแต่ละช่อง (ลำดับเดียวกับแถวของอาร์เรย์ values)
+PROFILE_FIELDS = ('entries_mean', 'entries_var', 'occupancy_mean', 'occupancy_var')
+
+# จำนวนชั่วโมงสูงสุดที่พยากรณ์ได้ต่อคำขอ
+MAX_FORECAST_HOURS = SLOTS
+
+def hour_of_week(timestamp):
+    """ช่องของเวลา (0 = วันจันทร์ 00:00 ถึง 167 = วันอาทิตย์ 23:00)"""
+    return timestamp.weekday() * 24 + timestamp.hour
+
+def _hour_start(timestamp):
+    return timestamp.replace(tzinfo=None, minute=0, second=0, microsecond=0)
+
+class _BranchProfile:
+    """โปรไฟล์และชั่วโมงที่กำลังสะสมของสาขาหนึ่ง"""
+    
+    __slots__ = ('values', 'samples', 'last_buckets', 'last_folded', 'dirty', 'open_hours', 'newest')
+    
+    def __init__(self):
+        self.values = np.zeros((len(PROFILE_FIELDS), SLOTS))
+        self.samples = np.zeros(SLOTS, dtype=np.int64)
+        self.last_buckets = [None] * SLOTS
+        self.last_folded = None  # ชั่วโมงล่าสุดที่รวมแล้ว (ข้อมูลของชั่วโมงนี้หรือก่อนหน้าจะถูกข้าม)
+        self.dirty = set()       # ช่องที่ยังไม่ได้บันทึกลงฐานข้อมูล
+        self.open_hours = {}     # ต้นชั่วโมง -> [entries, peak] ของชั่วโมงที่ยังไม่ได้รวม
+        self.newest = None       # เวลาของข้อมูลล่าสุดที่ได้รับ
+
+class ForecastProfiles:
+    """
+    โปรไฟล์รายชั่วโมงของสัปดาห์ของทุกสาขาในหน่วยความจำ อัพเดตแบบ incremental จากข้อมูลที่ ingest บันทึกแล้ว
+    """
+    
+    def __init__(self, half_life_weeks=4.0, lateness_seconds=900.0, persist_interval=60.0):
+        if half_life_weeks <= 0:
+            raise ValueError('half_life_weeks ต้องมากกว่า 0')
+        if lateness_seconds < 0:
+            raise ValueError('lateness_seconds ต้องไม่ติดลบ')
+        
+        self.half_life_weeks = half_life_weeks
+        # แต่ละช่องถูกรวมสัปดาห์ละครั้ง น้ำหนักของค่าเดิมจึงเหลือครึ่งหนึ่งหลัง half_life_weeks ครั้ง
+        self.alpha = 1 - 0.5 ** (1 / half_life_weeks)
+        # ชั่วโมงถูกรวมเมื่อได้รับข้อมูลที่เลยท้ายชั่วโมงไปแล้วเกินช่วงนี้
+        self.lateness = timedelta(seconds=lateness_seconds)
+        self.persist_interval = persist_interval
+        
+        self._branches = {}
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def load(self, db):
+        """
+        โหลดโปรไฟล์ที่บันทึกไว้จากฐานข้อมูล
+        
+        Args:
+            db: database session
+        """
+        table = ForecastProfile.__table__
+        rows = db.execute(select(
+            table.c.branch_id, table.c.slot, *(table.c[field] for field in PROFILE_FIELDS),
+            table.c.samples, table.c.last_bucket
+        )).all()
+        
+        with self._lock:
+            self._branches = {}
+            for branch_id, slot, *values, samples, last_bucket in rows:
+                state = self._branches.get(branch_id)
+                if state is None:
+                    state = self._branches[branch_id] = _BranchProfile()
+                state.values[:, slot] = values
+                state.samples[slot] = samples
+                state.last_buckets[slot] = last_bucket
+                if last_bucket is not None and (state.last_folded is None or last_bucket > state.last_folded):
+                    state.last_folded = last_bucket
+        
+        logger.info(f"โหลดโปรไฟล์การพยากรณ์ของ {len(self._branches)} สาขา")
+    
+    def observe(self, records):
+        """
+        รับข้อมูลการนับที่บันทึกแล้ว และรวมชั่วโมงที่ปิดแล้วเข้าโปรไฟล์
+        
+        Args:
+            records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+        """
+        with self._lock:
+            touched = {}
+            for record in records:
+                state = self._branches.get(record['branch_id'])
+                if state is None:
+                    state = self._branches[record['branch_id']] = _BranchProfile()
+                
+                timestamp = record['timestamp'].replace(tzinfo=None)
+                hour = _hour_start(timestamp)
+                if state.last_folded is not None and hour <= state.last_folded:
+                    continue
+                
+                totals = state.open_hours.get(hour)
+                if totals is None:
+                    totals = state.open_hours[hour] = [0, 0]
+                totals[0] += record['entry_count']
+                totals[1] = max(totals[1], record['current_count'])
+                if state.newest is None or timestamp > state.newest:
+                    state.newest = timestamp
+                touched[record['branch_id']] = state
+            
+            for state in touched.values():
+                # รวมชั่วโมงที่ปิดแล้วตามลำดับ เมื่อพ้นช่วงรอข้อมูลที่มาช้า
+                for hour in sorted(state.open_hours):
+                    if hour + timedelta(hours=1) + self.lateness > state.newest:
+                        break
+                    entries, peak = state.open_hours.pop(hour)
+                    self._fold(state, hour, entries, peak)
+    
+    def _fold(self, state, hour, entries, occupancy):
+        """รวมค่าของชั่วโมงที่ปิดแล้วเข้าช่องของชั่วโมงนั้น (ต้องถือ lock อยู่)"""
+        slot = hour_of_week(hour)
+        values = state.values[:, slot]
+        
+        for index, value in ((0, entries), (2, occupancy)):
+            if state.samples[slot] == 0:
+                values[index], values[index + 1] = value, 0.0
+            else:
+                # ค่าเฉลี่ยและความแปรปรวนแบบ exponentially weighted
+                difference = value - values[index]
+                increment = self.alpha * difference
+                values[index] += increment
+                values[index + 1] = (1 - self.alpha) * (values[index + 1] + difference * increment)
+        
+        state.samples[slot] += 1
+        state.last_buckets[slot] = hour
+        state.last_folded = hour
+        state.dirty.add(slot)
+    
+    def rebuild(self, db, start=None):
+        """
+        คำนวณโปรไฟล์ใหม่ทั้งหมดจากตารางสรุปรายชั่วโมง (แทนที่โปรไฟล์เดิมในหน่วยความจำ
+        บันทึกลงฐานข้อมูลด้วย persist(replace=True))
+        
+        occupancy ของแต่ละชั่วโมงคือ max_count สูงสุดของกล้องในสาขา (ค่าเดียวกับที่ ingest รวมเข้าโปรไฟล์)
+        
+        Args:
+            db: database session
+            start: เวลาเริ่มต้นของข้อมูลที่ใช้ (None = ทั้งหมด)
+        
+        Returns:
+            dict: จำนวนสาขา (branches) และจำนวนชั่วโมง (hours) ที่รวมเข้าโปรไฟล์
+        """
+        table = TrafficRollupHour.__table__
+        # ชั่วโมงปัจจุบันยังไม่ปิด จะถูกรวมจาก ingest เมื่อพ้นช่วงรอข้อมูลที่มาช้า
+        statement = select(table.c.branch_id, table.c.bucket, func.sum(table.c.entry_count), func.max(table.c.max_count)) \
+            .where(table.c.bucket < _hour_start(get_timezones().storage_now())) \
+            .group_by(table.c.branch_id, table.c.bucket) \
+            .order_by(table.c.branch_id, table.c.bucket)
+        if start is not None:
+            statement = statement.where(table.c.bucket >= start)
+        
+        branches = {}
+        hours = 0
+        for branch_id, bucket, entries, occupancy in db.execute(statement):
+            state = branches.get(branch_id)
+            if state is None:
+                state = branches[branch_id] = _BranchProfile()
+            self._fold(state, bucket, int(entries or 0), int(occupancy or 0))
+            hours += 1
+        
+        with self._lock:
+            self._branches = branches
+        
+        return {'branches': len(branches), 'hours': hours}
+    
+    def forecast(self, branch_id, start, hours):
+        """
+        ค่าที่คาดว่าจะเกิดขึ้นในแต่ละชั่วโมงตั้งแต่ start
+        
+        Args:
+            branch_id: รหัสสาขา
+            start: ชั่วโมงแรก (ปัดลงเป็นต้นชั่วโมง)
+            hours: จำนวนชั่วโมง (ไม่เกิน MAX_FORECAST_HOURS)
+        
+        Returns:
+            list: dict ของแต่ละชั่วโมง (ค่าเป็น 0 และ samples เป็น 0 ถ้ายังไม่มีข้อมูลของช่องนั้น)
+        """
+        start = _hour_start(start)
+        results = []
+        
+        with self._lock:
+            state = self._branches.get(branch_id)
+            for offset in range(hours):
+                hour = start + timedelta(hours=offset)
+                slot = hour_of_week(hour)
+                if state is None:
+                    entries_mean = entries_var = occupancy_mean = occupancy_var = 0.0
+                    samples = 0
+                else:
+                    entries_mean, entries_var, occupancy_mean, occupancy_var = state.values[:, slot].tolist()
+                    samples = int(state.samples[slot])
+                
+                item = {
+                    'hour': hour.strftime('%Y-%m-%d %H:00'),
+                    'expected_entries': round(entries_mean, 2),
+                    'entries_stddev': round(entries_var ** 0.5, 2),
+                    'expected_occupancy': round(occupancy_mean, 2),
+                    'occupancy_stddev': round(occupancy_var ** 0.5, 2),
+                    'samples': samples
+                }
+                totals = state.open_hours.get(hour) if state is not None else None
+                if totals is not None:
+                    # ค่าที่นับได้แล้วของชั่วโมงที่กำลังสะสม
+                    item['observed_entries'], item['observed_occupancy'] = totals
+                results.append(item)
+        
+        return results
+    
+    def persist(self, replace=False):
+        """
+        บันทึกช่องที่เปลี่ยนแปลงลงตาราง forecast_profiles
+        
+        Args:
+            replace: True = ลบโปรไฟล์เดิมทั้งหมดก่อนบันทึก (หลัง rebuild)
+        
+        Returns:
+            int: จำนวนช่องที่บันทึก
+        """
+        table = ForecastProfile.__table__
+        
+        with self._persist_lock:
+            with self._lock:
+                changes = []
+                for branch_id, state in self._branches.items():
+                    for slot in sorted(state.dirty):
+                        changes.append({
+                            'branch_id': branch_id,
+                            'slot': slot,
+                            **dict(zip(PROFILE_FIELDS, state.values[:, slot].tolist())),
+                            'samples': int(state.samples[slot]),
+                            'last_bucket': state.last_buckets[slot]
+                        })
+                    state.dirty = set()
+            
+            if not changes and not replace:
+                return 0
+            
+            db = get_session()
+            try:
+                if replace:
+                    db.execute(delete(table))
+                else:
+                    slots_by_branch = {}
+                    for change in changes:
+                        slots_by_branch.setdefault(change['branch_id'], []).append(change['slot'])
+                    for branch_id, slots in slots_by_branch.items():
+                        db.execute(delete(table).where(table.c.branch_id == branch_id, table.c.slot.in_(slots)))
+                if changes:
+                    db.execute(insert(table), changes)
+                db.commit()
+            except SQLAlchemyError as e:
+                db.rollback()
+                logger.error(f"เกิดข้อผิดพลาดในการบันทึกโปรไฟล์การพยากรณ์: {str(e)}")
+                # บันทึกใหม่ในรอบถัดไป
+                with self._lock:
+                    for change in changes:
+                        state = self._branches.get(change['branch_id'])
+                        if state is not None:
+                            state.dirty.add(change['slot'])
+                return 0
+            finally:
+                db.close()
+            
+            return len(changes)
+    
+    def start(self):
+        """เริ่มเธรดที่บันทึกโปรไฟล์ลงฐานข้อมูลเป็นระยะ"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='forecast-persister', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """หยุดเธรดและบันทึกโปรไฟล์ที่เหลือก่อนปิดโปรแกรม"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.persist()
+    
+    def _run(self):
+        """ลูปหลักของเธรดบันทึกโปรไฟล์"""
+        while not self._stop_event.wait(self.persist_interval):
+            self.persist()
+
+def _create_profiles(config):
+    return ForecastProfiles(
+        half_life_weeks=config.getfloat('forecast', 'half_life_weeks', fallback=4.0),
+        # รอข้อมูลที่มาช้าตาม late_minutes รวมกับรอบการบันทึกของ ingest
+        lateness_seconds=(config.getfloat('forecast', 'late_minutes', fallback=15.0) * 60
+                          + config.getint('ingest', 'flush_interval_ms', fallback=500) / 1000),
+        persist_interval=config.getfloat('forecast', 'persist_interval', fallback=60.0)
+    )
+
+def init_forecast(config):
+    """
+    เริ่มต้นโปรไฟล์การพยากรณ์ตามการตั้งค่าในส่วน [forecast]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        ForecastProfiles หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global forecast_profiles
+    
+    if not config.getboolean('forecast', 'enabled', fallback=True):
+        return None
+    
+    if forecast_profiles is not None:
+        return forecast_profiles
+    
+    profiles = _create_profiles(config)
+    
+    db = get_session()
+    try:
+        profiles.load(db)
+    finally:
+        db.close()
+    
+    # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+    from server.ingest import add_commit_listener
+    add_commit_listener(profiles.observe)
+    
+    profiles.start()
+    atexit.register(profiles.stop)
+    
+    forecast_profiles = profiles
+    logger.info(f"เริ่มโปรไฟล์การพยากรณ์ (half-life: {profiles.half_life_weeks} สัปดาห์)")
+    
+    return profiles
+
+def rebuild_forecast(config, start=None):
+    """
+    คำนวณโปรไฟล์ใหม่จากตารางสรุปรายชั่วโมง (python main.py --rebuild-forecast)
+    
+    Returns:
+        dict: ผลลัพธ์ของ ForecastProfiles.rebuild
+    """
+    profiles = _create_profiles(config)
+    db = get_session()
+    try:
+        result = profiles.rebuild(db, start)
+    finally:
+        db.close()
+    
+    profiles.persist(replace=True)
+    return result
+
+def get_forecast_profiles():
+    """คืนค่าทะเบียนโปรไฟล์ที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return forecast_profiles
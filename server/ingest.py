@@ -0,0 +1,408 @@
+# server/ingest.py - ตรวจสอบและบันทึกข้อมูลการนับลูกค้าจากกล้อง
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import insert, update, select, bindparam, and_, or_, event, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from models.branch import Branch
+from models.camera_latest import CameraLatest
+from server.occupancy import get_occupancy_registry
+from server.rollups import update_rollups
+from server.utilisation import occupancy_timeline
+from server.partitions import route_counts
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# ฟิลด์ที่จำเป็นของข้อมูลการนับแต่ละรายการ
+REQUIRED_FIELDS = ('camera_id', 'branch_id', 'timestamp', 'entry_count', 'exit_count', 'current_count')
+
+# คอลัมน์ของ camera_latest ที่ถูกแทนที่ด้วยข้อมูลที่ใหม่กว่า
+CAMERA_LATEST_FIELDS = ('branch_id', 'entry_count', 'exit_count', 'current_count', 'updated_at', 'timestamp')
+
+# ฟิลด์ตัวเลขที่ต้องเป็นจำนวนเต็มไม่ติดลบ
+COUNT_FIELDS = ('entry_count', 'exit_count', 'current_count')
+
+# key ใน session.info ที่เก็บข้อมูลการนับใหม่ซึ่งรอ commit
+PENDING_COUNTS_KEY = 'pending_counts'
+
+# ฟังก์ชันที่ถูกเรียกพร้อมข้อมูลการนับใหม่หลัง commit สำเร็จ
+_commit_listeners = []
+
+def add_commit_listener(listener):
+    """
+    ลงทะเบียนฟังก์ชันที่จะถูกเรียกพร้อมรายการข้อมูลการนับใหม่ หลังจาก transaction ถูก commit แล้ว
+    
+    Args:
+        listener: ฟังก์ชันที่รับรายการข้อมูลที่ผ่าน parse_count แล้ว
+    """
+    if listener not in _commit_listeners:
+        _commit_listeners.append(listener)
+
+@event.listens_for(Session, 'after_commit')
+def _notify_committed_counts(session):
+    """ส่งข้อมูลการนับใหม่ให้ listener หลัง commit สำเร็จ"""
+    records = session.info.pop(PENDING_COUNTS_KEY, None)
+    if not records:
+        return
+    
+    for listener in _commit_listeners:
+        try:
+            listener(records)
+        except Exception as e:
+            logger.error(f"เกิดข้อผิดพลาดในการส่งข้อมูลการนับหลัง commit: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending_counts(session):
+    """ทิ้งข้อมูลการนับที่รอ commit เมื่อ transaction ถูก rollback"""
+    session.info.pop(PENDING_COUNTS_KEY, None)
+
+def parse_timestamp(value, branch_id=None):
+    """
+    แปลง timestamp จากอุปกรณ์เป็นเวลาแบบไม่มี timezone ในเขตเวลาที่บันทึก (server/timezones.py)
+    
+    Args:
+        value: timestamp ในรูปแบบ ISO 8601 (ถ้าไม่ใช่ string จะใช้เวลาปัจจุบัน)
+               ถ้าไม่มี timezone ถือเป็นเวลาท้องถิ่นของสาขา
+        branch_id: รหัสสาขาของอุปกรณ์
+    
+    Returns:
+        datetime: เวลาที่แปลงแล้ว
+    """
+    timezones = get_timezones()
+    if isinstance(value, str):
+        return timezones.to_storage(datetime.fromisoformat(value.replace('Z', '+00:00')), branch_id)
+    return timezones.storage_now()
+
+def parse_count(item):
+    """
+    ตรวจสอบและแปลงข้อมูลการนับหนึ่งรายการให้พร้อมบันทึก
+    
+    Args:
+        item: dictionary ข้อมูลการนับที่ได้รับจากกล้อง
+    
+    Returns:
+        dict: ข้อมูลที่ตรงกับคอลัมน์ของตาราง customer_counts
+    
+    Raises:
+        ValueError: ถ้าข้อมูลไม่ครบถ้วนหรือรูปแบบไม่ถูกต้อง
+    """
+    if not isinstance(item, dict) or not all(field in item for field in REQUIRED_FIELDS):
+        raise ValueError('ข้อมูลไม่ครบถ้วน')
+    
+    record = {
+        'camera_id': str(item['camera_id']),
+        'branch_id': str(item['branch_id']),
+        'meta_data': json.dumps(item.get('meta_data', {})),
+        'event_id': None
+    }
+    
+    # รหัสเหตุการณ์จากอุปกรณ์ (ไม่บังคับ) ใช้เป็น key กันข้อมูลซ้ำ
+    event_id = item.get('event_id')
+    if event_id is not None:
+        event_id = str(event_id)
+        if not event_id or len(event_id) > 64:
+            raise ValueError('event_id ต้องมีความยาว 1-64 ตัวอักษร')
+        record['event_id'] = event_id
+    
+    try:
+        record['timestamp'] = parse_timestamp(item['timestamp'], record['branch_id'])
+    except ValueError:
+        raise ValueError('รูปแบบ timestamp ไม่ถูกต้อง')
+    
+    for field in COUNT_FIELDS:
+        value = item[field]
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            raise ValueError(f'{field} ต้องเป็นจำนวนเต็มไม่ติดลบ')
+        record[field] = value
+    
+    return record
+
+def _insert_ignoring_duplicates(table, dialect_name):
+    """
+    สร้างคำสั่ง INSERT ที่ข้ามแถวซึ่งชนกับ unique index ตาม dialect ของฐานข้อมูล
+    
+    SQLite/PostgreSQL ใช้ ON CONFLICT DO NOTHING และ MySQL ใช้ INSERT IGNORE
+    """
+    if dialect_name == 'sqlite':
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect_name == 'postgresql':
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect_name in ('mysql', 'mariadb'):
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+def _timestamp_key(camera_id, timestamp, dialect_name):
+    """key (camera_id, timestamp) ในรูปแบบเดียวกับค่าที่อ่านกลับจากฐานข้อมูล"""
+    timestamp = timestamp.replace(tzinfo=None)
+    if dialect_name in ('mysql', 'mariadb'):
+        # DATETIME ของ MySQL ไม่เก็บเศษวินาที
+        timestamp = timestamp.replace(microsecond=0)
+    return (camera_id, timestamp)
+
+def _unique_in_batch(records, dialect_name):
+    """ตัดรายการที่ซ้ำกันเองภายในชุดข้อมูลเดียวกัน (ใช้ key เดียวกับ unique index)"""
+    seen_timestamps = set()
+    seen_events = set()
+    unique_records = []
+    
+    for record in records:
+        timestamp_key = _timestamp_key(record['camera_id'], record['timestamp'], dialect_name)
+        event_key = (record['camera_id'], record['event_id']) if record['event_id'] else None
+        
+        if timestamp_key in seen_timestamps or (event_key and event_key in seen_events):
+            continue
+        
+        seen_timestamps.add(timestamp_key)
+        if event_key:
+            seen_events.add(event_key)
+        unique_records.append(record)
+    
+    return unique_records
+
+def _existing_keys(db, table, records, dialect_name):
+    """
+    ดึง key ที่มีอยู่แล้วในฐานข้อมูล สำหรับฐานข้อมูลที่ไม่รองรับ INSERT ... RETURNING
+    
+    Returns:
+        tuple: (set ของ (camera_id, timestamp), set ของ (camera_id, event_id))
+    """
+    camera_ids = {record['camera_id'] for record in records}
+    timestamps = [record['timestamp'].replace(tzinfo=None) for record in records]
+    event_ids = {record['event_id'] for record in records if record['event_id']}
+    
+    conditions = [and_(
+        table.c.timestamp >= min(timestamps).replace(microsecond=0),
+        table.c.timestamp <= max(timestamps)
+    )]
+    if event_ids:
+        conditions.append(table.c.event_id.in_(event_ids))
+    
+    rows = db.execute(
+        select(table.c.camera_id, table.c.timestamp, table.c.event_id)
+        .where(table.c.camera_id.in_(camera_ids))
+        .where(or_(*conditions))
+    ).all()
+    
+    timestamp_keys = {_timestamp_key(camera_id, timestamp, dialect_name) for camera_id, timestamp, _ in rows}
+    event_keys = {(camera_id, event_id) for camera_id, _, event_id in rows if event_id}
+    return timestamp_keys, event_keys
+
+def _insert_counts(db, table, records, dialect):
+    """
+    บันทึกข้อมูลการนับลงตารางเดียวโดยข้ามรายการที่ซ้ำกับข้อมูลเดิม
+    
+    Returns:
+        tuple: (รายการที่บันทึกใหม่, id ของแถวที่บันทึก หรือ None)
+    """
+    statement = _insert_ignoring_duplicates(table, dialect.name)
+    row_id = None
+    
+    if dialect.insert_executemany_returning:
+        # ฐานข้อมูลคืนเฉพาะแถวที่บันทึกใหม่ จึงไม่ต้อง SELECT ตรวจสอบก่อน
+        returned = db.execute(
+            statement.returning(table.c.id, table.c.camera_id, table.c.timestamp),
+            records
+        ).all()
+        inserted_ids = {
+            _timestamp_key(camera_id, timestamp, dialect.name): returned_id
+            for returned_id, camera_id, timestamp in returned
+        }
+        new_records = []
+        for record in records:
+            returned_id = inserted_ids.get(_timestamp_key(record['camera_id'], record['timestamp'], dialect.name))
+            if returned_id is not None:
+                new_records.append(record)
+                row_id = returned_id
+    else:
+        timestamp_keys, event_keys = _existing_keys(db, table, records, dialect.name)
+        new_records = [
+            record for record in records
+            if _timestamp_key(record['camera_id'], record['timestamp'], dialect.name) not in timestamp_keys
+            and (record['camera_id'], record['event_id']) not in event_keys
+        ]
+        if new_records:
+            inserted = db.execute(statement, new_records)
+            if len(new_records) == 1 and inserted.inserted_primary_key:
+                row_id = inserted.inserted_primary_key[0]
+    
+    return new_records, row_id
+
+def store_counts(db, records):
+    """
+    บันทึกข้อมูลการนับหลายรายการด้วย INSERT ระดับ Core แบบ executemany (ผู้เรียกต้อง commit เอง)
+    
+    คำสั่ง INSERT ถูก compile ครั้งเดียวแล้วส่งทุกแถวให้ DBAPI โดยไม่ผ่าน unit-of-work ของ ORM
+    รายการที่ซ้ำกับข้อมูลเดิม (camera_id + timestamp หรือ camera_id + event_id) จะถูกข้าม
+    โดยใช้ unique index ของฐานข้อมูล จึงส่งข้อมูลเดิมซ้ำได้อย่างปลอดภัย
+    
+    Args:
+        db: database session
+        records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+    
+    Returns:
+        dict: inserted (จำนวนที่บันทึกใหม่), duplicates (จำนวนที่ซ้ำ),
+              id (เฉพาะกรณีบันทึกรายการเดียว) และ records (รายการที่บันทึกใหม่)
+    """
+    result = {'inserted': 0, 'duplicates': 0, 'id': None, 'records': []}
+    if not records:
+        return result
+    
+    dialect = db.get_bind().dialect
+    unique_records = _unique_in_batch(records, dialect.name)
+    
+    # บันทึกลงพาร์ทิชันของเดือนของแต่ละรายการ (ตาราง customer_counts ถ้าไม่ได้แบ่งพาร์ทิชัน)
+    new_records = []
+    for table, table_records in route_counts(db, unique_records):
+        inserted, row_id = _insert_counts(db, table, table_records, dialect)
+        new_records.extend(inserted)
+        if row_id is not None:
+            result['id'] = row_id
+    
+    if len(records) > 1:
+        result['id'] = None
+    
+    result['inserted'] = len(new_records)
+    result['duplicates'] = len(records) - len(new_records)
+    result['records'] = new_records
+    
+    # สถานะก่อนหน้าของสาขาสำหรับ visitor-minutes ต้องอ่านก่อน camera_latest ถูกอัพเดต
+    timeline = occupancy_timeline(db, new_records)
+    update_camera_latest(db, new_records)
+    update_rollups(db, new_records, timeline)
+    
+    # ทะเบียนจำนวนลูกค้าปัจจุบันจะอัพเดตตาราง branches เองเป็นระยะ
+    if get_occupancy_registry() is None:
+        update_branch_occupancy(db, new_records)
+    
+    if new_records:
+        db.info.setdefault(PENDING_COUNTS_KEY, []).extend(new_records)
+    
+    return result
+
+def update_branch_occupancy(db, records):
+    """
+    อัพเดตจำนวนลูกค้าปัจจุบันของทุกสาขาในชุดข้อมูลด้วยคำสั่ง UPDATE เดียว
+    
+    ใช้ข้อมูลล่าสุดของแต่ละสาขา และไม่เขียนทับข้อมูลที่ใหม่กว่าซึ่งบันทึกไว้แล้ว
+    
+    Args:
+        db: database session
+        records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+    """
+    latest_by_branch = {}
+    for record in records:
+        latest = latest_by_branch.get(record['branch_id'])
+        if latest is None or record['timestamp'] >= latest['timestamp']:
+            latest_by_branch[record['branch_id']] = record
+    
+    if not latest_by_branch:
+        return
+    
+    table = Branch.__table__
+    statement = update(table) \
+        .where(table.c.branch_id == bindparam('b_branch_id')) \
+        .where(or_(
+            table.c.last_updated.is_(None),
+            table.c.last_updated <= bindparam('b_timestamp')
+        )) \
+        .values(
+            current_customer_count=bindparam('b_current_count'),
+            last_updated=bindparam('b_timestamp')
+        )
+    
+    db.execute(statement, [
+        {
+            'b_branch_id': branch_id,
+            'b_current_count': record['current_count'],
+            'b_timestamp': record['timestamp']
+        }
+        for branch_id, record in latest_by_branch.items()
+    ])
+
+def _upsert_camera_latest(table, dialect_name):
+    """
+    สร้างคำสั่ง upsert ของ camera_latest ที่แทนที่ข้อมูลเดิมเฉพาะเมื่อข้อมูลใหม่ไม่เก่ากว่า
+    
+    Returns:
+        คำสั่ง INSERT หรือ None ถ้าฐานข้อมูลไม่รองรับ upsert
+    """
+    if dialect_name in ('sqlite', 'postgresql'):
+        statement = (sqlite_insert if dialect_name == 'sqlite' else pg_insert)(table)
+        return statement.on_conflict_do_update(
+            index_elements=[table.c.camera_id],
+            set_={field: statement.excluded[field] for field in CAMERA_LATEST_FIELDS},
+            where=table.c.timestamp <= statement.excluded.timestamp
+        )
+    
+    if dialect_name in ('mysql', 'mariadb'):
+        # MySQL ประเมินค่าตามลำดับ จึงต้องอัพเดต timestamp เป็นคอลัมน์สุดท้าย
+        statement = mysql_insert(table)
+        newer = statement.inserted.timestamp >= table.c.timestamp
+        return statement.on_duplicate_key_update([
+            (field, func.if_(newer, statement.inserted[field], table.c[field]))
+            for field in CAMERA_LATEST_FIELDS
+        ])
+    
+    return None
+
+def update_camera_latest(db, records):
+    """
+    อัพเดตข้อมูลล่าสุดของทุกกล้องในชุดข้อมูลลงตาราง camera_latest ด้วยคำสั่ง upsert เดียว
+    
+    Args:
+        db: database session
+        records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+    """
+    latest_by_camera = {}
+    for record in records:
+        latest = latest_by_camera.get(record['camera_id'])
+        if latest is None or record['timestamp'] >= latest['timestamp']:
+            latest_by_camera[record['camera_id']] = record
+    
+    if not latest_by_camera:
+        return
+    
+    now = datetime.now()
+    rows = [
+        {
+            'camera_id': camera_id,
+            'branch_id': record['branch_id'],
+            'timestamp': record['timestamp'],
+            'entry_count': record['entry_count'],
+            'exit_count': record['exit_count'],
+            'current_count': record['current_count'],
+            'updated_at': now
+        }
+        for camera_id, record in latest_by_camera.items()
+    ]
+    
+    table = CameraLatest.__table__
+    statement = _upsert_camera_latest(table, db.get_bind().dialect.name)
+    if statement is not None:
+        db.execute(statement, rows)
+        return
+    
+    # ฐานข้อมูลอื่น: แยกเป็น INSERT สำหรับกล้องใหม่ และ UPDATE สำหรับกล้องที่มีข้อมูลเก่ากว่า
+    existing = dict(db.execute(
+        select(table.c.camera_id, table.c.timestamp).where(table.c.camera_id.in_(latest_by_camera))
+    ).all())
+    new_rows = [row for row in rows if row['camera_id'] not in existing]
+    newer_rows = [
+        {('b_' + key): value for key, value in row.items()}
+        for row in rows
+        if row['camera_id'] in existing and existing[row['camera_id']] <= row['timestamp'].replace(tzinfo=None)
+    ]
+    
+    if new_rows:
+        db.execute(insert(table), new_rows)
+    if newer_rows:
+        db.execute(
+            update(table)
+            .where(table.c.camera_id == bindparam('b_camera_id'))
+            .values({field: bindparam('b_' + field) for field in CAMERA_LATEST_FIELDS}),
+            newer_rows
+        )
@@ -0,0 +1,236 @@
+# server/ingest_queue.py - คิวบันทึกข้อมูลแบบ write-behind พร้อม group commit
+import time
+import queue
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+from sqlalchemy.exc import SQLAlchemyError
+from server.db import get_session
+
+logger = logging.getLogger(__name__)
+
+# คิวที่ใช้งานอยู่ (None = บันทึกลงฐานข้อมูลทันทีแบบเดิม)
+ingest_queue = None
+
+class IngestQueue:
+    """
+    คิวในหน่วยความจำที่รวบรวมข้อมูลการนับแล้วบันทึกเป็นกลุ่มใน transaction เดียว
+    
+    เธรดเบื้องหลังจะ commit ข้อมูลเมื่อครบ flush_max_rows รายการ
+    หรือเมื่อครบ flush_interval_ms มิลลิวินาที แล้วแต่อย่างใดถึงก่อน
+    """
+    
+    def __init__(self, max_size=10000, flush_interval_ms=500, flush_max_rows=500,
+                 durability='async', sync_timeout=10):
+        self.max_size = max_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_max_rows = flush_max_rows
+        self.durability = durability
+        self.sync_timeout = sync_timeout
+        
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop_event = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        
+        self._stats = {
+            'enqueued': 0,
+            'rejected': 0,
+            'flushed': 0,
+            'duplicates': 0,
+            'failed': 0,
+            'flushes': 0,
+            'max_depth': 0,
+            'last_flush_rows': 0,
+            'last_flush_ms': 0.0,
+            'last_flush_at': None
+        }
+    
+    def start(self):
+        """เริ่มเธรด flusher"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='ingest-flusher', daemon=True)
+        self._thread.start()
+        logger.info(
+            f"เริ่มคิวบันทึกข้อมูล (ขนาด {self.max_size}, ทุก {int(self.flush_interval * 1000)} ms "
+            f"หรือ {self.flush_max_rows} รายการ, durability: {self.durability})"
+        )
+    
+    def put(self, record):
+        """
+        นำข้อมูลที่ผ่านการตรวจสอบแล้วเข้าคิว
+        
+        Args:
+            record: ข้อมูลที่ผ่าน server.ingest.parse_count แล้ว
+        
+        Returns:
+            Future: เมื่อ durability เป็น sync (สำเร็จเมื่อ commit แล้ว), หรือ None
+        
+        Raises:
+            queue.Full: ถ้าคิวเต็ม
+        """
+        future = Future() if self.durability == 'sync' else None
+        
+        try:
+            self._queue.put_nowait((record, future))
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['rejected'] += 1
+            raise
+        
+        with self._stats_lock:
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._queue.qsize())
+        
+        return future
+    
+    def flush(self):
+        """บันทึกข้อมูลทั้งหมดที่ค้างอยู่ในคิวทันที"""
+        while self._flush_batch(self._drain(block=False)):
+            pass
+    
+    def stop(self):
+        """หยุดเธรด flusher และบันทึกข้อมูลที่เหลือก่อนปิดโปรแกรม"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(5.0, self.flush_interval * 4))
+            self._thread = None
+        self.flush()
+        logger.info("หยุดคิวบันทึกข้อมูลเรียบร้อยแล้ว")
+    
+    def stats(self):
+        """ข้อมูลสถิติของคิวสำหรับการติดตามการทำงาน"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'depth': self._queue.qsize(),
+            'capacity': self.max_size,
+            'flush_interval_ms': int(self.flush_interval * 1000),
+            'flush_max_rows': self.flush_max_rows,
+            'durability': self.durability,
+            'running': self._thread is not None and self._thread.is_alive()
+        })
+        return stats
+    
+    def _run(self):
+        """ลูปหลักของเธรด flusher (ข้อผิดพลาดใดๆ ต้องไม่ทำให้เธรดหยุด ไม่เช่นนั้นข้อมูลจะค้างในคิวโดยไม่ถูกบันทึก)"""
+        while not self._stop_event.is_set():
+            try:
+                batch = self._drain(block=True)
+                if batch:
+                    self._flush_batch(batch)
+            except Exception:
+                logger.exception("เกิดข้อผิดพลาดในเธรดบันทึกข้อมูลจากคิว")
+    
+    def _drain(self, block):
+        """ดึงข้อมูลจากคิวจนครบ flush_max_rows หรือหมดเวลารอ"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        
+        while len(batch) < self.flush_max_rows:
+            try:
+                if block:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=timeout))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        return batch
+    
+    def _flush_batch(self, batch):
+        """บันทึกข้อมูลหนึ่งกลุ่มใน transaction เดียว"""
+        if not batch:
+            return False
+        
+        # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+        from server.ingest import store_counts
+        
+        records = [record for record, _ in batch]
+        started = time.perf_counter()
+        
+        with self._flush_lock:
+            db = None
+            try:
+                db = get_session()
+                stored = store_counts(db, records)
+                db.commit()
+                error = None
+            except Exception as e:
+                # ไม่ใช่เฉพาะข้อผิดพลาดของฐานข้อมูล (เช่นจาก store_counts หรือ listener ตอน commit)
+                error = e
+                logger.exception(f"เกิดข้อผิดพลาดในการบันทึกข้อมูลจากคิว {len(records)} รายการ: {str(e)}")
+                if db is not None:
+                    try:
+                        db.rollback()
+                    except SQLAlchemyError:
+                        logger.exception("ไม่สามารถ rollback การบันทึกข้อมูลจากคิวได้")
+            finally:
+                if db is not None:
+                    db.close()
+        
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        
+        with self._stats_lock:
+            if error is None:
+                self._stats['flushed'] += stored['inserted']
+                self._stats['duplicates'] += stored['duplicates']
+            else:
+                self._stats['failed'] += len(records)
+            self._stats['flushes'] += 1
+            self._stats['last_flush_rows'] = len(records)
+            self._stats['last_flush_ms'] = round(elapsed_ms, 2)
+            self._stats['last_flush_at'] = time.time()
+        
+        for _, future in batch:
+            if future is None:
+                continue
+            if error is None:
+                future.set_result(True)
+            else:
+                future.set_exception(error)
+        
+        return True
+
+def init_ingest_queue(config):
+    """
+    เริ่มต้นคิวบันทึกข้อมูลตามการตั้งค่าในส่วน [ingest]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        IngestQueue หรือ None ถ้าใช้โหมดบันทึกทันที
+    """
+    global ingest_queue
+    
+    mode = config.get('ingest', 'mode', fallback='direct')
+    if mode != 'queued':
+        return None
+    
+    if ingest_queue is not None:
+        return ingest_queue
+    
+    ingest_queue = IngestQueue(
+        max_size=config.getint('ingest', 'queue_size', fallback=10000),
+        flush_interval_ms=config.getint('ingest', 'flush_interval_ms', fallback=500),
+        flush_max_rows=config.getint('ingest', 'flush_max_rows', fallback=500),
+        durability=config.get('ingest', 'durability', fallback='async'),
+        sync_timeout=config.getfloat('ingest', 'sync_timeout', fallback=10)
+    )
+    ingest_queue.start()
+    
+    # บันทึกข้อมูลที่ค้างอยู่ในคิวก่อนปิดโปรแกรม
+    atexit.register(ingest_queue.stop)
+    
+    return ingest_queue
+
+def get_ingest_queue():
+    """คืนค่าคิวที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return ingest_queue
@@ -0,0 +1,165 @@
+# server/ingest_stream.py - รับข้อมูลการนับแบบ NDJSON ทีละบรรทัดสำหรับข้อมูลย้อนหลังขนาดใหญ่
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy.exc import SQLAlchemyError
+from server.db import get_session
+from server.ingest import parse_count, store_counts
+
+logger = logging.getLogger(__name__)
+
+# จำนวนรายละเอียดของบรรทัดที่ถูกปฏิเสธที่จะส่งกลับสูงสุด
+MAX_REJECTED_DETAILS = 100
+
+# จำนวนการอัพโหลดที่เก็บความคืบหน้าไว้ในหน่วยความจำ
+MAX_TRACKED_UPLOADS = 1000
+
+class UploadProgress:
+    """เก็บความคืบหน้าของการอัพโหลดแบบ stream ตาม upload_id เพื่อให้อุปกรณ์ส่งต่อจากจุดที่ค้างได้"""
+    
+    def __init__(self, max_uploads=MAX_TRACKED_UPLOADS):
+        self.max_uploads = max_uploads
+        self._uploads = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def update(self, upload_id, **fields):
+        """อัพเดตความคืบหน้าของการอัพโหลด"""
+        if not upload_id:
+            return
+        with self._lock:
+            progress = self._uploads.pop(upload_id, {'upload_id': upload_id})
+            progress.update(fields)
+            progress['updated_at'] = time.time()
+            self._uploads[upload_id] = progress
+            while len(self._uploads) > self.max_uploads:
+                self._uploads.popitem(last=False)
+    
+    def get(self, upload_id):
+        """ดึงความคืบหน้าล่าสุดของการอัพโหลด (None ถ้าไม่พบ)"""
+        with self._lock:
+            progress = self._uploads.get(upload_id)
+            return dict(progress) if progress else None
+
+upload_progress = UploadProgress()
+
+def ingest_ndjson(stream, upload_id=None, base_offset=0, chunk_rows=1000, max_line_bytes=65536):
+    """
+    อ่านข้อมูล NDJSON จาก stream ทีละบรรทัดและบันทึกเป็นช่วงๆ ละ chunk_rows รายการ
+    
+    หน่วยความจำที่ใช้ขึ้นกับขนาดของหนึ่งช่วงเท่านั้น ไม่ขึ้นกับขนาดของข้อมูลทั้งหมด
+    หลัง commit แต่ละช่วงจะบันทึก committed_offset (ตำแหน่งไบต์ในไฟล์ของอุปกรณ์
+    ที่บันทึกครบแล้ว) เพื่อให้ส่งต่อจากตำแหน่งนั้นได้เมื่อการเชื่อมต่อขาด
+    
+    Args:
+        stream: file-like object ที่อ่านเป็นไบต์
+        upload_id: รหัสการอัพโหลดสำหรับติดตามความคืบหน้า (ไม่บังคับ)
+        base_offset: ตำแหน่งไบต์ในไฟล์ของอุปกรณ์ที่ข้อมูลชุดนี้เริ่มต้น
+        chunk_rows: จำนวนรายการต่อการ commit หนึ่งครั้ง
+        max_line_bytes: ความยาวสูงสุดของหนึ่งบรรทัด
+    
+    Returns:
+        dict: สรุปผลการบันทึก
+    """
+    summary = {
+        'upload_id': upload_id,
+        'lines': 0,
+        'accepted': 0,
+        'inserted': 0,
+        'duplicates': 0,
+        'rejected_count': 0,
+        'rejected': [],
+        'chunks': 0,
+        'base_offset': base_offset,
+        'committed_offset': base_offset,
+        'complete': False
+    }
+    
+    records = []
+    offset = base_offset
+    line_number = 0
+    truncated = False
+    
+    def commit_chunk():
+        db = get_session()
+        try:
+            stored = store_counts(db, records)
+            db.commit()
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        
+        summary['inserted'] += stored['inserted']
+        summary['duplicates'] += stored['duplicates']
+        summary['chunks'] += 1
+        records.clear()
+    
+    def report_progress():
+        upload_progress.update(upload_id, **{
+            k: v for k, v in summary.items() if k not in ('upload_id', 'rejected')
+        })
+    
+    report_progress()
+    
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            break
+        
+        line_number += 1
+        offset += len(line)
+        raw_line = line
+        
+        # บรรทัดที่ยาวเกินกำหนดจะถูกอ่านทิ้งจนจบบรรทัดโดยไม่เก็บไว้ในหน่วยความจำ
+        too_long = len(line) > max_line_bytes
+        while too_long and not line.endswith(b'\n'):
+            line = stream.readline(max_line_bytes)
+            if not line:
+                break
+            offset += len(line)
+        
+        if too_long:
+            summary['lines'] += 1
+            summary['rejected_count'] += 1
+            if len(summary['rejected']) < MAX_REJECTED_DETAILS:
+                summary['rejected'].append({'line': line_number, 'message': f'บรรทัดยาวเกิน {max_line_bytes} ไบต์'})
+            continue
+        
+        complete_line = line.endswith(b'\n')
+        line = line.strip()
+        if line:
+            summary['lines'] += 1
+            try:
+                records.append(parse_count(json.loads(line)))
+                summary['accepted'] += 1
+            except ValueError as e:
+                if not complete_line:
+                    # บรรทัดสุดท้ายที่ไม่มีการขึ้นบรรทัดใหม่และอ่านไม่ได้ อาจถูกตัดระหว่างส่ง
+                    # จึงไม่นับรวมใน committed_offset เพื่อให้ส่งบรรทัดนี้ใหม่ได้
+                    offset -= len(raw_line)
+                    truncated = True
+                summary['rejected_count'] += 1
+                if len(summary['rejected']) < MAX_REJECTED_DETAILS:
+                    summary['rejected'].append({'line': line_number, 'message': str(e)})
+        
+        if len(records) >= chunk_rows:
+            commit_chunk()
+            summary['committed_offset'] = offset
+            report_progress()
+    
+    if records:
+        commit_chunk()
+    summary['committed_offset'] = offset
+    # complete = False เมื่อบรรทัดสุดท้ายถูกตัด client ต้องส่งใหม่ตั้งแต่ committed_offset
+    summary['complete'] = not truncated
+    report_progress()
+    
+    logger.info(
+        f"บันทึกข้อมูลแบบ stream {summary['lines']} บรรทัด ({summary['inserted']} ใหม่, "
+        f"{summary['duplicates']} ซ้ำ, {summary['rejected_count']} ถูกปฏิเสธ)"
+    )
+    
+    return summary
@@ -0,0 +1,236 @@
+# server/migrations.py - ปรับโครงสร้างฐานข้อมูลเดิมให้ตรงกับโมเดลปัจจุบัน
+import logging
+from datetime import datetime
+from sqlalchemy import MetaData, inspect, text, select, insert, func, and_
+import server.db
+
+logger = logging.getLogger(__name__)
+
+def _has_column(conn, table, column):
+    """ตรวจสอบว่าตารางมีคอลัมน์นี้แล้วหรือไม่"""
+    return column in [c['name'] for c in inspect(conn).get_columns(table)]
+
+def _has_index(conn, table, index):
+    """ตรวจสอบว่าตารางมี index นี้แล้วหรือไม่"""
+    return index in [i['name'] for i in inspect(conn).get_indexes(table)]
+
+def _has_table(conn, table):
+    """ตรวจสอบว่ามีตารางนี้แล้วหรือไม่"""
+    return inspect(conn).has_table(table)
+
+def _create_index(conn, model, index_name):
+    """สร้าง index ตามที่ประกาศไว้ในโมเดล ถ้ายังไม่มี"""
+    table = model.__table__
+    if _has_index(conn, table.name, index_name):
+        return
+    index = next(i for i in table.indexes if i.name == index_name)
+    index.create(bind=conn)
+    logger.info(f"สร้าง index {index_name} บนตาราง {table.name}")
+
+def _create_missing_indexes(conn, table):
+    """สร้าง index ทั้งหมดที่ประกาศไว้ใน Table แต่ยังไม่มีในฐานข้อมูล"""
+    existing = {i['name'] for i in inspect(conn).get_indexes(table.name)}
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(bind=conn)
+            logger.info(f"สร้าง index {index.name} บนตาราง {table.name}")
+
+def _migrate_customer_count_dedup_key(conn):
+    """เพิ่มคอลัมน์ event_id และ unique index สำหรับกันข้อมูลการนับซ้ำ"""
+    from models.customer_count import CustomerCount
+    
+    if not _has_table(conn, 'customer_counts'):
+        return
+    
+    if not _has_column(conn, 'customer_counts', 'event_id'):
+        conn.execute(text("ALTER TABLE customer_counts ADD COLUMN event_id VARCHAR(64)"))
+    
+    # ลบข้อมูลซ้ำที่บันทึกไว้ก่อนหน้า โดยเก็บรายการแรกของแต่ละ (camera_id, timestamp)
+    if not _has_index(conn, 'customer_counts', 'uq_customer_counts_camera_timestamp'):
+        deleted = conn.execute(text(
+            "DELETE FROM customer_counts WHERE id NOT IN ("
+            "SELECT id FROM (SELECT MIN(id) AS id FROM customer_counts "
+            "GROUP BY camera_id, timestamp) AS keep_rows)"
+        )).rowcount
+        if deleted:
+            logger.info(f"ลบข้อมูลการนับที่ซ้ำกัน {deleted} รายการ")
+    
+    _create_index(conn, CustomerCount, 'uq_customer_counts_camera_timestamp')
+    _create_index(conn, CustomerCount, 'uq_customer_counts_camera_event')
+
+def _migrate_camera_latest(conn):
+    """สร้างตาราง camera_latest และเติมข้อมูลล่าสุดของแต่ละกล้องจากข้อมูลการนับเดิม"""
+    from models.customer_count import CustomerCount
+    from models.camera_latest import CameraLatest
+    
+    table = CameraLatest.__table__
+    table.create(bind=conn, checkfirst=True)
+    
+    if not _has_table(conn, 'customer_counts'):
+        return
+    if conn.execute(select(func.count()).select_from(table)).scalar():
+        return
+    
+    counts = CustomerCount.__table__
+    latest = select(counts.c.camera_id, func.max(counts.c.timestamp).label('timestamp')) \
+        .group_by(counts.c.camera_id) \
+        .subquery()
+    
+    inserted = conn.execute(insert(table).from_select(
+        ['camera_id', 'branch_id', 'timestamp', 'entry_count', 'exit_count', 'current_count', 'updated_at'],
+        select(
+            counts.c.camera_id, counts.c.branch_id, counts.c.timestamp,
+            counts.c.entry_count, counts.c.exit_count, counts.c.current_count,
+            func.current_timestamp()
+        ).join(latest, and_(
+            counts.c.camera_id == latest.c.camera_id,
+            counts.c.timestamp == latest.c.timestamp
+        ))
+    )).rowcount
+    
+    logger.info(f"เติมข้อมูลล่าสุดของกล้อง {inserted} ตัวลงตาราง camera_latest")
+
+def _migrate_traffic_rollups(conn):
+    """สร้างตารางสรุปข้อมูลการนับรายนาที รายชั่วโมง และรายวัน"""
+    from models.customer_count import CustomerCount
+    from models.traffic_rollup import TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay
+    
+    for model in (TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay):
+        model.__table__.create(bind=conn, checkfirst=True)
+    
+    # ข้อมูลเดิมอาจมีจำนวนมาก จึงแยกการคำนวณย้อนหลังเป็นคำสั่ง --backfill-rollups
+    counts = CustomerCount.__table__
+    if _has_table(conn, 'customer_counts') and conn.execute(select(counts.c.id).limit(1)).first():
+        logger.warning("มีข้อมูลการนับเดิมที่ยังไม่อยู่ในตารางสรุป ให้รัน python main.py --backfill-rollups")
+
+def _migrate_hot_query_indexes(conn):
+    """สร้าง composite index สำหรับคำสั่งที่อ่านช่วงเวลาของสาขาหรือกล้อง"""
+    from models.customer_count import CustomerCount
+    from models.snapshot import Snapshot
+    from models.device import Device
+    from server.partitions import PARTITION_PATTERN, partition_table
+    
+    for model, index_names in (
+        (CustomerCount, ['ix_customer_counts_branch_timestamp']),
+        (Snapshot, ['ix_snapshots_camera_timestamp', 'ix_snapshots_branch_timestamp']),
+        (Device, ['ix_devices_branch_camera', 'ix_devices_last_seen']),
+    ):
+        if _has_table(conn, model.__tablename__):
+            for index_name in index_names:
+                _create_index(conn, model, index_name)
+    
+    # พาร์ทิชันรายเดือนของ SQLite/MySQL เป็นตารางแยก (PostgreSQL สร้าง index ในพาร์ทิชันจากตารางหลักเอง)
+    if conn.dialect.name != 'postgresql':
+        metadata = MetaData()
+        for name in inspect(conn).get_table_names():
+            if PARTITION_PATTERN.match(name):
+                _create_missing_indexes(conn, partition_table(metadata, name))
+
+def _migrate_rollup_bucket_indexes(conn):
+    """สร้าง index ที่เริ่มด้วย bucket ของตารางสรุปรายชั่วโมง/รายวัน สำหรับคำสั่งที่อ่านทุกสาขา"""
+    from models.traffic_rollup import TrafficRollupHour, TrafficRollupDay
+    
+    for model in (TrafficRollupHour, TrafficRollupDay):
+        if _has_table(conn, model.__tablename__):
+            _create_index(conn, model, f'ix_{model.__tablename__}_bucket')
+
+def _migrate_forecast_profiles(conn):
+    """สร้างตาราง forecast_profiles (โปรไฟล์เริ่มต้นคำนวณได้ด้วย --rebuild-forecast)"""
+    from models.forecast_profile import ForecastProfile
+    
+    ForecastProfile.__table__.create(bind=conn, checkfirst=True)
+    
+    from models.traffic_rollup import TrafficRollupHour
+    table = TrafficRollupHour.__table__
+    if _has_table(conn, table.name) and conn.execute(select(table.c.branch_id).limit(1)).first():
+        logger.warning("มีข้อมูลเดิมที่ยังไม่อยู่ในโปรไฟล์การพยากรณ์ ให้รัน python main.py --rebuild-forecast")
+
+def _migrate_rollup_utilisation(conn):
+    """เพิ่มคอลัมน์ occupancy_seconds และ busy_seconds ในตารางสรุปทุกระดับ"""
+    from models.traffic_rollup import TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay
+    
+    has_rows = False
+    for model in (TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay):
+        table = model.__tablename__
+        if not _has_table(conn, table):
+            continue
+        for column in ('occupancy_seconds', 'busy_seconds'):
+            if not _has_column(conn, table, column):
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} FLOAT NOT NULL DEFAULT 0"))
+        has_rows = has_rows or conn.execute(select(model.__table__.c.branch_id).limit(1)).first() is not None
+    
+    # ค่าตามเวลาต้องคำนวณจากข้อมูลการนับเรียงตามเวลา
+    if has_rows:
+        logger.warning("ข้อมูลสรุปเดิมยังไม่มี visitor-minutes ให้รัน python main.py --backfill-rollups")
+
+def _migrate_traffic_sketches(conn):
+    """สร้างตาราง traffic_sketch_day (sketch ของวันเดิมถูกสร้างจากตารางสรุปเมื่อถูกขอครั้งแรก)"""
+    from models.traffic_sketch import TrafficSketchDay
+    
+    TrafficSketchDay.__table__.create(bind=conn, checkfirst=True)
+    _create_index(conn, TrafficSketchDay, 'ix_traffic_sketch_day_bucket')
+
+def _migrate_branch_timezone(conn):
+    """เพิ่มคอลัมน์ timezone ในตาราง branches"""
+    if _has_table(conn, 'branches') and not _has_column(conn, 'branches', 'timezone'):
+        conn.execute(text("ALTER TABLE branches ADD COLUMN timezone VARCHAR(50)"))
+
+def _migrate_sketch_peak(conn):
+    """ลบ sketch เดิมที่ peak เป็นผลรวม max_count ของทุกกล้อง (จะถูกสร้างใหม่เมื่อถูกขอครั้งถัดไป)"""
+    if _has_table(conn, 'traffic_sketch_day'):
+        conn.execute(text("DELETE FROM traffic_sketch_day"))
+
+# รายการ migration ตามลำดับ (version, ชื่อ, ฟังก์ชัน) ห้ามเปลี่ยน version ที่ใช้ไปแล้ว
+MIGRATIONS = [
+    (1, 'customer_count_dedup_key', _migrate_customer_count_dedup_key),
+    (2, 'camera_latest', _migrate_camera_latest),
+    (3, 'traffic_rollups', _migrate_traffic_rollups),
+    (4, 'hot_query_indexes', _migrate_hot_query_indexes),
+    (5, 'rollup_bucket_indexes', _migrate_rollup_bucket_indexes),
+    (6, 'forecast_profiles', _migrate_forecast_profiles),
+    (7, 'rollup_utilisation', _migrate_rollup_utilisation),
+    (8, 'traffic_sketches', _migrate_traffic_sketches),
+    (9, 'branch_timezone', _migrate_branch_timezone),
+    (10, 'sketch_peak', _migrate_sketch_peak),
+]
+
+def run_migrations(config):
+    """
+    รัน migration ที่ยังไม่เคยรันกับฐานข้อมูลนี้
+    
+    แต่ละ migration ทำงานใน transaction ของตัวเอง และถูกบันทึกไว้ในตาราง schema_migrations
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่าฐานข้อมูล
+    
+    Returns:
+        list: version ของ migration ที่รันในครั้งนี้
+    """
+    if server.db.engine is None:
+        server.db.init_db(config)
+    
+    engine = server.db.engine
+    
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at VARCHAR(32))"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+    
+    ran = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+                {'version': version, 'name': name, 'applied_at': datetime.now().isoformat()}
+            )
+        
+        logger.info(f"รัน migration {version} ({name}) สำเร็จ")
+        ran.append(version)
+    
+    return ran
@@ -0,0 +1,387 @@
+# server/occupancy.py - จำนวนลูกค้าปัจจุบันของแต่ละสาขาในหน่วยความจำ (รวมค่าจากหลายกล้อง)
+import time
+import atexit
+import logging
+import threading
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from server.db import get_session
+from server.watermarks import touch_branches
+from models.branch import Branch
+from models.camera_latest import CameraLatest
+
+logger = logging.getLogger(__name__)
+
+# ทะเบียนที่ใช้งานอยู่ (None = อ่านจากตาราง branches แบบเดิม)
+occupancy_registry = None
+
+# วิธีรวมค่าจากหลายกล้องในสาขาเดียวกัน
+# sum = แต่ละกล้องนับคนคนละพื้นที่, max = กล้องมองพื้นที่เดียวกัน
+FUSION_MODES = ('sum', 'max')
+
+class _BranchState:
+    """สถานะของสาขาหนึ่งในทะเบียน"""
+    
+    __slots__ = ('name', 'capacity', 'known', 'cameras', 'total', 'last_updated',
+                 'persisted_total', 'persisted_updated')
+    
+    def __init__(self, name=None, capacity=None, known=False):
+        self.name = name
+        self.capacity = capacity
+        self.known = known
+        self.cameras = {}  # camera_id -> (current_count, timestamp)
+        self.total = 0
+        self.last_updated = None
+        self.persisted_total = 0
+        self.persisted_updated = None
+
+class OccupancyRegistry:
+    """
+    เก็บจำนวนลูกค้าล่าสุดของแต่ละกล้อง และคำนวณจำนวนรวมของสาขาแบบ incremental
+    
+    การอ่านข้อมูลทำจากหน่วยความจำทั้งหมด ส่วนตาราง branches จะถูกอัพเดตเป็นกลุ่ม
+    ทุก persist_interval วินาที หรือทันทีเมื่อจำนวนของสาขาเปลี่ยนไปอย่างน้อย persist_min_change คน
+    
+    ทะเบียนเป็นของแต่ละ process สาขาที่ถูกสร้าง แก้ไข หรือลบนอก process นี้ (SQL, migration, worker อื่น)
+    จะถูกอ่านจากตาราง branches ทุก branch_refresh_interval วินาที
+    """
+    
+    def __init__(self, fusion='sum', persist_interval=5.0, persist_min_change=5, branch_refresh_interval=30.0):
+        if fusion not in FUSION_MODES:
+            raise ValueError(f"fusion ต้องเป็นหนึ่งใน {', '.join(FUSION_MODES)}")
+        
+        self.fusion = fusion
+        self.persist_interval = persist_interval
+        self.persist_min_change = persist_min_change
+        self.branch_refresh_interval = branch_refresh_interval
+        
+        self._branches = {}
+        self._refreshed_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def load(self, db):
+        """
+        โหลดข้อมูลสาขาและค่าล่าสุดของแต่ละกล้องจากฐานข้อมูล
+        
+        Args:
+            db: database session
+        """
+        branches = db.execute(
+            select(Branch.branch_id, Branch.name, Branch.capacity,
+                   Branch.current_customer_count, Branch.last_updated)
+        ).all()
+        
+        cameras = db.execute(
+            select(CameraLatest.branch_id, CameraLatest.camera_id,
+                   CameraLatest.current_count, CameraLatest.timestamp)
+        ).all()
+        
+        with self._lock:
+            self._branches = {}
+            for branch_id, name, capacity, current_count, last_updated in branches:
+                state = _BranchState(name, capacity, known=True)
+                state.total = state.persisted_total = current_count or 0
+                state.last_updated = state.persisted_updated = last_updated
+                self._branches[branch_id] = state
+            
+            self._observe_locked([
+                {'branch_id': branch_id, 'camera_id': camera_id,
+                 'current_count': current_count, 'timestamp': timestamp}
+                for branch_id, camera_id, current_count, timestamp in cameras
+            ])
+            
+            # ค่าที่คำนวณจากกล้องถือว่าตรงกับฐานข้อมูลแล้ว จนกว่าจะมีข้อมูลใหม่
+            for state in self._branches.values():
+                state.persisted_total = state.total
+                state.persisted_updated = state.last_updated
+        
+        logger.info(f"โหลดจำนวนลูกค้าปัจจุบันของ {len(branches)} สาขา ({len(cameras)} กล้อง)")
+    
+    def observe(self, records):
+        """
+        รับข้อมูลการนับที่บันทึกแล้ว และอัพเดตจำนวนรวมของสาขาที่เกี่ยวข้อง
+        
+        Args:
+            records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+        """
+        with self._lock:
+            persist_now = self._observe_locked(records)
+        
+        if persist_now:
+            self._wake.set()
+    
+    def _observe_locked(self, records):
+        """อัพเดตสถานะ (ต้องถือ lock อยู่) คืนค่า True ถ้าควรบันทึกลงฐานข้อมูลทันที"""
+        persist_now = False
+        
+        for record in records:
+            state = self._branches.get(record['branch_id'])
+            if state is None:
+                state = self._branches[record['branch_id']] = _BranchState()
+            
+            camera_id = record['camera_id']
+            timestamp = record['timestamp'].replace(tzinfo=None)
+            previous = state.cameras.get(camera_id)
+            
+            # ข้อมูลที่เก่ากว่าค่าล่าสุดของกล้อง (เช่นข้อมูลย้อนหลัง) ไม่เปลี่ยนจำนวนปัจจุบัน
+            if previous is not None and timestamp < previous[1]:
+                continue
+            
+            count = record['current_count']
+            state.cameras[camera_id] = (count, timestamp)
+            
+            if self.fusion == 'sum':
+                # กล้องแรกของสาขาแทนที่ค่าที่โหลดจากตาราง branches
+                if previous is None and not state.cameras.keys() - {camera_id}:
+                    state.total = count
+                else:
+                    state.total += count - (previous[0] if previous else 0)
+            else:
+                state.total = max(value for value, _ in state.cameras.values())
+            
+            if state.last_updated is None or timestamp > state.last_updated:
+                state.last_updated = timestamp
+            
+            if abs(state.total - state.persisted_total) >= self.persist_min_change:
+                persist_now = True
+        
+        return persist_now
+    
+    def get_branch(self, branch_id):
+        """
+        ดึงจำนวนลูกค้าปัจจุบันของสาขา
+        
+        Returns:
+            dict หรือ None ถ้าไม่พบสาขา
+        """
+        with self._lock:
+            state = self._branches.get(branch_id)
+            if state is None or not state.known:
+                return None
+            return self._to_dict(branch_id, state)
+    
+    def get_branches(self):
+        """ดึงจำนวนลูกค้าปัจจุบันของทุกสาขา"""
+        with self._lock:
+            return [
+                self._to_dict(branch_id, state)
+                for branch_id, state in self._branches.items()
+                if state.known
+            ]
+    
+    def _to_dict(self, branch_id, state):
+        return {
+            'branch_id': branch_id,
+            'name': state.name,
+            'capacity': state.capacity,
+            'current_count': state.total,
+            'last_updated': state.last_updated,
+            'cameras': [
+                {'camera_id': camera_id, 'current_count': count, 'timestamp': timestamp}
+                for camera_id, (count, timestamp) in state.cameras.items()
+            ]
+        }
+    
+    def set_branch(self, branch_id, name, capacity):
+        """อัพเดตข้อมูลสาขาหลังสร้างหรือแก้ไขสาขา"""
+        with self._lock:
+            state = self._branches.get(branch_id)
+            if state is None:
+                state = self._branches[branch_id] = _BranchState()
+            state.name = name
+            state.capacity = capacity
+            state.known = True
+    
+    def remove_branch(self, branch_id):
+        """ลบสาขาออกจากทะเบียนหลังลบสาขา"""
+        with self._lock:
+            self._branches.pop(branch_id, None)
+    
+    def refresh_branches(self, db):
+        """
+        อ่านรายการสาขาจากตาราง branches เพิ่มสาขาที่ยังไม่อยู่ในทะเบียน อัพเดตชื่อและความจุ
+        และลบสาขาที่ไม่อยู่ในตารางแล้ว
+        
+        Args:
+            db: database session
+        
+        Returns:
+            list: รหัสสาขาที่เปลี่ยนแปลง
+        """
+        branches = db.execute(
+            select(Branch.branch_id, Branch.name, Branch.capacity,
+                   Branch.current_customer_count, Branch.last_updated)
+        ).all()
+        
+        changed = []
+        with self._lock:
+            for branch_id, name, capacity, current_count, last_updated in branches:
+                state = self._branches.get(branch_id)
+                if state is None:
+                    state = self._branches[branch_id] = _BranchState()
+                if not state.known:
+                    # สาขาใหม่ที่ยังไม่มีข้อมูลจากกล้องใน process นี้ใช้ค่าจากตาราง branches
+                    if not state.cameras:
+                        state.total = state.persisted_total = current_count or 0
+                        state.last_updated = state.persisted_updated = last_updated
+                    state.known = True
+                    changed.append(branch_id)
+                elif state.name != name or state.capacity != capacity:
+                    changed.append(branch_id)
+                state.name = name
+                state.capacity = capacity
+            
+            existing = {branch_id for branch_id, *_ in branches}
+            for branch_id in [branch_id for branch_id, state in self._branches.items()
+                              if state.known and branch_id not in existing]:
+                del self._branches[branch_id]
+                changed.append(branch_id)
+            
+            self._refreshed_at = time.monotonic()
+        
+        if changed:
+            touch_branches(changed)
+        return changed
+    
+    def _refresh_if_due(self):
+        """อ่านรายการสาขาใหม่เมื่อครบ branch_refresh_interval วินาที (0 = ไม่อ่าน)"""
+        if not self.branch_refresh_interval or time.monotonic() - self._refreshed_at < self.branch_refresh_interval:
+            return
+        
+        db = get_session()
+        try:
+            changed = self.refresh_branches(db)
+            if changed:
+                logger.info(f"อัพเดตรายการสาขาในทะเบียนจากตาราง branches {len(changed)} สาขา")
+        except SQLAlchemyError as e:
+            logger.error(f"เกิดข้อผิดพลาดในการอ่านรายการสาขา: {str(e)}")
+        finally:
+            db.close()
+    
+    def persist(self):
+        """
+        บันทึกจำนวนลูกค้าของสาขาที่เปลี่ยนแปลงลงตาราง branches ด้วยคำสั่ง UPDATE เดียว
+        
+        Returns:
+            int: จำนวนสาขาที่บันทึก
+        """
+        with self._persist_lock:
+            with self._lock:
+                changes = [
+                    (branch_id, state.total, state.last_updated)
+                    for branch_id, state in self._branches.items()
+                    if state.known and (state.total != state.persisted_total
+                                        or state.last_updated != state.persisted_updated)
+                ]
+            
+            if not changes:
+                return 0
+            
+            table = Branch.__table__
+            statement = update(table) \
+                .where(table.c.branch_id == bindparam('b_branch_id')) \
+                .values(
+                    current_customer_count=bindparam('b_current_count'),
+                    last_updated=bindparam('b_timestamp')
+                )
+            
+            db = get_session()
+            try:
+                db.execute(statement, [
+                    {'b_branch_id': branch_id, 'b_current_count': total, 'b_timestamp': last_updated}
+                    for branch_id, total, last_updated in changes
+                ])
+                db.commit()
+            except SQLAlchemyError as e:
+                db.rollback()
+                logger.error(f"เกิดข้อผิดพลาดในการบันทึกจำนวนลูกค้าปัจจุบัน: {str(e)}")
+                return 0
+            finally:
+                db.close()
+            
+            with self._lock:
+                for branch_id, total, last_updated in changes:
+                    state = self._branches.get(branch_id)
+                    if state is not None:
+                        state.persisted_total = total
+                        state.persisted_updated = last_updated
+            
+            # ข้อมูลสาขาที่อ่านจากตาราง branches เปลี่ยนแล้ว
+            touch_branches([branch_id for branch_id, _, _ in changes])
+            
+            return len(changes)
+    
+    def start(self):
+        """เริ่มเธรดที่บันทึกข้อมูลลงฐานข้อมูลเป็นระยะ"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='occupancy-persister', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """หยุดเธรดและบันทึกข้อมูลที่เหลือก่อนปิดโปรแกรม"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.persist()
+    
+    def _run(self):
+        """ลูปหลักของเธรดบันทึกข้อมูล"""
+        while not self._stop_event.is_set():
+            self._wake.wait(self.persist_interval)
+            self._wake.clear()
+            self.persist()
+            self._refresh_if_due()
+
+def init_occupancy(config):
+    """
+    เริ่มต้นทะเบียนจำนวนลูกค้าปัจจุบันตามการตั้งค่าในส่วน [occupancy]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        OccupancyRegistry หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global occupancy_registry
+    
+    if not config.getboolean('occupancy', 'enabled', fallback=True):
+        return None
+    
+    if occupancy_registry is not None:
+        return occupancy_registry
+    
+    registry = OccupancyRegistry(
+        fusion=config.get('occupancy', 'fusion', fallback='sum'),
+        persist_interval=config.getfloat('occupancy', 'persist_interval', fallback=5.0),
+        persist_min_change=config.getint('occupancy', 'persist_min_change', fallback=5),
+        branch_refresh_interval=config.getfloat('occupancy', 'branch_refresh_interval', fallback=30.0)
+    )
+    
+    db = get_session()
+    try:
+        registry.load(db)
+    finally:
+        db.close()
+    
+    # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+    from server.ingest import add_commit_listener
+    add_commit_listener(registry.observe)
+    
+    registry.start()
+    atexit.register(registry.stop)
+    
+    occupancy_registry = registry
+    logger.info(f"เริ่มทะเบียนจำนวนลูกค้าปัจจุบัน (fusion: {registry.fusion})")
+    
+    return registry
+
+def get_occupancy_registry():
+    """คืนค่าทะเบียนที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return occupancy_registry
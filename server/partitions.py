@@ -0,0 +1,407 @@
+# server/partitions.py - แบ่งตาราง customer_counts เป็นพาร์ทิชันรายเดือน
+"""
+ข้อมูลการนับถูกแบ่งตามเดือนของ timestamp
+    
+    PostgreSQL     customer_counts เป็น partitioned table (PARTITION BY RANGE) มีพาร์ทิชัน
+                   customer_counts_pYYYYMM ฐานข้อมูลเลือกพาร์ทิชันทั้งตอนบันทึกและตอนอ่านเอง
+    SQLite/MySQL   ตารางจริงหนึ่งตารางต่อเดือน customer_counts_pYYYYMM โครงสร้างเดียวกับ customer_counts
+                   (ตาราง customer_counts เดิมว่างเปล่า) โมดูลนี้เลือกตารางให้ทั้งตอนบันทึกและตอนอ่าน
+
+counts = counts_table(start, end)       # อ่านเฉพาะพาร์ทิชันที่คาบเกี่ยวกับช่วง [start, end)
+select(counts.c.entry_count).where(counts.c.branch_id == 'BR001', counts.c.timestamp >= start, ...)
+
+ingest สร้างพาร์ทิชันของเดือนที่ยังไม่มีให้อัตโนมัติ การลบข้อมูลทั้งเดือนใช้ DROP TABLE แทน DELETE
+unique index ของ (camera_id, event_id) มีผลภายในพาร์ทิชันเดียวกัน (เดือนเดียวกัน)
+"""
+import re
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import MetaData, select, insert, delete, func, union_all, inspect, text
+from models.customer_count import CustomerCount
+from server.timebucket import time_bucket
+
+logger = logging.getLogger(__name__)
+
+# ตัวจัดการพาร์ทิชันที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน ใช้ตาราง customer_counts ตารางเดียว)
+count_partitions = None
+
+# ชื่อพาร์ทิชัน และชื่อพาร์ทิชันที่ถูกแยกออกเพื่อรอย้ายไปคลัง (_a ตามด้วยเวลาที่แยกเป็นไมโครวินาที)
+PARTITION_PATTERN = re.compile(r'^customer_counts_p(\d{4})(\d{2})$')
+DETACHED_PATTERN = re.compile(r'^customer_counts_p(\d{4})(\d{2})_a(\d+)$')
+
+# อายุของรายชื่อพาร์ทิชันที่จำไว้ (วินาที) ก่อนอ่านจากฐานข้อมูลใหม่
+TABLE_LIST_TTL = 5.0
+
+def month_start(timestamp):
+    """วันแรกของเดือนของเวลาที่กำหนด"""
+    return timestamp.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(month):
+    """วันแรกของเดือนถัดไป"""
+    return datetime(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+def partition_name(month):
+    """ชื่อพาร์ทิชันของเดือน เช่น customer_counts_p202401"""
+    return f"{CustomerCount.__tablename__}_p{month:%Y%m}"
+
+def partition_table(metadata, name):
+    """สร้าง Table ชื่อ name ที่มีคอลัมน์และ index เดียวกับ customer_counts ใน metadata"""
+    source = CustomerCount.__table__
+    table = source.to_metadata(metadata, name=name)
+    # ชื่อ index ของ SQLite และ PostgreSQL ต้องไม่ซ้ำกันทั้งฐานข้อมูล
+    for index in table.indexes:
+        if name not in index.name:
+            index.name = index.name.replace(source.name, name, 1)
+    return table
+
+class CountPartitions:
+    """เลือกพาร์ทิชันรายเดือนของ customer_counts สำหรับการบันทึกและการอ่าน"""
+    
+    def __init__(self, engine):
+        self.engine = engine
+        self.dialect_name = engine.dialect.name
+        # PostgreSQL ใช้ declarative partitioning ของฐานข้อมูลเอง
+        self.native = self.dialect_name == 'postgresql'
+        
+        self._metadata = MetaData()
+        self._tables = {}
+        self._names = None
+        self._listed_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _table_names(self, refresh=False):
+        """ชื่อตารางทั้งหมดในฐานข้อมูล (จำไว้ TABLE_LIST_TTL วินาที)"""
+        with self._lock:
+            if refresh or self._names is None or time.monotonic() - self._listed_at > TABLE_LIST_TTL:
+                self._names = inspect(self.engine).get_table_names()
+                self._listed_at = time.monotonic()
+            return self._names
+    
+    def _invalidate(self):
+        with self._lock:
+            self._names = None
+    
+    def months(self, refresh=False):
+        """เดือนที่มีพาร์ทิชัน (datetime ของวันแรกของเดือน เรียงจากเก่าไปใหม่)"""
+        months = []
+        for name in self._table_names(refresh):
+            match = PARTITION_PATTERN.match(name)
+            if match:
+                months.append(datetime(int(match.group(1)), int(match.group(2)), 1))
+        return sorted(months)
+    
+    def table(self, month, name=None):
+        """Table ของพาร์ทิชันเดือนนั้น (หรือของตารางชื่อ name ที่มีโครงสร้างเดียวกัน)"""
+        name = name or partition_name(month)
+        table = self._tables.get(name)
+        if table is not None:
+            return table
+        
+        table = partition_table(self._metadata, name)
+        self._tables[name] = table
+        return table
+    
+    def ensure(self, db, month):
+        """
+        สร้างพาร์ทิชันของเดือนถ้ายังไม่มี
+        
+        Returns:
+            Table ที่ใช้บันทึกข้อมูลของเดือนนั้น
+        """
+        if self.native:
+            if month not in self.months():
+                name = partition_name(month)
+                db.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {CustomerCount.__tablename__} "
+                    f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')"
+                ))
+                # unique index ของ partitioned table ต้องมีคอลัมน์ timestamp จึงสร้างแยกในแต่ละพาร์ทิชัน
+                db.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS uq_{name}_camera_event ON {name} (camera_id, event_id)"))
+                self._invalidate()
+            return CustomerCount.__table__
+        
+        table = self.table(month)
+        if month not in self.months():
+            if self.dialect_name in ('mysql', 'mariadb'):
+                # DDL ของ MySQL commit transaction ปัจจุบันทันที จึงสร้างผ่าน connection แยก
+                with self.engine.begin() as conn:
+                    table.create(bind=conn, checkfirst=True)
+            else:
+                table.create(bind=db.connection(), checkfirst=True)
+            self._invalidate()
+            logger.info(f"สร้างพาร์ทิชัน {table.name}")
+        return table
+    
+    def route(self, db, records):
+        """
+        แบ่งข้อมูลการนับตามพาร์ทิชันที่ต้องบันทึก (สร้างพาร์ทิชันที่ยังไม่มี)
+        
+        Returns:
+            list: (Table, รายการข้อมูล) ของแต่ละพาร์ทิชัน
+        """
+        by_month = {}
+        for record in records:
+            month = month_start(record['timestamp'].replace(tzinfo=None))
+            by_month.setdefault(month, []).append(record)
+        
+        if self.native:
+            for month in by_month:
+                self.ensure(db, month)
+            return [(CustomerCount.__table__, records)]
+        
+        return [(self.ensure(db, month), month_records) for month, month_records in sorted(by_month.items())]
+    
+    def source(self, start=None, end=None):
+        """
+        ตารางสำหรับอ่านข้อมูลการนับในช่วง [start, end) โดยอ่านเฉพาะพาร์ทิชันที่คาบเกี่ยวกับช่วงนั้น
+        
+        Returns:
+            Table หรือ subquery (UNION ALL ของหลายพาร์ทิชัน) ที่มีคอลัมน์เดียวกับ customer_counts
+        """
+        if self.native:
+            return CustomerCount.__table__
+        
+        tables = [
+            self.table(month) for month in self.months()
+            if (start is None or next_month(month) > start) and (end is None or month < end)
+        ]
+        if not tables:
+            # ไม่มีพาร์ทิชันในช่วงนี้ ตาราง customer_counts เดิมว่างเปล่าจึงใช้แทนได้
+            return CustomerCount.__table__
+        if len(tables) == 1:
+            return tables[0]
+        
+        # กรองช่วงเวลาในแต่ละพาร์ทิชันเพื่อให้ใช้ index ของแต่ละตาราง
+        def bounded(table):
+            statement = select(table)
+            if start is not None:
+                statement = statement.where(table.c.timestamp >= start)
+            if end is not None:
+                statement = statement.where(table.c.timestamp < end)
+            return statement
+        
+        return union_all(*map(bounded, tables)).subquery(CustomerCount.__tablename__)
+    
+    def time_range(self, db):
+        """
+        เวลาแรกและเวลาสุดท้ายของข้อมูลการนับ (อ่านเฉพาะพาร์ทิชันแรกและสุดท้ายที่มีข้อมูล)
+        
+        Returns:
+            tuple: (เวลาแรก, เวลาสุดท้าย) หรือ (None, None) ถ้าไม่มีข้อมูล
+        """
+        if self.native:
+            tables = [CustomerCount.__table__]
+        else:
+            tables = [self.table(month) for month in self.months()] or [CustomerCount.__table__]
+        
+        first = last = None
+        for table in tables:
+            first = db.execute(select(table.c.timestamp).order_by(table.c.timestamp).limit(1)).scalar()
+            if first is not None:
+                break
+        for table in reversed(tables):
+            last = db.execute(select(table.c.timestamp).order_by(table.c.timestamp.desc()).limit(1)).scalar()
+            if last is not None:
+                break
+        return first, last
+    
+    def detach(self, db, month):
+        """
+        แยกพาร์ทิชันของเดือนออกจากข้อมูลที่ใช้งาน (เปลี่ยนชื่อตาราง) แล้ว commit
+        
+        ข้อมูลของเดือนนั้นที่เข้ามาหลังจากนี้จะถูกบันทึกลงพาร์ทิชันใหม่
+        
+        Returns:
+            str: ชื่อตารางที่ถูกแยก
+        """
+        name = partition_name(month)
+        detached = f"{name}_a{time.time_ns() // 1000}"
+        
+        if self.native:
+            db.execute(text(f"ALTER TABLE {CustomerCount.__tablename__} DETACH PARTITION {name}"))
+        db.execute(text(f"ALTER TABLE {name} RENAME TO {detached}"))
+        
+        # index ย้ายตามตารางแต่ยังใช้ชื่อเดิม ต้องลบออกเพื่อให้สร้างพาร์ทิชันใหม่ของเดือนนี้ได้
+        # (ชื่อ index ของ MySQL แยกตามตาราง จึงไม่ชนกัน)
+        if self.native:
+            db.execute(text(f"DROP INDEX IF EXISTS uq_{name}_camera_event"))
+        elif self.dialect_name == 'sqlite':
+            for index in self.table(month).indexes:
+                db.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        
+        db.commit()
+        self._invalidate()
+        logger.info(f"แยกพาร์ทิชัน {name} เป็น {detached}")
+        return detached
+    
+    def detached(self):
+        """
+        ตารางที่ถูกแยกด้วย detach และยังไม่ถูกลบ
+        
+        Returns:
+            list: (เดือน, Table, ชื่อตาราง) เรียงตามชื่อ
+        """
+        result = []
+        for name in sorted(self._table_names(refresh=True)):
+            match = DETACHED_PATTERN.match(name)
+            if match:
+                month = datetime(int(match.group(1)), int(match.group(2)), 1)
+                result.append((month, self.table(month, name), name))
+        return result
+    
+    def drop(self, db, name):
+        """ลบพาร์ทิชันหรือตารางที่ถูกแยกทั้งตาราง แล้ว commit"""
+        db.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        db.commit()
+        table = self._tables.pop(name, None)
+        if table is not None:
+            self._metadata.remove(table)
+        self._invalidate()
+        logger.info(f"ลบตาราง {name}")
+    
+    def partition_existing(self, db):
+        """
+        ย้ายข้อมูลในตาราง customer_counts เดิมเข้าพาร์ทิชันรายเดือน (commit ทีละเดือน)
+        
+        Returns:
+            int: จำนวนข้อมูลการนับที่ย้าย
+        """
+        if self.native:
+            return self._convert_postgresql(db)
+        
+        counts = CustomerCount.__table__
+        month = time_bucket('month', counts.c.timestamp)
+        months = db.execute(
+            select(month).where(counts.c.timestamp.isnot(None)).group_by(month).order_by(month)
+        ).scalars().all()
+        
+        moved = 0
+        for start in months:
+            end = next_month(start)
+            table = self.ensure(db, start)
+            in_month = (counts.c.timestamp >= start, counts.c.timestamp < end)
+            moved += db.execute(insert(table).from_select(
+                [column.name for column in counts.columns], select(*counts.columns).where(*in_month)
+            )).rowcount
+            db.execute(delete(counts).where(*in_month))
+            db.commit()
+            logger.info(f"ย้ายข้อมูลการนับเดือน {start:%Y-%m} เข้าพาร์ทิชัน {table.name}")
+        
+        return moved
+    
+    def _convert_postgresql(self, db):
+        """เปลี่ยน customer_counts เป็น partitioned table และย้ายข้อมูลเดิมเข้าพาร์ทิชัน (transaction เดียว)"""
+        name = CustomerCount.__tablename__
+        relkind = db.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"), {'name': name}).scalar()
+        if relkind != 'r':
+            return 0
+        
+        old = f"{name}_unpartitioned"
+        db.execute(text(f"ALTER TABLE {name} RENAME TO {old}"))
+        db.execute(text(f"ALTER INDEX {name}_pkey RENAME TO {old}_pkey"))
+        for index in CustomerCount.__table__.indexes:
+            db.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        
+        db.execute(text(f"CREATE TABLE {name} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)"))
+        db.execute(text(f"ALTER TABLE {name} ALTER COLUMN timestamp SET NOT NULL"))
+        # primary key และ unique index ของ partitioned table ต้องมีคอลัมน์ที่ใช้แบ่งพาร์ทิชัน
+        db.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {name}_pkey PRIMARY KEY (id, timestamp)"))
+        for index in CustomerCount.__table__.indexes:
+            if 'timestamp' in index.columns:
+                index.create(bind=db.connection())
+        db.execute(text(f"ALTER SEQUENCE {name}_id_seq OWNED BY {name}.id"))
+        
+        months = db.execute(text(
+            f"SELECT DISTINCT date_trunc('month', timestamp) FROM {old} WHERE timestamp IS NOT NULL"
+        )).scalars().all()
+        for month in months:
+            self.ensure(db, month)
+        
+        moved = db.execute(text(f"INSERT INTO {name} SELECT * FROM {old} WHERE timestamp IS NOT NULL")).rowcount
+        db.execute(text(f"DROP TABLE {old}"))
+        db.commit()
+        
+        logger.info(f"เปลี่ยน {name} เป็น partitioned table และย้ายข้อมูลเดิม {moved} รายการ")
+        return moved
+
+def init_partitions(config):
+    """
+    เริ่มต้นการแบ่งพาร์ทิชันตามการตั้งค่าในส่วน [partitions]
+    
+    ถ้าตาราง customer_counts เดิมยังมีข้อมูล จะถูกย้ายเข้าพาร์ทิชันรายเดือนก่อน
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        CountPartitions หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global count_partitions
+    
+    # ถ้าไม่ได้ตั้งค่าไว้ถือว่าปิด เพราะการเปิดใช้งานกับฐานข้อมูลเดิมจะย้ายข้อมูลการนับทั้งหมด
+    # (config.ini ที่มากับโปรแกรมปิดไว้ การติดตั้งใหม่ที่สร้างไฟล์การตั้งค่าจาก initialize_config เปิดไว้)
+    if not config.getboolean('partitions', 'enabled', fallback=False):
+        return None
+    
+    if count_partitions is not None:
+        return count_partitions
+    
+    # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+    import server.db
+    if server.db.engine is None:
+        server.db.init_db(config)
+    
+    partitions = CountPartitions(server.db.engine)
+    
+    db = server.db.get_session()
+    try:
+        counts = CustomerCount.__table__
+        if inspect(server.db.engine).has_table(counts.name):
+            moved = partitions.partition_existing(db)
+            if moved:
+                logger.info(f"ย้ายข้อมูลการนับเดิม {moved} รายการเข้าพาร์ทิชันรายเดือน")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    
+    count_partitions = partitions
+    logger.info(f"เริ่มแบ่งพาร์ทิชันข้อมูลการนับรายเดือน ({partitions.dialect_name})")
+    
+    return partitions
+
+def get_partitions():
+    """คืนค่าตัวจัดการพาร์ทิชันที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return count_partitions
+
+def counts_table(start=None, end=None):
+    """
+    ตารางสำหรับอ่านข้อมูลการนับในช่วง [start, end)
+    
+    Returns:
+        customer_counts หรือเฉพาะพาร์ทิชันที่คาบเกี่ยวกับช่วงนั้น (ใช้ .c เหมือน Table)
+    """
+    if count_partitions is None:
+        return CustomerCount.__table__
+    return count_partitions.source(start, end)
+
+def route_counts(db, records):
+    """
+    แบ่งข้อมูลการนับที่จะบันทึกตามตาราง
+    
+    Returns:
+        list: (Table, รายการข้อมูล)
+    """
+    if count_partitions is None:
+        return [(CustomerCount.__table__, records)]
+    return count_partitions.route(db, records)
+
+def count_time_range(db):
+    """เวลาแรกและเวลาสุดท้ายของข้อมูลการนับ (None, None ถ้าไม่มีข้อมูล)"""
+    if count_partitions is None:
+        counts = CustomerCount.__table__
+        return db.execute(select(func.min(counts.c.timestamp), func.max(counts.c.timestamp))).one()
+    return count_partitions.time_range(db)
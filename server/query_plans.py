@@ -0,0 +1,289 @@
+# server/query_plans.py - ตรวจแผนการทำงานของคำสั่ง SELECT ที่ใช้บ่อยว่าไม่ถดถอยเป็นการอ่านทั้งตาราง
+"""
+เรียก endpoint ที่อ่านข้อมูลบ่อย (HOT_ENDPOINTS) ผ่าน test client ของ Flask บันทึกคำสั่ง SELECT ทุกคำสั่ง
+ที่ถูกส่งไปยังฐานข้อมูล แล้วรัน EXPLAIN ของแต่ละคำสั่งด้วยพารามิเตอร์เดิม
+    
+    SQLite      EXPLAIN QUERY PLAN          SCAN <ตาราง> (อ่านทั้งตารางหรือทั้ง index)
+    PostgreSQL  EXPLAIN (FORMAT JSON)       Seq Scan (ปิด enable_seqscan เพื่อไม่ให้ขึ้นกับขนาดข้อมูล)
+    MySQL       EXPLAIN                     type = ALL หรือ index
+
+คำสั่งที่อ่านทั้งตารางใน WATCHED_TABLES (รวมพาร์ทิชันรายเดือน) ถือว่าถดถอย
+ตารางอื่น เช่น branches และ users อ่านทั้งตารางได้ตามปกติ endpoint ที่ไม่มีคำสั่ง SELECT ให้ตรวจ
+(เช่นตอบ 4xx เพราะไม่มีข้อมูล) ถือว่าตรวจไม่ครบ
+
+python main.py --check-query-plans                  # ตรวจกับฐานข้อมูลตามการตั้งค่า
+python main.py --check-query-plans --sample-data    # ตรวจกับฐานข้อมูล SQLite ชั่วคราวที่มีข้อมูลตัวอย่าง (สำหรับ CI)
+
+ทั้งสองแบบออกด้วย exit code 1 ถ้ามีคำสั่งที่ถดถอยหรือ endpoint ที่ตรวจไม่ครบ
+"""
+import re
+import json
+import logging
+from datetime import timedelta
+from collections import Counter
+from sqlalchemy import event, select
+import server.db
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# endpoint ที่ตรวจ ({branch_id}, {camera_id} และวันที่ถูกแทนที่ก่อนเรียก)
+HOT_ENDPOINTS = (
+    '/api/v1/traffic/current',
+    '/api/v1/traffic/history/{branch_id}?start_date={today}&end_date={today}',
+    '/api/v1/traffic/history/{branch_id}?start_date={week_ago}&end_date={today}&interval=hour',
+    '/api/v1/traffic/history/{branch_id}?start_date={quarter_ago}&end_date={today}&interval=day',
+    '/api/v1/traffic/summary/{branch_id}',
+    '/api/v1/traffic/compare/{branch_id}',
+    '/api/v1/traffic/rankings',
+    '/api/v1/traffic/rankings?group_by=province&sort_by=capacity_pct',
+    '/api/v1/traffic/percentiles?start_date={quarter_ago}&end_date={today}',
+    '/api/v1/reports/daily/{branch_id}?date={today}',
+    '/api/v1/reports/weekly/{branch_id}?date={today}',
+    '/api/v1/reports/monthly/{branch_id}?date={month}',
+    '/api/v1/reports/comparison/{branch_id}?periods={week_ago}:{today}&previous=3',
+    '/api/v1/branches/{branch_id}',
+    '/api/v1/branches/{branch_id}/current-count',
+    '/api/v1/branches/current-counts',
+    '/api/v1/snapshots/camera/{camera_id}?start_date={week_ago}&end_date={today}',
+    '/dashboard',
+    '/branch/{branch_id}',
+    '/snapshots/{branch_id}',
+    '/admin',
+)
+
+# ตารางที่ต้องไม่ถูกอ่านทั้งตาราง (ชื่อที่ขึ้นต้นด้วย customer_counts รวมพาร์ทิชันรายเดือน)
+WATCHED_TABLES = ('customer_counts', 'traffic_rollup_minute', 'traffic_rollup_hour', 'traffic_rollup_day',
+                  'traffic_sketch_day', 'camera_latest', 'snapshots', 'devices')
+
+# ข้อมูลตัวอย่างของ seed_sample_data: (รหัสสาขา, ชื่อ, จังหวัด) กล้องต่อสาขา และจำนวนวันย้อนหลัง
+SAMPLE_BRANCHES = (
+    ('BR001', 'สาขาตัวอย่าง 1', 'กรุงเทพมหานคร'),
+    ('BR002', 'สาขาตัวอย่าง 2', 'เชียงใหม่'),
+)
+SAMPLE_CAMERAS = 2
+SAMPLE_DAYS = 100
+
+_SQLITE_SCAN = re.compile(r'^SCAN (\w+)')
+_SQLITE_SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)')
+
+def _watched(table):
+    return table is not None and (table in WATCHED_TABLES or table.startswith('customer_counts'))
+
+def _sqlite_scans(conn, statement, parameters):
+    """ตารางที่ถูกอ่านทั้งตารางและแผนการทำงานจาก EXPLAIN QUERY PLAN ของ SQLite"""
+    details = [row[-1] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+    # SCAN ของ subquery (เช่น UNION ALL ของพาร์ทิชัน) อ่านผลลัพธ์ที่กรองแล้ว ไม่ใช่ตาราง
+    subqueries = {match.group(1) for match in map(_SQLITE_SUBQUERY.match, details) if match}
+    scans = [match.group(1) for match in map(_SQLITE_SCAN.match, details) if match]
+    return [table for table in scans if table not in subqueries], details
+
+def _postgresql_scans(conn, statement, parameters):
+    """ตารางที่ถูกอ่านทั้งตารางและแผนการทำงานจาก EXPLAIN (FORMAT JSON) ของ PostgreSQL"""
+    conn.exec_driver_sql('SET enable_seqscan = off')
+    plan = conn.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    
+    scans, details = [], []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        details.append(f"{node['Node Type']} {node.get('Relation Name', '')}".strip())
+        if node['Node Type'] == 'Seq Scan':
+            scans.append(node.get('Relation Name'))
+        nodes.extend(node.get('Plans', []))
+    return scans, details
+
+def _mysql_scans(conn, statement, parameters):
+    """ตารางที่ถูกอ่านทั้งตารางและแผนการทำงานจาก EXPLAIN ของ MySQL"""
+    rows = [row._mapping for row in conn.exec_driver_sql('EXPLAIN ' + statement, parameters)]
+    scans = [row['table'] for row in rows if row['type'] in ('ALL', 'index')]
+    details = [f"{row['table']} type={row['type']} key={row['key']}" for row in rows]
+    return scans, details
+
+def _explain(conn, statement, parameters):
+    dialect_name = conn.dialect.name
+    if dialect_name == 'sqlite':
+        return _sqlite_scans(conn, statement, parameters)
+    if dialect_name == 'postgresql':
+        return _postgresql_scans(conn, statement, parameters)
+    if dialect_name in ('mysql', 'mariadb'):
+        return _mysql_scans(conn, statement, parameters)
+    raise ValueError(f'ไม่รองรับการตรวจแผนการทำงานของ {dialect_name}')
+
+def _sample_ids(db):
+    """รหัสสาขาและกล้องที่ใช้เรียก endpoint (ค่าตัวอย่างถ้ายังไม่มีข้อมูล)"""
+    from models.branch import Branch
+    from models.camera_latest import CameraLatest
+    
+    branch_id = db.execute(select(Branch.branch_id).order_by(Branch.id).limit(1)).scalar() or 'BR001'
+    camera_id = db.execute(
+        select(CameraLatest.camera_id).where(CameraLatest.branch_id == branch_id).limit(1)
+    ).scalar() or 'CAM001'
+    return branch_id, camera_id
+
+def seed_sample_data(app, days=SAMPLE_DAYS):
+    """
+    เพิ่มข้อมูลตัวอย่างให้ทุก endpoint ใน HOT_ENDPOINTS มีข้อมูลให้อ่าน (ใช้กับฐานข้อมูลชั่วคราวเท่านั้น)
+    
+    ข้อมูลการนับรายชั่วโมงย้อนหลัง days วันถูกส่งผ่าน /api/v1/traffic/batch จึงสร้างตารางสรุป
+    camera_latest และพาร์ทิชันแบบเดียวกับข้อมูลจริง ส่วนสแนปช็อตและอุปกรณ์ถูกเพิ่มลงตารางโดยตรง
+    
+    Args:
+        app: แอปพลิเคชัน Flask
+        days: จำนวนวันย้อนหลังของข้อมูลการนับ
+    
+    Returns:
+        int: จำนวนข้อมูลการนับที่เพิ่ม
+    """
+    from models.branch import Branch
+    from models.device import Device
+    from models.snapshot import Snapshot
+    
+    now = get_timezones().now().replace(minute=0, second=0, microsecond=0)
+    first = (now - timedelta(days=days)).replace(hour=0)
+    cameras = [(f'{branch_id}-CAM{index + 1:02d}', branch_id)
+               for branch_id, _, _ in SAMPLE_BRANCHES for index in range(SAMPLE_CAMERAS)]
+    
+    db = server.db.get_session()
+    try:
+        for branch_id, name, province in SAMPLE_BRANCHES:
+            db.add(Branch(branch_id=branch_id, name=name, province=province, capacity=50))
+        for camera_id, branch_id in cameras:
+            db.add(Device(device_id=f'device-{camera_id}', camera_id=camera_id, branch_id=branch_id, last_seen=now))
+            for hours in range(0, 7 * 24, 6):
+                db.add(Snapshot(camera_id=camera_id, branch_id=branch_id, timestamp=now - timedelta(hours=hours),
+                                filename=f'{camera_id}-{hours}.jpg', current_count=hours % 10))
+        db.commit()
+    finally:
+        db.close()
+    
+    records = []
+    timestamp = first
+    while timestamp <= now:
+        for index, (camera_id, branch_id) in enumerate(cameras):
+            records.append({
+                'camera_id': camera_id,
+                'branch_id': branch_id,
+                'timestamp': timestamp.isoformat(),
+                'entry_count': (timestamp.hour + index) % 7,
+                'exit_count': (timestamp.hour + index) % 5,
+                'current_count': (timestamp.hour * 3 + index) % 20
+            })
+        timestamp += timedelta(hours=1)
+    
+    client = app.test_client()
+    for start in range(0, len(records), 1000):
+        response = client.post('/api/v1/traffic/batch', json={'data': records[start:start + 1000]})
+        if response.status_code != 200:
+            raise RuntimeError(f'เพิ่มข้อมูลตัวอย่างไม่สำเร็จ: {response.get_json()}')
+    
+    logger.info(f"เพิ่มข้อมูลตัวอย่าง {len(SAMPLE_BRANCHES)} สาขา {len(cameras)} กล้อง {len(records)} รายการ")
+    return len(records)
+
+def capture_statements(app, endpoints=HOT_ENDPOINTS):
+    """
+    เรียก endpoint แล้วบันทึกคำสั่ง SELECT ที่ถูกส่งไปยังฐานข้อมูล
+    
+    Args:
+        app: แอปพลิเคชัน Flask
+        endpoints: รายการ URL (รูปแบบเดียวกับ HOT_ENDPOINTS)
+    
+    Returns:
+        tuple: (รายการ (endpoint, คำสั่ง SQL, พารามิเตอร์) ไม่ซ้ำกันตามคำสั่ง SQL,
+                รายการ (endpoint, เหตุผล) ของ endpoint ที่ไม่มีคำสั่งให้ตรวจ)
+    """
+    from models.user import User
+    from api.middleware.auth import generate_token
+    
+    db = server.db.get_session()
+    try:
+        branch_id, camera_id = _sample_ids(db)
+        admin = db.query(User).filter_by(is_admin=True).order_by(User.id).first()
+        if admin is None:
+            raise RuntimeError('ไม่พบผู้ใช้ admin สำหรับเรียก endpoint')
+        with app.test_request_context():
+            token = generate_token(admin)
+        admin_id, admin_username = admin.id, admin.username
+    finally:
+        db.close()
+    
+    today = get_timezones().now()
+    values = {
+        'branch_id': branch_id,
+        'camera_id': camera_id,
+        'today': today.strftime('%Y-%m-%d'),
+        'week_ago': (today - timedelta(days=7)).strftime('%Y-%m-%d'),
+        'quarter_ago': (today - timedelta(days=90)).strftime('%Y-%m-%d'),
+        'month': today.strftime('%Y-%m')
+    }
+    
+    captured = {}
+    selects = Counter()
+    unchecked = []
+    current = {'endpoint': None}
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.setdefault(statement, (current['endpoint'], statement, parameters))
+            selects[current['endpoint']] += 1
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = admin_id
+        session['username'] = admin_username
+        session['is_admin'] = True
+    
+    engine = server.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        for endpoint in endpoints:
+            current['endpoint'] = endpoint
+            url = endpoint.format(**values)
+            # endpoint ที่ผิดพลาดหลังจากอ่านข้อมูลแล้ว (เช่น template) ยังใช้คำสั่งที่บันทึกไว้ได้
+            try:
+                response = client.get(url, headers={'Authorization': f'Bearer {token}'})
+                # อ่าน body ให้ครบเพื่อให้คำสั่งของ response แบบ stream ถูกส่งไปยังฐานข้อมูล
+                response.get_data()
+                response.close()
+            except Exception as e:
+                logger.warning(f"{url} เกิดข้อผิดพลาด: {str(e)}")
+                if not selects[endpoint]:
+                    unchecked.append((endpoint, str(e)))
+                continue
+            if response.status_code >= 500:
+                logger.warning(f"{url} ตอบกลับ {response.status_code}")
+            # 4xx (เช่นไม่พบสาขา) หมายถึง query หลักของ endpoint ไม่ได้ทำงาน
+            if 400 <= response.status_code < 500 or not selects[endpoint]:
+                unchecked.append((endpoint, f'ตอบกลับ {response.status_code} และมีคำสั่ง SELECT {selects[endpoint]} คำสั่ง'))
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    
+    return list(captured.values()), unchecked
+
+def check_query_plans(app):
+    """
+    ตรวจแผนการทำงานของคำสั่ง SELECT จาก HOT_ENDPOINTS
+    
+    Args:
+        app: แอปพลิเคชัน Flask ที่ปิดแคชรายงานและ conditional GET (เพื่อให้ทุกคำสั่งถูกส่งไปยังฐานข้อมูล)
+    
+    Returns:
+        tuple: (รายการ dict ของแต่ละคำสั่ง: endpoint, statement, scans (ตารางใน WATCHED_TABLES
+                ที่ถูกอ่านทั้งตาราง), plan และรายการ (endpoint, เหตุผล) ของ endpoint ที่ตรวจไม่ครบ)
+    """
+    statements, unchecked = capture_statements(app)
+    
+    results = []
+    with server.db.engine.connect() as conn:
+        for endpoint, statement, parameters in statements:
+            scans, details = _explain(conn, statement, parameters)
+            results.append({
+                'endpoint': endpoint,
+                'statement': statement,
+                'scans': sorted({table for table in scans if _watched(table)}),
+                'plan': details
+            })
+        conn.rollback()
+    return results, unchecked
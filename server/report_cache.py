@@ -0,0 +1,270 @@
+# server/report_cache.py - แคชผลลัพธ์รายงานในหน่วยความจำ (LRU) ที่ถูกล้างเมื่อมีข้อมูลการนับใหม่
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import request, make_response
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# แคชที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+report_cache = None
+
+# รายการในแคช: เนื้อหาของ response และช่วงเวลาที่รายงานครอบคลุม [start, end)
+_Entry = namedtuple('_Entry', ('body', 'mimetype', 'headers', 'branch_id', 'start', 'end', 'expires'))
+
+# header ของ response ที่เก็บไว้ด้วย (เช่นชื่อไฟล์ของ CSV)
+_CACHED_HEADERS = ('Content-Disposition',)
+
+class ReportCache:
+    """
+    แคชผลลัพธ์รายงานตาม key (ประเภทรายงาน, สาขา, ช่วงเวลา, รูปแบบ)
+    
+    รายงานของช่วงที่ปิดแล้ว (สิ้นสุดก่อนวันนี้) เก็บไว้จนกว่าจะถูกไล่ออกตามลำดับ LRU
+    ส่วนรายงานของช่วงที่ยังไม่ปิด มีอายุไม่เกิน open_ttl วินาที เผื่อมีข้อมูลจาก process อื่น
+    ทั้งสองแบบจะถูกล้างทันทีเมื่อมีข้อมูลการนับใหม่ของสาขานั้นในช่วงเวลาของรายงาน
+    """
+    
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024, open_ttl=60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        
+        self._entries = OrderedDict()
+        self._size = 0
+        self._versions = {}  # branch_id -> จำนวนครั้งที่ข้อมูลของสาขาเปลี่ยน
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'invalidations': 0
+        }
+    
+    def branch_version(self, branch_id):
+        """ลำดับการเปลี่ยนแปลงข้อมูลของสาขา ใช้ตรวจว่ามีข้อมูลใหม่ระหว่างคำนวณรายงานหรือไม่"""
+        with self._lock:
+            return self._versions.get(branch_id, 0)
+    
+    def get(self, key):
+        """
+        ดึงรายการจากแคช
+        
+        Returns:
+            _Entry หรือ None ถ้าไม่มีในแคชหรือหมดอายุแล้ว
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires <= time.monotonic():
+                self._remove_locked(key)
+                entry = None
+            
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+    
+    def put(self, key, body, mimetype, headers, branch_id, start, end, version):
+        """
+        เก็บผลลัพธ์รายงานลงแคช
+        
+        Args:
+            key: key ของรายงาน
+            body: เนื้อหาของ response (bytes)
+            mimetype: ชนิดของเนื้อหา
+            headers: dict ของ header ที่ต้องส่งกลับพร้อมเนื้อหา
+            branch_id: รหัสสาขา
+            start, end: ช่วงเวลาที่รายงานครอบคลุม [start, end)
+            version: ค่าจาก branch_version() ก่อนเริ่มคำนวณ (ไม่เก็บถ้ามีข้อมูลใหม่ระหว่างนั้น)
+        
+        Returns:
+            bool: True ถ้าเก็บลงแคช
+        """
+        if len(body) > self.max_bytes:
+            return False
+        
+        # ช่วงที่ยังไม่สิ้นสุดอาจมีข้อมูลเพิ่ม (เวลาในเขตเวลาที่บันทึกแบบเดียวกับ start/end)
+        expires = None if end <= get_timezones().storage_now() else time.monotonic() + self.open_ttl
+        entry = _Entry(body, mimetype, headers, branch_id, start, end, expires)
+        
+        with self._lock:
+            if self._versions.get(branch_id, 0) != version:
+                return False
+            
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            self._stats['stores'] += 1
+            
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove_locked(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+        
+        return True
+    
+    def _remove_locked(self, key):
+        """ลบรายการออกจากแคช (ต้องถือ lock อยู่)"""
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body)
+    
+    def observe(self, records):
+        """
+        รับข้อมูลการนับที่บันทึกแล้ว และล้างรายงานที่ครอบคลุมเวลาของข้อมูลนั้น
+        
+        Args:
+            records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+        """
+        # ช่วงเวลาของข้อมูลใหม่แยกตามสาขา
+        touched = {}
+        for record in records:
+            timestamp = record['timestamp'].replace(tzinfo=None)
+            low, high = touched.get(record['branch_id'], (timestamp, timestamp))
+            touched[record['branch_id']] = (min(low, timestamp), max(high, timestamp))
+        
+        with self._lock:
+            for branch_id in touched:
+                self._versions[branch_id] = self._versions.get(branch_id, 0) + 1
+            
+            stale = [
+                key for key, entry in self._entries.items()
+                if entry.branch_id in touched
+                and entry.start <= touched[entry.branch_id][1]
+                and touched[entry.branch_id][0] < entry.end
+            ]
+            for key in stale:
+                self._remove_locked(key)
+            self._stats['invalidations'] += len(stale)
+    
+    def purge(self, branch_id=None):
+        """
+        ล้างแคช
+        
+        Args:
+            branch_id: ล้างเฉพาะรายงานของสาขานี้ (None = ทั้งหมด)
+        
+        Returns:
+            int: จำนวนรายการที่ถูกล้าง
+        """
+        with self._lock:
+            keys = [
+                key for key, entry in self._entries.items()
+                if branch_id is None or entry.branch_id == branch_id
+            ]
+            for key in keys:
+                self._remove_locked(key)
+            
+            # รายงานที่กำลังคำนวณอยู่ขณะล้างแคชจะไม่ถูกเก็บ
+            for branch in ([branch_id] if branch_id is not None else list(self._versions)):
+                self._versions[branch] = self._versions.get(branch, 0) + 1
+        
+        return len(keys)
+    
+    def stats(self):
+        """ข้อมูลสถิติของแคชสำหรับการติดตามการทำงาน"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'open_ttl': self.open_ttl
+            })
+        
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+def cached_report(report_type, period_func):
+    """
+    Decorator สำหรับ view ของรายงานที่รับ branch_id และพารามิเตอร์ date/format
+    
+    Args:
+        report_type: ชื่อประเภทรายงาน (ส่วนหนึ่งของ key)
+        period_func: ฟังก์ชันที่รับค่าพารามิเตอร์ date (หรือ None) และ branch_id แล้วคืนค่า (start, end)
+                     ถ้าวันที่ไม่ถูกต้องให้ raise ValueError แล้ว view จะตอบข้อผิดพลาดเอง
+    
+    Returns:
+        decorator: ฟังก์ชันที่ครอบ view ด้วยแคช
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated(branch_id, *args, **kwargs):
+            cache = report_cache
+            if cache is None:
+                return f(branch_id, *args, **kwargs)
+            
+            try:
+                start, end = period_func(request.args.get('date'), branch_id)
+            except ValueError:
+                return f(branch_id, *args, **kwargs)
+            
+            key = (report_type, branch_id, start, request.args.get('format', 'json'))
+            entry = cache.get(key)
+            if entry is not None:
+                response = make_response(entry.body)
+                response.mimetype = entry.mimetype
+                response.headers.update(entry.headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            
+            version = cache.branch_version(branch_id)
+            response = make_response(f(branch_id, *args, **kwargs))
+            
+            if response.status_code == 200:
+                # send_file ส่งเนื้อหาแบบ passthrough ต้องอ่านออกมาก่อนเก็บ
+                response.direct_passthrough = False
+                headers = {name: response.headers[name] for name in _CACHED_HEADERS if name in response.headers}
+                cache.put(key, response.get_data(), response.mimetype, headers,
+                          branch_id, start, end, version)
+            
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        
+        return decorated
+    
+    return decorator
+
+def init_report_cache(config):
+    """
+    เริ่มต้นแคชรายงานตามการตั้งค่าในส่วน [report_cache]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        ReportCache หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global report_cache
+    
+    if not config.getboolean('report_cache', 'enabled', fallback=True):
+        return None
+    
+    if report_cache is not None:
+        return report_cache
+    
+    cache = ReportCache(
+        max_entries=config.getint('report_cache', 'max_entries', fallback=512),
+        max_bytes=int(config.getfloat('report_cache', 'max_size_mb', fallback=64) * 1024 * 1024),
+        open_ttl=config.getfloat('report_cache', 'open_ttl', fallback=60.0)
+    )
+    
+    # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+    from server.ingest import add_commit_listener
+    add_commit_listener(cache.observe)
+    
+    report_cache = cache
+    logger.info(f"เริ่มแคชรายงาน (สูงสุด {cache.max_entries} รายการ)")
+    
+    return cache
+
+def get_report_cache():
+    """คืนค่าแคชรายงานที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return report_cache
@@ -0,0 +1,364 @@
+# server/rollups.py - ตารางสรุปข้อมูลการนับรายนาที/ชั่วโมง/วัน และการอ่านข้อมูลจากตารางที่เหมาะสม
+import logging
+from datetime import timedelta
+from sqlalchemy import insert, update, select, delete, bindparam, func, case, and_, or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from models.traffic_rollup import TrafficRollupMinute, TrafficRollupHour, TrafficRollupDay
+from server.timebucket import time_bucket
+from server.archive import get_archive
+from server.partitions import counts_table, count_time_range
+from server.utilisation import new_timeline
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# ระดับของตารางสรุป เรียงจากละเอียดไปหยาบ
+GRAINS = ('minute', 'hour', 'day')
+
+ROLLUP_MODELS = {
+    'minute': TrafficRollupMinute,
+    'hour': TrafficRollupHour,
+    'day': TrafficRollupDay
+}
+
+# คอลัมน์ที่ระบุแถวของตารางสรุป
+KEY_FIELDS = ('branch_id', 'bucket', 'camera_id')
+
+# วิธีรวมค่าของแต่ละคอลัมน์เมื่อมีข้อมูลใหม่ในช่วงเวลาเดิม
+SUM_FIELDS = ('entry_count', 'exit_count', 'sample_count', 'occupancy_seconds', 'busy_seconds')
+MAX_FIELDS = ('max_count',)
+MIN_FIELDS = ('min_count',)
+
+# จำนวนข้อมูลการนับที่อ่านต่อครั้งระหว่าง backfill
+BACKFILL_BATCH_SIZE = 10000
+
+# จำนวนแถวที่อ่านจาก cursor ต่อครั้งเมื่ออ่านข้อมูลตามช่วงเวลา
+SERIES_FETCH_SIZE = 1000
+
+def truncate(timestamp, grain):
+    """
+    ปัดเวลาลงเป็นเวลาเริ่มต้นของช่วงตามระดับที่กำหนด
+    
+    Args:
+        timestamp: datetime (ถ้ามี timezone จะถูกตัดออกแบบเดียวกับค่าที่บันทึกในฐานข้อมูล)
+        grain: 'minute', 'hour' หรือ 'day'
+    
+    Returns:
+        datetime: เวลาเริ่มต้นของช่วง
+    """
+    timestamp = timestamp.replace(tzinfo=None, second=0, microsecond=0)
+    if grain in ('hour', 'day'):
+        timestamp = timestamp.replace(minute=0)
+    if grain == 'day':
+        timestamp = timestamp.replace(hour=0)
+    return timestamp
+
+def _combine(rows, grain):
+    """รวมแถวข้อมูลสรุปที่อยู่ในช่วงเดียวกันของระดับที่กำหนด (แถวเดิมไม่ถูกแก้ไข)"""
+    combined = {}
+    
+    for row in rows:
+        bucket = truncate(row['bucket'], grain)
+        key = (row['branch_id'], bucket, row['camera_id'])
+        current = combined.get(key)
+        
+        if current is None:
+            combined[key] = dict(row, bucket=bucket)
+            continue
+        
+        for field in SUM_FIELDS:
+            current[field] += row[field]
+        for field in MAX_FIELDS:
+            current[field] = max(current[field], row[field])
+        for field in MIN_FIELDS:
+            current[field] = min(current[field], row[field])
+    
+    return [combined[key] for key in sorted(combined)]
+
+def _merged_values(table, new, greatest, least):
+    """ค่าของแต่ละคอลัมน์หลังรวมแถวเดิมกับแถวใหม่ (ใช้ในส่วน UPDATE ของ upsert)"""
+    values = {field: table.c[field] + new[field] for field in SUM_FIELDS}
+    values.update({field: greatest(table.c[field], new[field]) for field in MAX_FIELDS})
+    values.update({field: least(table.c[field], new[field]) for field in MIN_FIELDS})
+    return values
+
+def _upsert_rollup(table, dialect_name):
+    """
+    สร้างคำสั่ง upsert ที่บวกค่าใหม่เข้ากับแถวเดิมของช่วงเวลาเดียวกัน
+    
+    Returns:
+        คำสั่ง INSERT หรือ None ถ้าฐานข้อมูลไม่รองรับ upsert
+    """
+    if dialect_name == 'sqlite':
+        # max()/min() ที่มีหลายอาร์กิวเมนต์ของ SQLite เป็นฟังก์ชันแบบ scalar
+        statement = sqlite_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[table.c[field] for field in KEY_FIELDS],
+            set_=_merged_values(table, statement.excluded, func.max, func.min)
+        )
+    
+    if dialect_name == 'postgresql':
+        statement = pg_insert(table)
+        return statement.on_conflict_do_update(
+            index_elements=[table.c[field] for field in KEY_FIELDS],
+            set_=_merged_values(table, statement.excluded, func.greatest, func.least)
+        )
+    
+    if dialect_name in ('mysql', 'mariadb'):
+        statement = mysql_insert(table)
+        return statement.on_duplicate_key_update(
+            _merged_values(table, statement.inserted, func.greatest, func.least)
+        )
+    
+    return None
+
+def _store_rollup_rows(db, table, rows, dialect_name):
+    """บันทึกแถวข้อมูลสรุปด้วย upsert แบบ executemany หรือแยก INSERT/UPDATE ถ้าไม่รองรับ"""
+    statement = _upsert_rollup(table, dialect_name)
+    if statement is not None:
+        db.execute(statement, rows)
+        return
+    
+    buckets = [row['bucket'] for row in rows]
+    existing = {
+        tuple(key) for key in db.execute(
+            select(*[table.c[field] for field in KEY_FIELDS])
+            .where(table.c.branch_id.in_({row['branch_id'] for row in rows}))
+            .where(table.c.bucket.between(min(buckets), max(buckets)))
+        ).all()
+    }
+    new_rows = [row for row in rows if tuple(row[field] for field in KEY_FIELDS) not in existing]
+    existing_rows = [
+        {('b_' + key): value for key, value in row.items()}
+        for row in rows
+        if tuple(row[field] for field in KEY_FIELDS) in existing
+    ]
+    
+    if new_rows:
+        db.execute(insert(table), new_rows)
+    if existing_rows:
+        values = {field: table.c[field] + bindparam('b_' + field) for field in SUM_FIELDS}
+        values.update({
+            field: case((table.c[field] < bindparam('b_' + field), bindparam('b_' + field)), else_=table.c[field])
+            for field in MAX_FIELDS
+        })
+        values.update({
+            field: case((table.c[field] > bindparam('b_' + field), bindparam('b_' + field)), else_=table.c[field])
+            for field in MIN_FIELDS
+        })
+        db.execute(
+            update(table)
+            .where(and_(*[table.c[field] == bindparam('b_' + field) for field in KEY_FIELDS]))
+            .values(values),
+            existing_rows
+        )
+
+def update_rollups(db, records, timeline=None):
+    """
+    เพิ่มข้อมูลการนับใหม่เข้าตารางสรุปทุกระดับ (ผู้เรียกต้อง commit เอง)
+    
+    ต้องส่งเฉพาะรายการที่บันทึกใหม่เท่านั้น เพราะค่าจะถูกบวกเพิ่มเข้ากับแถวเดิม
+    ข้อมูลถูกรวมในหน่วยความจำก่อน จึงใช้คำสั่ง upsert เพียงหนึ่งคำสั่งต่อระดับ
+    
+    Args:
+        db: database session
+        records: รายการข้อมูลที่ผ่าน parse_count แล้วและเพิ่งบันทึกลง customer_counts
+        timeline: OccupancyTimeline สำหรับคำนวณ occupancy_seconds/busy_seconds (None = ไม่คำนวณ)
+    """
+    if not records:
+        return
+    
+    dialect_name = db.get_bind().dialect.name
+    rows = [
+        {
+            'branch_id': record['branch_id'],
+            'bucket': record['timestamp'],
+            'camera_id': record['camera_id'],
+            'entry_count': record['entry_count'],
+            'exit_count': record['exit_count'],
+            'max_count': record['current_count'],
+            'min_count': record['current_count'],
+            'sample_count': 1,
+            'occupancy_seconds': 0.0,
+            'busy_seconds': 0.0
+        }
+        for record in records
+    ]
+    if timeline is not None:
+        rows.extend(timeline.integrate(records))
+    
+    # แต่ละระดับรวมต่อจากระดับที่ละเอียดกว่า แถวถูกเรียงตาม key เพื่อลด deadlock ระหว่าง transaction
+    for grain in GRAINS:
+        rows = _combine(rows, grain)
+        _store_rollup_rows(db, ROLLUP_MODELS[grain].__table__, rows, dialect_name)
+
+def backfill_rollups(db, start=None, end=None, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    สร้างข้อมูลสรุปใหม่จากตาราง customer_counts (และคลังข้อมูลเก่าถ้าเปิดใช้งาน) ทีละวัน
+    
+    แต่ละวันจะถูกลบข้อมูลสรุปเดิมแล้วคำนวณใหม่ใน transaction เดียว จึงรันซ้ำได้อย่างปลอดภัย
+    ควรรันขณะที่ไม่มีการรับข้อมูลของวันที่กำลังคำนวณ
+    
+    ข้อมูลถูกอ่านเรียงตามเวลา occupancy_seconds/busy_seconds จึงต่อเนื่องข้ามวันตั้งแต่ข้อมูลแรกของแต่ละสาขาในช่วงที่ระบุ
+    
+    Args:
+        db: database session
+        start: วันแรกที่ต้องการ (None = วันของข้อมูลแรก)
+        end: สิ้นสุดก่อนเวลานี้ (None = หลังข้อมูลล่าสุด)
+        batch_size: จำนวนข้อมูลการนับที่อ่านต่อครั้ง
+    
+    Returns:
+        dict: days (จำนวนวันที่คำนวณ) และ records (จำนวนข้อมูลการนับที่อ่าน)
+    """
+    archive = get_archive()
+    result = {'days': 0, 'records': 0}
+    
+    if start is None or end is None:
+        first, last = count_time_range(db)
+        archived_first = archive.first_month() if archive is not None else None
+        if archived_first is not None:
+            first = min(first or archived_first, archived_first)
+            last = last or get_timezones().storage_now()
+        if first is None:
+            return result
+        start = first if start is None else start
+        end = last + timedelta(days=1) if end is None else end
+    
+    timeline = new_timeline()
+    if timeline is not None:
+        timeline.load(db)
+    
+    day = truncate(start, 'day')
+    while day < end:
+        next_day = day + timedelta(days=1)
+        # หนึ่งวันอยู่ในพาร์ทิชันเดียวเสมอ id จึงไม่ซ้ำกันภายในวัน
+        counts = counts_table(day, next_day)
+        columns = [counts.c.id, counts.c.branch_id, counts.c.camera_id, counts.c.timestamp,
+                   counts.c.entry_count, counts.c.exit_count, counts.c.current_count]
+        
+        for model in ROLLUP_MODELS.values():
+            table = model.__table__
+            db.execute(delete(table).where(table.c.bucket >= day, table.c.bucket < next_day))
+        
+        # อ่านแบบ keyset ตาม (timestamp, id) เพื่อไม่ต้องโหลดข้อมูลทั้งวันไว้ในหน่วยความจำ
+        last_timestamp, last_id = day, 0
+        while True:
+            rows = db.execute(
+                select(*columns)
+                .where(counts.c.timestamp < next_day)
+                .where(or_(
+                    counts.c.timestamp > last_timestamp,
+                    and_(counts.c.timestamp == last_timestamp, counts.c.id > last_id)
+                ))
+                .order_by(counts.c.timestamp, counts.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            
+            last_timestamp, last_id = rows[-1].timestamp, rows[-1].id
+            update_rollups(db, [row._asdict() for row in rows], timeline)
+            result['records'] += len(rows)
+        
+        # ข้อมูลของวันนี้ที่ถูกย้ายไปคลังแล้ว (เรียงตามเวลาภายในแต่ละสาขา)
+        if archive is not None:
+            records = list(archive.iter_records(day, next_day))
+            for offset in range(0, len(records), batch_size):
+                update_rollups(db, records[offset:offset + batch_size], timeline)
+            result['records'] += len(records)
+        
+        db.commit()
+        result['days'] += 1
+        day = next_day
+    
+    logger.info(f"สร้างข้อมูลสรุปใหม่ {result['days']} วัน จากข้อมูลการนับ {result['records']} รายการ")
+    return result
+
+def choose_grain(start, end=None, interval=None):
+    """
+    เลือกตารางสรุประดับที่หยาบที่สุดที่ตอบคำขอได้ถูกต้อง
+    
+    ระดับที่เลือกต้องไม่หยาบกว่า interval และขอบเขตของช่วงเวลาต้องตรงกับขอบของช่วงในระดับนั้น
+    เช่น รายงาน 30 วันรายชั่วโมงที่เริ่มเที่ยงคืนจะอ่านจากตารางรายชั่วโมง (720 แถวต่อกล้อง)
+    
+    Args:
+        start: เวลาเริ่มต้น
+        end: เวลาสิ้นสุด (ไม่รวม) หรือ None ถ้าไม่จำกัด
+        interval: ระดับของผลลัพธ์ที่ต้องการ ('minute', 'hour', 'day', 'week', 'month') หรือ None
+    
+    Returns:
+        str: ระดับของตารางสรุป
+    """
+    finest = GRAINS.index(interval) if interval in GRAINS else len(GRAINS) - 1
+    
+    for grain in reversed(GRAINS[:finest + 1]):
+        if truncate(start, grain) == start and (end is None or truncate(end, grain) == end):
+            return grain
+    
+    # ขอบเขตที่มีเศษวินาทีจะถูกปัดลงเป็นนาที
+    return GRAINS[0]
+
+def iter_rollup_series(db, start, end=None, interval='hour', branch_ids=None, offset=None):
+    """
+    ดึงข้อมูลการนับตามช่วงเวลาของแต่ละสาขา (รวมทุกกล้อง) จากตารางสรุปด้วย query เดียว
+    
+    คำสั่งถูกรันทันที ส่วนผลลัพธ์ถูกอ่านจาก cursor ทีละแถวระหว่างวนลูป
+    ถ้า interval หยาบกว่าตารางที่เลือก (เช่น week/month หรือช่วงเวลาที่ไม่ตรงขอบวัน)
+    จะจัดกลุ่มต่อในฐานข้อมูลด้วย time_bucket
+    
+    Args:
+        db: database session (ต้องเปิดไว้จนกว่าจะอ่านผลลัพธ์ครบ)
+        start: เวลาเริ่มต้น
+        end: เวลาสิ้นสุด (ไม่รวม) หรือ None ถ้าไม่จำกัด
+        interval: ระดับของผลลัพธ์ ('minute', 'hour', 'day', 'week' หรือ 'month')
+        branch_ids: รายการรหัสสาขา (None = ทุกสาขา)
+        offset: ผลต่างของเวลาท้องถิ่นกับเขตเวลาที่บันทึก (TimezoneService.offset)
+                ถ้าระบุ bucket ของผลลัพธ์เป็นเวลาท้องถิ่น
+    
+    Returns:
+        iterator: tuple (branch_id, bucket, entries, exits, max_count, min_count, samples)
+                  เรียงตามสาขาและเวลา
+    """
+    grain = choose_grain(start, end, interval)
+    table = ROLLUP_MODELS[grain].__table__
+    if offset:
+        bucket = time_bucket(interval, table.c.bucket, offset=offset)
+    else:
+        bucket = table.c.bucket if grain == interval else time_bucket(interval, table.c.bucket)
+    
+    statement = select(
+            table.c.branch_id,
+            bucket,
+            func.sum(table.c.entry_count),
+            func.sum(table.c.exit_count),
+            func.max(table.c.max_count),
+            func.min(table.c.min_count),
+            func.sum(table.c.sample_count)
+        ) \
+        .where(table.c.bucket >= truncate(start, grain)) \
+        .group_by(table.c.branch_id, bucket) \
+        .order_by(table.c.branch_id, bucket)
+    
+    if end is not None:
+        statement = statement.where(table.c.bucket < end)
+    if branch_ids is not None:
+        statement = statement.where(table.c.branch_id.in_(branch_ids))
+    
+    result = db.execute(statement.execution_options(yield_per=SERIES_FETCH_SIZE))
+    
+    return (
+        (branch_id, bucket, int(entries or 0), int(exits or 0),
+         int(max_count or 0), int(min_count or 0), int(samples or 0))
+        for branch_id, bucket, entries, exits, max_count, min_count, samples in result
+    )
+
+def rollup_series(db, start, end=None, interval='hour', branch_ids=None, offset=None):
+    """
+    ดึงข้อมูลการนับตามช่วงเวลาของแต่ละสาขาเป็นรายการ (ดู iter_rollup_series)
+    
+    Returns:
+        list: tuple (branch_id, bucket, entries, exits, max_count, min_count, samples)
+    """
+    return list(iter_rollup_series(db, start, end, interval, branch_ids, offset))
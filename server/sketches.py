@@ -0,0 +1,331 @@
+# server/sketches.py - quantile sketch ที่รวมกันได้ สำหรับ p50/p90/p99 ของจำนวนคนเข้าและจำนวนคนสูงสุดต่อชั่วโมง
+"""
+QuantileSketch เป็น sketch แบบ DDSketch: ค่าบวก x ถูกนับในช่อง ceil(log_gamma(x)) โดย
+gamma = (1 + a) / (1 - a) ค่าที่ประมาณได้จึงคลาดเคลื่อนไม่เกิน a (relative_accuracy) ของค่าจริง
+การรวม sketch สองตัวคือการบวกจำนวนในช่องเดียวกัน ผลลัพธ์จึงเหมือนกับการสร้างจากข้อมูลทั้งหมดในครั้งเดียว
+และขนาดขึ้นกับช่วงของค่า (ไม่กี่ร้อยช่อง) ไม่ใช่จำนวนข้อมูล
+
+ตาราง traffic_sketch_day เก็บ sketch ของค่ารายชั่วโมงของแต่ละสาขาต่อวัน
+    
+    entries  จำนวนคนเข้าทั้งชั่วโมง (รวมทุกกล้อง)
+    peak     จำนวนคนสูงสุดระหว่างชั่วโมง (max_count สูงสุดของทุกกล้อง เหมือน max_count ของ /traffic/history
+             และ /traffic/rankings ผลรวม max_count ของแต่ละกล้องไม่ใช่จำนวนคนพร้อมกัน เพราะแต่ละกล้องอาจสูงสุดคนละนาที)
+
+sketch ไม่ได้ถูกอัพเดตระหว่างบันทึกข้อมูลการนับ (ค่ารายชั่วโมงยังเปลี่ยนจนกว่าชั่วโมงจะจบ)
+sketch ของวันที่ปิดแล้วถูกสร้างจากตารางสรุปรายชั่วโมงเมื่อถูกขอครั้งแรกแล้วบันทึกไว้ พร้อมผลรวม sample_count
+และ max_count ของวันนั้นจากตารางสรุปรายวัน ถ้าผลรวมไม่ตรงกับตารางสรุปปัจจุบัน (มีข้อมูลย้อนหลังเข้ามา
+หรือคำนวณตารางสรุปใหม่) sketch จะถูกสร้างใหม่ ส่วนวันปัจจุบันคำนวณจากตารางสรุปรายชั่วโมงทุกครั้งโดยไม่บันทึก
+"""
+import math
+import struct
+import logging
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import select, delete, insert, func
+from sqlalchemy.exc import SQLAlchemyError
+from models.traffic_rollup import TrafficRollupHour, TrafficRollupDay
+from models.traffic_sketch import TrafficSketchDay
+from server.timezones import get_timezones
+
+logger = logging.getLogger(__name__)
+
+# ที่เก็บ sketch ที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+sketch_store = None
+
+# ความคลาดเคลื่อนสัมพัทธ์เริ่มต้นของค่าที่ประมาณได้
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# quantile เริ่มต้นของ /traffic/percentiles
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+
+# ค่าที่เก็บ sketch (ชื่อใน API -> คอลัมน์ของตาราง traffic_sketch_day)
+SKETCH_METRICS = {
+    'entries': 'entries_sketch',
+    'peak': 'peak_sketch'
+}
+
+# ส่วนหัวของ sketch ที่บันทึก: relative_accuracy, จำนวนค่าที่เป็นศูนย์, จำนวนช่อง
+_HEADER = struct.Struct('<dqI')
+
+class QuantileSketch:
+    """sketch ของค่าที่ไม่ติดลบ (ค่าที่น้อยกว่าหรือเท่ากับศูนย์ถูกนับเป็นศูนย์)"""
+    
+    __slots__ = ('relative_accuracy', 'gamma', '_log_gamma', 'keys', 'counts', 'zero_count')
+    
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy ต้องอยู่ระหว่าง 0 ถึง 1')
+        
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.keys = np.empty(0, dtype=np.int32)     # ช่องที่มีค่า (เรียงจากน้อยไปมาก)
+        self.counts = np.empty(0, dtype=np.int64)   # จำนวนค่าในแต่ละช่อง
+        self.zero_count = 0
+    
+    @property
+    def count(self):
+        """จำนวนค่าทั้งหมดใน sketch"""
+        return self.zero_count + int(self.counts.sum())
+    
+    def _merge_bins(self, keys, counts):
+        keys = np.concatenate((self.keys, keys))
+        counts = np.concatenate((self.counts, counts))
+        self.keys, inverse = np.unique(keys, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts, minlength=len(self.keys)).astype(np.int64)
+    
+    def add(self, values):
+        """
+        เพิ่มค่าลง sketch
+        
+        Args:
+            values: ตัวเลขหรือลำดับของตัวเลข
+        """
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        positive = values[values > 0]
+        self.zero_count += len(values) - len(positive)
+        
+        if len(positive):
+            keys, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma).astype(np.int32),
+                                     return_counts=True)
+            self._merge_bins(keys, counts)
+    
+    def merge(self, *others):
+        """
+        รวม sketch อื่นเข้ากับ sketch นี้ (รวมหลายตัวพร้อมกันได้ในครั้งเดียว)
+        
+        Raises:
+            ValueError: ถ้า relative_accuracy ไม่เท่ากัน
+        """
+        if any(other.relative_accuracy != self.relative_accuracy for other in others):
+            raise ValueError('รวม sketch ที่มี relative_accuracy ต่างกันไม่ได้')
+        
+        self.zero_count += sum(other.zero_count for other in others)
+        others = [other for other in others if len(other.keys)]
+        if others:
+            self._merge_bins(np.concatenate([other.keys for other in others]),
+                             np.concatenate([other.counts for other in others]))
+    
+    def quantile(self, q):
+        """
+        ค่าที่ quantile q (0-1) ปัดเป็นจำนวนเต็มที่ใกล้ที่สุด เนื่องจากค่าที่เก็บเป็นจำนวนคน
+        
+        Returns:
+            int หรือ None ถ้า sketch ว่าง
+        """
+        total = self.count
+        if total == 0:
+            return None
+        
+        rank = q * (total - 1)
+        if rank < self.zero_count:
+            return 0
+        
+        index = int(np.searchsorted(np.cumsum(self.counts), rank - self.zero_count, side='right'))
+        key = int(self.keys[min(index, len(self.keys) - 1)])
+        # ค่ากลางของช่อง (gamma^(key-1), gamma^key] ที่คลาดเคลื่อนสัมพัทธ์ไม่เกิน relative_accuracy
+        return int(round(2 * self.gamma ** key / (self.gamma + 1)))
+    
+    def to_bytes(self):
+        """แปลง sketch เป็น bytes สำหรับบันทึกลงฐานข้อมูล"""
+        return (_HEADER.pack(self.relative_accuracy, self.zero_count, len(self.keys))
+                + self.keys.astype('<i4').tobytes() + self.counts.astype('<i8').tobytes())
+    
+    @classmethod
+    def from_bytes(cls, data):
+        """สร้าง sketch จาก bytes ที่ได้จาก to_bytes"""
+        relative_accuracy, zero_count, size = _HEADER.unpack_from(data)
+        sketch = cls(relative_accuracy)
+        sketch.zero_count = zero_count
+        offset = _HEADER.size
+        sketch.keys = np.frombuffer(data, dtype='<i4', count=size, offset=offset).astype(np.int32)
+        sketch.counts = np.frombuffer(data, dtype='<i8', count=size, offset=offset + 4 * size).astype(np.int64)
+        return sketch
+
+def _day_start(timestamp):
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+class SketchStore:
+    """สร้าง บันทึก และรวม sketch รายวันของตาราง traffic_sketch_day"""
+    
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+    
+    def _build(self, db, start, end, branch_ids=None):
+        """
+        สร้าง sketch ของแต่ละสาขาต่อวันจากตารางสรุปรายชั่วโมงในช่วง [start, end)
+        
+        Returns:
+            dict: (branch_id, วัน) -> (จำนวนชั่วโมง, {ชื่อค่า: QuantileSketch})
+        """
+        table = TrafficRollupHour.__table__
+        # ชั่วโมงที่มีแต่แถวของ visitor-minutes (sample_count = 0) ไม่มีข้อมูลการนับจริง
+        statement = select(table.c.branch_id, table.c.bucket, func.sum(table.c.entry_count), func.max(table.c.max_count)) \
+            .where(table.c.bucket >= start, table.c.bucket < end) \
+            .group_by(table.c.branch_id, table.c.bucket) \
+            .having(func.sum(table.c.sample_count) > 0)
+        if branch_ids is not None:
+            statement = statement.where(table.c.branch_id.in_(branch_ids))
+        
+        values = {}
+        for branch_id, bucket, entries, occupancy in db.execute(statement):
+            day_values = values.setdefault((branch_id, _day_start(bucket)), ([], []))
+            day_values[0].append(int(entries or 0))
+            day_values[1].append(int(occupancy or 0))
+        
+        days = {}
+        for key, (entries, occupancy) in values.items():
+            sketches = {name: QuantileSketch(self.relative_accuracy) for name in SKETCH_METRICS}
+            sketches['entries'].add(entries)
+            sketches['peak'].add(occupancy)
+            days[key] = (len(entries), sketches)
+        return days
+    
+    def _closed_days(self, db, start, end, branch_ids=None):
+        """
+        sketch ของวันที่ปิดแล้วในช่วง [start, end) จากตาราง traffic_sketch_day
+        วันที่ยังไม่มี sketch หรือ sketch ไม่ตรงกับตารางสรุปปัจจุบันถูกสร้างใหม่และบันทึก
+        
+        Returns:
+            tuple: (รายการ (จำนวนชั่วโมง, sketches), จำนวนวันที่อ่านจากตาราง, จำนวนวันที่สร้างใหม่)
+        """
+        day = TrafficRollupDay.__table__
+        signatures = select(day.c.branch_id, day.c.bucket, func.sum(day.c.sample_count), func.sum(day.c.max_count)) \
+            .where(day.c.bucket >= start, day.c.bucket < end) \
+            .group_by(day.c.branch_id, day.c.bucket) \
+            .having(func.sum(day.c.sample_count) > 0)
+        stored = select(TrafficSketchDay).where(TrafficSketchDay.bucket >= start, TrafficSketchDay.bucket < end)
+        if branch_ids is not None:
+            signatures = signatures.where(day.c.branch_id.in_(branch_ids))
+            stored = stored.where(TrafficSketchDay.branch_id.in_(branch_ids))
+        
+        expected = {(branch_id, bucket): (int(samples), int(max_total or 0))
+                    for branch_id, bucket, samples, max_total in db.execute(signatures)}
+        
+        results = []
+        for row in db.execute(stored).scalars():
+            key = (row.branch_id, row.bucket)
+            if expected.get(key) != (row.sample_count, row.max_count_total):
+                continue
+            sketches = {name: QuantileSketch.from_bytes(getattr(row, column))
+                        for name, column in SKETCH_METRICS.items()}
+            if sketches['entries'].relative_accuracy != self.relative_accuracy:
+                continue
+            results.append((row.hours, sketches))
+            del expected[key]
+        
+        stored_days = len(results)
+        if not expected:
+            return results, stored_days, 0
+        
+        missing_branches = {branch_id for branch_id, _ in expected}
+        missing_days = [bucket for _, bucket in expected]
+        built = self._build(db, min(missing_days), max(missing_days) + timedelta(days=1), missing_branches)
+        
+        rows = []
+        for key, (samples, max_total) in expected.items():
+            hours, sketches = built.get(key, (0, None))
+            if sketches is None:
+                continue
+            results.append((hours, sketches))
+            rows.append({
+                'branch_id': key[0],
+                'bucket': key[1],
+                'sample_count': samples,
+                'max_count_total': max_total,
+                'hours': hours,
+                **{column: sketches[name].to_bytes() for name, column in SKETCH_METRICS.items()}
+            })
+        
+        self._save(db, rows)
+        return results, stored_days, len(rows)
+    
+    @staticmethod
+    def _save(db, rows):
+        """บันทึก sketch ที่สร้างใหม่ (ถ้าบันทึกไม่สำเร็จ จะถูกสร้างใหม่ในครั้งถัดไป)"""
+        if not rows:
+            return
+        
+        table = TrafficSketchDay.__table__
+        try:
+            for row in rows:
+                db.execute(delete(table).where(table.c.branch_id == row['branch_id'],
+                                               table.c.bucket == row['bucket']))
+            db.execute(insert(table), rows)
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.warning(f"ไม่สามารถบันทึก quantile sketch ได้: {str(e)}")
+    
+    def percentiles(self, db, start, end, quantiles=DEFAULT_QUANTILES, branch_ids=None, metrics=None):
+        """
+        quantile ของค่ารายชั่วโมงในช่วง [start, end) จากการรวม sketch รายวันของทุกสาขาที่เลือก
+        
+        Args:
+            db: database session
+            start, end: ช่วงเวลา (เวลาเริ่มต้นของวัน)
+            quantiles: ลำดับของ quantile (0-1)
+            branch_ids: รหัสสาขาที่ต้องการ (None = ทุกสาขา)
+            metrics: ชื่อค่าใน SKETCH_METRICS (None = ทุกค่า)
+        
+        Returns:
+            dict: จำนวนชั่วโมงที่มีข้อมูล (hours), quantile ของแต่ละค่า และจำนวนวันตามแหล่งที่มา (days)
+        """
+        metrics = list(metrics or SKETCH_METRICS)
+        today = _day_start(get_timezones().storage_now())
+        
+        # sketch แบ่งตามวันของเขตเวลาที่บันทึก ช่วงที่ไม่ตรงเที่ยงคืน (สาขาอยู่เขตเวลาอื่น) จึงถูกขยายเป็นวันเต็ม
+        start = _day_start(start)
+        if _day_start(end) != end:
+            end = _day_start(end) + timedelta(days=1)
+        
+        parts = []
+        stored_days = built_days = open_days = 0
+        
+        if start < min(end, today):
+            parts, stored_days, built_days = self._closed_days(db, start, min(end, today), branch_ids)
+        
+        if end > today:
+            # วันปัจจุบันยังมีข้อมูลเข้ามา จึงไม่บันทึก sketch
+            open_parts = list(self._build(db, max(start, today), end, branch_ids).values())
+            open_days = len(open_parts)
+            parts.extend(open_parts)
+        
+        merged = {name: QuantileSketch(self.relative_accuracy) for name in metrics}
+        for name in metrics:
+            merged[name].merge(*(sketches[name] for _, sketches in parts))
+        
+        result = {
+            'hours': sum(day_hours for day_hours, _ in parts),
+            'days': {'stored': stored_days, 'built': built_days, 'open': open_days}
+        }
+        for name in metrics:
+            result[name] = {f"p{q * 100:g}": merged[name].quantile(q) for q in quantiles}
+        return result
+
+def init_sketches(config):
+    """
+    เริ่มต้นที่เก็บ quantile sketch ตามการตั้งค่าในส่วน [sketches]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        SketchStore หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global sketch_store
+    
+    if not config.getboolean('sketches', 'enabled', fallback=True):
+        sketch_store = None
+        return None
+    
+    sketch_store = SketchStore(
+        relative_accuracy=config.getfloat('sketches', 'relative_accuracy', fallback=DEFAULT_RELATIVE_ACCURACY)
+    )
+    logger.info(f"เปิดใช้งาน quantile sketch (relative_accuracy: {sketch_store.relative_accuracy})")
+    
+    return sketch_store
+
+def get_sketch_store():
+    """คืนค่าที่เก็บ sketch ที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return sketch_store
@@ -0,0 +1,174 @@
+# server/timebucket.py - จัดกลุ่มเวลาใน SQL ให้ใช้ได้ทุกฐานข้อมูล (SQLite, PostgreSQL, MySQL)
+"""
+func.hour() และ func.date_format() มีเฉพาะใน MySQL ส่วน func.date() ของ SQLite คืนค่าเป็นข้อความ
+โมดูลนี้จึงมี construct ที่ compile เป็นคำสั่งของแต่ละฐานข้อมูล และคืนค่าเป็นชนิดเดียวกันทุกฐานข้อมูล
+    
+    time_bucket('hour', CustomerCount.timestamp)             -> เวลาเริ่มต้นของชั่วโมง (datetime)
+    time_bucket('week', CustomerCount.timestamp, offset=420) -> วันจันทร์ของสัปดาห์ ตามเวลา UTC+7
+    time_part('hour', CustomerCount.timestamp)               -> ชั่วโมงของวัน 0-23 (int)
+
+offset คือจำนวนนาที (หรือ timedelta) ที่บวกเข้ากับเวลาที่บันทึกไว้ก่อนจัดกลุ่ม ใช้เมื่อต้องการ
+แบ่งช่วงตามเขตเวลาอื่น ผลลัพธ์เป็นเวลาตามเขตเวลานั้น
+"""
+from datetime import timedelta
+from sqlalchemy import DateTime, Integer, Interval, func, cast, extract, literal_column, type_coerce
+from sqlalchemy.exc import CompileError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+# ระดับการจัดกลุ่มที่รองรับ เรียงจากละเอียดไปหยาบ
+BUCKET_GRAINS = ('minute', 'hour', 'day', 'week', 'month')
+
+# ส่วนของเวลาที่รองรับใน time_part (weekday: 0 = วันจันทร์)
+TIME_PARTS = ('hour', 'weekday')
+
+# รูปแบบ strftime ของ SQLite สำหรับเวลาเริ่มต้นของแต่ละระดับ (week ปัดเป็นวันก่อนแล้วเลื่อนไปวันจันทร์)
+_SQLITE_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00',
+    'week': '%Y-%m-%d 00:00:00',
+    'month': '%Y-%m-01 00:00:00'
+}
+
+# รูปแบบ DATE_FORMAT ของ MySQL (week คำนวณจาก WEEKDAY แยกต่างหาก)
+_MYSQL_FORMATS = {
+    'minute': '%Y-%m-%d %H:%i:00',
+    'hour': '%Y-%m-%d %H:00:00',
+    'day': '%Y-%m-%d 00:00:00',
+    'month': '%Y-%m-01 00:00:00'
+}
+
+def _offset_minutes(offset):
+    """แปลง offset (นาทีหรือ timedelta) เป็นจำนวนนาที"""
+    if offset is None:
+        return 0
+    if isinstance(offset, timedelta):
+        return int(offset.total_seconds() // 60)
+    return int(offset)
+
+class _TimeExpression(ColumnElement):
+    """ฐานของ construct ที่คำนวณจากคอลัมน์เวลา ระดับ และ offset"""
+    
+    inherit_cache = True
+    
+    _traverse_internals = [
+        ('column', InternalTraversal.dp_clauseelement),
+        ('unit', InternalTraversal.dp_string),
+        ('offset', InternalTraversal.dp_plain_obj)
+    ]
+    
+    def __init__(self, unit, column, offset=None):
+        self.unit = unit
+        self.column = type_coerce(column, DateTime())
+        self.offset = _offset_minutes(offset)
+    
+    @property
+    def _from_objects(self):
+        return self.column._from_objects
+
+class time_bucket(_TimeExpression):
+    """
+    เวลาเริ่มต้นของช่วงที่เวลาในคอลัมน์อยู่ (ชนิด DateTime)
+    
+    Args:
+        grain: 'minute', 'hour', 'day', 'week' (เริ่มวันจันทร์) หรือ 'month'
+        column: คอลัมน์หรือ expression ชนิดเวลา
+        offset: จำนวนนาทีหรือ timedelta ที่บวกเข้ากับเวลาก่อนจัดกลุ่ม
+    """
+    
+    type = DateTime()
+    inherit_cache = True
+    
+    def __init__(self, grain, column, offset=None):
+        if grain not in BUCKET_GRAINS:
+            raise ValueError(f"grain ต้องเป็นหนึ่งใน {', '.join(BUCKET_GRAINS)}")
+        super().__init__(grain, column, offset)
+
+class time_part(_TimeExpression):
+    """
+    ส่วนของเวลาเป็นตัวเลข (ชนิด Integer)
+    
+    Args:
+        part: 'hour' (0-23) หรือ 'weekday' (0 = วันจันทร์ ถึง 6 = วันอาทิตย์)
+        column: คอลัมน์หรือ expression ชนิดเวลา
+        offset: จำนวนนาทีหรือ timedelta ที่บวกเข้ากับเวลาก่อนแยกส่วน
+    """
+    
+    type = Integer()
+    inherit_cache = True
+    
+    def __init__(self, part, column, offset=None):
+        if part not in TIME_PARTS:
+            raise ValueError(f"part ต้องเป็นหนึ่งใน {', '.join(TIME_PARTS)}")
+        super().__init__(part, column, offset)
+
+def _sqlite_args(element, *modifiers):
+    """อาร์กิวเมนต์เวลาและ modifier ของฟังก์ชันวันที่ใน SQLite"""
+    args = [element.column]
+    if element.offset:
+        args.append(literal_column(f"'{element.offset:+d} minutes'"))
+    args.extend(literal_column(f"'{modifier}'") for modifier in modifiers)
+    return args
+
+def _shifted(element, interval):
+    """คอลัมน์เวลาหลังบวก offset ด้วย interval literal ของฐานข้อมูล"""
+    if not element.offset:
+        return element.column
+    return element.column + literal_column(interval.format(element.offset), Interval())
+
+@compiles(time_bucket)
+@compiles(time_part)
+def _compile_unsupported(element, compiler, **kw):
+    raise CompileError(f"{type(element).__name__} ไม่รองรับฐานข้อมูล {compiler.dialect.name}")
+
+@compiles(time_bucket, 'sqlite')
+def _compile_bucket_sqlite(element, compiler, **kw):
+    modifiers = ('-6 days', 'weekday 1') if element.unit == 'week' else ()
+    expression = func.strftime(
+        literal_column(f"'{_SQLITE_FORMATS[element.unit]}'"),
+        *_sqlite_args(element, *modifiers)
+    )
+    return compiler.process(expression, **kw)
+
+@compiles(time_part, 'sqlite')
+def _compile_part_sqlite(element, compiler, **kw):
+    if element.unit == 'hour':
+        expression = cast(func.strftime(literal_column("'%H'"), *_sqlite_args(element)), Integer)
+    else:
+        # %w ของ SQLite เริ่มที่วันอาทิตย์ = 0 (ค่าคงที่เขียนลงใน SQL เพื่อให้ GROUP BY ตรงกับ SELECT)
+        expression = (cast(func.strftime(literal_column("'%w'"), *_sqlite_args(element)), Integer)
+                      + literal_column('6', Integer)) % literal_column('7', Integer)
+    return compiler.process(expression, **kw)
+
+@compiles(time_bucket, 'postgresql')
+def _compile_bucket_postgresql(element, compiler, **kw):
+    expression = func.date_trunc(literal_column(f"'{element.unit}'"), _shifted(element, "INTERVAL '{} minutes'"))
+    return compiler.process(expression, **kw)
+
+@compiles(time_part, 'postgresql')
+def _compile_part_postgresql(element, compiler, **kw):
+    column = _shifted(element, "INTERVAL '{} minutes'")
+    if element.unit == 'hour':
+        expression = cast(extract('hour', column), Integer)
+    else:
+        expression = cast(extract('isodow', column), Integer) - literal_column('1', Integer)
+    return compiler.process(expression, **kw)
+
+@compiles(time_bucket, 'mysql')
+@compiles(time_bucket, 'mariadb')
+def _compile_bucket_mysql(element, compiler, **kw):
+    column = _shifted(element, "INTERVAL {} MINUTE")
+    if element.unit == 'week':
+        expression = func.subdate(func.date(column), func.weekday(column))
+    else:
+        expression = func.date_format(column, literal_column(f"'{_MYSQL_FORMATS[element.unit]}'"))
+    return compiler.process(cast(expression, DateTime), **kw)
+
+@compiles(time_part, 'mysql')
+@compiles(time_part, 'mariadb')
+def _compile_part_mysql(element, compiler, **kw):
+    column = _shifted(element, "INTERVAL {} MINUTE")
+    expression = func.hour(column) if element.unit == 'hour' else func.weekday(column)
+    return compiler.process(expression, **kw)
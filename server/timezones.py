@@ -0,0 +1,254 @@
+# server/timezones.py - เขตเวลาของระบบและของแต่ละสาขา และขอบเขตของวัน/สัปดาห์/เดือนตามเวลาท้องถิ่น
+"""
+เวลาทุกค่าในฐานข้อมูล (ข้อมูลการนับ ตารางสรุป และสแนปช็อต) เป็นเวลาแบบไม่มี timezone ในเขตเวลาเดียวกัน
+คือ [app] storage_timezone (ค่าว่าง = [app] timezone ซึ่งตรงกับข้อมูลเดิมที่อุปกรณ์ส่งเป็นเวลาท้องถิ่น)
+    
+    ingest          timestamp ที่มี timezone (เช่น ...Z หรือ +07:00) ถูกแปลงเป็นเขตเวลาที่บันทึก
+                    ส่วน timestamp ที่ไม่มี timezone ถือเป็นเวลาท้องถิ่นของสาขา
+    วัน/สัปดาห์/เดือน   วันที่ตามเวลาท้องถิ่นของสาขา (Branch.timezone หรือ [app] timezone) ถูกแปลงเป็นช่วง [start, end)
+                    ในเขตเวลาที่บันทึก แล้วใช้เปรียบเทียบกับคอลัมน์เวลาโดยตรง จึงยังใช้ index ได้
+
+ถ้าเขตเวลาของสาขาตรงกับเขตเวลาที่บันทึก ขอบเขตของวันคือเที่ยงคืนตามเดิม ส่วนสาขาที่อยู่เขตเวลาอื่น
+ขอบเขตจะไม่ตรงเที่ยงคืน การอ่านจึงใช้ตารางสรุปรายชั่วโมง (หรือรายนาที) แทนตารางรายวันโดยอัตโนมัติ
+
+tzinfo ถูกสร้างครั้งเดียวต่อชื่อ และช่วงเวลาของแต่ละวันถูกคำนวณครั้งเดียวแล้วเก็บไว้
+"""
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime, date, time, timedelta
+from functools import lru_cache
+import pytz
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from server.db import get_session
+from models.branch import Branch
+
+logger = logging.getLogger(__name__)
+
+# บริการเขตเวลาที่ใช้งานอยู่ (สร้างจากค่าเริ่มต้นถ้ายังไม่ได้เรียก init_timezones)
+timezones = None
+
+# เขตเวลาเริ่มต้น (ตรงกับ [app] timezone ในไฟล์การตั้งค่าเริ่มต้น)
+DEFAULT_TIMEZONE = 'Asia/Bangkok'
+
+# จำนวนช่วงเวลาของวันที่เก็บไว้
+RANGE_CACHE_SIZE = 4096
+
+_EPOCH = datetime(1970, 1, 1)
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """
+    tzinfo ของเขตเวลา (สร้างครั้งเดียวต่อชื่อ)
+    
+    Raises:
+        ValueError: ถ้าไม่รู้จักชื่อเขตเวลา
+    """
+    try:
+        return pytz.timezone(name)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f'ไม่รู้จักเขตเวลา {name}')
+
+@lru_cache(maxsize=RANGE_CACHE_SIZE)
+def _local_range(zone_name, storage_name, first_day, days):
+    """ช่วง [start, end) ในเขตเวลาที่บันทึก ของวันที่ first_day ถึง first_day + days ตามเวลาท้องถิ่น"""
+    zone = get_zone(zone_name)
+    storage = get_zone(storage_name)
+    
+    def convert(day):
+        local = zone.localize(datetime.combine(day, time()))
+        return local.astimezone(storage).replace(tzinfo=None)
+    
+    return convert(first_day), convert(first_day + timedelta(days=days))
+
+class TimezoneService:
+    """แปลงเวลาระหว่างเวลาท้องถิ่นของสาขากับเขตเวลาที่บันทึกในฐานข้อมูล"""
+    
+    def __init__(self, default_zone=DEFAULT_TIMEZONE, storage_zone=None):
+        self.default_zone = get_zone(default_zone)
+        self.storage_zone = get_zone(storage_zone or default_zone)
+        
+        self._branches = {}  # branch_id -> tzinfo (เฉพาะสาขาที่กำหนด timezone เอง)
+        self._lock = threading.Lock()
+    
+    def load(self, db):
+        """โหลดเขตเวลาของสาขาที่กำหนดไว้"""
+        rows = db.execute(select(Branch.branch_id, Branch.timezone).where(Branch.timezone.isnot(None)))
+        for branch_id, name in rows:
+            try:
+                self.set_branch(branch_id, name)
+            except ValueError as e:
+                logger.warning(f"สาขา {branch_id}: {str(e)} ใช้เขตเวลาเริ่มต้นแทน")
+    
+    def set_branch(self, branch_id, name):
+        """
+        กำหนดเขตเวลาของสาขา (name ว่าง = ใช้เขตเวลาเริ่มต้น)
+        
+        Raises:
+            ValueError: ถ้าไม่รู้จักชื่อเขตเวลา
+        """
+        zone = get_zone(name) if name else None
+        with self._lock:
+            if zone is None:
+                self._branches.pop(branch_id, None)
+            else:
+                self._branches[branch_id] = zone
+    
+    def remove_branch(self, branch_id):
+        """ลบเขตเวลาของสาขาที่ถูกลบ"""
+        with self._lock:
+            self._branches.pop(branch_id, None)
+    
+    def zone(self, branch_id=None):
+        """tzinfo ของสาขา (None = เขตเวลาเริ่มต้น)"""
+        if branch_id is None:
+            return self.default_zone
+        return self._branches.get(branch_id, self.default_zone)
+    
+    def to_storage(self, timestamp, branch_id=None):
+        """
+        แปลงเวลาเป็นเวลาแบบไม่มี timezone ในเขตเวลาที่บันทึก
+        
+        Args:
+            timestamp: datetime ที่มี timezone หรือเวลาท้องถิ่นของสาขาแบบไม่มี timezone
+            branch_id: รหัสสาขา (None = เขตเวลาเริ่มต้น)
+        """
+        if timestamp.tzinfo is None:
+            zone = self.zone(branch_id)
+            if zone is self.storage_zone:
+                return timestamp
+            timestamp = zone.localize(timestamp)
+        return timestamp.astimezone(self.storage_zone).replace(tzinfo=None)
+    
+    def to_local(self, timestamp, branch_id=None):
+        """แปลงเวลาในเขตเวลาที่บันทึก (ไม่มี timezone) เป็นเวลาท้องถิ่นของสาขาแบบไม่มี timezone"""
+        zone = self.zone(branch_id)
+        if zone is self.storage_zone:
+            return timestamp
+        return self.storage_zone.localize(timestamp).astimezone(zone).replace(tzinfo=None)
+    
+    def from_epoch(self, seconds):
+        """แปลง epoch วินาทีเป็นเวลาในเขตเวลาที่บันทึก"""
+        return datetime.fromtimestamp(seconds, self.storage_zone).replace(tzinfo=None)
+    
+    def epoch_base(self, first, last):
+        """
+        เวลาในเขตเวลาที่บันทึกของ epoch 0 ที่ใช้ได้กับทุกค่าในช่วง [first, last] วินาที
+        ใช้แปลงข้อมูลจำนวนมากด้วยการบวก timedelta แทนการเรียก from_epoch ทีละค่า
+        
+        Returns:
+            datetime (epoch วินาที s ตรงกับ base + timedelta(seconds=s)) หรือ None
+            ถ้า offset ของเขตเวลาที่บันทึกเปลี่ยน (DST) ภายในช่วง
+        """
+        start = _EPOCH + timedelta(seconds=first)
+        transitions = getattr(self.storage_zone, '_utc_transition_times', None)
+        if transitions:
+            index = bisect_right(transitions, start)
+            if index < len(transitions) and transitions[index] <= _EPOCH + timedelta(seconds=last):
+                return None
+        
+        return _EPOCH + pytz.utc.localize(start).astimezone(self.storage_zone).utcoffset()
+    
+    def storage_now(self):
+        """เวลาปัจจุบันในเขตเวลาที่บันทึก (ใช้เปรียบเทียบกับเวลาในฐานข้อมูล)"""
+        return datetime.now(self.storage_zone).replace(tzinfo=None)
+    
+    def now(self, branch_id=None):
+        """เวลาปัจจุบันตามเวลาท้องถิ่นของสาขา (ไม่มี timezone)"""
+        return datetime.now(self.zone(branch_id)).replace(tzinfo=None)
+    
+    def today(self, branch_id=None):
+        """วันที่ปัจจุบันตามเวลาท้องถิ่นของสาขา"""
+        return self.now(branch_id).date()
+    
+    def offset(self, branch_id=None, at=None):
+        """
+        ผลต่างของเวลาท้องถิ่นของสาขากับเขตเวลาที่บันทึก ณ เวลา at (None = ปัจจุบัน)
+        ใช้เป็น offset ของ time_bucket/time_part เพื่อจัดกลุ่มตามเวลาท้องถิ่น
+        
+        Returns:
+            timedelta
+        """
+        zone = self.zone(branch_id)
+        if zone is self.storage_zone:
+            return timedelta(0)
+        at = self.storage_zone.localize(at or self.storage_now())
+        return at.astimezone(zone).utcoffset() - at.utcoffset()
+    
+    def day_range(self, day, days=1, branch_id=None):
+        """
+        ช่วง [start, end) ในเขตเวลาที่บันทึกของวันที่ตามเวลาท้องถิ่นของสาขา
+        
+        Args:
+            day: date หรือ datetime (ใช้เฉพาะวันที่) ของวันแรก
+            days: จำนวนวัน
+            branch_id: รหัสสาขา (None = เขตเวลาเริ่มต้น)
+        
+        Returns:
+            tuple: (start, end) เป็น datetime แบบไม่มี timezone
+        """
+        if isinstance(day, datetime):
+            day = day.date()
+        return _local_range(self.zone(branch_id).zone, self.storage_zone.zone, day, days)
+    
+    def week_range(self, day, branch_id=None):
+        """ช่วงของสัปดาห์ (เริ่มวันจันทร์) ที่มีวันที่ day"""
+        if isinstance(day, datetime):
+            day = day.date()
+        return self.day_range(day - timedelta(days=day.weekday()), 7, branch_id)
+    
+    def month_range(self, year, month, branch_id=None):
+        """ช่วงของเดือน"""
+        first_day = date(year, month, 1)
+        next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+        return self.day_range(first_day, (next_month - first_day).days, branch_id)
+    
+    def format(self, timestamp, format_str=None, branch_id=None):
+        """จัดรูปแบบเวลา (ไม่มี timezone = เขตเวลาที่บันทึก) ตามเวลาท้องถิ่นของสาขา"""
+        if timestamp.tzinfo is None:
+            timestamp = self.storage_zone.localize(timestamp)
+        return timestamp.astimezone(self.zone(branch_id)).strftime(format_str or '%Y-%m-%d %H:%M:%S')
+
+def init_timezones(config, load_branches=True):
+    """
+    เริ่มต้นบริการเขตเวลาตามการตั้งค่า [app] timezone และ storage_timezone
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+        load_branches: โหลดเขตเวลาของสาขาจากฐานข้อมูล
+    
+    Returns:
+        TimezoneService
+    
+    Raises:
+        ValueError: ถ้าไม่รู้จักชื่อเขตเวลาในการตั้งค่า
+    """
+    global timezones
+    
+    default_zone = config.get('app', 'timezone', fallback=DEFAULT_TIMEZONE) or DEFAULT_TIMEZONE
+    storage_zone = config.get('app', 'storage_timezone', fallback='') or None
+    
+    service = TimezoneService(default_zone, storage_zone)
+    
+    if load_branches:
+        db = get_session()
+        try:
+            service.load(db)
+        except SQLAlchemyError as e:
+            logger.error(f"ไม่สามารถโหลดเขตเวลาของสาขาได้: {str(e)}")
+        finally:
+            db.close()
+    
+    timezones = service
+    logger.info(f"เขตเวลา: {service.default_zone.zone} (บันทึกเป็น {service.storage_zone.zone})")
+    
+    return service
+
+def get_timezones():
+    """คืนค่าบริการเขตเวลาที่ใช้งานอยู่"""
+    global timezones
+    
+    if timezones is None:
+        timezones = TimezoneService()
+    return timezones
@@ -0,0 +1,199 @@
+# server/utilisation.py - ผลรวมจำนวนคนตามเวลา (visitor-seconds) และเวลาที่สาขาใกล้เต็มความจุ สำหรับตารางสรุป
+"""
+จำนวนคนในสาขา (รวมกล้องตาม fusion แบบเดียวกับ [occupancy]) ถือว่าคงที่ระหว่างข้อมูลการนับสองรายการที่ติดกัน
+ข้อมูลแต่ละรายการจึงปิดช่วงเวลาตั้งแต่ข้อมูลก่อนหน้าของสาขา และเพิ่มค่าของช่วงนั้นลงตารางสรุป
+    
+    occupancy_seconds  จำนวนคน x วินาที (หาร 60 = visitor-minutes, หารความยาวช่วง = จำนวนคนเฉลี่ย)
+    busy_seconds       วินาทีที่จำนวนคนไม่น้อยกว่า busy_threshold_pct % ของ Branch.capacity
+
+ช่วงเวลาถูกแบ่งตามนาทีแล้วบันทึกในแถวของกล้องที่ปิดช่วง (แถวที่ไม่มีข้อมูลการนับมี sample_count = 0
+และ max_count/min_count เป็นจำนวนของกล้องนั้นระหว่างช่วง) ผลรวมของทุกกล้องในสาขาจึงเป็นค่าของสาขา
+ช่วงที่ยาวเกิน max_gap_minutes (เช่นอุปกรณ์ออฟไลน์) นับเฉพาะ max_gap_minutes สุดท้าย
+
+สถานะก่อนหน้าของสาขาอ่านจากตาราง camera_latest ใน transaction เดียวกับการบันทึก ข้อมูลที่เก่ากว่าข้อมูลล่าสุด
+ของสาขาไม่เพิ่มค่า (คำนวณใหม่ได้ด้วย --backfill-rollups ซึ่งอ่านข้อมูลเรียงตามเวลา)
+"""
+import logging
+from datetime import timedelta
+from sqlalchemy import select
+from models.branch import Branch
+from models.camera_latest import CameraLatest
+
+logger = logging.getLogger(__name__)
+
+# การตั้งค่าที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+utilisation_settings = None
+
+_ONE_MINUTE = timedelta(minutes=1)
+
+class _BranchTimeline:
+    """จำนวนคนล่าสุดของแต่ละกล้องและเวลาของข้อมูลล่าสุดของสาขา"""
+    
+    __slots__ = ('cameras', 'timestamp')
+    
+    def __init__(self):
+        self.cameras = {}  # camera_id -> (current_count, timestamp)
+        self.timestamp = None
+
+class OccupancyTimeline:
+    """
+    สถานะของสาขาสำหรับคำนวณ occupancy_seconds และ busy_seconds ของข้อมูลการนับใหม่
+    
+    ingest สร้างใหม่ทุก transaction จาก camera_latest ส่วน --backfill-rollups ใช้ตัวเดียวตลอดการคำนวณ
+    """
+    
+    def __init__(self, fusion='sum', busy_threshold_pct=80.0, max_gap_minutes=15.0):
+        self.fusion = fusion
+        self.busy_threshold_pct = busy_threshold_pct
+        self.max_gap = timedelta(minutes=max_gap_minutes)
+        
+        self._branches = {}
+        self._capacities = {}
+    
+    def load(self, db, branch_ids=None):
+        """
+        โหลดความจุของสาขาและจำนวนล่าสุดของแต่ละกล้อง
+        
+        Args:
+            db: database session
+            branch_ids: รหัสสาขาที่ต้องการ (None = โหลดเฉพาะความจุของทุกสาขา ไม่โหลดกล้อง)
+        """
+        capacities = select(Branch.branch_id, Branch.capacity)
+        if branch_ids is not None:
+            capacities = capacities.where(Branch.branch_id.in_(branch_ids))
+        self._capacities.update(db.execute(capacities).all())
+        
+        if branch_ids is None:
+            return
+        
+        cameras = db.execute(
+            select(CameraLatest.branch_id, CameraLatest.camera_id,
+                   CameraLatest.current_count, CameraLatest.timestamp)
+            .where(CameraLatest.branch_id.in_(branch_ids))
+        )
+        for branch_id, camera_id, current_count, timestamp in cameras:
+            state = self._branches.get(branch_id)
+            if state is None:
+                state = self._branches[branch_id] = _BranchTimeline()
+            state.cameras[camera_id] = (current_count or 0, timestamp)
+            if state.timestamp is None or timestamp > state.timestamp:
+                state.timestamp = timestamp
+    
+    def _total(self, state):
+        counts = [count for count, _ in state.cameras.values()]
+        if not counts:
+            return 0
+        return sum(counts) if self.fusion == 'sum' else max(counts)
+    
+    def integrate(self, records):
+        """
+        คำนวณค่าตามเวลาของช่วงที่ข้อมูลการนับใหม่ปิด และอัพเดตสถานะ
+        
+        Args:
+            records: รายการข้อมูลที่ผ่าน parse_count แล้ว
+        
+        Returns:
+            list: แถวของตารางสรุป (bucket = เวลาเริ่มต้นของส่วนที่อยู่ในแต่ละนาที) ที่มีค่าเฉพาะ
+                  occupancy_seconds, busy_seconds และ max_count/min_count ของกล้อง
+        """
+        rows = []
+        
+        for record in sorted(records, key=lambda record: record['timestamp'].replace(tzinfo=None)):
+            branch_id = record['branch_id']
+            camera_id = record['camera_id']
+            timestamp = record['timestamp'].replace(tzinfo=None)
+            
+            state = self._branches.get(branch_id)
+            if state is None:
+                state = self._branches[branch_id] = _BranchTimeline()
+            
+            previous = state.cameras.get(camera_id)
+            if previous is not None and timestamp < previous[1]:
+                continue
+            
+            if state.timestamp is not None and timestamp > state.timestamp:
+                total = self._total(state)
+                if total:
+                    capacity = self._capacities.get(branch_id)
+                    busy = bool(capacity) and total * 100 >= capacity * self.busy_threshold_pct
+                    held = previous[0] if previous is not None else 0
+                    rows.extend(self._split(branch_id, camera_id, max(state.timestamp, timestamp - self.max_gap),
+                                            timestamp, total, busy, held))
+            
+            state.cameras[camera_id] = (record['current_count'], timestamp)
+            if state.timestamp is None or timestamp > state.timestamp:
+                state.timestamp = timestamp
+        
+        return rows
+    
+    @staticmethod
+    def _split(branch_id, camera_id, start, end, total, busy, held):
+        """แบ่งช่วง [start, end) ตามนาที"""
+        rows = []
+        cursor = start
+        while cursor < end:
+            next_cursor = min(cursor.replace(second=0, microsecond=0) + _ONE_MINUTE, end)
+            seconds = (next_cursor - cursor).total_seconds()
+            rows.append({
+                'branch_id': branch_id,
+                'bucket': cursor,
+                'camera_id': camera_id,
+                'entry_count': 0,
+                'exit_count': 0,
+                'max_count': held,
+                'min_count': held,
+                'sample_count': 0,
+                'occupancy_seconds': total * seconds,
+                'busy_seconds': seconds if busy else 0.0
+            })
+            cursor = next_cursor
+        return rows
+
+def init_utilisation(config):
+    """
+    เริ่มต้นการคำนวณค่าตามเวลาในตารางสรุปตามการตั้งค่าในส่วน [utilisation]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        dict ของการตั้งค่า หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global utilisation_settings
+    
+    if not config.getboolean('utilisation', 'enabled', fallback=True):
+        utilisation_settings = None
+        return None
+    
+    fusion = config.get('occupancy', 'fusion', fallback='sum')
+    if fusion not in ('sum', 'max'):
+        raise ValueError('fusion ต้องเป็น sum หรือ max')
+    
+    utilisation_settings = {
+        'fusion': fusion,
+        'busy_threshold_pct': config.getfloat('utilisation', 'busy_threshold_pct', fallback=80.0),
+        'max_gap_minutes': config.getfloat('utilisation', 'max_gap_minutes', fallback=15.0)
+    }
+    logger.info(f"เปิดใช้งาน visitor-minutes ในตารางสรุป (busy_threshold_pct: {utilisation_settings['busy_threshold_pct']})")
+    
+    return utilisation_settings
+
+def new_timeline():
+    """OccupancyTimeline ตามการตั้งค่าปัจจุบัน (None ถ้าไม่ได้เปิดใช้งาน)"""
+    if utilisation_settings is None:
+        return None
+    return OccupancyTimeline(**utilisation_settings)
+
+def occupancy_timeline(db, records):
+    """
+    OccupancyTimeline ของสาขาในรายการข้อมูลการนับ ต้องเรียกก่อนอัพเดต camera_latest ของรายการเหล่านั้น
+    
+    Returns:
+        OccupancyTimeline หรือ None ถ้าไม่ได้เปิดใช้งานหรือไม่มีข้อมูล
+    """
+    if utilisation_settings is None or not records:
+        return None
+    
+    timeline = new_timeline()
+    timeline.load(db, {record['branch_id'] for record in records})
+    return timeline
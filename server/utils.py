@@ -197,10 +197,12 @@ def load_timezone(config):
     Returns:
         datetime.tzinfo: timezone object
     """
+    from server.timezones import get_zone
+    
+    timezone_str = config.get('app', 'timezone', fallback='UTC')
     try:
-        timezone_str = config.get('app', 'timezone')
-        return pytz.timezone(timezone_str)
-    except Exception as e:
+        return get_zone(timezone_str)
+    except ValueError as e:
         logger.error(f"ไม่สามารถโหลด timezone {timezone_str}: {str(e)}")
         logger.info("ใช้ timezone UTC แทน")
         return pytz.UTC
@@ -217,17 +219,7 @@ def format_datetime(dt, config, format_str=None):
     Returns:
         str: วันที่และเวลาที่จัดรูปแบบแล้ว
     """
-    # โหลด timezone จากการตั้งค่า
-    tz = load_timezone(config)
-    
-    # แปลงเวลาเป็น timezone ที่กำหนด
-    if dt.tzinfo is None:
-        dt = pytz.UTC.localize(dt).astimezone(tz)
-    else:
-        dt = dt.astimezone(tz)
+    from server.timezones import get_timezones
     
-    # จัดรูปแบบวันที่และเวลา
-    if format_str is None:
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
-    else:
-        return dt.strftime(format_str)
\ No newline at end of file
+    # ใช้ tzinfo ที่สร้างไว้แล้วของบริการเขตเวลา (เวลาที่ไม่มี timezone คือเวลาในเขตเวลาที่บันทึก)
+    return get_timezones().format(dt, format_str)
\ No newline at end of file
@@ -0,0 +1,106 @@
+# server/watermarks.py - ลำดับการเปลี่ยนแปลงข้อมูลของแต่ละสาขา ใช้สร้าง ETag/Last-Modified
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ตัวติดตามที่ใช้งานอยู่ (None = ไม่ได้เปิดใช้งาน)
+data_watermarks = None
+
+class DataWatermarks:
+    """
+    เก็บลำดับ (version) และเวลาที่ข้อมูลของแต่ละสาขาเปลี่ยนครั้งล่าสุด
+    
+    version เพิ่มขึ้นเสมอทุกครั้งที่มีการเปลี่ยนแปลง และมี epoch ของ process กำกับ
+    validator ที่ออกก่อนเริ่มเซิร์ฟเวอร์ใหม่จึงไม่ตรงกับค่าปัจจุบัน
+    """
+    
+    def __init__(self):
+        self.epoch = os.urandom(4).hex()
+        
+        self._version = 0
+        self._branches = {}  # branch_id -> (version, เวลา epoch วินาที)
+        self._all = (0, time.time())     # การเปลี่ยนแปลงที่มีผลกับทุกสาขา
+        self._latest = self._all         # การเปลี่ยนแปลงล่าสุดของสาขาใดก็ได้
+        self._lock = threading.Lock()
+    
+    def touch(self, branch_ids=None):
+        """
+        บันทึกว่าข้อมูลมีการเปลี่ยนแปลง
+        
+        Args:
+            branch_ids: รหัสสาขาที่เปลี่ยน (None = ทุกสาขา)
+        """
+        with self._lock:
+            self._version += 1
+            mark = (self._version, time.time())
+            if branch_ids is None:
+                self._all = mark
+            else:
+                for branch_id in branch_ids:
+                    self._branches[branch_id] = mark
+            self._latest = mark
+    
+    def observe(self, records):
+        """รับข้อมูลการนับที่บันทึกแล้วจาก ingest"""
+        self.touch({record['branch_id'] for record in records})
+    
+    def get(self, branch_id=None):
+        """
+        ดึงการเปลี่ยนแปลงล่าสุดที่มีผลกับสาขา
+        
+        Args:
+            branch_id: รหัสสาขา (None = ข้อมูลของทุกสาขารวมกัน)
+        
+        Returns:
+            tuple: (version, เวลาที่เปลี่ยนเป็น epoch วินาที)
+        """
+        with self._lock:
+            if branch_id is None:
+                return self._latest
+            return max(self._branches.get(branch_id, self._all), self._all)
+
+def init_watermarks(config):
+    """
+    เริ่มต้นตัวติดตามการเปลี่ยนแปลงข้อมูลตามการตั้งค่าในส่วน [http_cache]
+    
+    Args:
+        config: อ็อบเจกต์ ConfigParser ที่มีการตั้งค่า
+    
+    Returns:
+        DataWatermarks หรือ None ถ้าไม่ได้เปิดใช้งาน
+    """
+    global data_watermarks
+    
+    if not config.getboolean('http_cache', 'enabled', fallback=True):
+        return None
+    
+    if data_watermarks is not None:
+        return data_watermarks
+    
+    watermarks = DataWatermarks()
+    
+    # นำเข้าเฉพาะเมื่อจำเป็น เพื่อหลีกเลี่ยง circular imports
+    from server.ingest import add_commit_listener
+    add_commit_listener(watermarks.observe)
+    
+    data_watermarks = watermarks
+    logger.info("เริ่มติดตามการเปลี่ยนแปลงข้อมูลสำหรับ conditional GET")
+    
+    return watermarks
+
+def get_data_watermarks():
+    """คืนค่าตัวติดตามที่ใช้งานอยู่ (None ถ้าไม่ได้เปิดใช้งาน)"""
+    return data_watermarks
+
+def touch_branches(branch_ids=None):
+    """
+    บันทึกการเปลี่ยนแปลงข้อมูลที่ไม่ได้มาจาก ingest (เช่นแก้ไขสาขา หรือคำนวณตารางสรุปใหม่)
+    
+    Args:
+        branch_ids: รหัสสาขาที่เปลี่ยน (None = ทุกสาขา)
+    """
+    if data_watermarks is not None:
+        data_watermarks.touch(branch_ids)
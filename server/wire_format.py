@@ -0,0 +1,257 @@
+# server/wire_format.py - รูปแบบข้อมูลไบนารีแบบกะทัดรัดสำหรับอัพโหลดข้อมูลการนับจากกล้อง
+"""
+รูปแบบเฟรม (Content-Type: application/x-shopcounter-frame)
+
+ตัวเลขทุกตัวเป็น unsigned varint (LEB128 ใช้ 7 บิตต่อไบต์ บิตสูงสุด = มีไบต์ถัดไป)
+ยกเว้นผลต่างของเวลาซึ่งเป็น zigzag varint (0, -1, 1, -2, ... -> 0, 1, 2, 3, ...)
+    
+    magic         4 ไบต์  b'SCF1'
+    string_count  varint  จำนวนข้อความใน dictionary
+    strings       string_count x (varint ความยาว + ข้อความ UTF-8)  รหัสกล้องและรหัสสาขา
+    base_time     varint  epoch วินาที (UTC) ของเวลาอ้างอิง
+    row_count     varint  จำนวนรายการ
+    rows          row_count x:
+        camera        varint  ลำดับของรหัสกล้องใน dictionary
+        branch        varint  ลำดับของรหัสสาขาใน dictionary
+        time_delta    zigzag  ผลต่างของเวลา (วินาที) จากรายการก่อนหน้า (รายการแรกเทียบกับ base_time)
+        entry_count   varint
+        exit_count    varint
+        current_count varint
+
+ข้อมูลหนึ่งรายการมักใช้เพียง 6-8 ไบต์ เทียบกับประมาณ 150 ไบต์ในรูปแบบ JSON
+"""
+from datetime import timedelta
+from itertools import accumulate
+from server.timezones import get_timezones
+
+# Content-Type ของข้อมูลแบบเฟรม
+FRAME_MIMETYPE = 'application/x-shopcounter-frame'
+
+FRAME_MAGIC = b'SCF1'
+
+# จำนวนไบต์ต่ำสุดของข้อมูลหนึ่งรายการ (ใช้ตรวจสอบ row_count ก่อนจองหน่วยความจำ)
+MIN_ROW_BYTES = 6
+
+# ความยาวสูงสุดของรหัสกล้อง/สาขา (ตรงกับคอลัมน์ในฐานข้อมูล)
+MAX_ID_LENGTH = 50
+
+# เวลาสูงสุดที่รองรับ (ปี 9999)
+MAX_TIMESTAMP = 253402214400
+
+# ค่าของ zigzag varint ขนาดหนึ่งไบต์ (0..127 -> 0, -1, 1, -2, ...)
+_ZIGZAG = tuple((value >> 1) ^ -(value & 1) for value in range(0x80))
+_ZIGZAG_DELTAS = tuple(timedelta(seconds=value) for value in _ZIGZAG)
+
+# ลำดับคอลัมน์ของ tuple ที่ได้จาก decode_frame
+FRAME_COLUMNS = ('camera_id', 'branch_id', 'timestamp', 'entry_count', 'exit_count', 'current_count')
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def encode_frame(rows):
+    """
+    เข้ารหัสข้อมูลการนับเป็นเฟรมไบนารี (ใช้ฝั่งอุปกรณ์และในการทดสอบ)
+    
+    Args:
+        rows: รายการ tuple ตามลำดับ FRAME_COLUMNS โดย timestamp เป็น epoch วินาที (int)
+    
+    Returns:
+        bytes: ข้อมูลเฟรม
+    """
+    strings = {}
+    for row in rows:
+        strings.setdefault(row[0], len(strings))
+        strings.setdefault(row[1], len(strings))
+    
+    out = bytearray(FRAME_MAGIC)
+    _write_varint(out, len(strings))
+    for value in strings:
+        encoded = value.encode('utf-8')
+        _write_varint(out, len(encoded))
+        out += encoded
+    
+    previous = rows[0][2] if rows else 0
+    _write_varint(out, previous)
+    _write_varint(out, len(rows))
+    
+    for camera_id, branch_id, timestamp, entry_count, exit_count, current_count in rows:
+        delta = timestamp - previous
+        previous = timestamp
+        _write_varint(out, strings[camera_id])
+        _write_varint(out, strings[branch_id])
+        _write_varint(out, (delta << 1) ^ (delta >> 63))
+        _write_varint(out, entry_count)
+        _write_varint(out, exit_count)
+        _write_varint(out, current_count)
+    
+    return bytes(out)
+
+def decode_frame(data):
+    """
+    ถอดรหัสเฟรมไบนารีเป็นรายการ tuple ตามลำดับ FRAME_COLUMNS
+    
+    อ่านค่าจากไบต์โดยตรงทีละรายการ โดยไม่สร้าง dict หรือแปลงข้อความเวลาต่อรายการ
+    เวลาถูกแปลงเป็นเวลาแบบไม่มี timezone ในเขตเวลาที่บันทึก (server/timezones.py)
+    
+    Args:
+        data: ข้อมูลเฟรม (bytes)
+    
+    Returns:
+        list: รายการ tuple (camera_id, branch_id, timestamp, entry_count, exit_count, current_count)
+    
+    Raises:
+        ValueError: ถ้าข้อมูลไม่ตรงตามรูปแบบเฟรม
+    """
+    if data[:4] != FRAME_MAGIC:
+        raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: ไม่ใช่เฟรม SCF1')
+    
+    end = len(data)
+    pos = 4
+    
+    def read_varint():
+        nonlocal pos
+        result = 0
+        shift = 0
+        while True:
+            if pos >= end:
+                raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: ข้อมูลไม่สมบูรณ์')
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+            if shift > 63:
+                raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: ตัวเลขยาวเกินไป')
+    
+    string_count = read_varint()
+    if string_count > end - pos:
+        raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: จำนวนข้อความเกินขนาดข้อมูล')
+    
+    strings = []
+    for _ in range(string_count):
+        length = read_varint()
+        if length == 0 or length > MAX_ID_LENGTH or pos + length > end:
+            raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: ความยาวรหัสไม่ถูกต้อง')
+        try:
+            strings.append(data[pos:pos + length].decode('utf-8'))
+        except UnicodeDecodeError:
+            raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: รหัสไม่ใช่ UTF-8')
+        pos += length
+    
+    timestamp = read_varint()
+    row_count = read_varint()
+    if row_count * MIN_ROW_BYTES > end - pos:
+        raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: จำนวนรายการเกินขนาดข้อมูล')
+    
+    block = data[pos:]
+    if len(block) == row_count * MIN_ROW_BYTES and (not block or max(block) < 0x80):
+        return _decode_single_byte_rows(block, strings, timestamp)
+    
+    rows = []
+    append = rows.append
+    
+    for _ in range(row_count):
+        # รายการส่วนใหญ่มีทุกค่าเป็น varint ขนาดหนึ่งไบต์ จึงแยกค่าจาก slice ได้ทันที
+        chunk = data[pos:pos + 6]
+        if len(chunk) == 6 and max(chunk) < 0x80:
+            camera, branch, delta, entry_count, exit_count, current_count = chunk
+            pos += 6
+        else:
+            camera = read_varint()
+            branch = read_varint()
+            delta = read_varint()
+            entry_count = read_varint()
+            exit_count = read_varint()
+            current_count = read_varint()
+        
+        if camera >= string_count or branch >= string_count:
+            raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: อ้างอิงรหัสที่ไม่มีใน dictionary')
+        
+        timestamp += (delta >> 1) ^ -(delta & 1)
+        append((strings[camera], strings[branch], timestamp,
+                entry_count, exit_count, current_count))
+    
+    if pos != end:
+        raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: มีข้อมูลเกินท้ายเฟรม')
+    
+    if rows:
+        # แปลงเวลาหลังอ่านครบทุกรายการ เพื่อคำนวณ offset ของเขตเวลาที่บันทึกครั้งเดียวต่อเฟรม
+        base = _epoch_base(min(row[2] for row in rows), max(row[2] for row in rows))
+        convert = get_timezones().from_epoch if base is None else (
+            lambda seconds: base + timedelta(seconds=seconds))
+        times = {}
+        for index, row in enumerate(rows):
+            moment = times.get(row[2])
+            if moment is None:
+                moment = times[row[2]] = convert(row[2])
+            rows[index] = row[:2] + (moment,) + row[3:]
+    
+    return rows
+
+def _epoch_base(first, last):
+    """ตรวจช่วงเวลาของเฟรม และคืนค่า TimezoneService.epoch_base ของช่วงนั้น"""
+    if not 0 <= first <= last <= MAX_TIMESTAMP:
+        raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: เวลาอยู่นอกช่วงที่รองรับ')
+    return get_timezones().epoch_base(first, last)
+
+def _decode_single_byte_rows(block, strings, base_time):
+    """
+    ถอดรหัสรายการทั้งหมดแบบแยกคอลัมน์ เมื่อทุกค่าในเฟรมเป็น varint ขนาดหนึ่งไบต์
+    
+    แต่ละคอลัมน์ได้จากการ slice ทุกๆ 6 ไบต์ และเวลาได้จากผลรวมสะสมของผลต่าง
+    จึงไม่มีการวนลูปต่อรายการในโค้ด Python
+    """
+    if max(block[0::6], default=-1) >= len(strings) or max(block[1::6], default=-1) >= len(strings):
+        raise ValueError('รูปแบบข้อมูลไม่ถูกต้อง: อ้างอิงรหัสที่ไม่มีใน dictionary')
+    
+    timestamps = list(accumulate(map(_ZIGZAG.__getitem__, block[2::6]), initial=base_time))[1:]
+    if not timestamps:
+        return []
+    
+    # ตรวจช่วงเวลาและคำนวณ offset ของเขตเวลาที่บันทึกครั้งเดียวจากค่าต่ำสุดและสูงสุด
+    base = _epoch_base(min(timestamps), max(timestamps))
+    if base is None:
+        moments = map(get_timezones().from_epoch, timestamps)
+    else:
+        # offset คงที่ตลอดเฟรม เวลาจึงได้จากผลรวมสะสมของ timedelta ที่สร้างไว้แล้ว
+        moments = accumulate(map(_ZIGZAG_DELTAS.__getitem__, block[2::6]),
+                             initial=base + timedelta(seconds=base_time))
+        next(moments)
+    
+    lookup = strings.__getitem__
+    return list(zip(
+        map(lookup, block[0::6]),
+        map(lookup, block[1::6]),
+        moments,
+        block[3::6],
+        block[4::6],
+        block[5::6]
+    ))
+
+def frame_records(rows):
+    """
+    แปลง tuple จาก decode_frame เป็นพารามิเตอร์สำหรับ INSERT แบบ executemany ของ store_counts
+    
+    Args:
+        rows: รายการ tuple ตามลำดับ FRAME_COLUMNS
+    
+    Returns:
+        list: รายการข้อมูลในรูปแบบเดียวกับผลลัพธ์ของ parse_count
+    """
+    return [
+        {
+            'camera_id': camera_id,
+            'branch_id': branch_id,
+            'timestamp': timestamp,
+            'entry_count': entry_count,
+            'exit_count': exit_count,
+            'current_count': current_count,
+            'meta_data': '{}',
+            'event_id': None
+        }
+        for camera_id, branch_id, timestamp, entry_count, exit_count, current_count in rows
+    ]
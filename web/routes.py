@@ -5,7 +5,10 @@ from werkzeug.security import check_password_hash
 from server.db import get_session
 from models.user import User
 from models.branch import Branch
-from models.customer_count import CustomerCount
+from server.occupancy import get_occupancy_registry
+from server.timebucket import time_bucket
+from server.partitions import counts_table
+from server.timezones import get_timezones
 from sqlalchemy import func, desc
 from datetime import datetime, timedelta
 import json
@@ -22,7 +25,7 @@ def login_required(f):
     
     Args:
         f: ฟังก์ชันที่จะตรวจสอบการล็อกอิน
-        
+    
     Returns:
         wrapper: ฟังก์ชันที่ครอบด้วยการตรวจสอบการล็อกอิน
     """
@@ -42,7 +45,7 @@ def admin_required(f):
     
     Args:
         f: ฟังก์ชันที่จะตรวจสอบสิทธิ์ admin
-        
+    
     Returns:
         wrapper: ฟังก์ชันที่ครอบด้วยการตรวจสอบสิทธิ์ admin
     """
@@ -140,21 +143,28 @@ def dashboard():
         # ดึงข้อมูลสาขาทั้งหมด
         branches = db.query(Branch).all()
         
+        # จำนวนลูกค้าปัจจุบันจากทะเบียนในหน่วยความจำ (ถ้าเปิดใช้งาน)
+        registry = get_occupancy_registry()
+        live_counts = {state['branch_id']: state for state in registry.get_branches()} if registry else {}
+        
         # ดึงข้อมูลการนับลูกค้าล่าสุดของแต่ละสาขา
         branch_data = []
+        since = get_timezones().storage_now() - timedelta(days=1)
+        counts = counts_table(since)
         for branch in branches:
-            # ดึงข้อมูลการนับลูกค้าล่าสุด
+            # ดึงข้อมูลการนับลูกค้าล่าสุด (รายชั่วโมง)
+            hour = time_bucket('hour', counts.c.timestamp).label('hour')
             latest_counts = db.query(
-                    CustomerCount.timestamp,
-                    func.sum(CustomerCount.entry_count).label('entries'),
-                    func.sum(CustomerCount.exit_count).label('exits')
+                    hour,
+                    func.sum(counts.c.entry_count).label('entries'),
+                    func.sum(counts.c.exit_count).label('exits')
                 ) \
                 .filter(
-                    CustomerCount.branch_id == branch.branch_id,
-                    CustomerCount.timestamp >= datetime.now() - timedelta(days=1)
+                    counts.c.branch_id == branch.branch_id,
+                    counts.c.timestamp >= since
                 ) \
-                .group_by(func.date(CustomerCount.timestamp), func.hour(CustomerCount.timestamp)) \
-                .order_by(desc(CustomerCount.timestamp)) \
+                .group_by(hour) \
+                .order_by(desc(hour)) \
                 .limit(24) \
                 .all()
             
@@ -168,13 +178,16 @@ def dashboard():
                 })
             
             # สร้างข้อมูลสาขา
+            live = live_counts.get(branch.branch_id)
+            current_count = live['current_count'] if live else branch.current_customer_count
+            last_updated = live['last_updated'] if live else branch.last_updated
             branch_data.append({
                 'id': branch.id,
                 'branch_id': branch.branch_id,
                 'name': branch.name,
-                'current_count': branch.current_customer_count,
+                'current_count': current_count,
                 'capacity': branch.capacity,
-                'last_updated': branch.last_updated.strftime('%Y-%m-%d %H:%M:%S') if branch.last_updated else 'ไม่มีข้อมูล',
+                'last_updated': last_updated.strftime('%Y-%m-%d %H:%M:%S') if last_updated else 'ไม่มีข้อมูล',
                 'chart_data': json.dumps(chart_data[::-1])  # กลับด้านให้เวลาเรียงจากน้อยไปมาก
             })
         
@@ -203,44 +216,49 @@ def branch_detail(branch_id):
             return redirect(url_for('web.dashboard'))
         
         # ดึงข้อมูลการนับลูกค้าของสาขานี้
+        since = get_timezones().storage_now() - timedelta(days=7)
+        counts = counts_table(since)
+        hour = time_bucket('hour', counts.c.timestamp).label('hour')
         counts_by_hour = db.query(
-                func.date(CustomerCount.timestamp).label('date'),
-                func.hour(CustomerCount.timestamp).label('hour'),
-                func.sum(CustomerCount.entry_count).label('entries'),
-                func.sum(CustomerCount.exit_count).label('exits'),
-                func.max(CustomerCount.current_count).label('max_count')
+                hour,
+                func.sum(counts.c.entry_count).label('entries'),
+                func.sum(counts.c.exit_count).label('exits'),
+                func.max(counts.c.current_count).label('max_count')
             ) \
             .filter(
-                CustomerCount.branch_id == branch_id,
-                CustomerCount.timestamp >= datetime.now() - timedelta(days=7)
+                counts.c.branch_id == branch_id,
+                counts.c.timestamp >= since
             ) \
-            .group_by('date', 'hour') \
-            .order_by('date', 'hour') \
+            .group_by(hour) \
+            .order_by(hour) \
             .all()
         
         # สร้างข้อมูลกราฟรายชั่วโมง
         hourly_chart_data = []
-        for date, hour, entries, exits, max_count in counts_by_hour:
+        for bucket, entries, exits, max_count in counts_by_hour:
             hourly_chart_data.append({
-                'datetime': f"{date} {hour:02d}:00",
+                'datetime': bucket.strftime('%Y-%m-%d %H:00'),
                 'entries': entries,
                 'exits': exits,
                 'max_count': max_count
             })
         
         # ดึงข้อมูลการนับลูกค้ารายวัน
+        since = get_timezones().storage_now() - timedelta(days=30)
+        counts = counts_table(since)
+        day = time_bucket('day', counts.c.timestamp).label('date')
         counts_by_day = db.query(
-                func.date(CustomerCount.timestamp).label('date'),
-                func.sum(CustomerCount.entry_count).label('entries'),
-                func.sum(CustomerCount.exit_count).label('exits'),
-                func.max(CustomerCount.current_count).label('max_count')
+                day,
+                func.sum(counts.c.entry_count).label('entries'),
+                func.sum(counts.c.exit_count).label('exits'),
+                func.max(counts.c.current_count).label('max_count')
             ) \
             .filter(
-                CustomerCount.branch_id == branch_id,
-                CustomerCount.timestamp >= datetime.now() - timedelta(days=30)
+                counts.c.branch_id == branch_id,
+                counts.c.timestamp >= since
             ) \
-            .group_by('date') \
-            .order_by('date') \
+            .group_by(day) \
+            .order_by(day) \
             .all()
         
         # สร้างข้อมูลกราฟรายวัน
@@ -370,26 +388,34 @@ def admin_dashboard():
         users_count = db.query(func.count(User.id)).scalar()
         
         # ดึงข้อมูลลูกค้าทั้งหมดในวันนี้
-        today = datetime.now().date()
+        timezones = get_timezones()
+        today = timezones.today()
+        start_of_today, end_of_today = timezones.day_range(today)
+        counts = counts_table(start_of_today, end_of_today)
         today_counts = db.query(
-                func.sum(CustomerCount.entry_count).label('entries'),
-                func.sum(CustomerCount.exit_count).label('exits')
+                func.sum(counts.c.entry_count).label('entries'),
+                func.sum(counts.c.exit_count).label('exits')
+            ) \
+            .filter(
+                counts.c.timestamp >= start_of_today,
+                counts.c.timestamp < end_of_today
             ) \
-            .filter(func.date(CustomerCount.timestamp) == today) \
             .first()
         
         today_entries = today_counts.entries or 0
         today_exits = today_counts.exits or 0
         
         # ดึงข้อมูลการนับลูกค้ารายวันในเดือนนี้
-        start_of_month = datetime(today.year, today.month, 1)
+        start_of_month, _ = timezones.month_range(today.year, today.month)
+        counts = counts_table(start_of_month)
+        day = time_bucket('day', counts.c.timestamp, offset=timezones.offset(at=start_of_month)).label('date')
         counts_by_day = db.query(
-                func.date(CustomerCount.timestamp).label('date'),
-                func.sum(CustomerCount.entry_count).label('entries')
+                day,
+                func.sum(counts.c.entry_count).label('entries')
             ) \
-            .filter(CustomerCount.timestamp >= start_of_month) \
-            .group_by('date') \
-            .order_by('date') \
+            .filter(counts.c.timestamp >= start_of_month) \
+            .group_by(day) \
+            .order_by(day) \
             .all()
         
         # สร้างข้อมูลกราฟรายวัน